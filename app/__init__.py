@@ -1,21 +1,39 @@
 from flask import Flask
-from .routes import routes
-from flask_cors import CORS
+from .instrumentation import configure_logging
 import os
 
-def create_app():
-    app = Flask(__name__)
-    CORS(app)  # Enable CORS globally
+def create_app(warm_up=None):
+    """
+    Creates the Flask application.
 
-    # Enable debugging mode
-    app.config['DEBUG'] = True
-    app.config['ENV'] = 'development'
+    Heavy libraries (SciPy, the HTTP client) are only imported once a route needs them, so a new
+    worker can answer its first request quickly. Pre-forking servers should preload the app with
+    warm-up enabled instead (e.g. ``APP_WARM_UP=1 gunicorn --preload 'app:create_app()'``): the
+    libraries are then imported and initialized once in the master process and shared by every worker.
 
-    app.secret_key = os.getenv('FLASK_SECRET_KEY')
+    Environment:
+        FLASK_DEBUG: '1' enables debug mode (off by default).
+        FLASK_SECRET_KEY: Key used to sign the session cookie.
+        APP_WARM_UP: '1' runs app.warmup.warm_up() while creating the app.
 
+    Args:
+        warm_up (bool): Overrides APP_WARM_UP.
+
+    Returns:
+        Flask: The application.
+    """
     # Load environment variables from .env file
     from dotenv import load_dotenv
     load_dotenv()
+    configure_logging()
+
+    from flask_cors import CORS
+    app = Flask(__name__)
+    CORS(app)  # Enable CORS globally
+
+    app.config['DEBUG'] = os.getenv('FLASK_DEBUG', '0').lower() in ('1', 'true', 'yes')
+
+    app.secret_key = os.getenv('FLASK_SECRET_KEY')
 
     # Basic route
     @app.route('/')
@@ -26,4 +44,10 @@ def create_app():
     from .routes import routes
     app.register_blueprint(routes)
 
+    if warm_up is None:
+        warm_up = os.getenv('APP_WARM_UP', '0').lower() in ('1', 'true', 'yes')
+    if warm_up:
+        from .warmup import warm_up as warm_up_process
+        warm_up_process()
+
     return app
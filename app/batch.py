@@ -0,0 +1,130 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from .calculations import enhanced_tax_loss_harvesting, fetch_price_histories, optimize_portfolio
+from .instrumentation import span
+from .market_context import MarketDataContext
+from .price_matrix import PriceMatrix
+
+BATCH_OPERATIONS = ('tax-loss-harvesting', 'optimize-portfolio')
+MAX_CHUNK_SIZE = 32
+
+# Prices of every symbol in the batch, installed once per worker process.
+_batch_prices = None
+
+
+def max_batch_workers():
+    """
+    Returns the server-side limit on worker processes per batch.
+
+    Environment:
+        BATCH_WORKERS: Maximum number of worker processes. Defaults to the number of CPUs.
+
+    Returns:
+        int: The limit, at least 1.
+    """
+    return max(1, int(os.getenv('BATCH_WORKERS') or os.cpu_count() or 1))
+
+
+def _install_prices(dates, symbols, values):
+    global _batch_prices
+    _batch_prices = PriceMatrix(dates, symbols, values)
+
+
+def run_batch_item(index, item, operations, options, prices=None):
+    """
+    Runs the requested operations for one portfolio of a batch.
+
+    Args:
+        index (int): Position of the item in the batch.
+        item (dict): {"id": str, "portfolio": [...], "tax_bracket": float, "long_term_rate": float}.
+        operations (tuple): Operations to run, from BATCH_OPERATIONS.
+        options (dict): Keyword arguments for optimize_portfolio.
+        prices (PriceMatrix): Prices of the batch. Defaults to the prices installed in the worker process.
+
+    Returns:
+        dict: The item's index, id and one result per operation, or an 'error' if any failed.
+    """
+    result = {"index": index, "id": item.get("id") if isinstance(item, dict) else None}
+    try:
+        portfolio = item["portfolio"]
+        if not portfolio:
+            raise ValueError("No portfolio data provided")
+        context = MarketDataContext.from_prices([security['symbol'] for security in portfolio],
+                                                _batch_prices if prices is None else prices)
+
+        if 'optimize-portfolio' in operations:
+            weights, expected_return, risk, sharpe_ratio = optimize_portfolio(portfolio, context=context, **options)
+            result['optimize-portfolio'] = {
+                "weights": weights,
+                "expected_return": float(expected_return),
+                "risk": float(risk),
+                "sharpe_ratio": float(sharpe_ratio),
+            }
+        if 'tax-loss-harvesting' in operations:
+            tax_bracket = item.get("tax_bracket")
+            tax_bracket = 0.2 if tax_bracket is None else float(tax_bracket)
+            recommended_sales, total_losses, tax_savings = enhanced_tax_loss_harvesting(
+                portfolio, tax_bracket, context=context, long_term_rate=item.get("long_term_rate"))
+            result['tax-loss-harvesting'] = {
+                "recommended_sales": recommended_sales,
+                "total_losses": float(total_losses),
+                "tax_savings": float(tax_savings),
+            }
+    except Exception as e:
+        return {"index": result["index"], "id": result["id"], "error": str(e)}
+    return result
+
+
+def _run_chunk(start, items, operations, options):
+    return [run_batch_item(start + offset, item, operations, options) for offset, item in enumerate(items)]
+
+
+def run_batch(items, operations=BATCH_OPERATIONS, options=None, workers=None):
+    """
+    Runs tax loss harvesting and/or optimization for many portfolios, yielding results as they finish.
+
+    The union of every portfolio's symbols is fetched and put into one price matrix once; the parsed prices are sent
+    to each worker process once when it starts, and portfolios are then handed out in small chunks
+    so the pool stays busy. A failing portfolio produces an error result instead of stopping the batch.
+
+    Args:
+        items (list): Batch items, see run_batch_item.
+        operations (tuple): Operations to run for every portfolio, from BATCH_OPERATIONS.
+        options (dict): Keyword arguments for optimize_portfolio.
+        workers (int): Number of worker processes, capped at max_batch_workers(), which is also the
+            default; 1 runs in-process.
+
+    Yields:
+        dict: One result per item, in completion order.
+    """
+    options = options or {}
+    limit = max_batch_workers()
+    workers = min(workers or limit, limit)
+    symbols = list(dict.fromkeys(
+        security.get('symbol') for item in items if isinstance(item, dict)
+        for security in item.get('portfolio') or () if isinstance(security, dict) and security.get('symbol')))
+    with span('fetch'):
+        histories = fetch_price_histories(symbols)
+    with span('parse'):
+        prices = PriceMatrix.from_histories(histories)
+
+    if workers == 1 or len(items) <= 1:
+        for index, item in enumerate(items):
+            yield run_batch_item(index, item, operations, options, prices)
+        return
+
+    chunk_size = max(1, min(MAX_CHUNK_SIZE, len(items) // (workers * 4)))
+    pool = ProcessPoolExecutor(max_workers=min(workers, len(items)), initializer=_install_prices,
+                               initargs=(prices.dates, prices.symbols, prices.values))
+    try:
+        pending = {pool.submit(_run_chunk, start, items[start:start + chunk_size], operations, options)
+                   for start in range(0, len(items), chunk_size)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+    finally:
+        # Also reached when the client goes away and the generator is closed early.
+        pool.shutdown(wait=False, cancel_futures=True)
+
@@ -0,0 +1,220 @@
+import argparse
+import io
+import logging
+import mmap
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .price_store import PriceHistory, PriceStore, valid_symbol
+
+logger = logging.getLogger(__name__)
+
+# Names of the symbol, date and closing price columns in the vendor files.
+DEFAULT_COLUMNS = ('symbol', 'date', 'close')
+# Size of the pieces of a CSV file parsed by one worker.
+DEFAULT_CHUNK_BYTES = 32 << 20
+MAX_SYMBOL_BYTES = 32
+
+
+class BulkLoadError(Exception):
+    """Raised when a price file cannot be read."""
+
+
+def _csv_layout(path, columns, chunk_bytes):
+    # Column positions from the header, and byte ranges of the rows that end on line boundaries
+    with open(path, 'rb') as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        header_end = data.find(b'\n')
+        header_end = len(data) if header_end < 0 else header_end + 1
+        names = [name.strip().strip('"').lower() for name in data[:header_end].decode().split(',')]
+        try:
+            usecols = [names.index(column.lower()) for column in columns]
+        except ValueError:
+            raise BulkLoadError(f"{path} needs the columns {', '.join(columns)}, found {', '.join(names)}")
+        ranges = []
+        start = header_end
+        while start < len(data):
+            end = data.find(b'\n', min(start + chunk_bytes, len(data)) - 1)
+            end = len(data) if end < 0 else end + 1
+            ranges.append((start, end))
+            start = end
+    return usecols, ranges
+
+
+def _parse_csv_range(path, start, end, usecols):
+    """Parses rows [start, end) of a memory-mapped CSV file into symbol, date and close arrays."""
+    with open(path, 'rb') as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        rows = io.BytesIO(data[start:end])
+    rows = np.loadtxt(rows, delimiter=',', usecols=usecols, quotechar='"', ndmin=1,
+                      dtype=[('symbol', f'S{MAX_SYMBOL_BYTES}'), ('date', 'M8[D]'), ('close', 'f8')])
+    return rows['symbol'], rows['date'].astype(np.int64), rows['close']
+
+
+def _read_parquet(path, columns):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise BulkLoadError("Reading Parquet files needs the pyarrow package")
+    table = pq.read_table(path, columns=list(columns), memory_map=True)
+    symbol, date, close = (table.column(column).to_numpy() for column in columns)
+    return (np.asarray(symbol).astype(f'S{MAX_SYMBOL_BYTES}'), np.asarray(date).astype('datetime64[D]').astype(np.int64),
+            np.asarray(close, dtype=np.float64))
+
+
+def read_price_file(path, columns=DEFAULT_COLUMNS, workers=None, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Reads a long-format price file with one row per symbol and day.
+
+    CSV files are memory-mapped and split into pieces ending on line boundaries, which worker
+    processes parse in parallel. Parquet files (suffix .parquet or .pq) are read with pyarrow,
+    memory-mapped as well.
+
+    Args:
+        path (str): CSV file with a header row, or Parquet file.
+        columns (tuple): Names of the symbol, date ('YYYY-MM-DD') and closing price columns.
+        workers (int): Number of worker processes. Defaults to the number of CPUs; 1 parses in-process.
+        chunk_bytes (int): Size of the CSV pieces.
+
+    Returns:
+        tuple: Symbols (bytes), int64 day numbers and float64 closes, one entry per row.
+
+    Raises:
+        BulkLoadError: If the file is empty, lacks a column or cannot be read or parsed.
+    """
+    if os.path.splitext(path)[1].lower() in ('.parquet', '.pq'):
+        return _read_parquet(path, columns)
+
+    try:
+        # mmap refuses empty files with a ValueError
+        usecols, ranges = _csv_layout(path, columns, chunk_bytes)
+        workers = min(workers or os.cpu_count() or 1, len(ranges))
+        if workers <= 1:
+            parts = [_parse_csv_range(path, start, end, usecols) for start, end in ranges]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(_parse_csv_range, *zip(*[(path, start, end, usecols) for start, end in ranges])))
+    except (OSError, ValueError) as e:
+        raise BulkLoadError(f"Cannot read {path}: {e}") from e
+    if not parts:
+        return np.empty(0, dtype=f'S{MAX_SYMBOL_BYTES}'), np.empty(0, dtype=np.int64), np.empty(0)
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+
+def group_by_symbol(symbols, dates, closes):
+    """
+    Splits rows of many symbols into one price history per symbol.
+
+    Symbols are stripped and upper-cased. Rows without a positive, finite close are dropped, and of
+    several rows for the same symbol and day the last one wins.
+
+    Args:
+        symbols (np.ndarray): Symbol of each row (bytes or str).
+        dates (np.ndarray): int64 day number of each row.
+        closes (np.ndarray): Closing price of each row.
+
+    Returns:
+        dict: Symbol -> PriceHistory, sorted oldest first.
+    """
+    valid = np.isfinite(closes) & (closes > 0)
+    symbols, dates, closes = symbols[valid], dates[valid], closes[valid]
+    # Normalize the distinct names only, then renumber the rows
+    names, inverse = np.unique(symbols, return_inverse=True)
+    names = np.char.upper(np.char.strip(names.astype(str)))
+    names, remap = np.unique(names, return_inverse=True)
+    codes = remap[inverse]
+
+    order = np.lexsort((np.arange(len(codes)), dates, codes))
+    codes, dates, closes = codes[order], dates[order], closes[order]
+    # Keep the last row (in file order) of every symbol and day
+    last = np.ones(len(codes), dtype=bool)
+    last[:-1] = (codes[1:] != codes[:-1]) | (dates[1:] != dates[:-1])
+    codes, dates, closes = codes[last], dates[last], closes[last]
+
+    bounds = np.flatnonzero(np.diff(codes)) + 1
+    starts = np.concatenate([[0], bounds]) if len(codes) else np.empty(0, dtype=np.int64)
+    ends = np.concatenate([bounds, [len(codes)]]) if len(codes) else np.empty(0, dtype=np.int64)
+    return {str(names[codes[start]]): PriceHistory(dates[start:end], closes[start:end])
+            for start, end in zip(starts.tolist(), ends.tolist())}
+
+
+def _store_histories(root, items):
+    store = PriceStore(None, root=root)
+    for symbol, history in items:
+        store.put(symbol, history, restate=True)
+
+
+def load_price_files(paths, store, columns=DEFAULT_COLUMNS, workers=None, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Loads vendor price dumps into the local price store.
+
+    Every file is parsed in parallel (see read_price_file), the rows of all files are grouped by
+    symbol, and each symbol's history is merged into the store by date, which writes it as
+    memory-mappable columns and marks it fresh. Files may be loaded in any order: prices in a file
+    replace stored prices for the same days, so backfills and restatements are kept. With several
+    workers the symbols are written by worker processes sharing the store's directory. Symbols the
+    store does not accept (see valid_symbol) are skipped.
+
+    Args:
+        paths (list): CSV or Parquet files, e.g. a full history dump and the nightly updates.
+        store (PriceStore): Store to load into.
+        columns (tuple): Names of the symbol, date and closing price columns.
+        workers (int): Number of parsing and writing processes. Defaults to the number of CPUs;
+            1 does everything in-process.
+        chunk_bytes (int): Size of the CSV pieces parsed by one process.
+
+    Returns:
+        dict: Number of 'files', 'rows', 'symbols' loaded and 'skipped', and the 'seconds' taken.
+
+    Raises:
+        BulkLoadError: If a file cannot be read.
+    """
+    start = time.perf_counter()
+    parts = [read_price_file(path, columns, workers, chunk_bytes) for path in paths]
+    rows = sum(len(part[0]) for part in parts)
+    histories = group_by_symbol(*(np.concatenate(column) for column in zip(*parts))) if parts else {}
+    skipped = [symbol for symbol in histories if not valid_symbol(symbol)]
+    for symbol in skipped:
+        del histories[symbol]
+
+    items = list(histories.items())
+    workers = min(workers or os.cpu_count() or 1, len(items))
+    if workers <= 1:
+        for symbol, history in items:
+            store.put(symbol, history, restate=True)
+    else:
+        # Each process writes its share of the symbols straight into the store's directory
+        size = -(-len(items) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_store_histories, *zip(*[(store.root, items[i:i + size])
+                                                   for i in range(0, len(items), size)])))
+        store.invalidate()
+
+    stats = {"files": len(paths), "rows": rows, "symbols": len(histories), "skipped": len(skipped),
+             "seconds": time.perf_counter() - start}
+    logger.info("Loaded price files", extra=stats)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load CSV/Parquet price files into the local price store.")
+    parser.add_argument("paths", nargs='+', help="Files with one row per symbol and day")
+    parser.add_argument("--columns", default=','.join(DEFAULT_COLUMNS),
+                        help="Names of the symbol, date and close columns (default: %(default)s)")
+    parser.add_argument("--workers", type=int, help="Parsing processes (default: number of CPUs)")
+    args = parser.parse_args(argv)
+
+    from .calculations import download_stock_data
+    from .price_store import get_price_store
+
+    columns = tuple(name.strip() for name in args.columns.split(','))
+    if len(columns) != 3:
+        parser.error("--columns needs three names")
+    stats = load_price_files(args.paths, get_price_store(download_stock_data), columns, args.workers)
+    print(f"Loaded {stats['rows']} rows for {stats['symbols']} symbols from {stats['files']} files "
+          f"in {stats['seconds']:.2f}s ({stats['skipped']} symbols skipped)")
+
+
+if __name__ == '__main__':
+    main()
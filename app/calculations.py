@@ -1,14 +1,68 @@
-import requests
-import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-from flask import session
 
-ALPHA_VANTAGE_API_KEY = os.getenv('ALPHA_VANTAGE_API_KEY')
+from .instrumentation import span
+from .market_context import MarketDataContext
+from .market_data import get_market_data_provider
+from .monte_carlo import PORTFOLIO_STATISTICS, estimate_portfolio_statistics, simulate_growth
+from .optimizer import annualized_moments, efficient_frontier, max_sharpe_weights
+from .price_matrix import PriceMatrix
+from .price_store import PriceStoreError, format_daily_series, get_price_store
+from .rebalance import DEFAULT_RISK_AVERSION, DEFAULT_SEGMENTS, account_segments, rebalance_weights
+from .replacements import DEFAULT_TOP_K, get_replacement_finder
+from .result_cache import fingerprint, get_result_cache, seed_from_key
+from .risk_stats import PortfolioRiskAccumulator, WelfordAccumulator
+from .tax_engine import DEFAULT_TAX_YEAR, compute_tax_liability
+from .tax_lots import LONG_TERM_DAYS, WASH_SALE_DAYS, LotLedger, to_days
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_price_history(symbol):
+    """
+    Fetches the price history of a stock symbol from the local price store.
+
+    The store only calls the market data provider when the symbol is missing or its history has gone stale.
+
+    Args:
+        symbol (str): Stock symbol to fetch data for.
+
+    Returns:
+        PriceHistory: Chronologically sorted day numbers and closing prices.
+
+    Raises:
+        PriceStoreError: If no price history is available for the symbol.
+    """
+    return get_price_store(download_stock_data).get(symbol)
 
 
 def fetch_stock_data(symbol):
     """
-    Fetches the daily time series data for a given stock symbol from Alpha Vantage API.
+    Fetches the daily time series data for a given stock symbol in the Alpha Vantage shape.
+
+    Calculations use fetch_price_history instead, which skips the conversion to and from text.
+
+    Args:
+        symbol (str): Stock symbol to fetch data for.
+
+    Returns:
+        dict: A dictionary containing time series data or an error message.
+    """
+    try:
+        history = fetch_price_history(symbol)
+    except PriceStoreError as e:
+        return {"error": str(e)}
+    return format_daily_series(history)
+
+
+def download_stock_data(symbol):
+    """
+    Downloads the daily time series data for a given stock symbol from the market data provider.
+
+    The provider is configured with MARKET_DATA_PROVIDER (see app.market_data). The default, Alpha
+    Vantage, is called through a shared, rate-limited client that reuses pooled connections.
 
     Args:
         symbol (str): Stock symbol to fetch data for.
@@ -16,49 +70,103 @@ def fetch_stock_data(symbol):
     Returns:
         dict: A dictionary containing time series data or an error message.
     """
-    url = f'https://www.alphavantage.co/query?function=TIME_SERIES_DAILY&symbol={symbol}&apikey={ALPHA_VANTAGE_API_KEY}'
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        if "Time Series (Daily)" in data:
-            return data["Time Series (Daily)"]
-        else:
-            return {"error": "Invalid symbol or data not available"}
+    return get_market_data_provider().fetch_daily(symbol)
+
+
+def _fetch_or_none(symbol):
+    try:
+        return fetch_price_history(symbol)
+    except PriceStoreError as e:
+        logger.warning("Price history not available", extra={"symbol": symbol, "error": str(e)})
+        return None
+
+
+def fetch_price_histories(symbols):
+    """
+    Fetches the price histories of several stock symbols concurrently.
+
+    Args:
+        symbols (list): Stock symbols to fetch data for. Duplicates are fetched once.
+
+    Returns:
+        dict: Mapping of each symbol with price data to its PriceHistory; symbols without data are left out.
+    """
+    symbols = list(dict.fromkeys(symbols))
+    if len(symbols) <= 1:
+        histories = [_fetch_or_none(symbol) for symbol in symbols]
     else:
-        return {"error": "Failed to fetch data from Alpha Vantage"}
+        max_workers = min(len(symbols), get_market_data_provider().max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            histories = list(pool.map(_fetch_or_none, symbols))
+    return {symbol: history for symbol, history in zip(symbols, histories) if history is not None}
+
+
+def load_price_matrix(symbols):
+    """
+    Fetches the price history of many symbols into one matrix.
+
+    Args:
+        symbols (list): Stock symbols; symbols without valid data are left out.
+
+    Returns:
+        PriceMatrix: Unaligned closing prices.
+    """
+    with span('fetch'):
+        histories = fetch_price_histories(symbols)
+    with span('parse'):
+        return PriceMatrix.from_histories(histories)
 
 
-def fetch_current_prices(portfolio):
+def build_market_context(portfolio, align='intersect'):
+    """
+    Creates the market data context shared by every calculation in a request.
+
+    Nothing is fetched until a calculation first needs prices.
+
+    Args:
+        portfolio (list): List of securities in the portfolio.
+        align (str): How price histories of different lengths are aligned: 'intersect', 'ffill' or 'drop'.
+
+    Returns:
+        MarketDataContext: Lazily populated market data for the portfolio's symbols.
+    """
+    return MarketDataContext([security['symbol'] for security in portfolio], fetch_price_histories, align=align)
+
+
+def fetch_current_prices(portfolio, context=None):
     """
     Fetches the current prices for the securities in the portfolio.
 
     Args:
         portfolio (list): List of dictionaries containing 'symbol', 'purchase_price', and 'shares' for each security.
+        context (MarketDataContext): Market data for the request. Built from the portfolio if omitted.
 
     Returns:
-        list: Updated portfolio with current prices included.
+        list: Copy of the portfolio with current prices included.
     """
-    updated_portfolio = []
-    for security in portfolio:
-        symbol = security['symbol']
-        stock_data = fetch_stock_data(symbol)
+    context = context or build_market_context(portfolio)
+    return [dict(security, current_price=context.latest_prices.get(security['symbol'])) for security in portfolio]
 
-        if isinstance(stock_data, dict) and "error" not in stock_data:
-            recent_date = sorted(stock_data.keys(), reverse=True)[0]
-            current_price = float(stock_data[recent_date]['4. close'])
-            security['current_price'] = current_price
-        else:
-            security['current_price'] = None
 
-        updated_portfolio.append(security)
+def historical_return_moments(portfolio, context=None):
+    """
+    Estimates daily log return moments from the price history of each security in the portfolio.
 
-    # Store the updated portfolio in the session
-    session['portfolio'] = updated_portfolio
+    Args:
+        portfolio (list): List of securities with their historical price data.
+        context (MarketDataContext): Market data for the request. Built from the portfolio if omitted.
 
-    return updated_portfolio
+    Returns:
+        tuple: Valid symbols, their latest prices, mean log returns and the covariance matrix.
+    """
+    context = context or build_market_context(portfolio)
+    context.require_data()
+    latest_prices = np.array([context.latest_prices[symbol] for symbol in context.symbols])
+    return context.symbols, latest_prices, context.mean_returns, context.covariance
 
 
-def monte_carlo_simulation_multi(portfolio, num_simulations=1000, time_horizon=252):
+def monte_carlo_simulation_multi(portfolio, num_simulations=1000, time_horizon=252, seed=None,
+                                 dtype=np.float64, workers=1, sampling='pseudo', context=None):
     """
     Runs a Monte Carlo simulation to predict future portfolio returns.
 
@@ -66,54 +174,202 @@ def monte_carlo_simulation_multi(portfolio, num_simulations=1000, time_horizon=2
         portfolio (list): List of securities with their historical price data.
         num_simulations (int): Number of simulations to run. Default is 1000.
         time_horizon (int): Number of days to simulate. Default is 252 (1 trading year).
+        seed (int): Seed for reproducible simulations. Default is None, which derives the seed from the
+            inputs so identical requests give identical (cached) results.
+        dtype (type): Floating point type of the result, np.float32 or np.float64.
+        workers (int): Number of worker processes used for large simulations. Default is 1.
+        sampling (str): 'pseudo', 'antithetic' or 'sobol'. Default is 'pseudo'.
+        context (MarketDataContext): Market data for the request. Built from the portfolio if omitted.
 
     Returns:
         np.ndarray: A 3D numpy array containing the simulation results.
     """
-    closing_prices = []
-    for stock in portfolio:
-        symbol = stock['symbol']
-        stock_data = fetch_stock_data(symbol)
-        if isinstance(stock_data, dict) and "error" not in stock_data:
-            prices = [float(value['4. close']) for date, value in stock_data.items()]
-            closing_prices.append(prices)
-        else:
-            print(f"Invalid stock data for {symbol}, skipping.")
-            continue
+    context = context or build_market_context(portfolio)
+    _, _, mean_returns, covariance_matrix = historical_return_moments(portfolio, context)
 
-    if not closing_prices:
-        raise ValueError("No valid stock data found for the portfolio.")
+    # The worker count does not change the paths, so it is not part of the key
+    key = fingerprint('monte_carlo', context.fingerprint, num_simulations, time_horizon, seed, np.dtype(dtype).name,
+                      sampling)
+    seed = seed_from_key(key) if seed is None else seed
 
-    # Convert to numpy array for easier manipulation
-    closing_prices = np.array(closing_prices)
+    def simulate():
+        with span('simulate'):
+            return simulate_growth(mean_returns, covariance_matrix, num_simulations, time_horizon, seed=seed,
+                                   dtype=dtype, workers=workers, sampling=sampling, factor=context.covariance_factor)
 
-    # Calculate log returns
-    log_returns = np.diff(np.log(closing_prices), axis=1)
+    # Run Monte Carlo simulations
+    return get_result_cache().get_or_compute(key, simulate)
 
-    mean_returns = np.mean(log_returns, axis=1)
-    covariance_matrix = np.cov(log_returns)
 
-    # Run Monte Carlo simulations
-    simulations = np.zeros((len(portfolio), num_simulations, time_horizon))
+def monte_carlo_risk_stream(portfolio, num_simulations=1000, time_horizon=252, chunk_size=1024,
+                            percentiles=(5, 25, 50, 75, 95), confidence=0.95, seed=None,
+                            dtype=np.float64, workers=1, sampling='pseudo', context=None, progress=None):
+    """
+    Runs a Monte Carlo simulation in chunks and reduces it to portfolio risk statistics.
+
+    Each chunk of paths is folded into online accumulators and then discarded, so peak memory is
+    bounded by ``chunk_size`` rather than ``num_simulations``.
+
+    Args:
+        portfolio (list): List of securities in the portfolio.
+        num_simulations (int): Number of simulations to run. Default is 1000.
+        time_horizon (int): Number of days to simulate. Default is 252 (1 trading year).
+        chunk_size (int): Number of paths simulated at a time. Default is 1024.
+        percentiles (tuple): Percentiles of the portfolio value reported for every day.
+        confidence (float): Confidence level for VaR, CVaR and maximum drawdown. Default is 0.95.
+        seed (int): Seed for reproducible simulations. Default is None, which derives the seed from the
+            inputs so identical requests give identical (cached) results.
+        dtype (type): Floating point type used for the simulated chunks.
+        workers (int): Number of worker processes used for each chunk. Default is 1.
+        sampling (str): 'pseudo', 'antithetic' or 'sobol'. Default is 'pseudo'.
+        context (MarketDataContext): Market data for the request. Built from the portfolio if omitted.
+        progress (callable): Called with (paths completed, total paths) after every chunk.
+
+    Returns:
+        dict: Per-day percentile bands, mean and standard deviation of the portfolio value, VaR,
+        CVaR, maximum drawdown and per-security summary statistics.
+    """
+    context = context or build_market_context(portfolio)
+    symbols, latest_prices, mean_returns, covariance_matrix = historical_return_moments(portfolio, context)
 
-    for i in range(num_simulations):
-        random_shocks = np.random.multivariate_normal(mean_returns, covariance_matrix, time_horizon)
-        for j in range(len(portfolio)):
-            simulations[j, i, :] = np.exp(random_shocks[:, j])
+    shares = _total_shares(portfolio, symbols)
+    key = fingerprint('monte_carlo_stream', context.fingerprint, shares, num_simulations, time_horizon, chunk_size,
+                      list(percentiles), confidence, seed, np.dtype(dtype).name, sampling)
+    seed = seed_from_key(key) if seed is None else seed
+    return get_result_cache().get_or_compute(key, lambda: _risk_stream(
+        symbols, shares, latest_prices, mean_returns, covariance_matrix, context.covariance_factor, num_simulations,
+        time_horizon, chunk_size, percentiles, confidence, seed, dtype, workers, sampling, progress))
+
+
+def _total_shares(portfolio, symbols):
+    shares = dict.fromkeys(symbols, 0.0)
+    for security in portfolio:
+        if security['symbol'] in shares:
+            shares[security['symbol']] += float(security.get('shares') or 0)
+    return shares
+
+
+def _market_weights(shares, latest_prices):
+    # Weight the securities by their current market value
+    market_values = np.array(list(shares.values())) * latest_prices
+    if market_values.sum() > 0:
+        return market_values / market_values.sum()
+    return np.full(len(shares), 1 / len(shares))
+
+
+@span('simulate')
+def _risk_stream(symbols, shares, latest_prices, mean_returns, covariance_matrix, factor, num_simulations,
+                 time_horizon, chunk_size, percentiles, confidence, seed, dtype, workers, sampling, progress):
+    """Simulates the risk statistics of monte_carlo_risk_stream on a cache miss."""
+    weights = _market_weights(shares, latest_prices)
+
+    accumulator = PortfolioRiskAccumulator(time_horizon)
+    security_means = WelfordAccumulator((len(symbols),))
+
+    num_chunks = -(-num_simulations // chunk_size)
+    chunk_seeds = np.random.SeedSequence(seed).spawn(num_chunks)
+    for index, chunk_seed in enumerate(chunk_seeds):
+        paths = min(chunk_size, num_simulations - index * chunk_size)
+        growth = simulate_growth(mean_returns, covariance_matrix, paths, time_horizon,
+                                 seed=chunk_seed, dtype=dtype, workers=workers, sampling=sampling, factor=factor)
+        security_means.update(growth.mean(axis=2).T)
+        np.cumprod(growth, axis=2, out=growth)
+        accumulator.update(np.tensordot(weights, growth, axes=1))
+        del growth
+        if progress:
+            progress(index * chunk_size + paths, num_simulations)
+
+    var, cvar = accumulator.value_at_risk(confidence)
+    mean_drawdown, tail_drawdown = accumulator.max_drawdown(confidence)
+    return {
+        "symbols": symbols,
+        "weights": weights.tolist(),
+        "num_simulations": num_simulations,
+        "time_horizon": time_horizon,
+        "confidence": confidence,
+        "mean": accumulator.daily_moments.mean.tolist(),
+        "std": accumulator.daily_moments.std.tolist(),
+        "percentiles": {format(p, "g"): band.tolist() for p, band in accumulator.percentile_bands(percentiles).items()},
+        "value_at_risk": var,
+        "conditional_value_at_risk": cvar,
+        "max_drawdown": {"mean": mean_drawdown, "tail": tail_drawdown},
+        "expected_returns": security_means.mean.tolist(),
+        "risk": security_means.std.tolist(),
+    }
+
+
+def monte_carlo_estimate(portfolio, num_simulations=1000, time_horizon=252, seed=None, dtype=np.float64, workers=1,
+                         sampling='pseudo', control_variates=False, target_standard_error=None,
+                         max_simulations=100_000, batch_size=1024, statistics=PORTFOLIO_STATISTICS,
+                         confidence=0.95, context=None, progress=None):
+    """
+    Estimates the portfolio's return statistics over the horizon together with their standard errors.
+
+    With ``target_standard_error`` paths are added in batches until every requested statistic is
+    that precise or ``max_simulations`` is reached; see estimate_portfolio_statistics.
+
+    Args:
+        portfolio (list): List of securities in the portfolio.
+        num_simulations (int): Number of simulations without a target. Default is 1000.
+        time_horizon (int): Number of days to simulate. Default is 252 (1 trading year).
+        seed (int): Seed for reproducible simulations. Default is None, which derives the seed from the
+            inputs so identical requests give identical (cached) results.
+        dtype (type): Floating point type used for the simulated batches.
+        workers (int): Number of worker processes used for each batch. Default is 1.
+        sampling (str): 'pseudo', 'antithetic' or 'sobol'. Default is 'pseudo'.
+        control_variates (bool): Correct the mean-type statistics with the terminal portfolio value.
+        target_standard_error (float): Standard error at which to stop adding batches.
+        max_simulations (int): Path budget with a target. Default is 100,000.
+        batch_size (int): Number of paths per batch. Default is 1024.
+        statistics (tuple): Names from PORTFOLIO_STATISTICS to estimate.
+        confidence (float): Confidence level for VaR. Default is 0.95.
+        context (MarketDataContext): Market data for the request. Built from the portfolio if omitted.
+        progress (callable): Called with (paths completed, path budget) after every batch.
 
-    return simulations
+    Returns:
+        dict: Estimates and standard errors, the number of paths and batches used and whether the
+        target was reached, plus the portfolio's symbols and weights.
+    """
+    context = context or build_market_context(portfolio)
+    symbols, latest_prices, mean_returns, covariance_matrix = historical_return_moments(portfolio, context)
+    shares = _total_shares(portfolio, symbols)
+
+    key = fingerprint('monte_carlo_estimate', context.fingerprint, shares, num_simulations, time_horizon, seed,
+                      np.dtype(dtype).name, sampling, control_variates, target_standard_error, max_simulations,
+                      batch_size, list(statistics), confidence)
+    seed = seed_from_key(key) if seed is None else seed
+
+    def estimate():
+        weights = _market_weights(shares, latest_prices)
+        with span('simulate'):
+            result = estimate_portfolio_statistics(
+                mean_returns, covariance_matrix, weights, num_simulations, time_horizon, seed=seed, dtype=dtype,
+                workers=workers, sampling=sampling, control_variates=control_variates,
+                target_standard_error=target_standard_error, max_simulations=max_simulations,
+                batch_size=batch_size, statistics=statistics, confidence=confidence,
+                factor=context.covariance_factor, progress=progress)
+        return dict(result, symbols=symbols, weights=weights.tolist(), time_horizon=time_horizon,
+                    confidence=confidence)
+
+    return get_result_cache().get_or_compute(key, estimate)
 
 
 def calculate_taxes(data):
     """
     Calculates taxes based on the user's income, investment gains, and losses.
 
+    With a 'filing_status' the progressive federal brackets are used (see calculate_progressive_taxes);
+    otherwise the single flat 'tax_bracket' is applied to the whole taxable income.
+
     Args:
         data (dict): Dictionary containing 'income', 'tax_bracket', 'investment_gains', 'investment_losses', and 'cost_basis'.
 
     Returns:
         dict: Dictionary containing the tax owed and an explanation.
     """
+    if data.get('filing_status'):
+        return calculate_progressive_taxes(data)
+
     income = data.get('income', 0)
     tax_bracket = data.get('tax_bracket', 0.2)
     investment_gains = data.get('investment_gains', 0)
@@ -140,93 +396,409 @@ def calculate_taxes(data):
     }
 
 
-from scipy.optimize import minimize
+def calculate_progressive_taxes(data):
+    """
+    Calculates federal taxes with progressive brackets, capital gains rates and loss carryforwards.
+
+    Args:
+        data (dict): Dictionary containing 'income', 'filing_status' and optionally 'tax_year',
+            'short_term_gains', 'long_term_gains', 'carryforward_short_term' and 'carryforward_long_term'.
+            Without explicit short- or long-term gains, 'investment_gains' minus 'investment_losses'
+            is treated as a long-term gain.
+
+    Returns:
+        dict: Dictionary containing the tax owed, its breakdown, the marginal rate, the loss
+        carryforward and an explanation.
+    """
+    income = float(data.get('income') or 0)
+    filing_status = data['filing_status']
+    tax_year = int(data.get('tax_year') or DEFAULT_TAX_YEAR)
+    short_term_gains = float(data.get('short_term_gains') or 0)
+    long_term_gains = data.get('long_term_gains')
+    if long_term_gains is None and data.get('short_term_gains') is None:
+        long_term_gains = (data.get('investment_gains') or 0) - (data.get('investment_losses') or 0)
+    long_term_gains = float(long_term_gains or 0)
+
+    result = {key: float(value) for key, value in compute_tax_liability(
+        income, short_term_gains, long_term_gains,
+        carryforward_short_term=float(data.get('carryforward_short_term') or 0),
+        carryforward_long_term=float(data.get('carryforward_long_term') or 0),
+        filing_status=filing_status, year=tax_year).items()}
+    tax_owed = result.pop('total_tax')
+    effective_rate = tax_owed / income if income > 0 else 0.0
+    carryforward = result['carryforward_short_term'] + result['carryforward_long_term']
+
+    explanation = (f"Your income of ${income:,.2f} with ${short_term_gains:,.2f} of short-term and "
+                   f"${long_term_gains:,.2f} of long-term gains results in a taxable income of "
+                   f"${result['taxable_income']:,.2f} for a {filing_status.replace('_', ' ')} filer in {tax_year}. "
+                   f"Your tax owed is ${tax_owed:,.2f} (${result['ordinary_tax']:,.2f} ordinary income tax and "
+                   f"${result['capital_gains_tax']:,.2f} capital gains tax), an effective rate of {effective_rate:.2%} "
+                   f"and a marginal rate of {result['marginal_rate']:.0%}.")
+    if carryforward > 0:
+        explanation += f" ${carryforward:,.2f} of capital losses carry forward to next year."
+
+    return {
+        "income": income,
+        "filing_status": filing_status,
+        "tax_year": tax_year,
+        "short_term_gains": short_term_gains,
+        "long_term_gains": long_term_gains,
+        **result,
+        "tax_owed": tax_owed,
+        "effective_rate": effective_rate,
+        "explanation": explanation
+    }
 
 
-def optimize_portfolio(portfolio):
+def _constraint_arrays(symbols, bounds=None, groups=None, initial_weights=None):
+    """Converts symbol-keyed optimizer constraints into the index-based form used by app.optimizer."""
+    index = {symbol: i for i, symbol in enumerate(symbols)}
+    bound_list = None
+    if bounds:
+        bound_list = [tuple(bounds.get(symbol, (0.0, 1.0))) for symbol in symbols]
+    group_list = []
+    for group in groups or ():
+        members = [index[symbol] for symbol in group['symbols'] if symbol in index]
+        group_list.append((members, group.get('min'), group.get('max')))
+    start = None
+    if initial_weights:
+        start = np.array([float(initial_weights.get(symbol, 0.0)) for symbol in symbols])
+        start = start / start.sum() if start.sum() > 0 else None
+    return bound_list, group_list, start
+
+
+def optimize_portfolio(portfolio, context=None, risk_free_rate=0.01, bounds=None, groups=None, initial_weights=None):
     """
     Optimizes the portfolio allocation to maximize returns and minimize risk.
 
+    The Sharpe ratio is maximized directly from the annualized mean and covariance of the historical
+    daily log returns, so the result is deterministic.
+
     Args:
         portfolio (list): List of securities in the portfolio.
+        context (MarketDataContext): Market data for the request. Built from the portfolio if omitted.
+        risk_free_rate (float): Annual risk-free rate. Default is 0.01.
+        bounds (dict): Optional (min, max) weight per symbol. Unlisted symbols may hold 0% to 100%.
+        groups (list): Optional group limits, each {"symbols": [...], "min": float, "max": float}.
+        initial_weights (dict): Optional previous weights per symbol used as a warm start.
 
     Returns:
         tuple: Optimal weights for each security, expected portfolio return, portfolio risk, and Sharpe ratio.
     """
-    num_stocks = len(portfolio)
-    simulations = monte_carlo_simulation_multi(portfolio)
-
-    # Expected returns and covariance matrix
-    expected_returns = simulations.mean(axis=2).mean(axis=1)
-    covariance_matrix = np.cov(simulations.mean(axis=2))
-
-    # Objective function: Minimize negative Sharpe ratio
-    def negative_sharpe_ratio(weights, expected_returns, covariance_matrix, risk_free_rate=0.01):
-        portfolio_return = np.dot(weights, expected_returns)
-        portfolio_volatility = np.sqrt(np.dot(weights.T, np.dot(covariance_matrix, weights)))
-        sharpe_ratio = (portfolio_return - risk_free_rate) / portfolio_volatility
-        return -sharpe_ratio
+    context = context or build_market_context(portfolio)
+    symbols, _, mean_returns, covariance_matrix = historical_return_moments(portfolio, context)
 
-    # Constraints and bounds for weights
-    constraints = {'type': 'eq', 'fun': lambda weights: np.sum(weights) - 1}
-    bounds = tuple((0, 1) for _ in range(num_stocks))
+    # The optimum does not depend on the warm start, so it is not part of the key
+    key = fingerprint('optimize', context.fingerprint, risk_free_rate, bounds, groups)
+    return get_result_cache().get_or_compute(key, lambda: _optimize(
+        symbols, mean_returns, covariance_matrix, risk_free_rate, bounds, groups, initial_weights))
 
-    # Initial guess for weights
-    initial_weights = num_stocks * [1. / num_stocks]
 
-    # Optimization
-    optimized_result = minimize(negative_sharpe_ratio, initial_weights,
-                                args=(expected_returns, covariance_matrix),
-                                method='SLSQP', bounds=bounds, constraints=constraints)
+@span('optimize')
+def _optimize(symbols, mean_returns, covariance_matrix, risk_free_rate, bounds, groups, initial_weights):
+    """Solves the maximum Sharpe ratio problem of optimize_portfolio on a cache miss."""
+    expected_returns, covariance_matrix = annualized_moments(mean_returns, covariance_matrix)
+    bound_list, group_list, start = _constraint_arrays(symbols, bounds, groups, initial_weights)
 
-    optimal_weights = optimized_result.x
+    optimal_weights = max_sharpe_weights(expected_returns, covariance_matrix, risk_free_rate,
+                                         bounds=bound_list, groups=group_list, initial_weights=start)
     portfolio_return = np.dot(optimal_weights, expected_returns)
     portfolio_risk = np.sqrt(np.dot(optimal_weights.T, np.dot(covariance_matrix, optimal_weights)))
-    sharpe_ratio = (portfolio_return - 0.01) / portfolio_risk
+    sharpe_ratio = (portfolio_return - risk_free_rate) / portfolio_risk
 
     # Map stock symbols to their optimal weights
-    optimal_weights_dict = {portfolio[i]['symbol']: optimal_weights[i] for i in range(num_stocks)}
+    optimal_weights_dict = {symbol: float(weight) for symbol, weight in zip(symbols, optimal_weights)}
 
     return optimal_weights_dict, portfolio_return, portfolio_risk, sharpe_ratio
 
 
-def enhanced_tax_loss_harvesting(portfolio, tax_bracket=0.2):
+def calculate_efficient_frontier(portfolio, context=None, num_points=20, target_returns=None, bounds=None,
+                                 groups=None):
     """
-    Performs tax loss harvesting to minimize tax liabilities.
+    Computes minimum-risk allocations for a range of target annual returns in one batched solve.
 
     Args:
         portfolio (list): List of securities in the portfolio.
-        tax_bracket (float): The user's tax bracket.
+        context (MarketDataContext): Market data for the request. Built from the portfolio if omitted.
+        num_points (int): Number of frontier points when no target returns are given. Default is 20.
+        target_returns (list): Optional annual target returns.
+        bounds (dict): Optional (min, max) weight per symbol.
+        groups (list): Optional group limits, each {"symbols": [...], "min": float, "max": float}.
 
     Returns:
-        tuple: Recommended sales, total losses, and tax savings.
+        list: One dictionary per target with the target return, risk, weights per symbol and whether
+        the target could be reached.
     """
-    # Ensure the portfolio has been updated with current prices
-    portfolio = fetch_current_prices(portfolio)
+    context = context or build_market_context(portfolio)
+    symbols, _, mean_returns, covariance_matrix = historical_return_moments(portfolio, context)
+
+    key = fingerprint('efficient_frontier', context.fingerprint, num_points, target_returns, bounds, groups)
+    return get_result_cache().get_or_compute(key, lambda: _frontier(
+        symbols, mean_returns, covariance_matrix, num_points, target_returns, bounds, groups))
+
+
+@span('optimize')
+def _frontier(symbols, mean_returns, covariance_matrix, num_points, target_returns, bounds, groups):
+    """Solves the batched frontier problems of calculate_efficient_frontier on a cache miss."""
+    expected_returns, covariance_matrix = annualized_moments(mean_returns, covariance_matrix)
+    bound_list, group_list, _ = _constraint_arrays(symbols, bounds, groups)
+
+    targets, weights, risks, solved = efficient_frontier(expected_returns, covariance_matrix, target_returns,
+                                                         num_points, bounds=bound_list, groups=group_list)
+    return [
+        {
+            "target_return": float(target),
+            "risk": float(risk) if ok else None,
+            "weights": dict(zip(symbols, row.tolist())) if ok else None,
+            "feasible": bool(ok),
+        }
+        for target, row, risk, ok in zip(targets, weights, risks, solved)
+    ]
+
+
+def enhanced_tax_loss_harvesting(portfolio, tax_bracket=0.2, context=None, long_term_rate=None, as_of=None,
+                                 replacements=0, replacement_universe=None):
+    """
+    Performs lot-level tax loss harvesting to minimize tax liabilities.
 
-    recommended_sales = []
-    total_losses = 0
+    Positions may list their tax lots under 'lots'; otherwise each position is a single lot. Losses
+    are split into short and long term by holding period, and losses that recent purchases of the
+    same symbol would turn into wash sales are excluded.
 
-    for security in portfolio:
-        symbol = security.get('symbol')
-        purchase_price = security.get('purchase_price')
-        current_price = security.get('current_price')
-        shares = security.get('shares')
+    With ``replacements`` every recommended sale lists that many substitutes from the replacement
+    universe that keep the market exposure, ranked by tracking error. Substantially identical
+    securities and securities the portfolio bought in the wash-sale window are never proposed.
+
+    Args:
+        portfolio (list): List of securities in the portfolio.
+        tax_bracket (float): The user's tax bracket, applied to short-term losses.
+        context (MarketDataContext): Market data for the request. Built from the portfolio if omitted.
+        long_term_rate (float): Rate applied to long-term losses. Defaults to the tax bracket.
+        as_of (str): Date of the harvesting sales. Defaults to today.
+        replacements (int): Number of substitutes per sale. Default is 0 (none).
+        replacement_universe (list): Candidate symbols. Defaults to the configured universe.
+
+    Returns:
+        tuple: Recommended sales, total losses, and tax savings.
+    """
+    context = context or build_market_context(portfolio)
+    as_of = as_of or np.datetime64('today', 'D')
+
+    # Ensure the portfolio has been updated with current prices
+    portfolio = fetch_current_prices(portfolio, context)
+    prices = {security['symbol']: security['current_price'] for security in portfolio
+              if security.get('current_price') is not None}
+    long_term_rate = tax_bracket if long_term_rate is None else long_term_rate
 
-        # Debugging output to ensure correct prices are being used
-        print(f"Symbol: {symbol}, Purchase Price: {purchase_price}, Current Price: {current_price}, Shares: {shares}")
+    with span('harvest'):
+        ledger = LotLedger.from_portfolio(portfolio)
+        losses = ledger.harvestable_losses(prices, as_of)
 
-        loss = (purchase_price - current_price) * shares
-        print(f"Calculated Loss for {symbol}: {loss}")  # Debugging output
-        if loss > 0:
+    recommended_sales = []
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for i, symbol in enumerate(ledger.symbol_names):
+        short_term_loss = float(losses['short_term_loss'][i])
+        long_term_loss = float(losses['long_term_loss'][i])
+        if debug:
+            logger.debug("Harvestable losses", extra={
+                "symbol": symbol, "current_price": prices.get(symbol), "short_term_loss": short_term_loss,
+                "long_term_loss": long_term_loss, "wash_sale_shares": float(losses['wash_sale_shares'][i])})
+        if short_term_loss + long_term_loss > 0:
             recommended_sales.append({
                 "symbol": symbol,
-                "loss": loss,
-                "shares": shares
+                "loss": short_term_loss + long_term_loss,
+                "shares": float(losses['loss_shares'][i]),
+                "lots": int(losses['loss_lots'][i]),
+                "short_term_loss": short_term_loss,
+                "long_term_loss": long_term_loss,
+                "wash_sale_shares": float(losses['wash_sale_shares'][i]),
+                "disallowed_loss": float(losses['disallowed_loss'][i]),
             })
-            total_losses += loss
 
-    tax_savings = total_losses * tax_bracket
+    if replacements and recommended_sales:
+        _add_replacements(recommended_sales, ledger, context, as_of, replacements, replacement_universe)
+
+    total_losses = sum(sale['loss'] for sale in recommended_sales)
+    tax_savings = sum(sale['short_term_loss'] * tax_bracket + sale['long_term_loss'] * long_term_rate
+                      for sale in recommended_sales)
 
     return recommended_sales, total_losses, tax_savings
 
+
+def _add_replacements(recommended_sales, ledger, context, as_of, k=DEFAULT_TOP_K, universe=None):
+    """Adds ranked substitutes with their tracking error to each recommended sale."""
+    index = get_replacement_finder(load_price_matrix).index(universe)
+    as_of = int(to_days(as_of))
+    recent = (ledger.acquired >= as_of - WASH_SALE_DAYS) & (ledger.acquired <= as_of)
+    bought_recently = {ledger.symbol_names[code] for code in np.unique(ledger.codes[recent])}
+
+    raw_prices = context.raw_prices
+    with span('harvest'):
+        for sale in recommended_sales:
+            symbol = sale['symbol']
+            prices = (raw_prices.dates, raw_prices.column(symbol)) if symbol in raw_prices.symbols else None
+            sale['replacements'] = index.nearest(symbol, k, exclude=bought_recently, prices=prices)
+
+
+def tax_aware_rebalance(accounts, target_weights=None, context=None, risk_aversion=DEFAULT_RISK_AVERSION,
+                        max_turnover=None, gains_budget=None, min_trade=None, as_of=None,
+                        num_segments=DEFAULT_SEGMENTS):
+    """
+    Finds trades that move accounts toward their target weights while limiting the tax they realize.
+
+    Each account trades off its annualized tracking variance to the targets against the tax of the
+    lots it sells, with lots relieved cheapest first (see app.rebalance). All accounts share the
+    covariance matrix of the union of their securities and are solved in batches against one
+    factorization.
+
+    Args:
+        accounts (list): Accounts as {"id", "portfolio", "tax_bracket", "long_term_rate",
+            "target_weights", "max_turnover", "gains_budget", "min_trade"}; all but the portfolio
+            are optional and override the shared values for that account.
+        target_weights (dict): Shared target weight per symbol, e.g. a model portfolio. Accounts
+            without targets aim for the maximum Sharpe ratio weights of their own holdings.
+        context (MarketDataContext): Market data covering every held and target symbol. Built if omitted.
+        risk_aversion (float): Weight of the tracking variance against the tax (a fraction of the account).
+        max_turnover (float): Largest fraction of an account sold.
+        gains_budget (float): Largest net realized gain of an account, in dollars.
+        min_trade (float): Smallest trade in one security, in dollars.
+        as_of (str): Trade date. Defaults to today.
+        num_segments (int): Linear pieces of each security's lot-relief cost.
+
+    Returns:
+        list: One result per account, in order, with its trades (and the lots each sale relieves),
+        weights after trading, tracking error before and after, realized gains and estimated tax;
+        or an 'error' for accounts that could not be rebalanced.
+    """
+    symbols = [security['symbol'] for account in accounts for security in account.get('portfolio') or ()]
+    symbols += list(target_weights or ())
+    symbols += [symbol for account in accounts for symbol in account.get('target_weights') or ()]
+    context = context or MarketDataContext(symbols, fetch_price_histories)
+    context.require_data()
+    as_of = as_of or np.datetime64('today', 'D')
+    assets = context.symbols
+    prices = context.latest_prices
+    _, covariance_matrix = annualized_moments(context.mean_returns, context.covariance)
+
+    results = [None] * len(accounts)
+    prepared = []
+    with span('harvest'):
+        for i, account in enumerate(accounts):
+            try:
+                prepared.append(_prepare_account(account, assets, prices, context, as_of, target_weights,
+                                                 max_turnover, gains_budget, min_trade, num_segments) + (i,))
+            except (KeyError, TypeError, ValueError) as e:
+                results[i] = {"id": account.get("id"), "error": str(e)}
+    if not prepared:
+        return results
+
+    account_data, targets, turnover, budget, minimum, positions = zip(*prepared)
+    with span('optimize'):
+        solution = rebalance_weights(
+            covariance_matrix, np.array(targets), np.array([data['segments']['weights'] for data in account_data]),
+            np.array([data['segments']['capacities'] for data in account_data]),
+            np.array([data['segments']['costs'] for data in account_data]),
+            np.array([data['segments']['gains'] for data in account_data]),
+            risk_aversion, np.array(turnover), np.array(budget), np.array(minimum))
+
+    with span('harvest'):
+        for k, (data, i) in enumerate(zip(account_data, positions)):
+            results[i] = _rebalance_result(data, solution, k, assets, prices, as_of)
+    return results
+
+
+def _prepare_account(account, assets, prices, context, as_of, target_weights, max_turnover, gains_budget,
+                     min_trade, num_segments):
+    """Values one account's lots and resolves its targets and limits, in weights, for tax_aware_rebalance."""
+    portfolio = account['portfolio']
+    if not portfolio:
+        raise ValueError("No portfolio data provided")
+    tax_bracket = 0.2 if account.get('tax_bracket') is None else float(account['tax_bracket'])
+    long_term_rate = tax_bracket if account.get('long_term_rate') is None else float(account['long_term_rate'])
+    ledger = LotLedger.from_portfolio(portfolio)
+    segments = account_segments(ledger, assets, prices, as_of, tax_bracket, long_term_rate, num_segments)
+
+    targets = account.get('target_weights') or target_weights
+    if not targets:
+        own = MarketDataContext.from_prices([security['symbol'] for security in portfolio], context.raw_prices)
+        targets, _, _, _ = optimize_portfolio(portfolio, context=own)
+    target = np.array([float(targets.get(symbol, 0.0)) for symbol in assets])
+    if np.any(target < 0) or target.sum() <= 0:
+        raise ValueError("Target weights must be non-negative and include a security with price data")
+
+    def limit(name, shared, default):
+        value = account.get(name, shared)
+        if value is None:
+            return default
+        if float(value) < 0 and name != 'gains_budget':
+            raise ValueError(f"{name} must not be negative")
+        return float(value)
+
+    value = segments['value']
+    data = {"id": account.get('id'), "ledger": ledger, "segments": segments, "target": target / target.sum(),
+            "tax_bracket": tax_bracket, "long_term_rate": long_term_rate,
+            "excluded_symbols": sorted(set(ledger.symbol_names) - set(assets))}
+    return (data, data["target"], limit('max_turnover', max_turnover, np.inf),
+            limit('gains_budget', gains_budget, np.inf) / value, limit('min_trade', min_trade, 0.0) / value)
+
+
+def _rebalance_result(data, solution, k, assets, prices, as_of):
+    """Turns one account's optimal weights into trades, relieving the sold lots in tax-cost order."""
+    ledger, segments = data['ledger'], data['segments']
+    value = segments['value']
+    as_of_day = int(to_days(as_of))
+    relief_order = {}
+    for row in segments['rows']:
+        relief_order.setdefault(ledger.symbol_names[ledger.codes[row]], []).append(row)
+
+    trades = []
+    short_term_gain = long_term_gain = disallowed_loss = 0.0
+    for j, symbol in enumerate(assets):
+        price = prices.get(symbol)
+        buy, sell = float(solution['buys'][k, j]), float(solution['sells'][k, j])
+        if buy > 0:
+            trades.append({"symbol": symbol, "action": "buy", "shares": buy * value / price, "value": buy * value})
+        if sell <= 0:
+            continue
+        rows = np.array(relief_order[symbol], dtype=np.int64)
+        shares = min(sell * value / price, float(ledger.quantity[rows].sum()))
+        relieved, taken = ledger.relieve(symbol, shares, 'specific', ledger.lot_ids[rows].tolist())
+        gains = (price - ledger.basis[relieved]) * taken
+        disallowed = 0.0
+        if symbol in segments['bought_recently']:
+            disallowed = float(-gains[gains < 0].sum())
+            gains = np.maximum(gains, 0.0)
+        long_term = as_of_day - ledger.acquired[relieved] > LONG_TERM_DAYS
+        trade = {
+            "symbol": symbol,
+            "action": "sell",
+            "shares": shares,
+            "value": sell * value,
+            "lots": [{"lot_id": str(lot_id), "shares": float(quantity)}
+                     for lot_id, quantity in zip(ledger.lot_ids[relieved].tolist(), taken)],
+            "short_term_gain": float(gains[~long_term].sum()),
+            "long_term_gain": float(gains[long_term].sum()),
+            "disallowed_loss": disallowed,
+        }
+        short_term_gain += trade['short_term_gain']
+        long_term_gain += trade['long_term_gain']
+        disallowed_loss += disallowed
+        trades.append(trade)
+
+    weights = solution['weights'][k]
+    return {
+        "id": data['id'],
+        "value": value,
+        "trades": trades,
+        "weights": {symbol: float(weight) for symbol, weight in zip(assets, weights) if weight > 1e-12},
+        "target_weights": {symbol: float(weight) for symbol, weight in zip(assets, data['target']) if weight > 0},
+        "tracking_error_before": float(solution['tracking_error_before'][k]),
+        "tracking_error_after": float(solution['tracking_error_after'][k]),
+        "turnover": float(solution['sells'][k].sum()),
+        "realized_short_term_gain": short_term_gain,
+        "realized_long_term_gain": long_term_gain,
+        "disallowed_loss": disallowed_loss,
+        "estimated_tax": short_term_gain * data['tax_bracket'] + long_term_gain * data['long_term_rate'],
+        "excluded_symbols": data['excluded_symbols'],
+        "solved": bool(solution['solved'][k]),
+    }
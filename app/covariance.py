@@ -0,0 +1,338 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict, deque, namedtuple
+
+import numpy as np
+
+from .instrumentation import REGISTRY
+from .monte_carlo import factor_covariance
+
+COVARIANCE_METHODS = ('expanding', 'ewma', 'rolling')
+DEFAULT_HALFLIFE = 63
+DEFAULT_WINDOW = 252
+DEFAULT_MAX_ENTRIES = 64
+
+# The rolling estimator subtracts the day leaving the window; it is refitted from the retained days
+# after this many windows so that rounding errors cannot accumulate.
+REFIT_WINDOWS = 4
+
+CovarianceEstimate = namedtuple('CovarianceEstimate', ['covariance', 'factor', 'shrinkage', 'num_observations'])
+
+
+class StreamingCovariance:
+    """
+    Covariance of daily returns that is updated in O(N^2) per new day.
+
+    The estimator keeps weighted sums of the returns, their squares and their second, third and
+    fourth order cross products. These are enough to compute both the sample covariance and the
+    Ledoit-Wolf (2004) shrinkage intensity towards a scaled identity exactly, without revisiting
+    the history. 'expanding' weighs every day equally, 'ewma' decays the weight of older days with
+    the given half-life, and 'rolling' keeps only the last ``window`` days.
+    """
+
+    def __init__(self, num_assets, method='expanding', window=DEFAULT_WINDOW, halflife=DEFAULT_HALFLIFE):
+        """
+        Args:
+            num_assets (int): Number of return series.
+            method (str): One of COVARIANCE_METHODS.
+            window (int): Number of days kept by the 'rolling' method.
+            halflife (float): Half-life in days of the 'ewma' weights.
+
+        Raises:
+            ValueError: If the method is unknown or its window or half-life is not positive.
+        """
+        if method not in COVARIANCE_METHODS:
+            raise ValueError(f"Unknown covariance method '{method}', expected one of {', '.join(COVARIANCE_METHODS)}")
+        if method == 'rolling' and window < 2:
+            raise ValueError("window must be at least 2 days")
+        if method == 'ewma' and not halflife > 0:
+            raise ValueError("halflife must be positive")
+        self.num_assets = num_assets
+        self.method = method
+        self.window = int(window)
+        self.decay = 0.5 ** (1 / halflife) if method == 'ewma' else 1.0
+        self._reset()
+
+    def _reset(self):
+        n = self.num_assets
+        self.weight = 0.0
+        self.weight_squares = 0.0
+        self.sum = np.zeros(n)
+        self.sum_squares = np.zeros(n)
+        self.products = np.zeros((n, n))
+        self.cubes = np.zeros((n, n))  # sum of x_i^2 x_j
+        self.fourths = np.zeros((n, n))  # sum of x_i^2 x_j^2
+        self.num_observations = 0
+        self._rows = deque()
+        self._removed = 0
+
+    def fit(self, returns):
+        """
+        Replaces the state with the given history.
+
+        Args:
+            returns (np.ndarray): (days x assets) daily returns, oldest first.
+
+        Returns:
+            StreamingCovariance: self.
+        """
+        self._reset()
+        returns = np.asarray(returns, dtype=np.float64).reshape(-1, self.num_assets)
+        if self.method == 'rolling':
+            returns = returns[-self.window:]
+            self._rows.extend(returns)
+        weights = self.decay ** np.arange(len(returns) - 1, -1, -1, dtype=np.float64)
+        squares = returns * returns
+        weighted = returns * weights[:, None]
+        weighted_squares = squares * weights[:, None]
+        self.weight = float(weights.sum())
+        self.weight_squares = float(weights @ weights)
+        self.sum = weighted.sum(axis=0)
+        self.sum_squares = weighted_squares.sum(axis=0)
+        self.products = weighted.T @ returns
+        self.cubes = weighted_squares.T @ returns
+        self.fourths = weighted_squares.T @ squares
+        self.num_observations = len(returns)
+        return self
+
+    def _accumulate(self, row, sign):
+        squares = row * row
+        self.weight += sign
+        self.weight_squares += sign
+        self.sum += sign * row
+        self.sum_squares += sign * squares
+        self.products += sign * np.outer(row, row)
+        self.cubes += sign * np.outer(squares, row)
+        self.fourths += sign * np.outer(squares, squares)
+        self.num_observations += int(sign)
+
+    def update(self, row):
+        """
+        Adds one day of returns.
+
+        Args:
+            row (np.ndarray): Return of each asset on the new day.
+        """
+        row = np.asarray(row, dtype=np.float64).reshape(self.num_assets)
+        if self.decay != 1.0:
+            for name in ('sum', 'sum_squares', 'products', 'cubes', 'fourths'):
+                getattr(self, name).__imul__(self.decay)
+            self.weight *= self.decay
+            self.weight_squares *= self.decay ** 2
+        self._accumulate(row, 1.0)
+        if self.method == 'rolling':
+            self._rows.append(row)
+            if len(self._rows) > self.window:
+                self._accumulate(self._rows.popleft(), -1.0)
+                self._removed += 1
+                if self._removed >= REFIT_WINDOWS * self.window:
+                    self.fit(np.array(self._rows))
+
+    @property
+    def mean(self):
+        """Weighted mean return of each asset."""
+        return self.sum / self.weight
+
+    def estimate(self, shrinkage=True):
+        """
+        Computes the covariance matrix from the current state.
+
+        Args:
+            shrinkage (bool): Shrink towards the average variance times the identity with the
+                Ledoit-Wolf intensity, which keeps the matrix well conditioned when the number of
+                assets approaches the number of days.
+
+        Returns:
+            tuple: (covariance matrix, shrinkage intensity in [0, 1]).
+
+        Raises:
+            ValueError: If fewer than two days have been added.
+        """
+        if self.num_observations < 2:
+            raise ValueError("At least two days of returns are needed to estimate a covariance.")
+        weight = self.weight
+        mean = self.mean
+        sample = self.products / weight - np.outer(mean, mean)
+        effective_days = weight ** 2 / self.weight_squares
+
+        intensity = 0.0
+        if shrinkage and self.num_assets > 1:
+            target = np.trace(sample) / self.num_assets
+            distance = np.sum(sample ** 2) - 2 * target * np.trace(sample) + target ** 2 * self.num_assets
+            # Weighted sum over days of (y_i y_j)^2 for the demeaned returns y, expanded in raw sums
+            mi, mj = mean[:, None], mean[None, :]
+            centered_fourths = (self.fourths + mj ** 2 * self.sum_squares[:, None] + mi ** 2 * self.sum_squares[None, :]
+                                - 3 * weight * mi ** 2 * mj ** 2 - 2 * mj * self.cubes - 2 * mi * self.cubes.T
+                                + 4 * mi * mj * self.products)
+            spread = max(np.sum(centered_fourths) / weight - np.sum(sample ** 2), 0.0) / effective_days
+            if distance > 0:
+                intensity = min(spread, distance) / distance
+            sample = (1 - intensity) * sample
+            sample[np.diag_indices_from(sample)] += intensity * target
+
+        # Same normalization as np.cov for equal weights
+        covariance = sample * effective_days / (effective_days - 1)
+        return covariance, float(intensity)
+
+
+class CovarianceService:
+    """
+    Shrunk covariance matrices and their Cholesky factors, cached per symbol universe and window.
+
+    Each entry keeps a StreamingCovariance over the universe's daily returns. When a request's
+    history extends the one an entry was built from (same days, same values), only the new days are
+    added, so a new trading day costs O(N^2) instead of a full O(N^2 T) recomputation; a revised
+    history is rebuilt. Entries are evicted least recently used first.
+    """
+
+    def __init__(self, method='expanding', window=DEFAULT_WINDOW, halflife=DEFAULT_HALFLIFE, shrinkage=True,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Args:
+            method (str): One of COVARIANCE_METHODS.
+            window (int): Number of days used by the 'rolling' method.
+            halflife (float): Half-life in days of the 'ewma' method.
+            shrinkage (bool): Apply Ledoit-Wolf shrinkage.
+            max_entries (int): Number of universes kept.
+
+        Raises:
+            ValueError: If the method, window or half-life is invalid.
+        """
+        StreamingCovariance(1, method, window, halflife)  # Validates the settings
+        self.method = method
+        self.window = int(window)
+        self.halflife = float(halflife)
+        self.shrinkage = bool(shrinkage)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hit": 0, "update": 0, "rebuild": 0}
+
+    @property
+    def settings(self):
+        """Settings that determine the estimate, e.g. to include in cache keys."""
+        parameter = {'rolling': self.window, 'ewma': self.halflife}.get(self.method)
+        return self.method, parameter, self.shrinkage
+
+    def estimate(self, symbols, dates, returns, universe=None):
+        """
+        Returns the covariance of the given daily returns, reusing and extending cached state.
+
+        Args:
+            symbols (list): Symbol of each column.
+            dates (np.ndarray): Sorted int64 day number of each row.
+            returns (np.ndarray): (days x symbols) daily returns, oldest first.
+            universe (tuple): Extra key separating histories of the same symbols, e.g. the alignment policy.
+
+        Returns:
+            CovarianceEstimate: Covariance, its Cholesky (or eigen) factor, shrinkage intensity and
+            the number of days used.
+        """
+        dates = np.asarray(dates, dtype=np.int64)
+        returns = np.asarray(returns, dtype=np.float64).reshape(len(dates), len(symbols))
+        key = (tuple(symbols), universe) + self.settings
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        result, new_entry = self._extend(entry, dates, returns)
+        with self._lock:
+            self.stats[result] += 1
+            self._entries[key] = new_entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return new_entry["estimate"]
+
+    def _extend(self, entry, dates, returns):
+        if entry is not None and len(dates) and dates[0] == entry["first_date"]:
+            position = np.searchsorted(dates, entry["last_date"])
+            if (position < len(dates) and dates[position] == entry["last_date"]
+                    and _digest(returns[:position + 1]) == entry["digest"]):
+                if position == len(dates) - 1:
+                    return "hit", entry
+                # Entries are shared between threads, so extend a copy of the state
+                estimator = _copy_estimator(entry["estimator"])
+                for row in returns[position + 1:]:
+                    estimator.update(row)
+                return "update", self._entry(estimator, dates, returns)
+
+        estimator = StreamingCovariance(returns.shape[1], self.method, self.window, self.halflife).fit(returns)
+        return "rebuild", self._entry(estimator, dates, returns)
+
+    def _entry(self, estimator, dates, returns):
+        covariance, intensity = estimator.estimate(self.shrinkage)
+        return {
+            "estimator": estimator,
+            "first_date": dates[0],
+            "last_date": dates[-1],
+            "digest": _digest(returns),
+            "estimate": CovarianceEstimate(covariance, factor_covariance(covariance), intensity,
+                                           estimator.num_observations),
+        }
+
+    def clear(self):
+        """Drops every cached universe."""
+        with self._lock:
+            self._entries.clear()
+
+
+def _digest(returns):
+    # Detects revisions of days already folded into an estimate
+    return hashlib.blake2b(np.ascontiguousarray(returns).tobytes(), digest_size=16).digest()
+
+
+def _copy_estimator(estimator):
+    copy = object.__new__(StreamingCovariance)
+    copy.__dict__.update(estimator.__dict__)
+    for name in ('sum', 'sum_squares', 'products', 'cubes', 'fourths'):
+        setattr(copy, name, getattr(estimator, name).copy())
+    copy._rows = deque(estimator._rows)
+    return copy
+
+
+_default_service = None
+_default_service_lock = threading.Lock()
+
+
+def get_covariance_service():
+    """
+    Returns the process-wide covariance service, creating it from the environment on first use.
+
+    Environment:
+        COVARIANCE_METHOD: 'expanding' (default), 'ewma' or 'rolling'.
+        COVARIANCE_WINDOW: Days used by the 'rolling' method.
+        COVARIANCE_HALFLIFE: Half-life in days of the 'ewma' method.
+        COVARIANCE_SHRINKAGE: '0' disables Ledoit-Wolf shrinkage.
+        COVARIANCE_CACHE_ENTRIES: Number of symbol universes kept.
+
+    Returns:
+        CovarianceService: The shared service.
+    """
+    global _default_service
+    with _default_service_lock:
+        if _default_service is None:
+            _default_service = CovarianceService(
+                method=os.getenv('COVARIANCE_METHOD', 'expanding'),
+                window=int(os.getenv('COVARIANCE_WINDOW', DEFAULT_WINDOW)),
+                halflife=float(os.getenv('COVARIANCE_HALFLIFE', DEFAULT_HALFLIFE)),
+                shrinkage=os.getenv('COVARIANCE_SHRINKAGE', '1').lower() in ('1', 'true', 'yes'),
+                max_entries=int(os.getenv('COVARIANCE_CACHE_ENTRIES', DEFAULT_MAX_ENTRIES)),
+            )
+        return _default_service
+
+
+@REGISTRY.collector
+def _covariance_metrics():
+    service = _default_service
+    if service is None:
+        return []
+    stats = dict(service.stats)
+    return [
+        ("tax_alpha_covariance_estimates_total", "counter",
+         "Covariance requests, by whether the cached estimate was reused, extended by new days or rebuilt.",
+         [({"result": result}, count) for result, count in stats.items()]),
+        ("tax_alpha_covariance_universes", "gauge", "Symbol universes with a cached covariance.",
+         [({}, len(service._entries))]),
+    ]
@@ -0,0 +1,244 @@
+import importlib
+import io
+import zlib
+
+import numpy as np
+from flask import Response, jsonify, request
+
+from .instrumentation import span
+
+JSON_MIMETYPE = 'application/json'
+NPY_MIMETYPE = 'application/x-npy'
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+# Bytes of an array handed to the server (and the compressor) at a time.
+CHUNK_BYTES = 1 << 20
+# Arrow IPC end-of-stream marker: a continuation token followed by a zero message length.
+ARROW_END_OF_STREAM = b'\xff\xff\xff\xff\x00\x00\x00\x00'
+# JSON bodies smaller than this are sent uncompressed; compressing them costs more than it saves.
+MIN_COMPRESS_BYTES = 1024
+
+_MISSING = object()
+_optional_modules = {}
+
+
+def optional_module(name):
+    """
+    Imports an optional dependency on first use.
+
+    Args:
+        name (str): Module name, e.g. 'pyarrow' or 'zstandard'.
+
+    Returns:
+        module: The module, or None if it is not installed.
+    """
+    module = _optional_modules.get(name, _MISSING)
+    if module is _MISSING:
+        try:
+            module = importlib.import_module(name)
+        except ImportError:
+            module = None
+        _optional_modules[name] = module
+    return module
+
+
+def negotiate_format(binary=True):
+    """
+    Picks the response format of the current request from its Accept header.
+
+    Args:
+        binary (bool): Whether the route can answer with arrays. NumPy's .npy format is always
+            offered, Arrow IPC streams only if pyarrow is installed.
+
+    Returns:
+        str: One of JSON_MIMETYPE, NPY_MIMETYPE and ARROW_MIMETYPE. JSON when the header is missing
+        or accepts none of the formats offered.
+    """
+    offered = [JSON_MIMETYPE]
+    if binary:
+        offered.append(NPY_MIMETYPE)
+        if optional_module('pyarrow') is not None:
+            offered.append(ARROW_MIMETYPE)
+    return request.accept_mimetypes.best_match(offered) or JSON_MIMETYPE
+
+
+def negotiate_encoding():
+    """
+    Picks the content coding of the current request from its Accept-Encoding header.
+
+    Returns:
+        str: 'zstd' (only if zstandard is installed), 'gzip', or None to send the body as is.
+    """
+    offered = ['gzip']
+    if optional_module('zstandard') is not None:
+        offered.insert(0, 'zstd')
+    return request.accept_encodings.best_match(offered)
+
+
+def _compressor(encoding):
+    # Both have compress(data) and flush(), which ends the stream
+    if encoding == 'zstd':
+        return optional_module('zstandard').ZstdCompressor().compressobj()
+    return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def encode_chunks(chunks, encoding):
+    """
+    Compresses a stream of byte chunks.
+
+    Args:
+        chunks (iterable): Bytes-like chunks.
+        encoding (str): 'gzip', 'zstd' or None.
+
+    Yields:
+        bytes: The encoded stream.
+    """
+    if encoding is None:
+        for chunk in chunks:
+            yield bytes(chunk)
+        return
+    compressor = _compressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def npy_chunks(array):
+    """
+    Writes an array in NumPy's .npy format, chunk by chunk.
+
+    The data chunks are slices of the array's own buffer, so no copy of the whole array (and no
+    text) is built; np.load reads the concatenated chunks back.
+
+    Args:
+        array (np.ndarray): Array to send. Made C-contiguous first if it is not.
+
+    Yields:
+        bytes | memoryview: The header, then the data in CHUNK_BYTES pieces.
+    """
+    array = np.ascontiguousarray(array)
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, np.lib.format.header_data_from_array_1_0(array))
+    yield header.getvalue()
+    if array.size:
+        data = memoryview(array.reshape(-1)).cast('B')
+        for start in range(0, len(data), CHUNK_BYTES):
+            yield data[start:start + CHUNK_BYTES]
+
+
+def arrow_chunks(batches):
+    """
+    Writes record batches as an Arrow IPC stream, in pieces of about CHUNK_BYTES.
+
+    Each batch is cut into zero-copy row slices of about CHUNK_BYTES, and each slice is serialized
+    into its own IPC message, so no more than one piece of the stream is held at a time.
+
+    Args:
+        batches (iterable): pyarrow.RecordBatch objects sharing one schema.
+
+    Yields:
+        memoryview: The stream: the schema message, one message per slice, and the end-of-stream marker.
+    """
+    schema = None
+    for batch in batches:
+        if schema is None:
+            schema = batch.schema
+            yield memoryview(schema.serialize())
+        rows = max(1, CHUNK_BYTES * batch.num_rows // max(batch.nbytes, 1))
+        for start in range(0, batch.num_rows, rows):
+            yield memoryview(batch.slice(start, rows).serialize())
+    if schema is not None:
+        yield memoryview(ARROW_END_OF_STREAM)
+
+
+def arrow_batch(columns, metadata=None):
+    """
+    Builds one Arrow record batch from arrays with equal first dimensions, without copying numeric data.
+
+    Args:
+        columns (dict): Column name -> 1-D array, or 2-D array whose rows become fixed-size lists.
+        metadata (dict): String keys and values stored in the batch's schema.
+
+    Returns:
+        pyarrow.RecordBatch: The batch.
+    """
+    pa = optional_module('pyarrow')
+    arrays = []
+    for values in columns.values():
+        values = np.ascontiguousarray(values)
+        if values.ndim == 2:
+            arrays.append(pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1)), values.shape[1]))
+        else:
+            arrays.append(pa.array(values))
+    batch = pa.record_batch(arrays, names=list(columns))
+    return batch.replace_schema_metadata(metadata) if metadata else batch
+
+
+def arrow_path_batches(symbols, simulations):
+    """
+    Yields simulated paths as Arrow record batches, one batch per security.
+
+    Each row is one path: its 'symbol', 'path' number and the daily 'values' as a fixed-size list
+    backed by the simulation's own buffer.
+
+    Args:
+        symbols (list): Symbol of each security along the first axis.
+        simulations (np.ndarray): Array of shape (securities, paths, days).
+
+    Yields:
+        pyarrow.RecordBatch: The paths of one security.
+    """
+    pa = optional_module('pyarrow')
+    _, num_paths, num_days = simulations.shape
+    path_numbers = pa.array(np.arange(num_paths, dtype=np.int32))
+    for symbol, paths in zip(symbols, simulations):
+        values = pa.FixedSizeListArray.from_arrays(pa.array(np.ascontiguousarray(paths).reshape(-1)), num_days)
+        yield pa.record_batch([pa.array([symbol] * num_paths, pa.string()), path_numbers, values],
+                              names=['symbol', 'path', 'values'])
+
+
+def _timed(chunks):
+    with span('serialize'):
+        yield from chunks
+
+
+def stream_response(chunks, mimetype, headers=None):
+    """
+    Streams a binary body, compressed if the client accepts it.
+
+    Args:
+        chunks (iterable): Bytes-like chunks of the body, e.g. from npy_chunks or arrow_chunks.
+        mimetype (str): Content type.
+        headers (dict): Extra response headers.
+
+    Returns:
+        Response: The streaming response.
+    """
+    encoding = negotiate_encoding()
+    response = Response(encode_chunks(_timed(chunks), encoding), mimetype=mimetype, headers=headers,
+                        direct_passthrough=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
+
+
+def json_response(body):
+    """
+    Builds a JSON response, compressed if the client accepts it and the body is large enough.
+
+    Args:
+        body (dict): Response data.
+
+    Returns:
+        Response: The JSON response.
+    """
+    response = jsonify(body)
+    encoding = negotiate_encoding()
+    if encoding and response.content_length >= MIN_COMPRESS_BYTES:
+        with span('serialize'):
+            response.set_data(b''.join(encode_chunks([response.get_data()], encoding)))
+        response.headers['Content-Encoding'] = encoding
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
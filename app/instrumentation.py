@@ -0,0 +1,303 @@
+import bisect
+import contextvars
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+from flask.json.provider import DefaultJSONProvider
+
+# Upper bounds in seconds of the histogram buckets, from a millisecond to a minute.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+STAGES = ('fetch', 'parse', 'returns', 'simulate', 'optimize', 'harvest', 'serialize')
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonically increasing count, optionally split by label values."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """Adds ``amount`` to the count of the given label values."""
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        """Returns (name suffix, labels, value) for every label combination seen so far."""
+        with self._lock:
+            return [('', dict(zip(self.label_names, key)), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """
+    Distribution of observed values in fixed buckets, optionally split by label values.
+
+    Only the bucket counts, the sum and the count are kept, so observing is O(log buckets) and the
+    memory does not grow with traffic.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """Records one observation for the given label values."""
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        """Returns cumulative '_bucket' samples plus '_sum' and '_count' for every label combination."""
+        with self._lock:
+            values = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self._values.items())
+        samples = []
+        for key, (counts, total, count) in values:
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Set of metrics rendered together in the Prometheus text exposition format.
+
+    Besides counters and histograms owned by the registry, collectors can report values that
+    other components already keep (such as cache statistics) at scrape time, so those components
+    need no extra bookkeeping on their hot paths.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text, label_names=()):
+        """Returns the counter called ``name``, creating it on first use."""
+        return self._register(Counter, name, help_text, label_names)
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        """Returns the histogram called ``name``, creating it on first use."""
+        return self._register(Histogram, name, help_text, label_names, buckets=buckets)
+
+    def collector(self, collect):
+        """
+        Registers a callable that returns metric families at scrape time.
+
+        Args:
+            collect (callable): Returns a list of (name, kind, help, samples) tuples, where samples
+                is a list of (labels, value) pairs and kind is 'counter' or 'gauge'.
+
+        Returns:
+            callable: ``collect``, so this can be used as a decorator.
+        """
+        with self._lock:
+            self._collectors.append(collect)
+        return collect
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        families = [(metric.name, metric.kind, metric.help, metric.samples()) for metric in self._metrics.values()]
+        for collect in self._collectors:
+            try:
+                families.extend((name, kind, help_text, [('', labels, value) for labels, value in samples])
+                                for name, kind, help_text, samples in collect())
+            except Exception:
+                logger.exception("Metrics collector failed", extra={"collector": getattr(collect, '__name__', None)})
+
+        lines = []
+        for name, kind, help_text, samples in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}"
+                         for suffix, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, cls, name, help_text, label_names, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, label_names, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric '{name}' is already registered as a {metric.kind}")
+            return metric
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram('tax_alpha_stage_seconds', "Time spent in each calculation stage.", ('stage',))
+REQUEST_SECONDS = REGISTRY.histogram('tax_alpha_http_request_seconds', "Time to handle each HTTP request.",
+                                     ('endpoint', 'method', 'status'))
+
+# Stage durations of the current request, for its Server-Timing header.
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def span(stage):
+    """
+    Times a stage of a calculation.
+
+    The duration is recorded in the 'tax_alpha_stage_seconds' histogram and, inside a request,
+    added to the request's Server-Timing header. Work running on pool threads is only recorded in
+    the histogram.
+
+    Args:
+        stage (str): Stage name, one of STAGES.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def server_timing(timings, total=None):
+    """
+    Formats stage durations as a Server-Timing header value, e.g. 'fetch;dur=12.5, parse;dur=3.1'.
+
+    Args:
+        timings (dict): Seconds spent per stage.
+        total (float): Seconds spent on the whole request, reported as 'total'.
+
+    Returns:
+        str: Header value.
+    """
+    entries = [f"{stage};dur={seconds * 1e3:.2f}" for stage, seconds in timings.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1e3:.2f}")
+    return ', '.join(entries)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that records building JSON responses as the 'serialize' stage."""
+
+    def response(self, *args, **kwargs):
+        with span('serialize'):
+            return super().response(*args, **kwargs)
+
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.request_timings_token = _request_timings.set({})
+
+
+def _finish_request(response):
+    started = g.pop('request_started', None)
+    token = g.pop('request_timings_token', None)
+    if started is None or token is None:
+        return response
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    elapsed = time.perf_counter() - started
+    REQUEST_SECONDS.observe(elapsed, endpoint=request.endpoint or 'unknown', method=request.method,
+                            status=response.status_code)
+    response.headers['Server-Timing'] = server_timing(timings, elapsed)
+    return response
+
+
+def init_app(app):
+    """
+    Instruments a Flask application: request durations, Server-Timing headers and timed JSON
+    serialization. Safe to call more than once for the same application.
+
+    Args:
+        app (Flask): Application to instrument.
+    """
+    if app.extensions.get('tax_alpha_instrumentation'):
+        return
+    app.extensions['tax_alpha_instrumentation'] = True
+    provider = TimedJSONProvider(app)
+    for name in ('ensure_ascii', 'sort_keys', 'compact', 'mimetype'):
+        setattr(provider, name, getattr(app.json, name, getattr(provider, name)))
+    app.json = provider
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats log records as one JSON object per line, including any ``extra`` fields."""
+
+    _reserved = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in self._reserved)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=None, fmt=None):
+    """
+    Sends the application's log records to stderr.
+
+    Environment:
+        LOG_LEVEL: Minimum level logged, e.g. DEBUG, INFO or WARNING (defaults to INFO).
+        LOG_FORMAT: 'json' for one JSON object per line (the default) or 'text'.
+
+    Args:
+        level (str): Overrides LOG_LEVEL.
+        fmt (str): Overrides LOG_FORMAT.
+    """
+    level = (level or os.getenv('LOG_LEVEL') or 'INFO').upper()
+    fmt = fmt or os.getenv('LOG_FORMAT') or 'json'
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if fmt == 'json'
+                         else logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    app_logger = logging.getLogger('app')
+    app_logger.handlers[:] = [handler]
+    app_logger.setLevel(level)
+    app_logger.propagate = False
@@ -0,0 +1,426 @@
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+from .instrumentation import REGISTRY
+from .risk_stats import QuantileSketch, WelfordAccumulator
+
+DEFAULT_STORE_PATH = os.path.join(tempfile.gettempdir(), 'tax_alpha_jobs.sqlite3')
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_QUEUED = 64
+# Seconds between a running job's progress writes to the store, which also pick up cancellations
+# requested by other processes.
+DEFAULT_SYNC_SECONDS = 1.0
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(RuntimeError):
+    """Raised when a job is submitted while the queue holds its maximum number of jobs."""
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job when it has been cancelled."""
+
+
+class Job:
+    """
+    One unit of background work and its observable state.
+
+    The job's function is called as ``function(progress)``. ``progress(done, total)`` records how far
+    the job has got and raises JobCancelled once the job has been cancelled, so long-running work
+    stops at its next progress report. With ``sync``, at most every ``sync_seconds`` a progress
+    report also calls ``sync(job)``, which records the progress and picks up cancellations made
+    elsewhere.
+    """
+
+    def __init__(self, kind, function, priority=0, metadata=None, sync=None, sync_seconds=DEFAULT_SYNC_SECONDS):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.function = function
+        self.priority = priority
+        self.metadata = metadata or {}
+        self.status = QUEUED
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self.sync = sync
+        self.sync_seconds = sync_seconds
+        self._synced_at = time.monotonic()
+
+    def progress(self, done, total=None):
+        """Records progress and raises JobCancelled if the job has been cancelled."""
+        self.done = done
+        if total is not None:
+            self.total = total
+        if self.sync is not None and time.monotonic() - self._synced_at >= self.sync_seconds:
+            self._synced_at = time.monotonic()
+            self.sync(self)
+        if self.cancel_requested:
+            raise JobCancelled()
+
+    def to_dict(self):
+        """Returns the job's status, progress and timings (without the result)."""
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "priority": self.priority,
+            "status": self.status,
+            "progress": {"done": self.done, "total": self.total},
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "cancel_requested": self.cancel_requested,
+            **self.metadata,
+        }
+
+
+class JobStore:
+    """
+    SQLite record of jobs and their JSON results, shared by every worker process on the host.
+
+    A job is run by the process that queued it. Other processes read its state from the store and
+    cancel it by setting its ``cancel_requested`` flag, which the owning process checks when it
+    records progress.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY, status TEXT NOT NULL, state TEXT NOT NULL, result TEXT,"
+                " cancel_requested INTEGER NOT NULL DEFAULT 0)"
+            )
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(jobs)")}
+            if 'cancel_requested' not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0")
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def save(self, job):
+        """Writes the job's current state, and its result once it has succeeded. Keeps a requested cancellation."""
+        result = json.dumps(job.result) if job.status == SUCCEEDED else None
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "INSERT INTO jobs (job_id, status, state, result, cancel_requested) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (job_id) DO UPDATE SET status = excluded.status, state = excluded.state,"
+                " result = excluded.result, cancel_requested = MAX(cancel_requested, excluded.cancel_requested)",
+                (job.job_id, job.status, json.dumps(job.to_dict()), result, int(job.cancel_requested)))
+
+    def load(self, job_id):
+        """
+        Returns:
+            tuple: The stored job state and result, or (None, None) if the job is unknown.
+        """
+        row = self._connection().execute("SELECT state, result, cancel_requested FROM jobs WHERE job_id = ?",
+                                         (job_id,)).fetchone()
+        if row is None:
+            return None, None
+        state = json.loads(row[0])
+        state["cancel_requested"] = bool(row[2])
+        return state, None if row[1] is None else json.loads(row[1])
+
+    def request_cancel(self, job_id):
+        """
+        Flags an unfinished job for cancellation by the process running it.
+
+        Returns:
+            bool: False if the job is unknown or already finished.
+        """
+        connection = self._connection()
+        with connection:
+            cursor = connection.execute("UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status IN (?, ?)",
+                                        (job_id, QUEUED, RUNNING))
+        return cursor.rowcount > 0
+
+    def cancel_requested(self, job_id):
+        """Returns whether a job has been flagged for cancellation."""
+        row = self._connection().execute("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+
+class JobQueue:
+    """
+    Bounded priority queue of jobs served by a pool of worker threads.
+
+    Jobs with a higher priority run first and jobs of equal priority run in submission order. The
+    NumPy work the jobs do releases the GIL, and large simulations fan out to processes on their own,
+    so threads are enough to keep request workers free. Queue wait and run times are tracked so the
+    pool can be sized from ``stats``.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_queued=DEFAULT_MAX_QUEUED, store=None,
+                 sync_seconds=DEFAULT_SYNC_SECONDS):
+        """
+        Args:
+            workers (int): Number of worker threads.
+            max_queued (int): Maximum number of jobs waiting to run.
+            store (JobStore): Where job states and results are recorded. Jobs are only kept in
+                memory if omitted.
+            sync_seconds (float): Least time between two progress writes of a running job.
+        """
+        self.max_queued = max_queued
+        self.store = store
+        self.sync_seconds = sync_seconds
+        self._heap = []
+        self._order = itertools.count()
+        self._jobs = {}
+        self._running = 0
+        self._condition = threading.Condition()
+        self._counts = dict.fromkeys((SUCCEEDED, FAILED, CANCELLED), 0)
+        self._wait_moments = WelfordAccumulator()
+        self._run_moments = WelfordAccumulator()
+        self._wait_sketch = QuantileSketch(relative_accuracy=0.01, min_value=1e-4, max_value=1e5)
+        self._run_sketch = QuantileSketch(relative_accuracy=0.01, min_value=1e-4, max_value=1e5)
+        self._threads = [threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, kind, function, priority=0, metadata=None):
+        """
+        Queues a job.
+
+        Args:
+            kind (str): Name of the kind of work, e.g. 'monte-carlo'.
+            function (callable): Called with the job's progress callback; returns a JSON-serializable result.
+            priority (int): Higher priorities run first.
+            metadata (dict): Extra fields reported with the job's status.
+
+        Returns:
+            Job: The queued job.
+
+        Raises:
+            QueueFullError: If ``max_queued`` jobs are already waiting.
+        """
+        job = Job(kind, function, priority, metadata, sync=self._sync if self.store is not None else None,
+                  sync_seconds=self.sync_seconds)
+        with self._condition:
+            if len(self._heap) >= self.max_queued:
+                raise QueueFullError(f"The job queue is full ({self.max_queued} jobs waiting)")
+            # Recorded before a worker can pick it up, so the store never goes back to 'queued'
+            self._save(job)
+            self._jobs[job.job_id] = job
+            heapq.heappush(self._heap, (-priority, next(self._order), job))
+            self._condition.notify()
+        return job
+
+    def get(self, job_id):
+        """
+        Returns:
+            tuple: The job's state dictionary and its result (None until it has succeeded), or
+            (None, None) if the job is unknown.
+        """
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict(), job.result
+        if self.store is not None:
+            return self.store.load(job_id)
+        return None, None
+
+    def cancel(self, job_id):
+        """
+        Cancels a job. A queued job is dropped; a running job stops at its next progress report.
+
+        A job queued by another process sharing the store is flagged for cancellation there, and
+        stops when that process next records its progress or before it starts.
+
+        Returns:
+            dict: The job's state, with 'cancel_requested' set while it has yet to stop, or None if
+            the job is unknown.
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            if self.store is not None and self.store.request_cancel(job_id):
+                return self.store.load(job_id)[0]
+            return self.get(job_id)[0]
+        with self._condition:
+            if job.status == QUEUED:
+                self._heap = [entry for entry in self._heap if entry[2] is not job]
+                heapq.heapify(self._heap)
+                self._finish(job, CANCELLED)
+            elif job.status == RUNNING:
+                job.cancel_requested = True
+        state = job.to_dict()
+        if job.status == CANCELLED:
+            self._record(job)
+        elif job.cancel_requested and self.store is not None:
+            # Only the flag, so that a final state the worker records meanwhile is kept
+            try:
+                self.store.request_cancel(job_id)
+            except sqlite3.Error as e:
+                logger.warning("Failed to record job", extra={"job_id": job_id, "error": str(e)})
+        return state
+
+    @property
+    def stats(self):
+        """Queue depth, worker utilization and wait/run time summaries in seconds."""
+        with self._condition:
+            def summary(moments, sketch):
+                if not moments.count:
+                    return {"count": 0}
+                return {"count": moments.count, "mean": float(moments.mean),
+                        "p50": float(sketch.quantile(0.5)), "p95": float(sketch.quantile(0.95))}
+
+            return {
+                "queued": len(self._heap),
+                "running": self._running,
+                "workers": len(self._threads),
+                "max_queued": self.max_queued,
+                **self._counts,
+                "wait_seconds": summary(self._wait_moments, self._wait_sketch),
+                "run_seconds": summary(self._run_moments, self._run_sketch),
+            }
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+                _, _, job = heapq.heappop(self._heap)
+                job.status = RUNNING
+                job.started_at = time.time()
+                self._running += 1
+                wait = job.started_at - job.submitted_at
+                self._wait_moments.update([wait])
+                self._wait_sketch.update([wait])
+            self._sync(job)
+
+            try:
+                if job.cancel_requested:
+                    raise JobCancelled()
+                result, status, error = job.function(job.progress), SUCCEEDED, None
+            except JobCancelled:
+                result, status, error = None, CANCELLED, None
+            except Exception as e:
+                result, status, error = None, FAILED, str(e)
+
+            with self._condition:
+                self._running -= 1
+                job.result = result
+                job.error = error
+                self._finish(job, status)
+                run = job.finished_at - job.started_at
+                self._run_moments.update([run])
+                self._run_sketch.update([run])
+            self._record(job)
+
+    def _finish(self, job, status):
+        # Caller holds the condition.
+        job.status = status
+        job.finished_at = time.time()
+        job.function = None
+        self._counts[status] += 1
+
+    def _record(self, job):
+        # Stores a finished job, and drops it from memory once its final state is stored. A result
+        # that cannot be stored fails the job instead of leaving it 'running' in the store.
+        error = self._save(job)
+        if error is not None and job.status == SUCCEEDED and not isinstance(error, sqlite3.Error):
+            with self._condition:
+                self._counts[SUCCEEDED] -= 1
+                self._counts[FAILED] += 1
+                job.status, job.result = FAILED, None
+                job.error = f"The result could not be stored: {error}"
+            error = self._save(job)
+        if error is None:
+            self._release(job)
+
+    def _release(self, job):
+        # Finished jobs stay in memory only until they have been recorded in the store.
+        if self.store is not None:
+            with self._condition:
+                self._jobs.pop(job.job_id, None)
+
+    def _save(self, job):
+        # Returns the error that kept the job from being recorded, or None
+        if self.store is None:
+            return None
+        try:
+            self.store.save(job)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning("Failed to record job", extra={"job_id": job.job_id, "error": str(e)})
+            return e
+        return None
+
+    def _sync(self, job):
+        # Records a running job's progress and picks up a cancellation requested by another process
+        if self.store is None or self._save(job) is not None:
+            return
+        try:
+            if self.store.cancel_requested(job.job_id):
+                job.cancel_requested = True
+        except sqlite3.Error as e:
+            logger.warning("Failed to read job", extra={"job_id": job.job_id, "error": str(e)})
+
+
+_default_queue = None
+_default_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """
+    Returns the process-wide job queue, creating it from the environment on first use.
+
+    Environment:
+        JOB_WORKERS: Number of worker threads.
+        JOB_MAX_QUEUED: Maximum number of jobs waiting to run.
+        JOB_STORE_PATH: SQLite database file for job states and results.
+
+    Returns:
+        JobQueue: The shared queue.
+    """
+    global _default_queue
+    with _default_queue_lock:
+        if _default_queue is None:
+            _default_queue = JobQueue(
+                workers=int(os.getenv('JOB_WORKERS', DEFAULT_WORKERS)),
+                max_queued=int(os.getenv('JOB_MAX_QUEUED', DEFAULT_MAX_QUEUED)),
+                store=JobStore(os.getenv('JOB_STORE_PATH', DEFAULT_STORE_PATH)),
+            )
+        return _default_queue
+
+
+@REGISTRY.collector
+def _queue_metrics():
+    queue = _default_queue
+    if queue is None:
+        return []
+    stats = queue.stats
+    return [
+        ("tax_alpha_jobs_queued", "gauge", "Jobs waiting to run.", [({}, stats["queued"])]),
+        ("tax_alpha_jobs_running", "gauge", "Jobs running.", [({}, stats["running"])]),
+        ("tax_alpha_jobs_finished_total", "counter", "Jobs finished, by final status.",
+         [({"status": status}, stats[status]) for status in FINISHED_STATES]),
+    ]
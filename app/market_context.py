@@ -0,0 +1,150 @@
+import logging
+from functools import cached_property
+
+from .covariance import get_covariance_service
+from .instrumentation import span
+from .price_matrix import ALIGN_POLICIES, PriceMatrix
+from .result_cache import fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+class MarketDataContext:
+    """
+    Market data for one request, fetched and parsed once and shared by every calculation.
+
+    Each derived quantity is computed on first access and cached on the instance, so a request that
+    both optimizes and simulates uses a single parse and a single covariance matrix.
+    """
+
+    def __init__(self, symbols, fetch_many, align='intersect'):
+        """
+        Args:
+            symbols (list): Stock symbols; duplicates are fetched once.
+            fetch_many (callable): Takes a list of symbols and returns a mapping of each symbol with
+                price data to its PriceHistory.
+            align (str): PriceMatrix alignment policy used for returns and covariance.
+
+        Raises:
+            ValueError: If the alignment policy is unknown.
+        """
+        if align not in ALIGN_POLICIES:
+            raise ValueError(f"Unknown alignment policy '{align}', expected one of {', '.join(ALIGN_POLICIES)}")
+        self.requested_symbols = list(dict.fromkeys(symbols))
+        self.fetch_many = fetch_many
+        self.align_policy = align
+
+    @classmethod
+    def from_prices(cls, symbols, prices, align='intersect'):
+        """
+        Creates a context over prices that have already been fetched and parsed, e.g. once for a
+        whole batch of portfolios.
+
+        Args:
+            symbols (list): Stock symbols; duplicates are used once.
+            prices (PriceMatrix): Unaligned prices covering (at least) the valid symbols.
+            align (str): PriceMatrix alignment policy used for returns and covariance.
+
+        Returns:
+            MarketDataContext: Context that never fetches.
+        """
+        context = cls(symbols, fetch_many=None, align=align)
+        context.raw_prices = prices.select(context.requested_symbols)
+        for symbol in context.requested_symbols:
+            if symbol not in context.raw_prices.symbols:
+                logger.warning("Invalid stock data, skipping symbol", extra={"symbol": symbol})
+        return context
+
+    @cached_property
+    def histories(self):
+        """PriceHistory of each requested symbol with price data."""
+        with span('fetch'):
+            return self.fetch_many(self.requested_symbols)
+
+    @cached_property
+    def raw_prices(self):
+        """Unaligned PriceMatrix over the union of every valid symbol's dates."""
+        histories = self.histories
+        with span('parse'):
+            matrix = PriceMatrix.from_histories(histories)
+        for symbol in self.requested_symbols:
+            if symbol not in matrix.symbols:
+                logger.warning("Invalid stock data, skipping symbol", extra={"symbol": symbol})
+        return matrix
+
+    @cached_property
+    def prices(self):
+        """PriceMatrix aligned with the context's policy, without missing values."""
+        raw_prices = self.raw_prices
+        with span('parse'):
+            return raw_prices.align(self.align_policy)
+
+    @property
+    def symbols(self):
+        """Symbols used for returns and covariance, in request order."""
+        return self.prices.symbols
+
+    @property
+    def dates(self):
+        """Aligned trading days as int64 days since the epoch."""
+        return self.prices.dates
+
+    @property
+    def closing_prices(self):
+        """Aligned (dates x symbols) matrix of closing prices, oldest date first."""
+        return self.prices.values
+
+    @property
+    def latest_prices(self):
+        """Most recent close of each symbol with valid data, whether or not it survives alignment."""
+        return self.raw_prices.latest_prices
+
+    @property
+    def log_returns(self):
+        """(dates - 1 x symbols) matrix of daily log returns."""
+        return self.prices.log_returns
+
+    @cached_property
+    def fingerprint(self):
+        """
+        Content hash of the aligned price history and the covariance settings; it changes as soon as
+        a new trading day arrives.
+        """
+        return fingerprint(self.align_policy, self.symbols, self.dates, self.closing_prices,
+                           get_covariance_service().settings)
+
+    @cached_property
+    def mean_returns(self):
+        """Mean daily log return of each symbol."""
+        prices = self.prices
+        with span('returns'):
+            return prices.log_returns.mean(axis=0)
+
+    @cached_property
+    def covariance_estimate(self):
+        """
+        CovarianceEstimate of the daily log returns from the shared covariance service, which
+        shrinks it and extends the cached estimate of the same symbols by the new days only.
+        """
+        prices = self.prices
+        with span('returns'):
+            return get_covariance_service().estimate(prices.symbols, prices.dates[1:], prices.log_returns,
+                                                     universe=self.align_policy)
+
+    @property
+    def covariance(self):
+        """Covariance matrix of the daily log returns."""
+        return self.covariance_estimate.covariance
+
+    @property
+    def covariance_factor(self):
+        """Cholesky (or eigen) factor of the covariance matrix, for drawing correlated shocks."""
+        return self.covariance_estimate.factor
+
+    def require_data(self):
+        """
+        Raises:
+            ValueError: If none of the requested symbols has valid price data.
+        """
+        if not self.symbols:
+            raise ValueError("No valid stock data found for the portfolio.")
@@ -0,0 +1,369 @@
+import importlib
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .instrumentation import REGISTRY
+
+ALPHA_VANTAGE_URL = 'https://www.alphavantage.co/query'
+
+# Phrases Alpha Vantage uses in the "Note"/"Information" payload when a caller is throttled.
+THROTTLE_MARKERS = ('call frequency', 'rate limit', 'requests per')
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that keeps callers under a per-minute request budget.
+
+    ``stall`` pushes every waiting caller back, which is how rate-limit responses from the
+    provider are turned into a queued backoff.
+    """
+
+    def __init__(self, requests_per_minute, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else max(1, requests_per_minute // 5))
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.stalled_until = 0.0
+        self.stalls = 0
+        self.waits = 0
+        self.waited_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        while True:
+            with self._lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.stalled_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.stalled_until - now, (1 - self.tokens) / self.rate)
+                self.waits += 1
+                self.waited_seconds += wait
+            self.sleep(wait)
+
+    def stall(self, seconds):
+        """Holds back every caller for at least ``seconds`` and empties the bucket."""
+        with self._lock:
+            self.stalled_until = max(self.stalled_until, self.clock() + seconds)
+            self.tokens = 0.0
+            self.stalls += 1
+
+
+class AlphaVantageClient:
+    """
+    Alpha Vantage daily price client with connection pooling, timeouts, retries and rate limiting.
+
+    Concurrent requests for the same symbol are coalesced into one upstream call.
+    """
+
+    def __init__(self, api_key, base_url=ALPHA_VANTAGE_URL, requests_per_minute=25, timeout=10.0,
+                 max_retries=3, backoff=15.0, max_workers=8, bucket=None, sleep=time.sleep):
+        """
+        Args:
+            api_key (str): Alpha Vantage API key.
+            base_url (str): Query endpoint, overridable for a local stub server.
+            requests_per_minute (int): Provider quota.
+            timeout (float): Per-request timeout in seconds.
+            max_retries (int): Retries after a throttled or failed request.
+            backoff (float): Base backoff in seconds after a throttled request, doubled on each retry.
+            max_workers (int): Size of the thread pool and of the connection pool.
+            bucket (TokenBucket): Shared limiter; one is created from ``requests_per_minute`` if omitted.
+            sleep (callable): Used for retry backoff after connection errors.
+        """
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_workers = max_workers
+        self.bucket = bucket or TokenBucket(requests_per_minute)
+        self.sleep = sleep
+        self.stats = {"requests": 0, "throttled": 0, "retries": 0, "coalesced": 0}
+
+        # Imported with the first client rather than with the application
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def fetch_daily(self, symbol):
+        """
+        Fetches the daily time series for a symbol.
+
+        Args:
+            symbol (str): Stock symbol to fetch data for.
+
+        Returns:
+            dict: The "Time Series (Daily)" mapping, or a dictionary with an 'error' key.
+        """
+        symbol = symbol.upper()
+        with self._lock:
+            future = self._inflight.get(symbol)
+            owner = future is None
+            if owner:
+                future = self._inflight[symbol] = Future()
+            else:
+                self.stats["coalesced"] += 1  # Already holding the lock
+        if not owner:
+            return future.result()
+
+        try:
+            result = self._request(symbol)
+        except Exception as e:
+            result = {"error": f"Failed to fetch data from Alpha Vantage: {e}"}
+        finally:
+            with self._lock:
+                del self._inflight[symbol]
+        future.set_result(result)
+        return result
+
+    def fetch_many(self, symbols):
+        """
+        Fetches several symbols concurrently.
+
+        Args:
+            symbols (list): Stock symbols; duplicates are fetched once.
+
+        Returns:
+            dict: Mapping of symbol to the result of fetch_daily.
+        """
+        symbols = list(dict.fromkeys(symbol.upper() for symbol in symbols))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return dict(zip(symbols, pool.map(self.fetch_daily, symbols)))
+
+    def _request(self, symbol):
+        import requests
+
+        params = {"function": "TIME_SERIES_DAILY", "symbol": symbol, "apikey": self.api_key}
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._count("retries")
+            self.bucket.acquire()
+            self._count("requests")
+            try:
+                response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                self.sleep(min(self.backoff, 2 ** attempt))
+                continue
+
+            if response.status_code == 429:
+                self._throttled(attempt)
+                continue
+            if response.status_code != 200:
+                return {"error": "Failed to fetch data from Alpha Vantage"}
+
+            try:
+                data = response.json()
+            except ValueError:
+                return {"error": "Failed to fetch data from Alpha Vantage"}
+            if "Time Series (Daily)" in data:
+                return data["Time Series (Daily)"]
+            message = str(data.get("Note") or data.get("Information") or "").lower()
+            if any(marker in message for marker in THROTTLE_MARKERS):
+                self._throttled(attempt)
+                continue
+            return {"error": "Invalid symbol or data not available"}
+
+        return {"error": "Alpha Vantage rate limit exceeded, try again later"}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _throttled(self, attempt):
+        self._count("throttled")
+        self.bucket.stall(self.backoff * 2 ** attempt)
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_market_data_client(api_key):
+    """
+    Returns the process-wide Alpha Vantage client, creating it from the environment on first use.
+
+    Environment:
+        ALPHA_VANTAGE_URL: Query endpoint (e.g. a local stub server).
+        ALPHA_VANTAGE_RPM: Requests per minute allowed by the API plan.
+        ALPHA_VANTAGE_TIMEOUT: Per-request timeout in seconds.
+        ALPHA_VANTAGE_MAX_WORKERS: Number of concurrent requests.
+
+    Args:
+        api_key (str): Alpha Vantage API key used if the client has to be created.
+
+    Returns:
+        AlphaVantageClient: The shared client.
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = AlphaVantageClient(
+                api_key,
+                base_url=os.getenv('ALPHA_VANTAGE_URL', ALPHA_VANTAGE_URL),
+                requests_per_minute=int(os.getenv('ALPHA_VANTAGE_RPM', 25)),
+                timeout=float(os.getenv('ALPHA_VANTAGE_TIMEOUT', 10)),
+                max_workers=int(os.getenv('ALPHA_VANTAGE_MAX_WORKERS', 8)),
+            )
+        return _default_client
+
+
+class OfflineProvider:
+    """
+    Provider that never downloads anything.
+
+    For deployments whose prices are bulk loaded into the price store (see app.bulk_loader): the
+    store then serves what was loaded, stale or not, and symbols that were never loaded fail.
+    """
+
+    max_workers = 8
+
+    def fetch_daily(self, symbol):
+        """Returns an error, as no price is available beyond the store."""
+        return {"error": f"No price data loaded for {symbol.upper()}"}
+
+
+class FallbackProvider:
+    """Asks several providers in turn until one has data for the symbol."""
+
+    def __init__(self, providers):
+        """
+        Args:
+            providers (list): Providers with a fetch_daily method, most preferred first.
+        """
+        self.providers = list(providers)
+        self.max_workers = max(getattr(provider, 'max_workers', 1) for provider in self.providers)
+
+    def fetch_daily(self, symbol):
+        """
+        Fetches the daily time series for a symbol from the first provider that has it.
+
+        Args:
+            symbol (str): Stock symbol to fetch data for.
+
+        Returns:
+            dict: The "Time Series (Daily)" mapping, or the error of the last provider.
+        """
+        result = None
+        for provider in self.providers:
+            result = provider.fetch_daily(symbol)
+            if result and "error" not in result:
+                return result
+        return result
+
+
+# Provider name -> factory taking no arguments. Factories run when the provider is first needed,
+# so configuration such as the API key is read then and not at import time.
+PROVIDERS = {
+    'alpha_vantage': lambda: get_market_data_client(os.getenv('ALPHA_VANTAGE_API_KEY')),
+    'offline': OfflineProvider,
+}
+
+
+def register_provider(name, factory):
+    """
+    Makes a market data provider available under a name for MARKET_DATA_PROVIDER.
+
+    Args:
+        name (str): Name used in the configuration.
+        factory (callable): Takes no arguments and returns an object with a
+            ``fetch_daily(symbol)`` method (returning an Alpha Vantage "Time Series (Daily)" mapping
+            or a dictionary with an 'error' key) and a ``max_workers`` attribute.
+    """
+    PROVIDERS[name] = factory
+
+
+def resolve_provider(spec):
+    """
+    Creates the provider described by a configuration string.
+
+    Args:
+        spec (str): Comma-separated provider names, most preferred first. Each is a name from
+            PROVIDERS or a 'package.module:factory' path. Several names give a FallbackProvider.
+
+    Returns:
+        object: The provider.
+
+    Raises:
+        ValueError: If a name is neither registered nor importable.
+    """
+    providers = []
+    for name in (part.strip() for part in spec.split(',')):
+        if not name:
+            continue
+        if name in PROVIDERS:
+            factory = PROVIDERS[name]
+        elif ':' in name:
+            module_name, _, attribute = name.partition(':')
+            try:
+                factory = getattr(importlib.import_module(module_name), attribute)
+            except (ImportError, AttributeError) as e:
+                raise ValueError(f"Cannot load market data provider '{name}': {e}") from e
+        else:
+            raise ValueError(f"Unknown market data provider '{name}'")
+        providers.append(factory())
+    if not providers:
+        raise ValueError("No market data provider configured")
+    return providers[0] if len(providers) == 1 else FallbackProvider(providers)
+
+
+_default_provider = None
+_default_provider_lock = threading.Lock()
+
+
+def get_market_data_provider():
+    """
+    Returns the process-wide market data provider, creating it from the environment on first use.
+
+    Environment:
+        MARKET_DATA_PROVIDER: Comma-separated providers tried in order, see resolve_provider.
+            Defaults to 'alpha_vantage'; e.g. 'vendor.feed:Provider,alpha_vantage' keeps the HTTP
+            API as a fallback for symbols the vendor feed lacks.
+
+    Returns:
+        object: The shared provider.
+    """
+    global _default_provider
+    with _default_provider_lock:
+        if _default_provider is None:
+            _default_provider = resolve_provider(os.getenv('MARKET_DATA_PROVIDER', 'alpha_vantage'))
+        return _default_provider
+
+
+@REGISTRY.collector
+def _client_metrics():
+    client = _default_client
+    if client is None:
+        return []
+    stats, bucket = dict(client.stats), client.bucket
+    return [
+        ("tax_alpha_upstream_requests_total", "counter", "Requests sent to Alpha Vantage, including retries.",
+         [({}, stats["requests"])]),
+        ("tax_alpha_upstream_retries_total", "counter", "Alpha Vantage requests retried after an error.",
+         [({}, stats["retries"])]),
+        ("tax_alpha_upstream_throttled_total", "counter", "Rate-limit responses received from Alpha Vantage.",
+         [({}, stats["throttled"])]),
+        ("tax_alpha_upstream_coalesced_total", "counter", "Fetches served by an identical request in flight.",
+         [({}, stats["coalesced"])]),
+        ("tax_alpha_rate_limit_stalls_total", "counter", "Times rate limiting held back every caller.",
+         [({}, bucket.stalls)]),
+        ("tax_alpha_rate_limit_waits_total", "counter", "Times a request waited for the rate limiter.",
+         [({}, bucket.waits)]),
+        ("tax_alpha_rate_limit_wait_seconds_total", "counter", "Time requests spent waiting for the rate limiter.",
+         [({}, bucket.waited_seconds)]),
+    ]
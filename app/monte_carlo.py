@@ -0,0 +1,300 @@
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Paths per random stream. Blocks, not workers, own a SeedSequence child, so a seeded run produces
+# the same paths whatever the worker count.
+BLOCK_SIZE = 256
+
+# Below this many simulated values the cost of the process pool outweighs the work.
+PARALLEL_THRESHOLD = 2_000_000
+
+SUPPORTED_DTYPES = {'float32': np.float32, 'float64': np.float64}
+
+# How the standard normal shocks are drawn: plain pseudo-random numbers, antithetic pairs (z, -z), or
+# a scrambled Sobol sequence over every (day, asset) dimension of a path.
+SAMPLING_METHODS = ('pseudo', 'antithetic', 'sobol')
+SOBOL_MAX_DIMENSIONS = 21201
+
+PORTFOLIO_STATISTICS = ('expected_return', 'probability_of_loss', 'value_at_risk')
+# Batches needed before a standard error is reported.
+MIN_BATCHES = 4
+
+_pools = {}
+
+
+def factor_covariance(covariance_matrix):
+    """
+    Factors a covariance matrix once so that correlated shocks can be drawn as ``z @ factor.T``.
+
+    Args:
+        covariance_matrix (np.ndarray): Symmetric positive semi-definite (n x n) matrix.
+
+    Returns:
+        np.ndarray: Lower-triangular Cholesky factor, or an eigen-decomposition factor when the
+        matrix is only semi-definite.
+    """
+    covariance_matrix = np.atleast_2d(np.asarray(covariance_matrix, dtype=np.float64))
+    try:
+        return np.linalg.cholesky(covariance_matrix)
+    except np.linalg.LinAlgError:
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance_matrix)
+        return eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))
+
+
+def _standard_normal(seed_sequence, start, stop, time_horizon, num_assets, dtype, sampling):
+    shape = (stop - start, time_horizon, num_assets)
+    if sampling == 'sobol':
+        from scipy.special import ndtri
+        from scipy.stats import qmc
+
+        # Every block scrambles with the same seed and skips to its own points, so the blocks
+        # together are one contiguous Sobol sequence whichever process draws them. SciPy spawns
+        # from a Generator it is given (advancing the shared SeedSequence), so pass an integer.
+        scramble_seed = int(seed_sequence.generate_state(1, np.uint64)[0])
+        engine = qmc.Sobol(time_horizon * num_assets, scramble=True, seed=scramble_seed)
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', message='The balance properties of Sobol', category=UserWarning)
+            if start:
+                engine.fast_forward(start)
+            uniform = engine.random(stop - start)
+        return ndtri(np.clip(uniform, 1e-12, 1 - 1e-12)).astype(dtype, copy=False).reshape(shape)
+
+    rng = np.random.default_rng(seed_sequence)
+    if sampling == 'antithetic':
+        half = rng.standard_normal(((shape[0] + 1) // 2,) + shape[1:], dtype=dtype)
+        return np.concatenate([half, -half])[:shape[0]]
+    return rng.standard_normal(shape, dtype=dtype)
+
+
+def _draw_block(out, start, stop, seed_sequence, mean_returns, factor, dtype, sampling='pseudo'):
+    shocks = _standard_normal(seed_sequence, start, stop, out.shape[2], len(mean_returns), dtype, sampling)
+    shocks = shocks @ factor.T.astype(dtype, copy=False)
+    shocks += mean_returns.astype(dtype, copy=False)
+    np.exp(shocks, out=shocks)
+    # (sims, horizon, assets) -> (assets, sims, horizon)
+    out[:, start:stop, :] = shocks.transpose(2, 0, 1)
+
+
+def _draw_shared_blocks(shm_name, shape, dtype, blocks, mean_returns, factor, sampling):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        out = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        for start, stop, seed_sequence in blocks:
+            _draw_block(out, start, stop, seed_sequence, mean_returns, factor, dtype, sampling)
+        del out
+    finally:
+        shm.close()
+
+
+def _get_pool(workers):
+    pool = _pools.get(workers)
+    if pool is None:
+        pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers)
+    return pool
+
+
+def simulate_growth(mean_returns, covariance_matrix, num_simulations=1000, time_horizon=252, seed=None,
+                    dtype=np.float64, workers=1, sampling='pseudo', factor=None):
+    """
+    Simulates daily growth factors ``exp(r)`` for correlated multivariate normal log returns.
+
+    The covariance matrix is factored once and every shock in a block is drawn in one vectorized
+    call. Large runs are split across a process pool writing into shared memory.
+
+    Antithetic sampling pairs every path with its mirror image within a block, which cancels the
+    odd-order sampling error of means. Sobol sampling draws each path from one point of a scrambled
+    low-discrepancy sequence with one dimension per (day, asset), which covers the space more
+    evenly than independent draws; it converges fastest for path counts that are powers of two.
+
+    Args:
+        mean_returns (np.ndarray): Mean daily log return for each asset.
+        covariance_matrix (np.ndarray): Covariance of the daily log returns.
+        num_simulations (int): Number of simulated paths.
+        time_horizon (int): Number of days per path.
+        seed (int | np.random.SeedSequence | None): Seed for reproducible results.
+        dtype (type): np.float32 or np.float64.
+        workers (int): Number of worker processes.
+        sampling (str): One of SAMPLING_METHODS.
+        factor (np.ndarray): factor_covariance(covariance_matrix), if already known.
+
+    Returns:
+        np.ndarray: Array of shape (assets, num_simulations, time_horizon).
+
+    Raises:
+        ValueError: If the sampling method is unknown, or a Sobol path would need more dimensions
+            than SOBOL_MAX_DIMENSIONS.
+    """
+    if sampling not in SAMPLING_METHODS:
+        raise ValueError(f"Unknown sampling method '{sampling}', expected one of {', '.join(SAMPLING_METHODS)}")
+    dtype = np.dtype(dtype)
+    mean_returns = np.atleast_1d(np.asarray(mean_returns, dtype=np.float64))
+    factor = factor_covariance(covariance_matrix) if factor is None else np.asarray(factor, dtype=np.float64)
+    shape = (len(mean_returns), num_simulations, time_horizon)
+    if sampling == 'sobol' and time_horizon * len(mean_returns) > SOBOL_MAX_DIMENSIONS:
+        raise ValueError(f"Sobol sampling supports at most {SOBOL_MAX_DIMENSIONS} days x assets, "
+                         f"got {time_horizon * len(mean_returns)}")
+
+    seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    starts = list(range(0, num_simulations, BLOCK_SIZE))
+    if sampling == 'sobol':
+        # One scramble for the whole sequence
+        block_seeds = [seed_sequence] * len(starts)
+    else:
+        block_seeds = seed_sequence.spawn(len(starts))
+    blocks = [(start, min(start + BLOCK_SIZE, num_simulations), child) for start, child in zip(starts, block_seeds)]
+
+    workers = max(1, min(int(workers), len(blocks), os.cpu_count() or 1))
+    if workers == 1 or np.prod(shape) < PARALLEL_THRESHOLD:
+        out = np.empty(shape, dtype=dtype)
+        if sampling == 'sobol':
+            # Scrambling dominates for long paths; do it once for the contiguous sequence
+            blocks = [(0, num_simulations, seed_sequence)]
+        for start, stop, child in blocks:
+            _draw_block(out, start, stop, child, mean_returns, factor, dtype, sampling)
+        return out
+
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * dtype.itemsize)
+    try:
+        pool = _get_pool(workers)
+        futures = [pool.submit(_draw_shared_blocks, shm.name, shape, dtype, blocks[i::workers],
+                               mean_returns, factor, sampling)
+                   for i in range(workers)]
+        for future in futures:
+            future.result()
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _batch_statistics(growth, weights, known_mean, statistics, confidence, control_variates):
+    # Terminal portfolio return of every path in the batch
+    terminal = weights @ growth.prod(axis=2, dtype=np.float64)
+    returns = terminal - 1
+    samples = {"expected_return": returns, "probability_of_loss": (returns < 0).astype(np.float64)}
+    values = {}
+    for name in statistics:
+        if name == "value_at_risk":
+            values[name] = -float(np.quantile(returns, 1 - confidence))
+            continue
+        sample = samples[name]
+        estimate = float(sample.mean())
+        if control_variates and len(sample) > 1:
+            # The terminal portfolio value has a known expectation; remove the part of the sampling
+            # error that it explains.
+            spread = terminal - terminal.mean()
+            variance = float(spread @ spread)
+            if variance > 0:
+                beta = float(spread @ (sample - estimate)) / variance
+                estimate -= beta * (float(terminal.mean()) - known_mean)
+        values[name] = estimate
+    return values, returns
+
+
+def estimate_portfolio_statistics(mean_returns, covariance_matrix, weights, num_simulations=1000, time_horizon=252,
+                                  seed=None, dtype=np.float64, workers=1, sampling='pseudo', control_variates=False,
+                                  target_standard_error=None, max_simulations=100_000, batch_size=1024,
+                                  statistics=PORTFOLIO_STATISTICS, confidence=0.95, factor=None, progress=None):
+    """
+    Estimates statistics of a buy-and-hold portfolio's return over the horizon, with standard errors.
+
+    Paths are simulated in independent batches (each with its own random stream or Sobol scramble)
+    and every statistic is computed per batch, so its standard error is the spread of the batch
+    values over the square root of the batch count. This holds for every sampling method,
+    including quasi-random ones whose paths are not independent. With ``target_standard_error``
+    batches are added until every requested statistic's standard error is at most the target (or
+    ``max_simulations`` paths have been simulated); otherwise ``num_simulations`` paths are used.
+
+    Control variates use the terminal portfolio value, whose expectation is known in closed form
+    for log-normal returns, to correct the mean-type statistics ('expected_return' and
+    'probability_of_loss'); the expected return is then exact. Quantiles are not corrected.
+
+    Args:
+        mean_returns (np.ndarray): Mean daily log return for each asset.
+        covariance_matrix (np.ndarray): Covariance of the daily log returns.
+        weights (np.ndarray): Portfolio weight of each asset, summing to 1.
+        num_simulations (int): Number of paths without a target.
+        time_horizon (int): Number of days per path.
+        seed (int | None): Seed for reproducible results.
+        dtype (type): np.float32 or np.float64.
+        workers (int): Number of worker processes per batch.
+        sampling (str): One of SAMPLING_METHODS.
+        control_variates (bool): Correct mean-type statistics with the terminal portfolio value.
+        target_standard_error (float): Stop once every requested statistic is at least this precise.
+        max_simulations (int): Path budget with a target.
+        batch_size (int): Paths per batch.
+        statistics (tuple): Statistics to estimate, from PORTFOLIO_STATISTICS.
+        confidence (float): Confidence level of 'value_at_risk'.
+        factor (np.ndarray): factor_covariance(covariance_matrix), if already known.
+        progress (callable): Called with (paths simulated, path budget) after every batch.
+
+    Returns:
+        dict: 'statistics' ({name: {'estimate', 'standard_error'}}, the error None with fewer than
+        MIN_BATCHES batches), 'num_simulations', 'batches',
+        'converged' (None without a target), 'sampling', 'control_variates' and 'target_standard_error'.
+
+    Raises:
+        ValueError: If a statistic is unknown.
+    """
+    unknown = [name for name in statistics if name not in PORTFOLIO_STATISTICS]
+    if unknown:
+        raise ValueError(f"Unknown statistics {', '.join(unknown)}, expected some of {', '.join(PORTFOLIO_STATISTICS)}")
+    mean_returns = np.atleast_1d(np.asarray(mean_returns, dtype=np.float64))
+    covariance_matrix = np.atleast_2d(np.asarray(covariance_matrix, dtype=np.float64))
+    weights = np.asarray(weights, dtype=np.float64)
+    known_mean = float(weights @ np.exp(time_horizon * (mean_returns + np.diag(covariance_matrix) / 2)))
+    factor = factor_covariance(covariance_matrix) if factor is None else factor
+
+    budget = max_simulations if target_standard_error else num_simulations
+    if not target_standard_error:
+        # At least MIN_BATCHES batches, so there is a spread to measure
+        batch_size = min(batch_size, -(-num_simulations // MIN_BATCHES))
+    root = np.random.SeedSequence(seed)
+    batches = {name: [] for name in statistics}
+    returns = []
+    done = 0
+    converged = None
+    errors = dict.fromkeys(statistics)
+    while done < budget:
+        paths = min(batch_size, budget - done)
+        growth = simulate_growth(mean_returns, covariance_matrix, paths, time_horizon, seed=root.spawn(1)[0],
+                                 dtype=dtype, workers=workers, sampling=sampling, factor=factor)
+        values, batch_returns = _batch_statistics(growth, weights, known_mean, statistics, confidence,
+                                                  control_variates)
+        del growth
+        returns.append(batch_returns)
+        for name, value in values.items():
+            batches[name].append(value)
+        done += paths
+        if progress:
+            progress(done, budget)
+
+        if len(returns) >= MIN_BATCHES:
+            errors = {name: float(np.std(batches[name], ddof=1) / np.sqrt(len(batches[name]))) for name in statistics}
+            if target_standard_error:
+                converged = all(error <= target_standard_error for error in errors.values())
+                if converged:
+                    break
+    if target_standard_error and converged is None:
+        converged = False
+
+    sizes = np.array([len(batch) for batch in returns], dtype=np.float64)
+    estimates = {}
+    for name in statistics:
+        if name == "value_at_risk":
+            estimates[name] = -float(np.quantile(np.concatenate(returns), 1 - confidence))
+        else:
+            estimates[name] = float(np.average(batches[name], weights=sizes))
+    return {
+        "statistics": {name: {"estimate": estimates[name], "standard_error": errors[name]} for name in statistics},
+        "num_simulations": done,
+        "batches": len(returns),
+        "converged": converged,
+        "sampling": sampling,
+        "control_variates": control_variates,
+        "target_standard_error": target_standard_error,
+    }
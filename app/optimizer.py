@@ -0,0 +1,524 @@
+import numpy as np
+
+# SciPy is imported inside the functions that use it: it takes longer to import than the rest of the
+# application together, and routes that never optimize should not pay for it.
+
+TRADING_DAYS = 252
+# Largest violation of the budget, a weight bound or a group limit accepted in a solution.
+FEASIBILITY_TOLERANCE = 1e-6
+
+
+def solve_qp(P, q, A, l, u, lb, ub, x0=None, max_iter=20000, rho=0.1, sigma=1e-6, alpha=1.6, A_batch=None,
+             P_factors=None):
+    """
+    Solves one or more convex quadratic programs that share ``P`` and ``A``::
+
+        minimize    1/2 x'Px + q'x
+        subject to  l <= Ax <= u,  lb <= x <= ub
+
+    ADMM (in the form used by OSQP) factors ``P + sigma I + rho A'A`` once and then only needs
+    triangular solves and matrix products per iteration. Passing ``q``, ``l``, ``u``, ``lb`` or
+    ``ub`` with a trailing dimension of K solves K problems at once against the same factorization.
+    A few constraint rows may also differ per problem (``A_batch``); they are folded into the shared
+    factorization with a low-rank Woodbury correction per problem. Every few iterations each
+    unsolved problem is polished: the equality-constrained KKT system on the active set guessed by
+    ADMM is solved directly, and the result is accepted once it is primal and dual feasible, i.e.
+    exactly optimal.
+
+    When ``P`` is a diagonal plus a low-rank term (``P_factors``), the x-update instead applies the
+    inverse through the Woodbury identity, so an iteration costs a (p + m) x (p + m) product and a
+    few passes over x rather than an n x n product.
+
+    Args:
+        P (np.ndarray): Positive semi-definite (n x n) matrix.
+        q (np.ndarray): Linear term, (n,) or (n x K).
+        A (np.ndarray): General constraint matrix (m x n); m may be zero.
+        l (np.ndarray): Lower bounds of ``Ax``, (m,) or (m x K); -inf where unbounded. The bounds of
+            the ``A_batch`` rows follow those of ``A``.
+        u (np.ndarray): Upper bounds of ``Ax``, (m,) or (m x K); inf where unbounded.
+        lb (np.ndarray): Lower bounds of ``x``, (n,) or (n x K).
+        ub (np.ndarray): Upper bounds of ``x``, (n,) or (n x K).
+        x0 (np.ndarray): Warm start, (n,) or (n x K).
+        max_iter (int): Maximum number of ADMM iterations.
+        rho (float): Initial ADMM step size; it is rescaled when the residuals are unbalanced.
+        sigma (float): Regularization of the x-update.
+        alpha (float): Over-relaxation factor.
+        A_batch (np.ndarray): Optional (r x n x K) constraint rows that differ per problem, with r small.
+        P_factors (tuple): Optional (d, U, W) with P = diag(d) + U' W U, where U is a dense or
+            scipy.sparse (p x n) matrix with p much smaller than n and W is (p x p). ``P`` must still
+            be given; it is used for the residuals and the polishing.
+
+    Returns:
+        tuple: Solutions (n,) or (n x K), and a boolean or boolean array marking problems solved to
+        optimality (the last ADMM iterate is returned for the others).
+    """
+    from scipy.linalg import cho_factor, cho_solve
+
+    single = np.ndim(q) == 1
+    P = np.asarray(P, dtype=np.float64)
+    n = P.shape[0]
+    A = np.asarray(A, dtype=np.float64).reshape(-1, n)
+    q = np.asarray(q, dtype=np.float64).reshape(n, -1)
+    K = q.shape[1]
+    B = np.zeros((0, n, K)) if A_batch is None else np.asarray(A_batch, dtype=np.float64).reshape(-1, n, K)
+    shared, r = A.shape[0], B.shape[0]
+    m = shared + r
+    l = np.broadcast_to(np.asarray(l, dtype=np.float64).reshape(m, -1), (m, K))
+    u = np.broadcast_to(np.asarray(u, dtype=np.float64).reshape(m, -1), (m, K))
+
+    # Constraint rows are the shared constraints, the per-problem ones and one identity row per variable.
+    def constrain(x):
+        return np.vstack([A @ x, np.einsum('rnk,nk->rk', B, x), x])
+
+    def constrain_transpose(v):
+        return A.T @ v[:shared] + np.einsum('rnk,rk->nk', B, v[shared:m]) + v[m:]
+
+    lower = np.vstack([l, np.broadcast_to(np.asarray(lb, dtype=np.float64).reshape(n, -1), (n, K))])
+    upper = np.vstack([u, np.broadcast_to(np.asarray(ub, dtype=np.float64).reshape(n, -1), (n, K))])
+    equality = np.all(lower == upper, axis=1)
+    unbounded = np.all(np.isinf(lower) & np.isinf(upper), axis=1)
+
+    def step_sizes(rho):
+        rho_vector = np.full(m + n, rho)
+        rho_vector[equality] *= 1e3
+        rho_vector[unbounded] = 1e-6
+        return rho_vector[:, None]
+
+    def shared_inverse(rho_flat):
+        # Returns a function applying M^-1 for M = P + sigma I + A'RA + R_x, the matrix shared by all problems
+        if P_factors is None:
+            factor = cho_factor(P + sigma * np.eye(n) + A.T @ (rho_flat[:shared, None] * A) + np.diag(rho_flat[m:]))
+            # One matrix product over all problems is several times faster than two triangular
+            # solves, and the system is regularized by sigma.
+            inverse_matrix = cho_solve(factor, np.eye(n))
+            return lambda rhs: inverse_matrix @ rhs
+
+        # M = D + V'GV with D diagonal, V = [U; A] and G = diag(W, R_A), so
+        # M^-1 = D^-1 - D^-1 V' G (I + V D^-1 V' G)^-1 V D^-1, which needs W to be only semi-definite.
+        d, U, W = P_factors
+        diagonal = (1 / (np.asarray(d, dtype=np.float64) + sigma + rho_flat[m:]))[:, None]
+        U_dense = U.toarray() if hasattr(U, 'toarray') else np.asarray(U, dtype=np.float64)
+        p = len(U_dense)
+        V = np.vstack([U_dense, A])
+        G = np.zeros((len(V), len(V)))
+        G[:p, :p] = W
+        G[p:, p:] = np.diag(rho_flat[:shared])
+        core = np.linalg.solve(np.eye(len(V)) + G @ ((V * diagonal.T) @ V.T), G)
+
+        def apply(rhs):
+            scaled = diagonal * rhs
+            middle = core @ np.vstack([U @ scaled, A @ scaled])
+            return scaled - diagonal * (U.T @ middle[:p] + A.T @ middle[p:])
+        return apply
+
+    def factorize(rho_vector):
+        rho_flat = rho_vector[:, 0]
+        inverse_of = shared_inverse(rho_flat)
+        if not r:
+            return inverse_of, None, None
+        # (M + B'RB)^-1 = M^-1 - H (R^-1 + B H)^-1 H' with H = M^-1 B' for each problem
+        H = inverse_of(B.transpose(1, 0, 2).reshape(n, -1)).reshape(n, r, -1)
+        capacitance = np.einsum('rnk,nsk->krs', B, H) + np.diag(1 / rho_flat[shared:m])
+        return inverse_of, H, np.linalg.inv(capacitance)
+
+    def solve(factors, rhs):
+        inverse_of, H, inverse = factors
+        x = inverse_of(rhs)
+        if r:
+            x -= np.einsum('nrk,kr->nk', H, np.einsum('krs,sk->kr', inverse, np.einsum('rnk,nk->rk', B, x)))
+        return x
+
+    rho_vector = step_sizes(rho)
+    factors = factorize(rho_vector)
+
+    x = np.zeros((n, K)) if x0 is None else np.array(np.asarray(x0, dtype=np.float64).reshape(n, -1), copy=True)
+    x = np.broadcast_to(x, (n, K)).copy()
+    z = np.clip(constrain(x), lower, upper)
+    y = np.zeros((m + n, K))
+    solved = np.zeros(K, dtype=bool)
+    solutions = np.empty((n, K))
+    previous_guess = np.zeros((m + n, K), dtype=np.int8)
+    tried = [set() for _ in range(K)]
+    # Problems still iterating; solved ones are dropped so a slow straggler iterates alone.
+    index = np.arange(K)
+
+    for iteration in range(1, max_iter + 1):
+        x_tilde = solve(factors, sigma * x - q + constrain_transpose(rho_vector * z - y))
+        z_tilde = constrain(x_tilde)
+        x = alpha * x_tilde + (1 - alpha) * x
+        z_relaxed = alpha * z_tilde + (1 - alpha) * z
+        z_next = np.clip(z_relaxed + y / rho_vector, lower, upper)
+        y = y + rho_vector * (z_relaxed - z_next)
+        z = z_next
+
+        if iteration % 25:
+            continue
+        # ADMM identifies the active set long before it converges, so try to finish each problem exactly
+        # once its guessed active set has settled.
+        guess = _active_set(lower, upper, z, y, equality)
+        finished = np.zeros(len(index), dtype=bool)
+        for k in np.flatnonzero((guess == previous_guess).all(axis=0)):
+            key = guess[:, k].tobytes()
+            if key in tried[k]:
+                continue
+            tried[k].add(key)
+            C = np.vstack([A, B[:, :, k], np.eye(n)])
+            polished = _polish(P, q[:, k], C, lower[:, k], upper[:, k], guess[:, k], m)
+            if polished is not None:
+                solutions[:, index[k]] = polished
+                solved[index[k]] = finished[k] = True
+        previous_guess = guess
+        if finished.all():
+            break
+        if finished.any():
+            keep = ~finished
+            index, q, lower, upper, B = index[keep], q[:, keep], lower[:, keep], upper[:, keep], B[:, :, keep]
+            x, z, y, previous_guess = x[:, keep], z[:, keep], y[:, keep], previous_guess[:, keep]
+            tried = [keys for keys, kept in zip(tried, keep) if kept]
+            inverse_of, H, inverse = factors
+            factors = (inverse_of, None, None) if H is None else (inverse_of, H[:, :, keep], inverse[keep])
+
+        # Rebalance the step size when one residual dominates (as OSQP does), at most every 100 steps.
+        if iteration % 100 == 0:
+            Cx, Px, Cy = constrain(x), P @ x, constrain_transpose(y)
+            primal = np.abs(Cx - z).max() / (np.abs(Cx).max() + np.abs(z).max() + 1e-12)
+            dual = np.abs(Px + q + Cy).max() / (np.abs(Px).max() + np.abs(Cy).max() + np.abs(q).max() + 1e-12)
+            # Damped, so a residual that has collapsed to zero cannot swing rho by orders of magnitude
+            ratio = float(np.clip(np.sqrt(primal / (dual + 1e-30)), 0.1, 10))
+            if ratio > 5 or ratio < 0.2:
+                rho = float(np.clip(rho * ratio, 1e-6, 1e6))
+                rho_vector = step_sizes(rho)
+                factors = factorize(rho_vector)
+
+    remaining = ~solved[index]
+    solutions[:, index[remaining]] = x[:, remaining]
+    x = solutions
+    converged = solved
+
+    return (x[:, 0], bool(converged[0])) if single else (x, converged)
+
+
+def _active_set(lower, upper, z, y, equality):
+    """Guesses the active constraints from the ADMM iterates: -1 at the lower bound, 1 at the upper, 0 free."""
+    at_lower = (z - lower < -y) | equality[:, None]
+    at_upper = (upper - z < y) & ~at_lower
+    return at_upper.astype(np.int8) - at_lower.astype(np.int8)
+
+
+def _polish(P, q, C, lower, upper, guess, m, max_steps=15, tolerance=1e-9):
+    """
+    Refines a guessed active set with primal-dual active-set steps and solves the KKT system on it.
+
+    Returns:
+        np.ndarray: The exact solution, or None if no optimal active set was found from the guess.
+    """
+    equality = lower == upper
+    # Balances primal bound gaps against multipliers, which are in units of P x.
+    scale = max(float(np.abs(np.diag(P)).max()), 1e-12)
+    guess = np.where(equality, -1, guess)
+    candidate = None
+    for _ in range(max_steps):
+        x, y = _solve_active_set(P, q, C, lower, upper, guess, m)
+        if x is None:
+            break
+        Cx = C @ x
+        next_guess = np.where(-y + scale * (lower - Cx) > 0, -1, np.where(y + scale * (Cx - upper) > 0, 1, 0))
+        next_guess = np.where(equality, -1, next_guess).astype(np.int8)
+        feasible = np.all(Cx >= lower - tolerance * (1 + np.abs(lower))) and \
+            np.all(Cx <= upper + tolerance * (1 + np.abs(upper)))
+        if feasible:
+            candidate = x
+        if np.array_equal(next_guess, guess):
+            dual_tolerance = tolerance * (1 + np.abs(y).max())
+            dual_feasible = np.all(y[(guess == -1) & ~equality] <= dual_tolerance) and \
+                np.all(y[guess == 1] >= -dual_tolerance)
+            if feasible and dual_feasible:
+                return x
+            break
+        guess = next_guess
+    if candidate is not None and _has_multipliers(P, q, C, lower, upper, candidate, tolerance):
+        return candidate
+    return None
+
+
+def _has_multipliers(P, q, C, lower, upper, x, tolerance=1e-9):
+    """
+    Checks whether a feasible point is optimal by looking for multipliers of the right signs.
+
+    At a degenerate vertex more constraints are active than there are free variables, so the
+    multipliers of the KKT solve are not unique and may have the wrong signs although the point is
+    optimal; a bounded least-squares fit of the stationarity conditions settles it.
+    """
+    from scipy.optimize import lsq_linear
+
+    Cx = C @ x
+    finite_lower, finite_upper = np.isfinite(lower), np.isfinite(upper)
+    lower, upper = np.where(finite_lower, lower, 0.0), np.where(finite_upper, upper, 0.0)
+    at_lower = finite_lower & (Cx <= lower + tolerance * (1 + np.abs(lower)))
+    at_upper = finite_upper & (Cx >= upper - tolerance * (1 + np.abs(upper)))
+    active = np.flatnonzero(at_lower | at_upper)
+    gradient = P @ x + q
+    if not len(active):
+        return bool(np.abs(gradient).max() <= tolerance * (1 + np.abs(q).max()))
+    # Stationarity Px + q + C'y = 0 with y <= 0 at lower bounds and y >= 0 at upper bounds
+    fit = lsq_linear(C[active].T, -gradient, bounds=(np.where(at_lower[active], -np.inf, 0.0),
+                                                      np.where(at_upper[active], np.inf, 0.0)))
+    residual = C[active].T @ fit.x + gradient
+    return bool(np.abs(residual).max() <= 1e3 * tolerance * (1 + np.abs(q).max() + np.abs(P @ x).max()))
+
+
+def _solve_active_set(P, q, C, lower, upper, guess, m):
+    """Solves the equality-constrained QP with the guessed constraints held at their bounds."""
+    n = C.shape[1]
+    active = guess != 0
+    # Variables held at one of their own bounds are fixed; the rest are solved for.
+    fixed = active[m:]
+    free = ~fixed
+    x_fixed = np.where(guess[m:] == -1, lower[m:], upper[m:])[fixed]
+    rows = np.flatnonzero(active[:m])
+    bound = np.where(guess[:m] == -1, lower[:m], upper[:m])[rows]
+    if not (np.all(np.isfinite(x_fixed)) and np.all(np.isfinite(bound))):
+        return None, None
+
+    A_f = C[rows][:, free]
+    kkt = np.block([[P[np.ix_(free, free)], A_f.T], [A_f, np.zeros((len(rows), len(rows)))]])
+    rhs = np.concatenate([-q[free] - P[np.ix_(free, fixed)] @ x_fixed, bound - C[rows][:, fixed] @ x_fixed])
+    try:
+        solution = np.linalg.solve(kkt, rhs)
+    except np.linalg.LinAlgError:
+        # Degenerate active sets (e.g. a corner of the frontier) have many valid multipliers.
+        solution = np.linalg.lstsq(kkt, rhs, rcond=None)[0]
+    if not np.allclose(kkt @ solution, rhs, rtol=1e-8, atol=1e-10):
+        return None, None
+
+    x = np.empty(n)
+    x[fixed] = x_fixed
+    x[free] = solution[:free.sum()]
+    y = np.zeros(m + n)
+    y[rows] = solution[free.sum():]
+    y[m:][fixed] = -(P @ x + q + C[rows].T @ y[rows])[fixed]
+    return x, y
+
+
+def _bound_arrays(num_assets, bounds):
+    if bounds is None:
+        return np.zeros(num_assets), np.ones(num_assets)
+    lower, upper = np.asarray(bounds, dtype=np.float64).reshape(num_assets, 2).T
+    return lower, upper
+
+
+def _group_rows(num_assets, groups):
+    rows, lowers, uppers = [], [], []
+    for indices, lower, upper in groups or ():
+        row = np.zeros(num_assets)
+        row[list(indices)] = 1.0
+        rows.append(row)
+        lowers.append(-np.inf if lower is None else lower)
+        uppers.append(np.inf if upper is None else upper)
+    return np.array(rows).reshape(-1, num_assets), np.array(lowers), np.array(uppers)
+
+
+def _check_feasible(lower, upper, group_rows, group_lower, group_upper):
+    """Rejects weight bounds and group limits that no fully invested portfolio can satisfy."""
+    if np.any(lower > upper) or lower.sum() > 1 + FEASIBILITY_TOLERANCE or upper.sum() < 1 - FEASIBILITY_TOLERANCE:
+        raise ValueError("The weight bounds cannot be satisfied by weights summing to 1")
+    for row, group_min, group_max in zip(group_rows, group_lower, group_upper):
+        members = row > 0
+        if group_min > min(upper[members].sum(), group_max) + FEASIBILITY_TOLERANCE or \
+                group_max < lower[members].sum() - FEASIBILITY_TOLERANCE:
+            raise ValueError("The group constraints cannot be satisfied with the weight bounds")
+
+
+def _check_weights(weights, converged, lower, upper, group_rows, group_lower, group_upper):
+    """Rejects a solution that did not converge or breaks the budget, bounds or group limits."""
+    group_weights = group_rows @ weights
+    if not (converged and np.all(np.isfinite(weights))
+            and abs(weights.sum() - 1) <= FEASIBILITY_TOLERANCE
+            and np.all(weights >= lower - FEASIBILITY_TOLERANCE) and np.all(weights <= upper + FEASIBILITY_TOLERANCE)
+            and np.all(group_weights >= group_lower - FEASIBILITY_TOLERANCE)
+            and np.all(group_weights <= group_upper + FEASIBILITY_TOLERANCE)):
+        raise ValueError("The weight bounds and group constraints cannot be satisfied together")
+
+
+def min_variance_weights(covariance_matrix, bounds=None, groups=None):
+    """
+    Finds the fully invested minimum-variance weights.
+
+    Args:
+        covariance_matrix (np.ndarray): Covariance of the asset returns.
+        bounds (list): (lower, upper) weight bounds per asset. Defaults to long-only (0, 1).
+        groups (list): (asset indices, lower, upper) limits on the total weight of a group of assets.
+
+    Returns:
+        np.ndarray: Optimal weights summing to 1.
+
+    Raises:
+        ValueError: If the bounds and group limits cannot be satisfied together.
+    """
+    covariance_matrix = np.asarray(covariance_matrix, dtype=np.float64)
+    num_assets = len(covariance_matrix)
+    lower, upper = _bound_arrays(num_assets, bounds)
+    group_rows, group_lower, group_upper = _group_rows(num_assets, groups)
+    _check_feasible(lower, upper, group_rows, group_lower, group_upper)
+    A = np.vstack([np.ones((1, num_assets)), group_rows])
+    weights, converged = solve_qp(covariance_matrix, np.zeros(num_assets), A, np.r_[1.0, group_lower],
+                                  np.r_[1.0, group_upper], lower, upper)
+    _check_weights(weights, converged, lower, upper, group_rows, group_lower, group_upper)
+    return weights
+
+
+def max_sharpe_weights(expected_returns, covariance_matrix, risk_free_rate=0.01, bounds=None, groups=None,
+                       initial_weights=None):
+    """
+    Finds the weights with the highest Sharpe ratio for the given return moments.
+
+    The ratio is maximized through the equivalent convex problem ``min y'Sy`` subject to
+    ``(mu - rf)'y = 1``, with the weight bounds and group limits rewritten as homogeneous constraints
+    on ``y``; the weights are ``y / sum(y)``. If no asset beats the risk-free rate, the
+    minimum-variance portfolio is returned instead.
+
+    Args:
+        expected_returns (np.ndarray): Expected return of each asset.
+        covariance_matrix (np.ndarray): Covariance of the asset returns.
+        risk_free_rate (float): Risk-free rate in the same units as the expected returns.
+        bounds (list): (lower, upper) weight bounds per asset. Defaults to long-only (0, 1).
+        groups (list): (asset indices, lower, upper) limits on the total weight of a group of
+            assets; either limit may be None.
+        initial_weights (np.ndarray): Warm start, for example the previous optimal weights.
+
+    Returns:
+        np.ndarray: Optimal weights summing to 1.
+
+    Raises:
+        ValueError: If the bounds and group limits cannot be satisfied together.
+    """
+    expected_returns = np.asarray(expected_returns, dtype=np.float64)
+    covariance_matrix = np.asarray(covariance_matrix, dtype=np.float64)
+    num_assets = len(expected_returns)
+    excess_returns = expected_returns - risk_free_rate
+    lower, upper = _bound_arrays(num_assets, bounds)
+    group_rows, group_lower, group_upper = _group_rows(num_assets, groups)
+    _check_feasible(lower, upper, group_rows, group_lower, group_upper)
+    if num_assets == 1:
+        return np.ones(1)
+    if excess_returns.max() <= 0:
+        return min_variance_weights(covariance_matrix, bounds, groups)
+
+    ones = np.ones(num_assets)
+    rows = [excess_returns, ones]
+    row_lower, row_upper = [1.0, 0.0], [1.0, np.inf]
+    # Weight bounds become y_i - bound * sum(y) >= 0 (or <= 0); y >= 0 covers non-negative lower bounds.
+    for i in np.flatnonzero(lower > 0):
+        rows.append(np.eye(num_assets)[i] - lower[i] * ones)
+        row_lower.append(0.0)
+        row_upper.append(np.inf)
+    for i in np.flatnonzero(upper < 1):
+        rows.append(np.eye(num_assets)[i] - upper[i] * ones)
+        row_lower.append(-np.inf)
+        row_upper.append(0.0)
+    for row, group_min, group_max in zip(group_rows, group_lower, group_upper):
+        if np.isfinite(group_min):
+            rows.append(row - group_min * ones)
+            row_lower.append(0.0)
+            row_upper.append(np.inf)
+        if np.isfinite(group_max):
+            rows.append(row - group_max * ones)
+            row_lower.append(-np.inf)
+            row_upper.append(0.0)
+    y_lower = np.where(lower >= 0, 0.0, -np.inf)
+
+    x0 = None
+    if initial_weights is not None:
+        initial_weights = np.asarray(initial_weights, dtype=np.float64)
+        if initial_weights @ excess_returns > 0:
+            x0 = initial_weights / (initial_weights @ excess_returns)
+
+    y, converged = solve_qp(covariance_matrix, np.zeros(num_assets), np.array(rows), np.array(row_lower),
+                            np.array(row_upper), y_lower, np.full(num_assets, np.inf), x0=x0)
+    weights = y / y.sum() if y.sum() > 0 else np.full(num_assets, np.nan)
+    _check_weights(weights, converged, lower, upper, group_rows, group_lower, group_upper)
+    return weights
+
+
+def _extreme_return_weights(expected_returns, sign, bounds=None, groups=None):
+    """Solves the linear program for the lowest (sign=1) or highest (sign=-1) attainable return."""
+    from scipy.optimize import linprog
+
+    num_assets = len(expected_returns)
+    lower, upper = _bound_arrays(num_assets, bounds)
+    group_rows, group_lower, group_upper = _group_rows(num_assets, groups)
+    has_upper, has_lower = np.isfinite(group_upper), np.isfinite(group_lower)
+    A_ub = np.vstack([group_rows[has_upper], -group_rows[has_lower]])
+    b_ub = np.concatenate([group_upper[has_upper], -group_lower[has_lower]])
+    result = linprog(sign * expected_returns, A_ub=A_ub if len(b_ub) else None, b_ub=b_ub if len(b_ub) else None,
+                     A_eq=np.ones((1, num_assets)), b_eq=[1.0], bounds=list(zip(lower, upper)), method='highs')
+    if not result.success:
+        raise ValueError("The weight bounds and group constraints cannot be satisfied together")
+    return result.x
+
+
+def efficient_frontier(expected_returns, covariance_matrix, target_returns=None, num_points=20, bounds=None,
+                       groups=None):
+    """
+    Solves the minimum-variance portfolio for each of several target returns in one batched call.
+
+    All targets share a single factorization; only the target-return bound differs between them.
+    The lowest and highest attainable returns are corners where only one portfolio is feasible, so
+    those targets are answered by the linear program that finds them.
+
+    Args:
+        expected_returns (np.ndarray): Expected return of each asset.
+        covariance_matrix (np.ndarray): Covariance of the asset returns.
+        target_returns (np.ndarray): Target portfolio returns. Defaults to ``num_points`` evenly
+            spaced between the minimum-variance portfolio's return and the highest attainable return.
+        num_points (int): Number of frontier points when no targets are given.
+        bounds (list): (lower, upper) weight bounds per asset. Defaults to long-only (0, 1).
+        groups (list): (asset indices, lower, upper) limits on group weights.
+
+    Returns:
+        tuple: Target returns (K,), weights (K x assets), portfolio risks (K,) and a boolean array
+        marking the targets that were solved to optimality. Unattainable targets get NaN weights.
+    """
+    expected_returns = np.asarray(expected_returns, dtype=np.float64)
+    covariance_matrix = np.asarray(covariance_matrix, dtype=np.float64)
+    num_assets = len(expected_returns)
+
+    lowest = _extreme_return_weights(expected_returns, 1, bounds, groups)
+    highest = _extreme_return_weights(expected_returns, -1, bounds, groups)
+    lowest_return, highest_return = lowest @ expected_returns, highest @ expected_returns
+    if target_returns is None:
+        start = min_variance_weights(covariance_matrix, bounds, groups) @ expected_returns
+        target_returns = np.linspace(start, highest_return, num_points)
+    target_returns = np.atleast_1d(np.asarray(target_returns, dtype=np.float64))
+    K = len(target_returns)
+
+    tolerance = 1e-10 * (1 + abs(highest_return) + abs(lowest_return))
+    at_lowest = np.abs(target_returns - lowest_return) <= tolerance
+    at_highest = np.abs(target_returns - highest_return) <= tolerance
+    interior = (target_returns > lowest_return + tolerance) & (target_returns < highest_return - tolerance)
+
+    weights = np.full((K, num_assets), np.nan)
+    solved = np.zeros(K, dtype=bool)
+    weights[at_lowest], weights[at_highest] = lowest, highest
+    solved[at_lowest | at_highest] = True
+
+    if interior.any():
+        targets = target_returns[interior]
+        lower, upper = _bound_arrays(num_assets, bounds)
+        group_rows, group_lower, group_upper = _group_rows(num_assets, groups)
+        A = np.vstack([np.ones(num_assets), expected_returns, group_rows])
+        count = len(targets)
+        l = np.vstack([np.ones((1, count)), targets[None, :], np.repeat(group_lower[:, None], count, axis=1)])
+        u = np.vstack([np.ones((1, count)), targets[None, :], np.repeat(group_upper[:, None], count, axis=1)])
+        interior_weights, interior_solved = solve_qp(covariance_matrix, np.zeros((num_assets, count)), A, l, u,
+                                                     lower, upper)
+        weights[interior] = interior_weights.T
+        solved[interior] = interior_solved
+
+    risks = np.sqrt(np.maximum(np.einsum('ki,ij,kj->k', weights, covariance_matrix, weights), 0))
+    return target_returns, weights, risks, solved
+
+
+def annualized_moments(mean_returns, covariance_matrix, periods=TRADING_DAYS):
+    """Scales daily log return moments to annual ones."""
+    return np.asarray(mean_returns) * periods, np.asarray(covariance_matrix) * periods
@@ -0,0 +1,308 @@
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+DEFAULT_STORE_PATH = os.path.join(tempfile.gettempdir(), 'tax_alpha_portfolios.sqlite3')
+DEFAULT_CACHE_ENTRIES = 64
+DEFAULT_KEEP_REVISIONS = 10
+
+ENCODING_MAGIC = b'TAPF'
+ENCODING_VERSION = 1
+_HEADER = struct.Struct('<4sHIII')
+_NO_DATE = np.iinfo(np.int64).min
+_POSITION_FIELDS = ('symbol', 'purchase_price', 'shares', 'purchase_date', 'lots')
+_LOT_FIELDS = ('acquired', 'quantity', 'basis', 'lot_id')
+
+StoredPortfolio = namedtuple('StoredPortfolio', ['portfolio_id', 'version', 'fingerprint', 'positions', 'tax_data'])
+
+
+class PortfolioEncodingError(ValueError):
+    """Raised when a stored portfolio blob cannot be decoded."""
+
+
+def _days(values):
+    return np.array([_NO_DATE if value is None else np.datetime64(value, 'D').astype(np.int64) for value in values],
+                    dtype=np.int64)
+
+
+def _date_strings(days):
+    strings = np.datetime_as_string(np.where(days == _NO_DATE, 0, days).astype('datetime64[D]'))
+    return [None if day == _NO_DATE else string for day, string in zip(days.tolist(), strings.tolist())]
+
+
+def _number(value):
+    return value if value is None or not float(value).is_integer() else int(value)
+
+
+def encode_positions(positions):
+    """
+    Encodes portfolio positions into a compact binary blob.
+
+    Numeric fields are stored column by column as little-endian arrays (symbols as codes into a
+    symbol table, dates as epoch days), lots are flattened into their own columns, and any field the
+    encoding does not know about is kept in a small JSON side table. The whole payload is
+    zlib-compressed.
+
+    Args:
+        positions (list): List of position dictionaries.
+
+    Returns:
+        bytes: Encoded positions.
+    """
+    symbols = list(dict.fromkeys(position['symbol'] for position in positions))
+    codes = {symbol: i for i, symbol in enumerate(symbols)}
+    lots = [lot for position in positions for lot in position.get('lots') or ()]
+
+    def floats(items, key):
+        return np.array([np.nan if item.get(key) is None else float(item[key]) for item in items], dtype='<f8')
+
+    columns = [
+        np.array([codes[position['symbol']] for position in positions], dtype='<i4'),
+        floats(positions, 'purchase_price'),
+        floats(positions, 'shares'),
+        _days(position.get('purchase_date') for position in positions).astype('<i8'),
+        np.array([len(position.get('lots') or ()) for position in positions], dtype='<i4'),
+        _days(lot.get('acquired') for lot in lots).astype('<i8'),
+        floats(lots, 'quantity'),
+        floats(lots, 'basis'),
+    ]
+    extras = {i: {key: value for key, value in position.items() if key not in _POSITION_FIELDS}
+              for i, position in enumerate(positions)}
+    meta = {
+        "symbols": symbols,
+        "lot_ids": [lot.get('lot_id') for lot in lots] if any('lot_id' in lot for lot in lots) else None,
+        "extras": {str(i): extra for i, extra in extras.items() if extra},
+    }
+    meta_bytes = json.dumps(meta, separators=(',', ':')).encode('utf-8')
+    payload = meta_bytes + b''.join(column.tobytes() for column in columns)
+    header = _HEADER.pack(ENCODING_MAGIC, ENCODING_VERSION, len(positions), len(lots), len(meta_bytes))
+    return header + zlib.compress(payload, 1)
+
+
+def decode_positions(blob):
+    """
+    Decodes a blob written by encode_positions back into position dictionaries.
+
+    Args:
+        blob (bytes): Encoded positions.
+
+    Returns:
+        list: List of position dictionaries.
+
+    Raises:
+        PortfolioEncodingError: If the blob is not a supported encoding.
+    """
+    try:
+        magic, version, num_positions, num_lots, meta_length = _HEADER.unpack_from(blob)
+        if magic != ENCODING_MAGIC or version != ENCODING_VERSION:
+            raise PortfolioEncodingError(f"Unsupported portfolio encoding {magic!r} v{version}")
+        payload = zlib.decompress(blob[_HEADER.size:])
+    except (struct.error, zlib.error) as e:
+        raise PortfolioEncodingError(f"Corrupt portfolio blob: {e}") from e
+
+    meta = json.loads(payload[:meta_length])
+    offset = meta_length
+    columns = []
+    for dtype, count in (('<i4', num_positions), ('<f8', num_positions), ('<f8', num_positions),
+                         ('<i8', num_positions), ('<i4', num_positions), ('<i8', num_lots),
+                         ('<f8', num_lots), ('<f8', num_lots)):
+        columns.append(np.frombuffer(payload, dtype=dtype, count=count, offset=offset))
+        offset += count * np.dtype(dtype).itemsize
+    codes, prices, shares, dates, lot_counts, acquired, quantity, basis = columns
+
+    symbols = meta["symbols"]
+    lot_ids = meta["lot_ids"] or [None] * num_lots
+    lot_dates = _date_strings(acquired)
+    lot_rows = [
+        {key: value for key, value in zip(_LOT_FIELDS, (date, _number(q), _number(b), lot_id)) if value is not None}
+        for date, q, b, lot_id in zip(lot_dates, quantity.tolist(), basis.tolist(), lot_ids)
+    ]
+    lot_starts = np.concatenate([[0], np.cumsum(lot_counts)]).tolist()
+
+    positions = []
+    for i, (code, price, share, date) in enumerate(zip(codes.tolist(), prices.tolist(), shares.tolist(),
+                                                       _date_strings(dates))):
+        position = {"symbol": symbols[code]}
+        if price == price:
+            position["purchase_price"] = _number(price)
+        if share == share:
+            position["shares"] = _number(share)
+        if date is not None:
+            position["purchase_date"] = date
+        if lot_starts[i + 1] > lot_starts[i]:
+            position["lots"] = lot_rows[lot_starts[i]:lot_starts[i + 1]]
+        position.update(meta["extras"].get(str(i), {}))
+        positions.append(position)
+    return positions
+
+
+class PortfolioStore:
+    """
+    Server-side store of portfolios and their tax data, keyed by an opaque id.
+
+    Every save of a portfolio creates a new revision with an increasing version number and a content
+    fingerprint, so derived results can be keyed to the exact revision they were computed from. Only
+    the latest ``keep_revisions`` revisions of a portfolio are kept. Decoded revisions are held in a
+    small in-process LRU, so a request for an unchanged portfolio costs one indexed lookup of its
+    version regardless of the portfolio's size.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH, cache_entries=DEFAULT_CACHE_ENTRIES,
+                 keep_revisions=DEFAULT_KEEP_REVISIONS):
+        """
+        Args:
+            path (str): SQLite database file.
+            cache_entries (int): Number of decoded revisions kept in memory.
+            keep_revisions (int): Number of revisions kept per portfolio.
+        """
+        self.path = path
+        self.cache_entries = cache_entries
+        self.keep_revisions = keep_revisions
+        self._local = threading.local()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS portfolio_revisions ("
+                " portfolio_id TEXT NOT NULL, version INTEGER NOT NULL, fingerprint TEXT NOT NULL,"
+                " positions BLOB NOT NULL, tax_data TEXT NOT NULL, created_at REAL NOT NULL,"
+                " PRIMARY KEY (portfolio_id, version))"
+            )
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def save(self, positions, tax_data=None, portfolio_id=None):
+        """
+        Stores a new revision of a portfolio.
+
+        Args:
+            positions (list): List of position dictionaries.
+            tax_data (dict): Tax-related data stored alongside the positions.
+            portfolio_id (str): Existing portfolio to revise. A new id is created if omitted.
+
+        Returns:
+            StoredPortfolio: The stored revision.
+        """
+        blob = encode_positions(positions)
+        tax_json = json.dumps(tax_data or {}, sort_keys=True)
+        fingerprint = hashlib.sha256(blob + tax_json.encode('utf-8')).hexdigest()
+        portfolio_id = portfolio_id or uuid.uuid4().hex
+
+        connection = self._connection()
+        with connection:
+            # Take the write lock before reading the latest version, so concurrent saves of one
+            # portfolio wait for each other instead of picking the same version.
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT MAX(version) FROM portfolio_revisions WHERE portfolio_id = ?",
+                                     (portfolio_id,)).fetchone()
+            version = (row[0] or 0) + 1
+            connection.execute("INSERT INTO portfolio_revisions VALUES (?, ?, ?, ?, ?, ?)",
+                               (portfolio_id, version, fingerprint, blob, tax_json, time.time()))
+            connection.execute("DELETE FROM portfolio_revisions WHERE portfolio_id = ? AND version <= ?",
+                               (portfolio_id, version - self.keep_revisions))
+
+        stored = StoredPortfolio(portfolio_id, version, fingerprint, decode_positions(blob), tax_data or {})
+        self._forget(portfolio_id, version - self.keep_revisions)
+        self._remember(stored)
+        return stored
+
+    def load(self, portfolio_id, version=None):
+        """
+        Loads a revision of a portfolio.
+
+        Args:
+            portfolio_id (str): Portfolio id.
+            version (int): Revision to load. Defaults to the latest.
+
+        Returns:
+            StoredPortfolio: The revision, or None if it does not exist. Its positions are shared with
+            the cache and must not be modified.
+        """
+        if not portfolio_id:
+            return None
+        connection = self._connection()
+        if version is None:
+            row = connection.execute("SELECT MAX(version) FROM portfolio_revisions WHERE portfolio_id = ?",
+                                     (portfolio_id,)).fetchone()
+            version = row[0]
+            if version is None:
+                return None
+
+        with self._cache_lock:
+            stored = self._cache.get((portfolio_id, version))
+            if stored is not None:
+                self._cache.move_to_end((portfolio_id, version))
+                return stored
+
+        row = connection.execute(
+            "SELECT fingerprint, positions, tax_data FROM portfolio_revisions WHERE portfolio_id = ? AND version = ?",
+            (portfolio_id, version)).fetchone()
+        if row is None:
+            return None
+        stored = StoredPortfolio(portfolio_id, version, row[0], decode_positions(row[1]), json.loads(row[2]))
+        self._remember(stored)
+        return stored
+
+    def delete(self, portfolio_id):
+        """Deletes every revision of a portfolio."""
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM portfolio_revisions WHERE portfolio_id = ?", (portfolio_id,))
+        self._forget(portfolio_id)
+
+    def _forget(self, portfolio_id, up_to_version=None):
+        with self._cache_lock:
+            for key in [key for key in self._cache
+                        if key[0] == portfolio_id and (up_to_version is None or key[1] <= up_to_version)]:
+                del self._cache[key]
+
+    def _remember(self, stored):
+        with self._cache_lock:
+            self._cache[(stored.portfolio_id, stored.version)] = stored
+            self._cache.move_to_end((stored.portfolio_id, stored.version))
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_portfolio_store():
+    """
+    Returns the process-wide portfolio store, creating it from the environment on first use.
+
+    Environment:
+        PORTFOLIO_STORE_PATH: SQLite database file.
+        PORTFOLIO_STORE_CACHE_ENTRIES: Number of decoded revisions kept in memory.
+
+    Returns:
+        PortfolioStore: The shared store.
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = PortfolioStore(
+                path=os.getenv('PORTFOLIO_STORE_PATH', DEFAULT_STORE_PATH),
+                cache_entries=int(os.getenv('PORTFOLIO_STORE_CACHE_ENTRIES', DEFAULT_CACHE_ENTRIES)),
+            )
+        return _default_store
@@ -0,0 +1,163 @@
+from functools import cached_property
+
+import numpy as np
+
+ALIGN_POLICIES = ('intersect', 'ffill', 'drop')
+
+
+class PriceMatrix:
+    """
+    Closing prices for several symbols on one sorted date index.
+
+    ``values`` is a contiguous float64 (dates x symbols) block in which missing observations are
+    NaN, and ``mask`` marks the observed cells. Dates are int64 days since the Unix epoch.
+    """
+
+    def __init__(self, dates, symbols, values):
+        """
+        Args:
+            dates (np.ndarray): Sorted int64 day numbers, one per row.
+            symbols (list): Symbol of each column.
+            values (np.ndarray): (dates x symbols) closing prices with NaN where a symbol has no close.
+        """
+        self.dates = np.asarray(dates, dtype=np.int64)
+        self.symbols = list(symbols)
+        self.values = np.ascontiguousarray(values, dtype=np.float64).reshape(len(self.dates), len(self.symbols))
+        self._columns = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+    @classmethod
+    def from_series(cls, series_by_symbol):
+        """
+        Builds a matrix from Alpha Vantage daily mappings in one parse pass over all symbols.
+
+        Every date string and close of every symbol is collected into flat lists and converted with
+        a single NumPy call each, so there is no per-symbol array building or date sorting.
+
+        Args:
+            series_by_symbol (dict): Mapping of symbol to a "Time Series (Daily)" mapping. Entries that
+                are empty or contain an 'error' key are left out.
+
+        Returns:
+            PriceMatrix: Matrix over the union of all dates, NaN where a symbol has no close.
+        """
+        symbols = [symbol for symbol, series in series_by_symbol.items()
+                   if isinstance(series, dict) and series and "error" not in series]
+        lengths = [len(series_by_symbol[symbol]) for symbol in symbols]
+        dates = np.array([date for symbol in symbols for date in series_by_symbol[symbol]],
+                         dtype='datetime64[D]').astype(np.int64)
+        closes = np.array([value['4. close'] for symbol in symbols for value in series_by_symbol[symbol].values()],
+                          dtype=np.float64)
+        columns = np.repeat(np.arange(len(symbols)), lengths)
+        return cls._scatter(symbols, dates, columns, closes)
+
+    @classmethod
+    def from_histories(cls, histories):
+        """
+        Builds a matrix from stored price histories.
+
+        Args:
+            histories (dict): Mapping of symbol to a PriceHistory.
+
+        Returns:
+            PriceMatrix: Matrix over the union of all dates, NaN where a symbol has no close.
+        """
+        symbols = list(histories)
+        if not symbols:
+            return cls(np.empty(0, dtype=np.int64), [], np.empty((0, 0)))
+        dates = np.concatenate([np.asarray(histories[symbol].dates) for symbol in symbols])
+        closes = np.concatenate([np.asarray(histories[symbol].closes) for symbol in symbols])
+        columns = np.repeat(np.arange(len(symbols)), [len(histories[symbol].dates) for symbol in symbols])
+        return cls._scatter(symbols, dates, columns, closes)
+
+    @classmethod
+    def _scatter(cls, symbols, dates, columns, closes):
+        index, rows = np.unique(dates, return_inverse=True)
+        values = np.full((len(index), len(symbols)), np.nan)
+        values[rows, columns] = closes
+        return cls(index, symbols, values)
+
+    @cached_property
+    def mask(self):
+        """Boolean (dates x symbols) array, True where a close was observed."""
+        return ~np.isnan(self.values)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def column(self, symbol):
+        """Returns the closing prices of one symbol."""
+        return self.values[:, self._columns[symbol]]
+
+    def select(self, symbols):
+        """
+        Returns the columns of the given symbols that the matrix holds, in the given order.
+
+        Dates on which none of the selected symbols has a close are left out.
+
+        Args:
+            symbols (list): Symbols to keep; symbols the matrix does not hold are skipped.
+
+        Returns:
+            PriceMatrix: Matrix of the selected columns.
+        """
+        symbols = [symbol for symbol in dict.fromkeys(symbols) if symbol in self._columns]
+        values = self.values[:, [self._columns[symbol] for symbol in symbols]]
+        observed = ~np.isnan(values).all(axis=1)
+        return PriceMatrix(self.dates[observed], symbols, values[observed])
+
+    @cached_property
+    def latest_prices(self):
+        """Mapping of symbol to its most recent observed close."""
+        if not len(self.dates):
+            return {}
+        last_row = len(self.dates) - 1 - np.argmax(self.mask[::-1], axis=0)
+        latest = self.values[last_row, np.arange(len(self.symbols))]
+        return {symbol: float(price) for symbol, price, observed in
+                zip(self.symbols, latest, self.mask.any(axis=0)) if observed}
+
+    def align(self, policy='intersect', min_coverage=0.9):
+        """
+        Returns a matrix without missing values.
+
+        Policies:
+            intersect: keep only the dates on which every symbol has a close.
+            ffill: carry each symbol's last close forward over gaps, then drop the leading dates
+                before every symbol has started trading.
+            drop: drop symbols observed on less than ``min_coverage`` of the dates (for example a
+                recent IPO), then intersect the remaining symbols.
+
+        Args:
+            policy (str): One of ALIGN_POLICIES.
+            min_coverage (float): Minimum fraction of dates observed for the 'drop' policy.
+
+        Returns:
+            PriceMatrix: Aligned matrix.
+
+        Raises:
+            ValueError: If the policy is unknown.
+        """
+        if policy not in ALIGN_POLICIES:
+            raise ValueError(f"Unknown alignment policy '{policy}', expected one of {', '.join(ALIGN_POLICIES)}")
+
+        if policy == 'drop':
+            coverage = self.mask.mean(axis=0) if len(self.dates) else np.ones(len(self.symbols))
+            keep = coverage >= min_coverage
+            symbols = [symbol for symbol, kept in zip(self.symbols, keep) if kept]
+            return PriceMatrix(self.dates, symbols, self.values[:, keep]).align('intersect')
+
+        if policy == 'ffill':
+            # Index of the latest observed row at or before each row, per column.
+            observed_rows = np.where(self.mask, np.arange(len(self.dates))[:, None], 0)
+            np.maximum.accumulate(observed_rows, axis=0, out=observed_rows)
+            values = self.values[observed_rows, np.arange(len(self.symbols))]
+            complete = ~np.isnan(values).any(axis=1)
+            return PriceMatrix(self.dates[complete], self.symbols, values[complete])
+
+        complete = self.mask.all(axis=1)
+        return PriceMatrix(self.dates[complete], self.symbols, self.values[complete])
+
+    @cached_property
+    def log_returns(self):
+        """(dates - 1 x symbols) matrix of daily log returns; NaN where a close is missing."""
+        return np.diff(np.log(self.values), axis=0)
@@ -0,0 +1,299 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from .instrumentation import REGISTRY
+
+DEFAULT_STORE_DIR = os.path.join(tempfile.gettempdir(), 'tax_alpha_prices')
+DEFAULT_TTL_SECONDS = 12 * 60 * 60
+DEFAULT_HOT_ENTRIES = 256
+
+# Symbols become file names in the store, so they are limited to characters that are safe there.
+SYMBOL_PATTERN = re.compile(r'[A-Z0-9^=\-][A-Z0-9.^=\-]{0,31}')
+
+# Dates are stored as int64 days since the Unix epoch, closes as float64, both sorted oldest first.
+PriceHistory = namedtuple('PriceHistory', ['dates', 'closes'])
+
+LOOKUPS = REGISTRY.counter('tax_alpha_price_store_lookups_total',
+                           "Price history lookups, by where they were served from.", ('result',))
+
+
+class PriceStoreError(Exception):
+    """Raised when price history for a symbol is neither stored nor downloadable."""
+
+
+def valid_symbol(symbol):
+    """
+    Checks whether a symbol can be kept in the store.
+
+    Args:
+        symbol (str): Upper-case stock symbol.
+
+    Returns:
+        bool: True for 1 to 32 letters, digits, '.', '-', '^' and '=', not starting with a dot.
+    """
+    return isinstance(symbol, str) and SYMBOL_PATTERN.fullmatch(symbol) is not None
+
+
+def parse_daily_series(series):
+    """
+    Converts an Alpha Vantage "Time Series (Daily)" mapping into a chronologically sorted PriceHistory.
+
+    Args:
+        series (dict): Mapping of 'YYYY-MM-DD' to a dictionary containing at least '4. close'.
+
+    Returns:
+        PriceHistory: Sorted int64 day numbers and float64 closing prices.
+    """
+    dates = np.array(list(series.keys()), dtype='datetime64[D]').astype(np.int64)
+    closes = np.array([value['4. close'] for value in series.values()], dtype=np.float64)
+    order = np.argsort(dates, kind='stable')
+    return PriceHistory(dates[order], closes[order])
+
+
+def format_daily_series(history):
+    """
+    Converts a PriceHistory back into the Alpha Vantage daily mapping, newest date first.
+
+    Args:
+        history (PriceHistory): Stored price history.
+
+    Returns:
+        dict: Mapping of 'YYYY-MM-DD' to {'4. close': str}.
+    """
+    dates = np.datetime_as_string(np.asarray(history.dates)[::-1].astype('datetime64[D]'))
+    closes = np.char.mod('%.4f', np.asarray(history.closes)[::-1])
+    return {date: {'4. close': close} for date, close in zip(dates.tolist(), closes.tolist())}
+
+
+class PriceStore:
+    """
+    On-disk price history store with a bounded in-process hot tier.
+
+    Each symbol is kept as two .npy columns (dates and closes) plus a small JSON metadata file, and
+    the columns are memory-mapped when read. A symbol is refreshed through ``downloader`` once its
+    time-to-live has expired, and only days newer than the last stored date are appended.
+    """
+
+    def __init__(self, downloader, root=DEFAULT_STORE_DIR, ttl=DEFAULT_TTL_SECONDS,
+                 hot_entries=DEFAULT_HOT_ENTRIES, clock=time.time):
+        """
+        Args:
+            downloader (callable): Takes a symbol and returns an Alpha Vantage daily mapping, or a
+                dictionary with an 'error' key.
+            root (str): Directory holding the per-symbol files.
+            ttl (float): Default freshness time-to-live in seconds.
+            hot_entries (int): Maximum number of symbols kept in the in-process tier.
+            clock (callable): Returns the current time in seconds.
+        """
+        self.downloader = downloader
+        self.root = root
+        self.ttl = ttl
+        self.hot_entries = hot_entries
+        self.clock = clock
+        self.ttl_overrides = {}
+        self._hot = OrderedDict()
+        self._lock = threading.Lock()
+        self._symbol_locks = {}
+        os.makedirs(root, exist_ok=True)
+
+    def set_ttl(self, symbol, ttl):
+        """Overrides the freshness time-to-live (in seconds) for a single symbol."""
+        self.ttl_overrides[symbol.upper()] = ttl
+
+    def get(self, symbol):
+        """
+        Returns the price history for a symbol, downloading or extending it when it is stale.
+
+        Args:
+            symbol (str): Stock symbol.
+
+        Returns:
+            PriceHistory: Memory-mapped, chronologically sorted price history.
+
+        Raises:
+            PriceStoreError: If the symbol is invalid, or nothing is stored for it and the download fails.
+        """
+        symbol = self._check_symbol(symbol)
+        entry = self._hot_get(symbol)
+        if entry is not None and self._is_fresh(symbol, entry[1]):
+            LOOKUPS.inc(result='memory')
+            return entry[0]
+
+        # One lock per symbol so that concurrent cold requests download each symbol only once.
+        with self._symbol_lock(symbol):
+            entry = self._hot_get(symbol)
+            if entry is None:
+                entry = self._read(symbol)
+                if entry is not None:
+                    self._hot_put(symbol, entry)
+            if entry is not None and self._is_fresh(symbol, entry[1]):
+                LOOKUPS.inc(result='disk')
+                return entry[0]
+
+            data = self.downloader(symbol)
+            if not data or "error" in data:
+                if entry is not None:
+                    # Serve stale history rather than failing when the upstream is unavailable.
+                    LOOKUPS.inc(result='stale')
+                    return entry[0]
+                LOOKUPS.inc(result='error')
+                message = data.get("error") if data else "Invalid symbol or data not available"
+                raise PriceStoreError(message)
+
+            history = self._merge(entry[0] if entry is not None else None, parse_daily_series(data))
+            entry = self._write(symbol, history)
+            self._hot_put(symbol, entry)
+            LOOKUPS.inc(result='download')
+            return entry[0]
+
+    def put(self, symbol, history, restate=False):
+        """
+        Stores price history obtained outside the downloader, e.g. from a bulk file.
+
+        As with a download, only days newer than the stored history are appended unless ``restate``
+        is set, and the symbol counts as freshly fetched.
+
+        Args:
+            symbol (str): Stock symbol.
+            history (PriceHistory): Chronologically sorted prices without duplicate days.
+            restate (bool): Merge by date instead, with the given prices replacing stored ones for
+                the same day. Used for vendor files, which may backfill or correct older days.
+
+        Returns:
+            PriceHistory: History now stored for the symbol.
+
+        Raises:
+            PriceStoreError: If the symbol is invalid.
+        """
+        symbol = self._check_symbol(symbol)
+        with self._symbol_lock(symbol):
+            entry = self._hot_get(symbol) or self._read(symbol)
+            history = self._merge(entry[0] if entry is not None else None, history, restate)
+            entry = self._write(symbol, history, mapped=False)
+            # Loading a whole universe should not flush the symbols requests are using
+            self.invalidate(symbol)
+            return entry[0]
+
+    def invalidate(self, symbol=None):
+        """Drops one symbol, or every symbol, from the hot tier."""
+        with self._lock:
+            if symbol is None:
+                self._hot.clear()
+            else:
+                self._hot.pop(symbol.upper(), None)
+
+    @staticmethod
+    def _check_symbol(symbol):
+        normalized = symbol.upper() if isinstance(symbol, str) else symbol
+        if not valid_symbol(normalized):
+            raise PriceStoreError(f"Invalid symbol {symbol!r}")
+        return normalized
+
+    def _is_fresh(self, symbol, fetched_at):
+        ttl = self.ttl_overrides.get(symbol, self.ttl)
+        return self.clock() - fetched_at < ttl
+
+    def _symbol_lock(self, symbol):
+        with self._lock:
+            return self._symbol_locks.setdefault(symbol, threading.Lock())
+
+    def _hot_get(self, symbol):
+        with self._lock:
+            entry = self._hot.get(symbol)
+            if entry is not None:
+                self._hot.move_to_end(symbol)
+            return entry
+
+    def _hot_put(self, symbol, entry):
+        with self._lock:
+            self._hot[symbol] = entry
+            self._hot.move_to_end(symbol)
+            while len(self._hot) > self.hot_entries:
+                self._hot.popitem(last=False)
+
+    def _paths(self, symbol):
+        base = os.path.join(self.root, symbol)
+        return base + '.dates.npy', base + '.close.npy', base + '.json'
+
+    def _read(self, symbol):
+        dates_path, close_path, meta_path = self._paths(symbol)
+        try:
+            with open(meta_path) as meta_file:
+                meta = json.load(meta_file)
+            history = PriceHistory(np.load(dates_path, mmap_mode='r'), np.load(close_path, mmap_mode='r'))
+        except (OSError, ValueError):
+            return None
+        return history, meta['fetched_at']
+
+    def _write(self, symbol, history, mapped=True):
+        dates_path, close_path, meta_path = self._paths(symbol)
+        fetched_at = self.clock()
+        for path, column in ((dates_path, history.dates), (close_path, history.closes)):
+            self._atomic_write(path, lambda handle, column=column: np.save(handle, column))
+        meta = {"fetched_at": fetched_at, "rows": int(len(history.dates))}
+        self._atomic_write(meta_path, lambda handle: handle.write(json.dumps(meta).encode()))
+        if not mapped:
+            return history, fetched_at
+        return PriceHistory(np.load(dates_path, mmap_mode='r'), np.load(close_path, mmap_mode='r')), fetched_at
+
+    def _atomic_write(self, path, write):
+        handle, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as tmp_file:
+            write(tmp_file)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _merge(existing, fresh, restate=False):
+        if existing is None or len(existing.dates) == 0:
+            return fresh
+        if restate:
+            # Union of the days, with the fresh price winning where both have one.
+            kept = ~np.isin(existing.dates, fresh.dates)
+            dates = np.concatenate([existing.dates[kept], fresh.dates])
+            closes = np.concatenate([existing.closes[kept], fresh.closes])
+            order = np.argsort(dates, kind='stable')
+            return PriceHistory(dates[order], closes[order])
+        # Only append days strictly newer than what is already stored.
+        newer = fresh.dates > existing.dates[-1]
+        if not newer.any():
+            return PriceHistory(np.asarray(existing.dates), np.asarray(existing.closes))
+        return PriceHistory(np.concatenate([existing.dates, fresh.dates[newer]]),
+                            np.concatenate([existing.closes, fresh.closes[newer]]))
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_price_store(downloader):
+    """
+    Returns the process-wide price store, creating it from the environment on first use.
+
+    Environment:
+        PRICE_STORE_DIR: Directory for the per-symbol files.
+        PRICE_STORE_TTL: Freshness time-to-live in seconds.
+        PRICE_STORE_HOT_ENTRIES: Size of the in-process tier.
+
+    Args:
+        downloader (callable): Downloader used if the store has to be created.
+
+    Returns:
+        PriceStore: The shared store.
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = PriceStore(
+                downloader,
+                root=os.getenv('PRICE_STORE_DIR', DEFAULT_STORE_DIR),
+                ttl=float(os.getenv('PRICE_STORE_TTL', DEFAULT_TTL_SECONDS)),
+                hot_entries=int(os.getenv('PRICE_STORE_HOT_ENTRIES', DEFAULT_HOT_ENTRIES)),
+            )
+        return _default_store
@@ -0,0 +1,240 @@
+import numpy as np
+
+from .optimizer import solve_qp
+from .tax_lots import LONG_TERM_DAYS, WASH_SALE_DAYS, to_days
+
+DEFAULT_RISK_AVERSION = 10.0
+DEFAULT_SEGMENTS = 4
+# Accounts solved together against one factorization; the cost of an ADMM iteration grows with it.
+CHUNK_SIZE = 256
+# Re-solves after removing trades below the minimum size.
+MIN_TRADE_ROUNDS = 4
+# Trades smaller than this (as a weight) are treated as no trade.
+TRADE_TOLERANCE = 1e-9
+# Makes the quadratic term positive definite, so ties between equally taxed lots have one solution.
+REGULARIZATION = 1e-9
+# ADMM step size for problems in weights. The solver's default adapts to it only slowly; on the
+# tax_aware_rebalance benchmark this needs three to eight times fewer iterations.
+STEP_SIZE = 3.0
+
+
+def relief_segments(codes, values, cost_rates, gain_rates, num_assets, num_segments=DEFAULT_SEGMENTS):
+    """
+    Builds the piecewise-linear tax cost of selling each asset of one account.
+
+    Lots are relieved cheapest first (losses, then gains taxed at lower rates), so the tax of selling
+    x dollars of an asset is a convex piecewise-linear function of x whose slope is the tax per
+    dollar of the lot being sold. Up to ``num_segments`` lots per asset the function is exact; larger
+    holdings merge adjacent lots into segments with their value-weighted slope, which can only
+    overstate the tax of a partial sale.
+
+    Args:
+        codes (np.ndarray): Asset index of each lot.
+        values (np.ndarray): Market value of each lot as a fraction of the account.
+        cost_rates (np.ndarray): Tax per dollar sold from each lot; negative for losses.
+        gain_rates (np.ndarray): Realized gain per dollar sold from each lot.
+        num_assets (int): Number of assets.
+        num_segments (int): Linear pieces per asset.
+
+    Returns:
+        tuple: (assets x segments) capacities, tax per unit and gain per unit of each segment, and
+        the lot indices in relief order (by asset, cheapest first).
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    order = np.lexsort((cost_rates, codes))
+    sorted_codes = codes[order]
+    counts = np.bincount(codes, minlength=num_assets)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rank = np.arange(len(order)) - starts[sorted_codes]
+    segment = sorted_codes * num_segments + rank * num_segments // np.maximum(counts[sorted_codes], 1)
+
+    size = num_assets * num_segments
+    capacities = np.bincount(segment, values[order], minlength=size)
+    taxes = np.bincount(segment, (values * cost_rates)[order], minlength=size)
+    gains = np.bincount(segment, (values * gain_rates)[order], minlength=size)
+    held = capacities > 0
+    costs = np.divide(taxes, capacities, out=np.zeros(size), where=held)
+    gains = np.divide(gains, capacities, out=np.zeros(size), where=held)
+    shape = (num_assets, num_segments)
+    return capacities.reshape(shape), costs.reshape(shape), gains.reshape(shape), order
+
+
+def account_segments(ledger, assets, prices, as_of, short_term_rate, long_term_rate=None,
+                     num_segments=DEFAULT_SEGMENTS):
+    """
+    Values the lots of one account and builds their relief segments.
+
+    Lots of symbols outside ``assets`` or without a price are left out. Losses on symbols bought
+    in the wash-sale window before ``as_of`` would be disallowed, so they are given no tax value.
+
+    Args:
+        ledger (LotLedger): Lots of the account.
+        assets (list): Symbols of the optimization, in covariance order.
+        prices (dict): Current price per symbol.
+        as_of (str | int): Trade date.
+        short_term_rate (float): Rate applied to short-term gains.
+        long_term_rate (float): Rate applied to long-term gains. Defaults to the short-term rate.
+        num_segments (int): Linear pieces per asset.
+
+    Returns:
+        dict: 'value' of the account, (n,) 'weights', (n x S) 'capacities', 'costs' and 'gains',
+        'rows', the ledger rows of the valued lots in relief order, and 'bought_recently', the
+        symbols bought in the wash-sale window.
+    """
+    as_of = int(to_days(as_of)) if not isinstance(as_of, (int, np.integer)) else int(as_of)
+    long_term_rate = short_term_rate if long_term_rate is None else long_term_rate
+    index = {symbol: i for i, symbol in enumerate(assets)}
+    asset_of_code = np.array([index.get(name, -1) for name in ledger.symbol_names], dtype=np.int64)
+    price_of_code = np.array([prices.get(name, np.nan) for name in ledger.symbol_names], dtype=np.float64)
+
+    rows = np.flatnonzero((asset_of_code[ledger.codes] >= 0) & (price_of_code[ledger.codes] > 0)
+                          & (ledger.quantity > 0))
+    codes = asset_of_code[ledger.codes[rows]]
+    price = price_of_code[ledger.codes[rows]]
+    values = ledger.quantity[rows] * price
+    total = float(values.sum())
+    if total <= 0:
+        raise ValueError("The account holds no priced positions")
+
+    gain_rates = (price - ledger.basis[rows]) / price
+    long_term = as_of - ledger.acquired[rows] > LONG_TERM_DAYS
+    cost_rates = np.where(long_term, long_term_rate, short_term_rate) * gain_rates
+    recent = (ledger.acquired >= as_of - WASH_SALE_DAYS) & (ledger.acquired <= as_of)
+    bought_recently = np.zeros(len(ledger.symbol_names), dtype=bool)
+    bought_recently[ledger.codes[recent]] = True
+    disallowed = (gain_rates < 0) & bought_recently[ledger.codes[rows]]
+    cost_rates = np.where(disallowed, 0.0, cost_rates)
+    gain_rates = np.where(disallowed, 0.0, gain_rates)
+
+    capacities, costs, gains, order = relief_segments(codes, values / total, cost_rates, gain_rates, len(assets),
+                                                      num_segments)
+    return {
+        "value": total,
+        "weights": np.bincount(codes, values, minlength=len(assets)) / total,
+        "capacities": capacities,
+        "costs": costs,
+        "gains": gains,
+        "rows": rows[order],
+        "bought_recently": {name for name, recent in zip(ledger.symbol_names, bought_recently) if recent},
+    }
+
+
+def rebalance_weights(covariance_matrix, target_weights, current_weights, capacities, costs, gains,
+                      risk_aversion=DEFAULT_RISK_AVERSION, max_turnover=None, gains_budget=None, min_trade=None):
+    """
+    Solves the tax-aware rebalancing problem of one or more accounts over the same assets.
+
+    For every account the trades minimize::
+
+        risk_aversion / 2 * (w - w*)' S (w - w*) + tax(sells)
+
+    where ``w = w0 + buys - sells`` are the weights after trading, ``w*`` the target weights and
+    ``tax`` the piecewise-linear cost of the relieved lots, subject to self-financing trades, at most
+    ``max_turnover`` sold, at most ``gains_budget`` of net realized gains and no trade smaller than
+    ``min_trade``. Assets under target are only bought and assets over target only sold, so no
+    trade buys back what another sells.
+
+    The quadratic term is the same for every account, so accounts are solved in chunks against one
+    factorization of it and differ only in the linear term, the bounds and the gains-budget row
+    (a rank-one correction per account). The term only depends on the n net trades, so the solver
+    inverts a system in the n assets and the constraint rows rather than in all n(1 + S) variables.
+    Minimum trade sizes are not convex: trades below the minimum are removed and the affected
+    accounts re-solved, for a few rounds at most.
+
+    Args:
+        covariance_matrix (np.ndarray): (n x n) covariance of the asset returns.
+        target_weights (np.ndarray): (n,) or (K x n) target weights.
+        current_weights (np.ndarray): (K x n) weights held by each account.
+        capacities (np.ndarray): (K x n x S) weight held in each relief segment, see relief_segments.
+        costs (np.ndarray): (K x n x S) tax per unit of weight sold from each segment.
+        gains (np.ndarray): (K x n x S) realized gain per unit of weight sold from each segment.
+        risk_aversion (float): Weight of the tracking variance against the tax.
+        max_turnover (float | np.ndarray): Largest weight sold, per account or for all. None for no limit.
+        gains_budget (float | np.ndarray): Largest net realized gain as a fraction of the account. None
+            for no limit.
+        min_trade (float | np.ndarray): Smallest trade in one asset as a weight. None for no minimum.
+
+    Returns:
+        dict: (K x n) 'weights' after trading, 'buys' and 'sells', (K x n x S) 'segment_sells', and
+        (K,) 'realized_gain', 'tax', 'tracking_error_before', 'tracking_error_after' and 'solved'.
+        Accounts that could not be solved keep their weights and are marked unsolved.
+    """
+    covariance_matrix = np.asarray(covariance_matrix, dtype=np.float64)
+    current = np.atleast_2d(np.asarray(current_weights, dtype=np.float64))
+    K, n = current.shape
+    target = np.broadcast_to(np.asarray(target_weights, dtype=np.float64), (K, n))
+    capacities = np.asarray(capacities, dtype=np.float64).reshape(K, n, -1)
+    S = capacities.shape[2]
+    costs = np.asarray(costs, dtype=np.float64).reshape(K, n * S)
+    gains = np.asarray(gains, dtype=np.float64).reshape(K, n * S)
+    turnover = np.broadcast_to(np.inf if max_turnover is None else np.asarray(max_turnover, dtype=np.float64), (K,))
+    budget = np.broadcast_to(np.inf if gains_budget is None else np.asarray(gains_budget, dtype=np.float64), (K,))
+    minimum = np.broadcast_to(0.0 if min_trade is None else np.asarray(min_trade, dtype=np.float64), (K,))
+
+    from scipy import sparse
+
+    # Variables per account: buys of each asset, then sells from each segment (asset-major).
+    exposure = sparse.hstack([sparse.identity(n), -sparse.kron(sparse.identity(n), np.ones((1, S)))]).tocsr()
+    P = risk_aversion * (exposure.T @ (exposure.T @ covariance_matrix).T) + REGULARIZATION * np.eye(n * (1 + S))
+    P_factors = (np.full(n * (1 + S), REGULARIZATION), exposure, risk_aversion * covariance_matrix)
+    q = risk_aversion * exposure.T @ covariance_matrix @ (current - target).T
+    q[n:] += costs.T
+    A = np.vstack([np.r_[np.ones(n), -np.ones(n * S)], np.r_[np.zeros(n), np.ones(n * S)]])
+
+    buy_limit = np.where(target > current, np.inf, 0.0)
+    sell_limit = np.where((target < current)[:, :, None], capacities, 0.0).reshape(K, n * S)
+    frozen = np.zeros((K, n), dtype=bool)
+    solution = np.zeros((K, n * (1 + S)))
+    solved = np.zeros(K, dtype=bool)
+
+    def solve(accounts):
+        # The gains row differs per account: sells weighted by their realized gain per unit.
+        budget_rows = np.hstack([np.zeros((len(accounts), n)), gains[accounts]]).T[None]
+        lower = np.vstack([np.zeros((2, len(accounts))), np.full(len(accounts), -np.inf)])
+        upper = np.vstack([np.zeros(len(accounts)), turnover[accounts], budget[accounts]])
+        for round_number in range(MIN_TRADE_ROUNDS + 1):
+            trading = ~frozen[accounts]
+            ub = np.hstack([np.where(trading, buy_limit[accounts], 0.0),
+                            np.where(np.repeat(trading, S, axis=1), sell_limit[accounts], 0.0)])
+            # Later rounds start from the previous trades, less the removed ones
+            x, ok = solve_qp(P, q[:, accounts], A, lower, upper, np.zeros(n * (1 + S)), ub.T,
+                             x0=np.minimum(solution[accounts], ub).T, rho=STEP_SIZE, A_batch=budget_rows,
+                             P_factors=P_factors)
+            solution[accounts] = x.T
+            solved[accounts] = ok
+
+            trades = np.abs(x[:n] - x[n:].reshape(n, S, -1).sum(axis=1))
+            small = (trades > TRADE_TOLERANCE) & (trades < minimum[accounts])
+            redo = small.any(axis=0)
+            if not redo.any() or round_number == MIN_TRADE_ROUNDS:
+                return
+            frozen[accounts] |= small.T
+            accounts, budget_rows = accounts[redo], budget_rows[:, :, redo]
+            lower, upper = lower[:, redo], upper[:, redo]
+
+    for start in range(0, K, CHUNK_SIZE):
+        solve(np.arange(start, min(start + CHUNK_SIZE, K)))
+
+    solution[~solved] = 0.0
+    solution[np.abs(solution) < TRADE_TOLERANCE] = 0.0
+    buys = solution[:, :n]
+    segment_sells = solution[:, n:].reshape(K, n, S)
+    sells = segment_sells.sum(axis=2)
+    weights = current + buys - sells
+
+    def tracking_error(weights):
+        difference = weights - target
+        return np.sqrt(np.maximum(np.einsum('ij,jk,ik->i', difference, covariance_matrix, difference), 0.0))
+
+    return {
+        "weights": weights,
+        "buys": buys,
+        "sells": sells,
+        "segment_sells": segment_sells,
+        "realized_gain": np.einsum('ij,ij->i', solution[:, n:], gains),
+        "tax": np.einsum('ij,ij->i', solution[:, n:], costs),
+        "tracking_error_before": tracking_error(current),
+        "tracking_error_after": tracking_error(weights),
+        "solved": solved,
+    }
@@ -0,0 +1,340 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .optimizer import TRADING_DAYS
+from .price_matrix import PriceMatrix
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOOKBACK_DAYS = 252
+DEFAULT_TOP_K = 5
+DEFAULT_TTL_SECONDS = 12 * 60 * 60
+DEFAULT_MAX_INDEXES = 8
+# Largest universe a request may give that is not part of the finder's own universe.
+DEFAULT_MAX_REQUEST_UNIVERSE = 200
+# Securities observed on fewer of the lookback days are left out of the index.
+MIN_COVERAGE = 0.9
+# Fewest overlapping days of returns for which a correlation is reported.
+MIN_OBSERVATIONS = 20
+
+
+class SimilarityIndex:
+    """
+    Standardized daily returns of a universe of securities, for nearest-substitute queries.
+
+    The returns over the lookback window are stored once as a contiguous (securities x days) block
+    scaled so that the correlations of a target with every security are a single matrix-vector
+    product. A query ranks the candidates by the tracking error of swapping the target for them one
+    dollar for one dollar, which takes both correlation and volatility into account.
+    """
+
+    def __init__(self, symbols, price_dates, returns, identical_groups=(), max_correlation=None):
+        """
+        Args:
+            symbols (list): Symbol of each column of ``returns``.
+            price_dates (np.ndarray): Sorted int64 day numbers of the prices; the returns are on
+                every date but the first.
+            returns (np.ndarray): (days x symbols) daily log returns without missing values.
+            identical_groups (list): Groups of symbols that are substantially identical to each other,
+                e.g. share classes of one company or funds tracking the same index.
+            max_correlation (float): Candidates at least this correlated with the target are treated
+                as substantially identical too. Disabled by default.
+        """
+        returns = np.asarray(returns, dtype=np.float64).reshape(len(price_dates) - 1, len(symbols))
+        volatility = returns.std(axis=0) if len(returns) > 1 else np.zeros(len(symbols))
+        usable = np.isfinite(volatility) & (volatility > 0)
+        self.symbols = [symbol for symbol, kept in zip(symbols, usable) if kept]
+        self.price_dates = np.asarray(price_dates, dtype=np.int64)
+        self.returns = np.ascontiguousarray(returns[:, usable].T)
+        self.volatility = volatility[usable]
+        self._columns = {symbol: i for i, symbol in enumerate(self.symbols)}
+        if self.returns.size:
+            self._scaled = (self.returns - self.returns.mean(axis=1, keepdims=True)) / (
+                self.volatility[:, None] * self.returns.shape[1])
+        else:
+            self._scaled = self.returns
+        self.identical = {}
+        for group in identical_groups:
+            group = frozenset(group)
+            for symbol in group:
+                self.identical[symbol] = self.identical.get(symbol, frozenset()) | group
+        self.max_correlation = max_correlation
+
+    @classmethod
+    def from_prices(cls, prices, lookback=DEFAULT_LOOKBACK_DAYS, **kwargs):
+        """
+        Builds an index over the most recent ``lookback`` days of returns.
+
+        Securities observed on less than MIN_COVERAGE of those days are left out; gaps of the others
+        are forward filled.
+
+        Args:
+            prices (PriceMatrix): Unaligned closing prices of the universe.
+            lookback (int): Number of days of returns to keep.
+            **kwargs: Passed to the constructor.
+
+        Returns:
+            SimilarityIndex: The index.
+        """
+        window = PriceMatrix(prices.dates[-(lookback + 1):], prices.symbols, prices.values[-(lookback + 1):])
+        coverage = window.mask.mean(axis=0) if len(window.dates) else np.zeros(len(window.symbols))
+        keep = coverage >= MIN_COVERAGE
+        aligned = PriceMatrix(window.dates, [s for s, kept in zip(window.symbols, keep) if kept],
+                              window.values[:, keep]).align('ffill')
+        if len(aligned.dates) < 2:
+            return cls([], aligned.dates[:1] if len(aligned.dates) else np.zeros(1, dtype=np.int64),
+                       np.empty((0, 0)), **kwargs)
+        return cls(aligned.symbols, aligned.dates, aligned.log_returns, **kwargs)
+
+    def subset(self, symbols):
+        """
+        Restricts the index to some of its securities, without reloading any prices.
+
+        Args:
+            symbols (iterable): Symbols to keep; those not in the index are ignored.
+
+        Returns:
+            SimilarityIndex: Index over the kept securities, in the order of this index.
+        """
+        wanted = set(symbols)
+        rows = [i for i, symbol in enumerate(self.symbols) if symbol in wanted]
+        return SimilarityIndex([self.symbols[i] for i in rows], self.price_dates, self.returns[rows].T,
+                               identical_groups=set(self.identical.values()), max_correlation=self.max_correlation)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol):
+        return symbol in self._columns
+
+    def _target_returns(self, dates, closes):
+        # Returns of a security outside the index on the index's dates, forward filling its gaps
+        dates = np.asarray(dates, dtype=np.int64)
+        closes = np.asarray(closes, dtype=np.float64)
+        observed = ~np.isnan(closes)
+        dates, closes = dates[observed], closes[observed]
+        positions = np.searchsorted(dates, self.price_dates, side='right') - 1
+        prices = np.where(positions >= 0, closes[np.maximum(positions, 0)], np.nan)
+        return np.diff(np.log(prices))
+
+    def nearest(self, symbol, k=DEFAULT_TOP_K, exclude=(), prices=None):
+        """
+        Finds the k securities that track ``symbol`` most closely.
+
+        The symbol itself, the members of its identical group, candidates at least
+        ``max_correlation`` correlated with it, and every symbol in ``exclude`` are never returned.
+
+        Args:
+            symbol (str): Security to replace.
+            k (int): Number of substitutes.
+            exclude (iterable): Symbols that may not be proposed, e.g. those bought in the wash-sale window.
+            prices (tuple): (dates, closes) of the target if it is not in the index.
+
+        Returns:
+            list: Up to k dictionaries with the substitute's 'symbol', 'correlation', 'beta' (of the
+            target on the substitute, i.e. the dollars of substitute per dollar sold with the
+            smallest tracking error) and the annualized 'tracking_error' of a one-for-one swap,
+            closest first. Empty if the target has too little history.
+        """
+        if not len(self) or k <= 0:
+            return []
+        if symbol in self._columns:
+            target = self.returns[self._columns[symbol]]
+        elif prices is not None:
+            target = self._target_returns(*prices)
+        else:
+            return []
+
+        valid = np.isfinite(target)
+        start = int(np.argmax(valid)) if valid.any() else len(target)
+        if not valid[start:].all() or len(target) - start < MIN_OBSERVATIONS:
+            return []
+        target = target[start:]
+        target_volatility = target.std()
+        if not target_volatility > 0:
+            return []
+        centered = (target - target.mean()) / target_volatility
+        if start == 0:
+            correlation = self._scaled @ centered
+            volatility = self.volatility
+        else:
+            # Shorter overlap: standardize the universe over the same days
+            window = self.returns[:, start:]
+            volatility = window.std(axis=1)
+            correlation = ((window - window.mean(axis=1, keepdims=True)) @ centered) / (
+                np.where(volatility > 0, volatility, np.inf) * len(target))
+
+        tracking_variance = target_volatility ** 2 + volatility ** 2 - 2 * correlation * target_volatility * volatility
+        tracking_error = np.sqrt(np.maximum(tracking_variance, 0) * TRADING_DAYS)
+
+        excluded = set(exclude) | {symbol} | self.identical.get(symbol, frozenset())
+        allowed = np.ones(len(self), dtype=bool)
+        allowed[[self._columns[name] for name in excluded if name in self._columns]] = False
+        allowed &= volatility > 0
+        if self.max_correlation is not None:
+            allowed &= correlation < self.max_correlation
+        candidates = np.flatnonzero(allowed)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(tracking_error[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(tracking_error[candidates], kind='stable')]
+        return [
+            {
+                "symbol": self.symbols[i],
+                "correlation": float(correlation[i]),
+                "beta": float(correlation[i] * target_volatility / volatility[i]),
+                "tracking_error": float(tracking_error[i]),
+            }
+            for i in candidates
+        ]
+
+
+class ReplacementFinder:
+    """
+    Builds similarity indexes over universes of securities and keeps them for a time-to-live.
+
+    An index is built from the price history loader on first use, so a universe of thousands of
+    securities is read and standardized once and then answers queries with one matrix-vector
+    product each. Universes given by requests are served from the finder's own index when they are
+    part of its universe; other, small universes get indexes of their own, kept apart from it.
+    """
+
+    def __init__(self, load_prices, universe=(), lookback=DEFAULT_LOOKBACK_DAYS, identical_groups=(),
+                 max_correlation=None, ttl=DEFAULT_TTL_SECONDS, max_indexes=DEFAULT_MAX_INDEXES,
+                 max_request_universe=DEFAULT_MAX_REQUEST_UNIVERSE, clock=time.time):
+        """
+        Args:
+            load_prices (callable): Takes a list of symbols and returns their PriceMatrix.
+            universe (list): Default candidate symbols.
+            lookback (int): Days of returns in each index.
+            identical_groups (list): Groups of substantially identical symbols.
+            max_correlation (float): Correlation from which candidates count as substantially identical.
+            ttl (float): Seconds after which an index is rebuilt with fresh prices.
+            max_indexes (int): Number of other universes kept besides the default one.
+            max_request_universe (int): Largest universe outside the default one that is indexed.
+            clock (callable): Returns the current time in seconds.
+        """
+        self.load_prices = load_prices
+        self.universe = list(dict.fromkeys(universe))
+        self.lookback = lookback
+        self.identical_groups = [list(group) for group in identical_groups]
+        self.max_correlation = max_correlation
+        self.ttl = ttl
+        self.max_indexes = max_indexes
+        self.max_request_universe = max_request_universe
+        self.clock = clock
+        self._universe_set = frozenset(self.universe)
+        self._default = None
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def index(self, universe=None):
+        """
+        Returns the similarity index of a universe, building it if it is missing or stale.
+
+        Args:
+            universe (list): Candidate symbols. Defaults to the finder's universe; a part of it is
+                cut from the default index without loading prices.
+
+        Returns:
+            SimilarityIndex: The index (empty if the universe is).
+
+        Raises:
+            ValueError: If a universe reaching outside the finder's has more than
+                max_request_universe symbols.
+        """
+        if universe is None:
+            return self._default_index()
+        universe = tuple(sorted(set(universe)))
+        if self._universe_set.issuperset(universe):
+            return self._default_index().subset(universe)
+        if len(universe) > self.max_request_universe:
+            raise ValueError(f"A replacement universe outside the configured one may have at most "
+                             f"{self.max_request_universe} symbols")
+
+        with self._lock:
+            entry = self._indexes.get(universe)
+        if entry is not None and self.clock() - entry[1] < self.ttl:
+            return entry[0]
+        # Small and private to the requests asking for it, so it is built without the shared lock
+        index = self._build(universe)
+        with self._lock:
+            self._indexes[universe] = (index, self.clock())
+            self._indexes.move_to_end(universe)
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+        return index
+
+    def _default_index(self):
+        entry = self._default
+        if entry is not None and self.clock() - entry[1] < self.ttl:
+            return entry[0]
+
+        # One build at a time, so concurrent cold requests load the universe only once
+        with self._build_lock:
+            entry = self._default
+            if entry is not None and self.clock() - entry[1] < self.ttl:
+                return entry[0]
+            index = self._build(tuple(sorted(self._universe_set)))
+            self._default = (index, self.clock())
+            return index
+
+    def _build(self, universe):
+        start = time.perf_counter()
+        prices = self.load_prices(list(universe)) if universe else PriceMatrix.from_histories({})
+        index = SimilarityIndex.from_prices(prices, self.lookback, identical_groups=self.identical_groups,
+                                            max_correlation=self.max_correlation)
+        logger.info("Built similarity index", extra={
+            "securities": len(index), "requested": len(universe), "seconds": round(time.perf_counter() - start, 4)})
+        return index
+
+
+def _identical_groups(value):
+    # 'GOOG,GOOGL;SPY,IVV,VOO' -> [['GOOG', 'GOOGL'], ['SPY', 'IVV', 'VOO']]
+    groups = [[symbol.strip().upper() for symbol in group.split(',') if symbol.strip()] for group in value.split(';')]
+    return [group for group in groups if len(group) > 1]
+
+
+_default_finder = None
+_default_finder_lock = threading.Lock()
+
+
+def get_replacement_finder(load_prices):
+    """
+    Returns the process-wide replacement finder, creating it from the environment on first use.
+
+    Environment:
+        REPLACEMENT_UNIVERSE: Comma-separated candidate symbols (tickers and ETFs).
+        REPLACEMENT_IDENTICAL_GROUPS: Semicolon-separated groups of comma-separated symbols that are
+            substantially identical, e.g. 'GOOG,GOOGL;SPY,IVV,VOO'.
+        REPLACEMENT_MAX_CORRELATION: Correlation from which candidates count as substantially identical.
+        REPLACEMENT_LOOKBACK_DAYS: Days of returns used for the similarity.
+        REPLACEMENT_INDEX_TTL: Seconds after which the index is rebuilt.
+        REPLACEMENT_MAX_REQUEST_UNIVERSE: Largest universe a request may give outside REPLACEMENT_UNIVERSE.
+
+    Args:
+        load_prices (callable): Price loader used if the finder has to be created.
+
+    Returns:
+        ReplacementFinder: The shared finder.
+    """
+    global _default_finder
+    with _default_finder_lock:
+        if _default_finder is None:
+            max_correlation = os.getenv('REPLACEMENT_MAX_CORRELATION')
+            _default_finder = ReplacementFinder(
+                load_prices,
+                universe=[symbol.strip().upper() for symbol in os.getenv('REPLACEMENT_UNIVERSE', '').split(',')
+                          if symbol.strip()],
+                lookback=int(os.getenv('REPLACEMENT_LOOKBACK_DAYS', DEFAULT_LOOKBACK_DAYS)),
+                identical_groups=_identical_groups(os.getenv('REPLACEMENT_IDENTICAL_GROUPS', '')),
+                max_correlation=float(max_correlation) if max_correlation else None,
+                ttl=float(os.getenv('REPLACEMENT_INDEX_TTL', DEFAULT_TTL_SECONDS)),
+                max_request_universe=int(os.getenv('REPLACEMENT_MAX_REQUEST_UNIVERSE', DEFAULT_MAX_REQUEST_UNIVERSE)),
+            )
+        return _default_finder
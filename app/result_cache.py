@@ -0,0 +1,316 @@
+import copy
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+from .instrumentation import REGISTRY
+
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+DEFAULT_DISK_MAX_BYTES = 1024 * 1024 * 1024
+# Larger results are returned without being cached: pickling and writing them would cost a full
+# copy and a synchronous disk write on every miss.
+DEFAULT_MAX_ENTRY_BYTES = 32 * 1024 * 1024
+
+
+def fingerprint(*parts):
+    """
+    Computes a stable content hash of calculation inputs.
+
+    NumPy arrays are hashed by dtype, shape and raw bytes; dictionaries, lists, tuples, strings,
+    numbers and None are hashed structurally, so equal inputs always give the same key across
+    processes.
+
+    Args:
+        *parts: Inputs to hash.
+
+    Returns:
+        str: Hex SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+
+    def feed(value):
+        if isinstance(value, np.ndarray):
+            array = np.ascontiguousarray(value)
+            digest.update(f"a{array.dtype.str}{array.shape}".encode())
+            digest.update(array.tobytes())
+        elif isinstance(value, dict):
+            digest.update(f"d{len(value)}".encode())
+            for key in sorted(value, key=str):
+                feed(str(key))
+                feed(value[key])
+        elif isinstance(value, (list, tuple, range)):
+            digest.update(f"l{len(value)}".encode())
+            for item in value:
+                feed(item)
+        elif isinstance(value, (np.generic, float, int, bool)) or value is None:
+            digest.update(f"s{value!r}|".encode())
+        else:
+            text = str(value).encode('utf-8')
+            digest.update(f"t{len(text)}:".encode() + text)
+
+    for part in parts:
+        feed(part)
+    return digest.hexdigest()
+
+
+def array_bytes(value):
+    """
+    Estimates the size of a result from the NumPy arrays it holds, without pickling it.
+
+    Args:
+        value: Result, possibly nesting arrays in dictionaries, lists and tuples.
+
+    Returns:
+        int: Total bytes of the arrays found.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(array_bytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(array_bytes(item) for item in value)
+    return 0
+
+
+def seed_from_key(key):
+    """Derives a deterministic 64-bit simulation seed from a cache key."""
+    return int(key[:16], 16)
+
+
+class ResultCache:
+    """
+    Content-addressed memoization of calculation results.
+
+    Results are pickled and kept in an in-memory LRU bounded by total size in bytes, with an optional
+    on-disk tier for results evicted from memory or computed by another process. Because keys hash
+    the full inputs (including the price history), a new trading day produces new keys and stale
+    results simply age out. Concurrent requests for the same key are coalesced into one computation.
+    Results whose arrays exceed ``max_entry_bytes`` are not cached at all.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, directory=None, disk_max_bytes=DEFAULT_DISK_MAX_BYTES,
+                 max_entry_bytes=DEFAULT_MAX_ENTRY_BYTES):
+        """
+        Args:
+            max_bytes (int): Size limit of the in-memory tier.
+            directory (str): Directory of the on-disk tier. No disk tier if omitted.
+            disk_max_bytes (int): Size limit of the on-disk tier.
+            max_entry_bytes (int): Size limit of one result, checked (see array_bytes) before pickling.
+        """
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "bytes": 0,
+                      "uncacheable": 0}
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Looks up a result.
+
+        Args:
+            key (str): Cache key.
+
+        Returns:
+            tuple: (found, value); value is a fresh copy of the cached result.
+        """
+        with self._lock:
+            blob = self._entries.get(key)
+            if blob is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+        if blob is not None:
+            # Unpickled outside the lock, so hits do not wait for each other
+            return True, pickle.loads(blob)
+
+        blob = self._read_disk(key)
+        with self._lock:
+            if blob is None:
+                self.stats["misses"] += 1
+                return False, None
+            self.stats["disk_hits"] += 1
+            self._store(key, blob)
+        return True, pickle.loads(blob)
+
+    def put(self, key, value):
+        """Stores a result in memory and, if configured, on disk, unless it is too large."""
+        if not self._cacheable(value):
+            return
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._store(key, blob)
+        self._write_disk(key, blob)
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached result for ``key``, computing and storing it on a miss.
+
+        Args:
+            key (str): Cache key.
+            compute (callable): Computes the result; called at most once per key at a time.
+
+        Returns:
+            The result.
+        """
+        found, value = self.get(key)
+        if found:
+            return value
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+            else:
+                self.stats["coalesced"] += 1
+        if not owner:
+            blob, value = future.result()
+            # Every caller gets its own copy of the result
+            return copy.deepcopy(value) if blob is None else pickle.loads(blob)
+
+        try:
+            value = compute()
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL) if self._cacheable(value) else None
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            if blob is not None:
+                self._store(key, blob)
+            del self._inflight[key]
+        if blob is not None:
+            self._write_disk(key, blob)
+        future.set_result((blob, value))
+        return value
+
+    def clear(self):
+        """Empties the in-memory tier."""
+        with self._lock:
+            self._entries.clear()
+            self.stats["bytes"] = 0
+
+    def _cacheable(self, value):
+        if array_bytes(value) <= self.max_entry_bytes:
+            return True
+        with self._lock:
+            self.stats["uncacheable"] += 1
+        return False
+
+    def _store(self, key, blob):
+        # Caller holds the lock. Results larger than the whole tier are not kept in memory.
+        if len(blob) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.stats["bytes"] -= len(previous)
+        self._entries[key] = blob
+        self.stats["bytes"] += len(blob)
+        while self.stats["bytes"] > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.stats["bytes"] -= len(evicted)
+            self.stats["evictions"] += 1
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                blob = f.read()
+            os.utime(self._path(key))  # Disk eviction is least recently used first
+            return blob
+        except OSError:
+            return None
+
+    def _write_disk(self, key, blob):
+        if not self.directory or len(blob) > self.disk_max_bytes:
+            return
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(blob)
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self._evict_disk()
+
+    def _evict_disk(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pkl'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    Returns the process-wide result cache, creating it from the environment on first use.
+
+    Environment:
+        RESULT_CACHE_MAX_BYTES: Size limit of the in-memory tier.
+        RESULT_CACHE_DIR: Directory of the optional on-disk tier.
+        RESULT_CACHE_DISK_MAX_BYTES: Size limit of the on-disk tier.
+        RESULT_CACHE_MAX_ENTRY_BYTES: Size limit of one cached result.
+
+    Returns:
+        ResultCache: The shared cache.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResultCache(
+                max_bytes=int(os.getenv('RESULT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+                directory=os.getenv('RESULT_CACHE_DIR') or None,
+                disk_max_bytes=int(os.getenv('RESULT_CACHE_DISK_MAX_BYTES', DEFAULT_DISK_MAX_BYTES)),
+                max_entry_bytes=int(os.getenv('RESULT_CACHE_MAX_ENTRY_BYTES', DEFAULT_MAX_ENTRY_BYTES)),
+            )
+        return _default_cache
+
+
+@REGISTRY.collector
+def _cache_metrics():
+    cache = _default_cache
+    if cache is None:
+        return []
+    stats = dict(cache.stats)
+    return [
+        ("tax_alpha_result_cache_lookups_total", "counter", "Result cache lookups, by outcome.",
+         [({"result": "hit"}, stats["hits"]), ({"result": "disk_hit"}, stats["disk_hits"]),
+          ({"result": "miss"}, stats["misses"]), ({"result": "coalesced"}, stats["coalesced"])]),
+        ("tax_alpha_result_cache_evictions_total", "counter", "Results evicted from the in-memory cache.",
+         [({}, stats["evictions"])]),
+        ("tax_alpha_result_cache_bytes", "gauge", "Size of the in-memory result cache.", [({}, stats["bytes"])]),
+    ]
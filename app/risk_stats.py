@@ -0,0 +1,184 @@
+import numpy as np
+
+
+class WelfordAccumulator:
+    """
+    Running element-wise mean and variance that can be updated with batches and merged.
+
+    Batches are folded in with Chan's parallel form of Welford's algorithm, so the result does not
+    depend on how the samples were chunked.
+    """
+
+    def __init__(self, shape=()):
+        self.count = 0
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.m2 = np.zeros(shape, dtype=np.float64)
+
+    def update(self, batch):
+        """
+        Folds a batch of samples into the accumulator.
+
+        Args:
+            batch (np.ndarray): Samples stacked along axis 0.
+        """
+        batch = np.asarray(batch, dtype=np.float64)
+        if len(batch) == 0:
+            return
+        batch_mean = batch.mean(axis=0)
+        batch_m2 = ((batch - batch_mean) ** 2).sum(axis=0)
+        self._combine(len(batch), batch_mean, batch_m2)
+
+    def merge(self, other):
+        """Folds another accumulator of the same shape into this one."""
+        if other.count:
+            self._combine(other.count, other.mean, other.m2)
+
+    def _combine(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / total)
+        self.m2 = self.m2 + m2 + delta ** 2 * (self.count * count / total)
+        self.count = total
+
+    @property
+    def variance(self):
+        """Sample variance (ddof=1)."""
+        if self.count < 2:
+            return np.zeros_like(self.mean)
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+class QuantileSketch:
+    """
+    Mergeable log-bucket histogram for positive values with a bounded relative error.
+
+    Values are assigned to geometric buckets (as in DDSketch), so every quantile estimate is within
+    ``relative_accuracy`` of a true sample value. A sketch can hold an independent histogram per
+    cell of ``shape``, e.g. one per simulated day.
+    """
+
+    def __init__(self, shape=(), relative_accuracy=0.005, min_value=1e-4, max_value=1e4):
+        self.shape = tuple(shape)
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = np.log(self.gamma)
+        self.min_index = int(np.ceil(np.log(min_value) / self._log_gamma))
+        self.max_index = int(np.ceil(np.log(max_value) / self._log_gamma))
+        self.num_buckets = self.max_index - self.min_index + 1
+        self.counts = np.zeros(self.shape + (self.num_buckets,), dtype=np.int64)
+
+    @property
+    def count(self):
+        return self.counts.sum(axis=-1)
+
+    def update(self, batch):
+        """
+        Adds a batch of samples to the sketch.
+
+        Args:
+            batch (np.ndarray): Positive samples of shape (n, *shape).
+        """
+        batch = np.asarray(batch, dtype=np.float64).reshape((-1,) + self.shape)
+        index = np.ceil(np.log(np.maximum(batch, 1e-300)) / self._log_gamma).astype(np.int64)
+        index = np.clip(index, self.min_index, self.max_index) - self.min_index
+        cells = int(np.prod(self.shape, dtype=np.int64))
+        flat = index.reshape(len(batch), cells) + np.arange(cells) * self.num_buckets
+        counts = np.bincount(flat.ravel(), minlength=cells * self.num_buckets)
+        self.counts += counts.reshape(self.counts.shape)
+
+    def merge(self, other):
+        """Adds the counts of a sketch with identical parameters."""
+        if other.counts.shape != self.counts.shape or other.gamma != self.gamma:
+            raise ValueError("Sketches must have the same shape and accuracy to be merged")
+        self.counts += other.counts
+
+    def _bucket_values(self):
+        index = np.arange(self.min_index, self.max_index + 1)
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q):
+        """
+        Estimates quantile ``q`` (0 to 1) for every cell of the sketch.
+
+        Returns:
+            np.ndarray: Array of the sketch's shape.
+        """
+        cumulative = np.cumsum(self.counts, axis=-1)
+        rank = np.maximum(np.ceil(q * cumulative[..., -1:]), 1)
+        bucket = np.argmax(cumulative >= rank, axis=-1)
+        return self._bucket_values()[bucket]
+
+    def tail_mean(self, q):
+        """
+        Estimates the mean of the samples at or below quantile ``q`` for every cell.
+
+        Returns:
+            np.ndarray: Array of the sketch's shape.
+        """
+        cumulative = np.cumsum(self.counts, axis=-1)
+        rank = np.maximum(np.ceil(q * cumulative[..., -1:]), 1)
+        # Take whole buckets below the quantile bucket and only part of the quantile bucket itself.
+        previous = cumulative - self.counts
+        weights = np.clip(rank - previous, 0, self.counts)
+        return (weights * self._bucket_values()).sum(axis=-1) / weights.sum(axis=-1)
+
+
+class PortfolioRiskAccumulator:
+    """
+    Folds chunks of simulated portfolio value paths into constant-memory risk statistics.
+
+    Tracks per-day mean/variance and percentiles of the portfolio value, the distribution of the
+    terminal value (for VaR and CVaR) and the distribution of each path's maximum drawdown.
+    """
+
+    def __init__(self, time_horizon, relative_accuracy=0.005):
+        self.daily_moments = WelfordAccumulator((time_horizon,))
+        self.daily_sketch = QuantileSketch((time_horizon,), relative_accuracy)
+        self.drawdown_moments = WelfordAccumulator()
+        # Stores 1 - drawdown so that the sketched values are positive.
+        self.drawdown_sketch = QuantileSketch((), relative_accuracy)
+
+    @property
+    def count(self):
+        return self.daily_moments.count
+
+    def update(self, values):
+        """
+        Args:
+            values (np.ndarray): Portfolio values relative to today, shape (paths, time_horizon).
+        """
+        values = np.asarray(values, dtype=np.float64)
+        self.daily_moments.update(values)
+        self.daily_sketch.update(values)
+
+        peaks = np.maximum(np.maximum.accumulate(values, axis=1), 1.0)
+        trough_ratio = (values / peaks).min(axis=1)
+        self.drawdown_moments.update(1 - trough_ratio)
+        self.drawdown_sketch.update(trough_ratio)
+
+    def merge(self, other):
+        self.daily_moments.merge(other.daily_moments)
+        self.daily_sketch.merge(other.daily_sketch)
+        self.drawdown_moments.merge(other.drawdown_moments)
+        self.drawdown_sketch.merge(other.drawdown_sketch)
+
+    def percentile_bands(self, percentiles):
+        """Returns {percentile: per-day portfolio values} for a fan chart."""
+        return {p: self.daily_sketch.quantile(p / 100) for p in percentiles}
+
+    def value_at_risk(self, confidence=0.95):
+        """
+        Returns the horizon VaR and CVaR as fractions of today's portfolio value.
+        """
+        cutoff = 1 - confidence
+        var = 1 - float(self.daily_sketch.quantile(cutoff)[-1])
+        cvar = 1 - float(self.daily_sketch.tail_mean(cutoff)[-1])
+        return var, cvar
+
+    def max_drawdown(self, confidence=0.95):
+        """Returns the mean and the ``confidence`` percentile of the paths' maximum drawdown."""
+        return float(self.drawdown_moments.mean), 1 - float(self.drawdown_sketch.quantile(1 - confidence))
@@ -1,34 +1,448 @@
+import json
+import logging
 import numpy as np
-import os
-import requests
-from flask import Blueprint, request, jsonify, session
+import time
+from flask import Blueprint, Response, request, jsonify, session
 
 from .calculations import (
+    build_market_context,
+    calculate_efficient_frontier,
     calculate_taxes,
     optimize_portfolio,
     fetch_current_prices,
     monte_carlo_simulation_multi,
-    enhanced_tax_loss_harvesting
+    monte_carlo_risk_stream,
+    monte_carlo_estimate,
+    enhanced_tax_loss_harvesting,
+    tax_aware_rebalance
 )
+from . import instrumentation
+from .batch import BATCH_OPERATIONS, run_batch
+from .formats import (JSON_MIMETYPE, NPY_MIMETYPE, arrow_batch, arrow_chunks, arrow_path_batches, json_response,
+                      negotiate_format, npy_chunks, stream_response)
+from .jobs import FINISHED_STATES, SUCCEEDED, QueueFullError, get_job_queue
+from .monte_carlo import PORTFOLIO_STATISTICS, SAMPLING_METHODS, SOBOL_MAX_DIMENSIONS, SUPPORTED_DTYPES
+from .portfolio_store import get_portfolio_store
+from .price_store import valid_symbol
+from .rebalance import DEFAULT_RISK_AVERSION, DEFAULT_SEGMENTS
+from .replacements import DEFAULT_TOP_K
+from .result_cache import get_result_cache
+from .tax_engine import DEFAULT_TAX_YEAR, what_if_grid
 
 routes = Blueprint('routes', __name__)
+routes.record_once(lambda state: instrumentation.init_app(state.app))
+
+logger = logging.getLogger(__name__)
+
+MAX_WHAT_IF_CELLS = 4_000_000
+MAX_BATCH_PORTFOLIOS = 10_000
+# Grids answered as JSON are kept smaller: every cell of every surface becomes text.
+MAX_WHAT_IF_JSON_CELLS = 100_000
+MAX_SIMULATIONS = 1_000_000
+MAX_TIME_HORIZON = 30 * 252
+# Paths x days x securities held at once: all paths by default, one chunk or batch in the other modes.
+MAX_SIMULATION_CELLS = 50_000_000
+
+
+def session_portfolio():
+    """
+    Loads the latest revision of the portfolio whose id is stored in the session.
+
+    Returns:
+        StoredPortfolio: The stored portfolio, or None if the session has none.
+    """
+    return get_portfolio_store().load(session.get('portfolio_id'))
+
+
+def simulation_options(data):
+    """
+    Reads the Monte Carlo knobs from a request body.
+
+    Args:
+        data (dict): Request JSON, possibly empty.
+
+    Returns:
+        dict: Keyword arguments for monte_carlo_simulation_multi.
+
+    Raises:
+        ValueError: If a knob has an invalid value.
+    """
+    options = {
+        "num_simulations": int(data.get("num_simulations", 1000)),
+        "time_horizon": int(data.get("time_horizon", 252)),
+        "workers": int(data.get("workers", 1)),
+    }
+    for name, value in options.items():
+        if value < 1:
+            raise ValueError(f"{name} must be a positive integer")
+    if options["num_simulations"] > MAX_SIMULATIONS:
+        raise ValueError(f"num_simulations may be at most {MAX_SIMULATIONS}")
+    if options["time_horizon"] > MAX_TIME_HORIZON:
+        raise ValueError(f"time_horizon may be at most {MAX_TIME_HORIZON} days")
+
+    dtype = data.get("dtype", "float64")
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"dtype must be one of {', '.join(SUPPORTED_DTYPES)}")
+    options["dtype"] = SUPPORTED_DTYPES[dtype]
+
+    seed = data.get("seed")
+    options["seed"] = None if seed is None else int(seed)
+
+    sampling = data.get("sampling", "pseudo")
+    if sampling not in SAMPLING_METHODS:
+        raise ValueError(f"sampling must be one of {', '.join(SAMPLING_METHODS)}")
+    options["sampling"] = sampling
+    return options
+
+
+def stream_options(data):
+    """
+    Reads the streaming risk statistics knobs from a request body.
+
+    Args:
+        data (dict): Request JSON, possibly empty.
+
+    Returns:
+        dict: Keyword arguments for monte_carlo_risk_stream, in addition to simulation_options.
+
+    Raises:
+        ValueError: If a knob has an invalid value.
+    """
+    options = {
+        "chunk_size": int(data.get("chunk_size", 1024)),
+        "percentiles": tuple(float(p) for p in data.get("percentiles", (5, 25, 50, 75, 95))),
+        "confidence": float(data.get("confidence", 0.95)),
+    }
+    if options["chunk_size"] < 1:
+        raise ValueError("chunk_size must be a positive integer")
+    if not all(0 <= p <= 100 for p in options["percentiles"]):
+        raise ValueError("percentiles must be between 0 and 100")
+    if not 0 < options["confidence"] < 1:
+        raise ValueError("confidence must be between 0 and 1")
+    return options
+
+
+def estimate_options(data):
+    """
+    Reads the standard error estimation knobs from a request body.
+
+    Args:
+        data (dict): Request JSON, possibly empty.
+
+    Returns:
+        dict: Keyword arguments for monte_carlo_estimate, in addition to simulation_options.
+
+    Raises:
+        ValueError: If a knob has an invalid value.
+    """
+    target = data.get("target_standard_error")
+    options = {
+        "control_variates": bool(data.get("control_variates", False)),
+        "target_standard_error": None if target is None else float(target),
+        "max_simulations": int(data.get("max_simulations", 100_000)),
+        "batch_size": int(data.get("batch_size", 1024)),
+        "statistics": tuple(data.get("statistics", PORTFOLIO_STATISTICS)),
+        "confidence": float(data.get("confidence", 0.95)),
+    }
+    if options["target_standard_error"] is not None and not options["target_standard_error"] > 0:
+        raise ValueError("target_standard_error must be positive")
+    if options["max_simulations"] < 1:
+        raise ValueError("max_simulations must be a positive integer")
+    if options["max_simulations"] > MAX_SIMULATIONS:
+        raise ValueError(f"max_simulations may be at most {MAX_SIMULATIONS}")
+    if options["batch_size"] < 2:
+        raise ValueError("batch_size must be at least 2")
+    unknown = [name for name in options["statistics"] if name not in PORTFOLIO_STATISTICS]
+    if unknown or not options["statistics"]:
+        raise ValueError(f"statistics must be some of {', '.join(PORTFOLIO_STATISTICS)}")
+    if not 0 < options["confidence"] < 1:
+        raise ValueError("confidence must be between 0 and 1")
+    return options
+
+
+def optimizer_options(data):
+    """
+    Reads the optional optimizer constraints from a request body.
+
+    Args:
+        data (dict): Request JSON, possibly empty.
+
+    Returns:
+        dict: Keyword arguments for optimize_portfolio and calculate_efficient_frontier.
+
+    Raises:
+        ValueError: If a constraint is malformed.
+    """
+    options = {}
+    if data.get("bounds"):
+        options["bounds"] = {}
+        for symbol, (lower, upper) in data["bounds"].items():
+            if not 0 <= float(lower) <= float(upper) <= 1:
+                raise ValueError(f"bounds for {symbol} must satisfy 0 <= min <= max <= 1")
+            options["bounds"][symbol] = (float(lower), float(upper))
+    if data.get("groups"):
+        options["groups"] = [
+            {
+                "symbols": list(group["symbols"]),
+                "min": None if group.get("min") is None else float(group["min"]),
+                "max": None if group.get("max") is None else float(group["max"]),
+            }
+            for group in data["groups"]
+        ]
+    return options
+
+
+def optimize_options(data):
+    """
+    Reads the /optimize-portfolio parameters from a request body.
+
+    Args:
+        data (dict): Request JSON, possibly empty.
+
+    Returns:
+        dict: Keyword arguments for optimize_portfolio.
+
+    Raises:
+        ValueError: If a parameter is malformed.
+    """
+    options = optimizer_options(data)
+    options["risk_free_rate"] = float(data.get("risk_free_rate", 0.01))
+    if data.get("initial_weights"):
+        options["initial_weights"] = {symbol: float(weight) for symbol, weight in data["initial_weights"].items()}
+    return options
+
+
+def rebalance_options(data):
+    """
+    Reads the /rebalance parameters shared by every account from a request body.
+
+    Args:
+        data (dict): Request JSON, possibly empty.
+
+    Returns:
+        dict: Keyword arguments for tax_aware_rebalance.
+
+    Raises:
+        ValueError: If a parameter is malformed.
+    """
+    options = {
+        "risk_aversion": float(data.get("risk_aversion", DEFAULT_RISK_AVERSION)),
+        "num_segments": int(data.get("segments", DEFAULT_SEGMENTS)),
+    }
+    if options["risk_aversion"] <= 0:
+        raise ValueError("risk_aversion must be positive")
+    if options["num_segments"] < 1:
+        raise ValueError("segments must be a positive integer")
+    for name in ("max_turnover", "gains_budget", "min_trade"):
+        if data.get(name) is not None:
+            options[name] = float(data[name])
+    if options.get("max_turnover", 0) < 0 or options.get("min_trade", 0) < 0:
+        raise ValueError("max_turnover and min_trade must not be negative")
+    if data.get("target_weights"):
+        options["target_weights"] = {str(symbol): float(weight) for symbol, weight in data["target_weights"].items()}
+    return options
+
+
+def monte_carlo_options(data, num_assets=None):
+    """
+    Reads the /monte-carlo parameters from a request body.
+
+    Args:
+        data (dict): Request JSON, possibly empty.
+        num_assets (int): Number of securities simulated, used to check the Sobol dimension limit
+            and MAX_SIMULATION_CELLS.
+
+    Returns:
+        dict: Keyword arguments for monte_carlo_simulation_multi, or for monte_carlo_risk_stream
+        when the body asks for "mode": "stream", or for monte_carlo_estimate for "mode": "estimate".
+
+    Raises:
+        ValueError: If a parameter is malformed or the simulation is too large.
+    """
+    options = simulation_options(data)
+    if data.get("mode") == "stream":
+        options.update(stream_options(data))
+    elif data.get("mode") == "estimate":
+        options.update(estimate_options(data))
+    if options["sampling"] == "sobol" and num_assets and options["time_horizon"] * num_assets > SOBOL_MAX_DIMENSIONS:
+        raise ValueError(f"sobol sampling supports at most {SOBOL_MAX_DIMENSIONS} days x securities")
+    paths = options.get("batch_size") or min(options.get("chunk_size", np.inf), options["num_simulations"])
+    if paths * options["time_horizon"] * (num_assets or 1) > MAX_SIMULATION_CELLS:
+        raise ValueError(f"A simulation may hold at most {MAX_SIMULATION_CELLS} paths x days x securities at once")
+    return options
+
+
+def run_optimization(portfolio, options):
+    """
+    Optimizes a portfolio and explains the result.
+
+    Args:
+        portfolio (list): List of securities in the portfolio.
+        options (dict): Parameters from optimize_options.
+
+    Returns:
+        dict: JSON response body.
+    """
+    # Perform portfolio optimization
+    optimal_weights, expected_portfolio_return, portfolio_risk, sharpe_ratio = optimize_portfolio(
+        portfolio, context=build_market_context(portfolio), **options)
+
+    # Create a user-friendly explanation
+    response_text = (
+        f"After analyzing your portfolio, the optimal allocation to maximize returns while minimizing risk is:"
+        f"{', '.join([f'{symbol}: {weight:.2%}' for symbol, weight in optimal_weights.items()])}."
+        f"The expected return of the optimized portfolio is {expected_portfolio_return:.2%}, "
+        f"with a risk (standard deviation) of {portfolio_risk:.2%}."
+        f"The Sharpe ratio, which indicates the risk-adjusted return, is {sharpe_ratio:.2f}."
+    )
+    return {
+        "message": response_text,
+        "weights": optimal_weights,
+        "expected_return": expected_portfolio_return,
+        "risk": portfolio_risk,
+        "sharpe_ratio": sharpe_ratio,
+    }
+
+
+def run_monte_carlo(portfolio, data, options, context, progress=None):
+    """
+    Runs a Monte Carlo simulation of a portfolio and summarizes it.
+
+    Args:
+        portfolio (list): List of securities in the portfolio.
+        data (dict): Request JSON, used to pick the simulation mode.
+        options (dict): Parameters from monte_carlo_options.
+        context (MarketDataContext): Market data for the portfolio.
+        progress (callable): Called with (paths completed, total paths) as the simulation advances.
+
+    Returns:
+        dict: JSON response body.
+    """
+    if data.get("mode") == "estimate":
+        result = monte_carlo_estimate(portfolio, context=context, progress=progress, **options)
+        if progress:
+            progress(result["num_simulations"], result["num_simulations"])  # Also when served from the cache
+        expected_return = result["statistics"].get("expected_return")
+        response_text = f"The Monte Carlo estimate used {result['num_simulations']} paths ({result['sampling']} sampling)."
+        if expected_return:
+            response_text += (f" The expected return over {result['time_horizon']} days is "
+                              f"{expected_return['estimate']:.2%} (standard error {expected_return['standard_error']:.3%}).")
+        if result["converged"] is False:
+            response_text += " The target standard error was not reached within max_simulations."
+        return {"message": response_text, **result}
+
+    if progress:
+        progress(0, options["num_simulations"])
+    if data.get("mode") == "stream":
+        result = monte_carlo_risk_stream(portfolio, context=context, progress=progress, **options)
+        if progress:
+            progress(options["num_simulations"], options["num_simulations"])  # Also when served from the cache
+        response_text = (
+            f"The Monte Carlo simulation of {result['num_simulations']} paths for your portfolio was successful. "
+            f"Over {result['time_horizon']} days, there is a {1 - result['confidence']:.0%} chance of losing "
+            f"more than {result['value_at_risk']:.2%} of the portfolio value (VaR), and the average loss in "
+            f"those cases is {result['conditional_value_at_risk']:.2%} (CVaR). "
+            f"The average maximum drawdown is {result['max_drawdown']['mean']:.2%}."
+        )
+        return {"message": response_text, **result}
+
+    # Perform Monte Carlo simulation for the entire portfolio
+    simulations = monte_carlo_simulation_multi(portfolio, context=context, **options)
+    if progress:
+        progress(options["num_simulations"], options["num_simulations"])
+
+    # Calculate summary statistics
+    portfolio_expected_returns = simulations.mean(axis=2).mean(axis=1)
+    portfolio_risk = np.std(simulations.mean(axis=2), axis=1)
+
+    # Generate a user-friendly summary
+    response_text = "The Monte Carlo simulation for your portfolio was successful."
+    response_text += "Here is a summary of the expected performance for your portfolio:"
+
+    symbols = context.symbols
+    for symbol, expected_return, risk in zip(symbols, portfolio_expected_returns, portfolio_risk):
+        expected_return = expected_return * 100  # Convert to percentage
+        risk = risk * 100  # Convert to percentage
+
+        response_text += (
+            f"For {symbol}:"
+            f"1. Expected annual return: {expected_return:.2f}%."
+            f"2. Expected risk (standard deviation): {risk:.2f}%."
+            f"This means that while you can expect an average return of {expected_return:.2f}% over the year, "
+            f"the value of {symbol} could fluctuate by approximately {risk:.2f}%."
+        )
+    return {
+        "message": response_text,
+        "symbols": symbols,
+        "num_simulations": options["num_simulations"],
+        "time_horizon": options["time_horizon"],
+        "expected_returns": portfolio_expected_returns.tolist(),
+        "risk": portfolio_risk.tolist(),
+    }
+
+
+def monte_carlo_arrays(portfolio, data, options, context, mimetype):
+    """
+    Answers /monte-carlo with arrays instead of JSON.
+
+    Without a mode the simulated daily growth factors are sent: a (securities x paths x days)
+    array for .npy, or one row per security and path for Arrow. In "stream" mode the per-day
+    percentile bands of the portfolio value are sent: a (percentiles x days) array for .npy, or a
+    table with the day, the mean, the standard deviation and one column per percentile for Arrow.
+    The order of the securities and percentiles is in the X-Symbols and X-Percentiles headers.
+
+    Args:
+        portfolio (list): List of securities in the portfolio.
+        data (dict): Request JSON, used to pick the simulation mode.
+        options (dict): Parameters from monte_carlo_options.
+        context (MarketDataContext): Market data for the portfolio.
+        mimetype (str): NPY_MIMETYPE or ARROW_MIMETYPE.
+
+    Returns:
+        Response: The streaming response.
+    """
+    if data.get("mode") == "stream":
+        result = monte_carlo_risk_stream(portfolio, context=context, **options)
+        levels = list(result["percentiles"])
+        headers = {"X-Symbols": ",".join(result["symbols"]), "X-Percentiles": ",".join(levels)}
+        if mimetype == NPY_MIMETYPE:
+            bands = np.array([result["percentiles"][level] for level in levels], dtype=np.float64)
+            return stream_response(npy_chunks(bands), mimetype, headers)
+        columns = {"day": np.arange(1, result["time_horizon"] + 1, dtype=np.int32),
+                   "mean": np.array(result["mean"]), "std": np.array(result["std"]),
+                   **{f"p{level}": np.array(band) for level, band in result["percentiles"].items()}}
+        return stream_response(arrow_chunks([arrow_batch(columns)]), mimetype, headers)
+
+    simulations = monte_carlo_simulation_multi(portfolio, context=context, **options)
+    headers = {"X-Symbols": ",".join(context.symbols)}
+    if mimetype == NPY_MIMETYPE:
+        return stream_response(npy_chunks(simulations), mimetype, headers)
+    return stream_response(arrow_chunks(arrow_path_batches(context.symbols, simulations)), mimetype, headers)
 
 
 @routes.route('/input-portfolio', methods=['POST'])
 def input_portfolio_route():
     """
-    Record the user's portfolio data and store it in the session.
+    Record the user's portfolio data in the server-side portfolio store and keep its id in the session.
 
     Expected JSON data:
     {
         "portfolio": [
-            {"symbol": "str", "purchase_price": float, "shares": int}
+            {"symbol": "str", "purchase_price": float, "shares": int, "purchase_date": "YYYY-MM-DD" (optional),
+             "lots": [{"acquired": "YYYY-MM-DD", "quantity": float, "basis": float, "lot_id": "str"}] (optional)}
         ],
         "income": float,
         "tax_bracket": float,
+        "long_term_rate": float (optional),
         "investment_gains": float,
         "investment_losses": float,
-        "cost_basis": float
+        "cost_basis": float,
+        "filing_status": "single" | "married_joint" | "married_separate" | "head_of_household" (optional),
+        "tax_year": int (optional),
+        "short_term_gains": float (optional),
+        "long_term_gains": float (optional),
+        "carryforward_short_term": float (optional),
+        "carryforward_long_term": float (optional)
     }
 
     Returns:
@@ -37,22 +451,31 @@ def input_portfolio_route():
     try:
         data = request.json
         portfolio = data.get('portfolio', [])
-        session['portfolio'] = portfolio  # Store portfolio in session
-        session['tax_data'] = {
+        tax_data = {
             "income": data.get("income"),
             "tax_bracket": data.get("tax_bracket"),
+            "long_term_rate": data.get("long_term_rate"),
             "investment_gains": data.get("investment_gains"),
             "investment_losses": data.get("investment_losses"),
-            "cost_basis": data.get("cost_basis")
-        }  # Store tax-related data in session
+            "cost_basis": data.get("cost_basis"),
+            "filing_status": data.get("filing_status"),
+            "tax_year": data.get("tax_year"),
+            "short_term_gains": data.get("short_term_gains"),
+            "long_term_gains": data.get("long_term_gains"),
+            "carryforward_short_term": data.get("carryforward_short_term"),
+            "carryforward_long_term": data.get("carryforward_long_term")
+        }
+        # Only the opaque portfolio id goes into the session; a repeated upload creates a new revision.
+        stored = get_portfolio_store().save(portfolio, tax_data, portfolio_id=session.get('portfolio_id'))
+        session['portfolio_id'] = stored.portfolio_id
 
-        print(f"Stored portfolio in session: {session.get('portfolio')}")  # Debugging
-        print(f"Stored tax data in session: {session.get('tax_data')}")  # Debugging
+        logger.info("Stored portfolio", extra={"portfolio_id": stored.portfolio_id, "version": stored.version,
+                                               "positions": len(portfolio)})
 
         response_text = f"Your portfolio and tax data have been recorded with {len(portfolio)} securities."
-        return jsonify({"message": response_text}), 200
+        return jsonify({"message": response_text, "portfolio_id": stored.portfolio_id, "version": stored.version}), 200
     except Exception as e:
-        print(f"Error storing data in session: {str(e)}")  # Debugging
+        logger.exception("Error storing portfolio")
         return jsonify({"error": "An internal error occurred", "details": str(e)}), 500
 
 
@@ -65,21 +488,132 @@ def calculate_taxes_route():
         JSON response with a message explaining the tax calculation.
     """
     try:
-        # Retrieve data from session
-        tax_data = session.get('tax_data')
+        # Retrieve data from the portfolio stored for this session
+        stored = session_portfolio()
+        tax_data = stored.tax_data if stored else None
         if not tax_data:
             return jsonify({"error": "Required financial data is missing from the session"}), 400
 
         # Package the data in a dictionary to pass to calculate_taxes function
-        result = calculate_taxes(tax_data)
+        try:
+            result = calculate_taxes(tax_data)
+        except ValueError as e:
+            return jsonify({"error": "Invalid tax data", "details": str(e)}), 400
         response_text = result['explanation']
-        return jsonify({"message": response_text}), 200
+        return json_response({"message": response_text,
+                              **{name: value for name, value in result.items() if name != 'explanation'}}), 200
     except Exception as e:
         return jsonify({"error": "An internal error occurred", "details": str(e)}), 500
 
 
 
 
+def grid_axis(data, name, default):
+    """
+    Reads one axis of the what-if grid: either a list of values or {"start", "stop", "num"}.
+
+    Raises:
+        ValueError: If the axis is malformed.
+    """
+    spec = data.get(name, default)
+    if isinstance(spec, dict):
+        num = int(spec.get("num", 50))
+        if num < 1:
+            raise ValueError(f"{name} must have at least one point")
+        return np.linspace(float(spec["start"]), float(spec["stop"]), num)
+    values = np.asarray(spec, dtype=np.float64).ravel()
+    if not len(values):
+        raise ValueError(f"{name} must have at least one point")
+    return values
+
+
+def what_if_arrays(incomes, gains, harvests, grid, mimetype):
+    """
+    Answers /tax-what-if with arrays instead of JSON.
+
+    For .npy the body is a sequence of .npy arrays, one after the other: the three axes, then each
+    surface, in the order given by the X-Arrays header; call numpy.load once per array on the same
+    file object. For Arrow there is one row per income and gain, with an 'income' and a 'gain'
+    column and one fixed-size list column per surface holding its values along the harvest axis.
+    The harvest amounts are in the schema metadata under 'harvests'.
+
+    Args:
+        incomes (np.ndarray): Income axis.
+        gains (np.ndarray): Gains axis.
+        harvests (np.ndarray): Ascending harvest axis.
+        grid (dict): Surfaces from what_if_grid.
+        mimetype (str): NPY_MIMETYPE or ARROW_MIMETYPE.
+
+    Returns:
+        Response: The streaming response.
+    """
+    if mimetype == NPY_MIMETYPE:
+        arrays = {"incomes": incomes, "gains": gains, "harvests": harvests, **grid}
+        chunks = (chunk for array in arrays.values() for chunk in npy_chunks(array))
+        return stream_response(chunks, mimetype, {"X-Arrays": ",".join(arrays)})
+
+    num_rows = len(incomes) * len(gains)
+    columns = {"income": np.repeat(incomes, len(gains)), "gain": np.tile(gains, len(incomes)),
+               **{name: surface.reshape(num_rows, -1) for name, surface in grid.items() if surface.shape[2]}}
+    batch = arrow_batch(columns, metadata={"harvests": json.dumps(harvests.tolist())})
+    return stream_response(arrow_chunks([batch]), mimetype)
+
+
+@routes.route('/tax-what-if', methods=['POST'])
+def tax_what_if_route():
+    """
+    Sweep a grid of incomes, realized gains and harvested losses through the progressive tax brackets.
+
+    Expected JSON data (each axis is a list or {"start": float, "stop": float, "num": int}):
+    {
+        "filing_status": "str",
+        "tax_year": int (optional),
+        "incomes": [float],
+        "gains": [float],
+        "harvests": [float],
+        "gain_term": "long_term" | "short_term" (optional),
+        "harvest_term": "short_term" | "long_term" (optional)
+    }
+
+    Returns:
+        JSON response with the axes and (incomes x gains x harvests) surfaces of total tax, marginal
+        rate and tax savings, plus the tax saved per dollar harvested between neighbouring harvest amounts.
+        Clients accepting application/x-npy or Arrow get the same arrays in binary (see
+        what_if_arrays), for grids of up to MAX_WHAT_IF_CELLS cells instead of MAX_WHAT_IF_JSON_CELLS.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        mimetype = negotiate_format()
+        try:
+            incomes = grid_axis(data, "incomes", [0])
+            gains = grid_axis(data, "gains", [0])
+            harvests = np.sort(grid_axis(data, "harvests", [0]))
+            cells = len(incomes) * len(gains) * len(harvests)
+            if cells > MAX_WHAT_IF_CELLS:
+                raise ValueError(f"The grid may have at most {MAX_WHAT_IF_CELLS} cells")
+            if mimetype == JSON_MIMETYPE and cells > MAX_WHAT_IF_JSON_CELLS:
+                raise ValueError(f"The grid may have at most {MAX_WHAT_IF_JSON_CELLS} cells as JSON; accept "
+                                 f"{NPY_MIMETYPE} for up to {MAX_WHAT_IF_CELLS} cells")
+            grid = what_if_grid(incomes, gains, harvests,
+                                filing_status=data.get("filing_status", "single"),
+                                year=int(data.get("tax_year") or DEFAULT_TAX_YEAR),
+                                gain_term=data.get("gain_term", "long_term"),
+                                harvest_term=data.get("harvest_term", "short_term"))
+        except (TypeError, ValueError, KeyError) as e:
+            return jsonify({"error": "Invalid what-if parameters", "details": str(e)}), 400
+
+        if mimetype != JSON_MIMETYPE:
+            return what_if_arrays(incomes, gains, harvests, grid, mimetype)
+        return json_response({
+            "incomes": incomes.tolist(),
+            "gains": gains.tolist(),
+            "harvests": harvests.tolist(),
+            **{name: surface.tolist() for name, surface in grid.items()}
+        }), 200
+    except Exception as e:
+        return jsonify({"error": "An internal error occurred", "details": str(e)}), 500
+
+
 @routes.route('/optimize-portfolio', methods=['POST'])
 def optimize_portfolio_route():
     """
@@ -87,28 +621,87 @@ def optimize_portfolio_route():
 
     Uses the portfolio data stored in the session.
 
+    Optional JSON data:
+    {
+        "risk_free_rate": float,
+        "bounds": {"symbol": [min, max]},
+        "groups": [{"symbols": ["str"], "min": float, "max": float}],
+        "initial_weights": {"symbol": float}
+    }
+
     Returns:
         JSON response with the optimized portfolio allocation and performance metrics.
     """
     try:
-        portfolio = session.get('portfolio')  # Retrieve portfolio from session
-        print(f"Retrieved portfolio: {portfolio}")  # Debugging
+        stored = session_portfolio()
+        portfolio = stored.positions if stored else None
+        logger.debug("Retrieved portfolio", extra={"portfolio_id": stored.portfolio_id if stored else None})
         if not portfolio:
             return jsonify({"error": "No portfolio data provided"}), 400
 
-        # Perform portfolio optimization
-        optimal_weights, expected_portfolio_return, portfolio_risk, sharpe_ratio = optimize_portfolio(portfolio)
+        data = request.get_json(silent=True) or {}
+        try:
+            options = optimize_options(data)
+        except (TypeError, ValueError, KeyError) as e:
+            return jsonify({"error": "Invalid optimization parameters", "details": str(e)}), 400
+
+        try:
+            body = run_optimization(portfolio, options)
+        except ValueError as e:
+            return jsonify({"error": "Invalid optimization parameters", "details": str(e)}), 400
+        return json_response(body), 200
+    except Exception as e:
+        return jsonify({"error": "An internal error occurred", "details": str(e)}), 500
 
-        # Create a user-friendly explanation
-        response_text = (
-            f"After analyzing your portfolio, the optimal allocation to maximize returns while minimizing risk is:"
-            f"{', '.join([f'{symbol}: {weight:.2%}' for symbol, weight in optimal_weights.items()])}."
-            f"The expected return of the optimized portfolio is {expected_portfolio_return:.2%}, "
-            f"with a risk (standard deviation) of {portfolio_risk:.2%}."
-            f"The Sharpe ratio, which indicates the risk-adjusted return, is {sharpe_ratio:.2f}."
-        )
 
-        return jsonify({"message": response_text}), 200
+@routes.route('/efficient-frontier', methods=['POST'])
+def efficient_frontier_route():
+    """
+    Compute the efficient frontier of the user's portfolio: the lowest-risk allocation for each of a
+    range of target annual returns.
+
+    Uses the portfolio data stored in the session.
+
+    Optional JSON data:
+    {
+        "num_points": int,
+        "target_returns": [float],
+        "bounds": {"symbol": [min, max]},
+        "groups": [{"symbols": ["str"], "min": float, "max": float}]
+    }
+
+    Returns:
+        JSON response with one allocation per target return.
+    """
+    try:
+        stored = session_portfolio()
+        portfolio = stored.positions if stored else None
+        if not portfolio:
+            return jsonify({"error": "No portfolio data provided"}), 400
+
+        data = request.get_json(silent=True) or {}
+        try:
+            options = optimizer_options(data)
+            options["num_points"] = int(data.get("num_points", 20))
+            if options["num_points"] < 2:
+                raise ValueError("num_points must be at least 2")
+            if data.get("target_returns"):
+                options["target_returns"] = [float(target) for target in data["target_returns"]]
+        except (TypeError, ValueError, KeyError) as e:
+            return jsonify({"error": "Invalid optimization parameters", "details": str(e)}), 400
+
+        try:
+            frontier = calculate_efficient_frontier(portfolio, context=build_market_context(portfolio), **options)
+        except ValueError as e:
+            return jsonify({"error": "Invalid optimization parameters", "details": str(e)}), 400
+        reachable = [point for point in frontier if point["feasible"]]
+        response_text = f"The efficient frontier of your portfolio was computed at {len(reachable)} target returns."
+        if reachable:
+            response_text += (
+                f" Expected returns range from {reachable[0]['target_return']:.2%} with a risk of {reachable[0]['risk']:.2%} "
+                f"to {reachable[-1]['target_return']:.2%} with a risk of {reachable[-1]['risk']:.2%}."
+            )
+        return json_response({"message": response_text, "frontier": frontier}), 200
     except Exception as e:
         return jsonify({"error": "An internal error occurred", "details": str(e)}), 500
 
@@ -119,37 +712,57 @@ def monte_carlo_route():
 
     Uses the portfolio data stored in the session.
 
-    Returns:
-        JSON response with the results of the Monte Carlo simulation.
-    """
-    try:
-        portfolio = session.get("portfolio", [])  # Retrieve from session
+    Optional JSON data:
+    {
+        "num_simulations": int,
+        "time_horizon": int,
+        "dtype": "float32" | "float64",
+        "workers": int,
+        "seed": int,
+        "sampling": "pseudo" | "antithetic" | "sobol",
+        "mode": "stream" | "estimate",
+        "chunk_size": int,
+        "percentiles": [float],
+        "confidence": float,
+        "control_variates": bool,
+        "target_standard_error": float,
+        "max_simulations": int,
+        "batch_size": int,
+        "statistics": ["expected_return" | "probability_of_loss" | "value_at_risk"],
+        "align": "intersect" | "ffill" | "drop"
+    }
 
-        # Perform Monte Carlo simulation for the entire portfolio
-        simulations = monte_carlo_simulation_multi(portfolio)
+    With "mode": "stream" the paths are simulated in chunks and only risk statistics are kept, and
+    the response includes per-day percentile bands, VaR, CVaR and maximum drawdown.
 
-        # Calculate summary statistics
-        portfolio_expected_returns = simulations.mean(axis=2).mean(axis=1)
-        portfolio_risk = np.std(simulations.mean(axis=2), axis=1)
+    With "mode": "estimate" the response has each requested statistic of the portfolio return with
+    its standard error, and the number of paths used. Given "target_standard_error", batches of
+    paths are added until every statistic is that precise (or "max_simulations" is reached);
+    "converged" tells which.
 
-        # Generate a user-friendly summary
-        response_text = "The Monte Carlo simulation for your portfolio was successful."
-        response_text += "Here is a summary of the expected performance for your portfolio:"
+    The response format follows the Accept header. Besides JSON, the simulated paths (or, in
+    "stream" mode, the percentile bands) can be requested as "application/x-npy" or, with pyarrow
+    installed, as an Arrow IPC stream ("application/vnd.apache.arrow.stream"); see
+    monte_carlo_arrays. Responses are gzip or zstd compressed if Accept-Encoding allows it.
 
-        for i, security in enumerate(portfolio):
-            symbol = security.get('symbol')
-            expected_return = portfolio_expected_returns[i] * 100  # Convert to percentage
-            risk = portfolio_risk[i] * 100  # Convert to percentage
+    Returns:
+        JSON response with the results of the Monte Carlo simulation, or a binary stream of arrays.
+    """
+    try:
+        stored = session_portfolio()
+        portfolio = stored.positions if stored else []
 
-            response_text += (
-                f"For {symbol}:"
-                f"1. Expected annual return: {expected_return:.2f}%."
-                f"2. Expected risk (standard deviation): {risk:.2f}%."
-                f"This means that while you can expect an average return of {expected_return:.2f}% over the year, "
-                f"the value of {symbol} could fluctuate by approximately {risk:.2f}%."
-            )
+        data = request.get_json(silent=True) or {}
+        try:
+            context = build_market_context(portfolio, align=data.get("align", "intersect"))
+            options = monte_carlo_options(data, len(context.requested_symbols))
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": "Invalid simulation parameters", "details": str(e)}), 400
 
-        return jsonify({"message": response_text}), 200
+        mimetype = negotiate_format(binary=data.get("mode") != "estimate")
+        if mimetype != JSON_MIMETYPE:
+            return monte_carlo_arrays(portfolio, data, options, context, mimetype)
+        return json_response(run_monte_carlo(portfolio, data, options, context)), 200
     except Exception as e:
         return jsonify({"error": "An internal error occurred", "details": str(e)}), 500
 
@@ -160,20 +773,53 @@ def tax_loss_harvesting_route():
 
     Uses the portfolio data stored in the session.
 
+    Optional JSON data:
+    {
+        "replacements": int,
+        "replacement_universe": [str]
+    }
+
+    Every recommended sale lists up to "replacements" (default 5) substitute securities from the
+    configured (or given) universe, closest first, with their expected tracking error. A given
+    universe reaching outside the configured one is limited to REPLACEMENT_MAX_REQUEST_UNIVERSE symbols.
+
     Returns:
         JSON response with a summary of the tax loss harvesting results.
     """
     try:
-        portfolio = session.get('portfolio')  # Retrieve portfolio from session
-        tax_data = session.get('tax_data')  # Retrieve tax data from session
+        stored = session_portfolio()
+        portfolio = stored.positions if stored else None
+        tax_data = stored.tax_data if stored else None
 
         if not portfolio or not tax_data:
             return jsonify({"error": "Required portfolio or tax data is missing from the session"}), 400
 
+        data = request.get_json(silent=True) or {}
+        try:
+            replacements = int(data.get("replacements", DEFAULT_TOP_K))
+            if replacements < 0:
+                raise ValueError("replacements must not be negative")
+            universe = data.get("replacement_universe")
+            if universe is not None:
+                if not isinstance(universe, list):
+                    raise ValueError("replacement_universe must be a list of symbols")
+                universe = [symbol.upper() if isinstance(symbol, str) else symbol for symbol in universe]
+                invalid = [symbol for symbol in universe if not valid_symbol(symbol)]
+                if invalid:
+                    raise ValueError(f"Invalid symbols in replacement_universe: {invalid[:5]}")
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": "Invalid harvesting parameters", "details": str(e)}), 400
+
         tax_bracket = tax_data.get('tax_bracket', 0.2)
 
         # Use the enhanced tax loss harvesting logic
-        recommended_sales, total_losses, tax_savings = enhanced_tax_loss_harvesting(portfolio, tax_bracket)
+        try:
+            recommended_sales, total_losses, tax_savings = enhanced_tax_loss_harvesting(
+                portfolio, tax_bracket, context=build_market_context(portfolio),
+                long_term_rate=tax_data.get('long_term_rate'), replacements=replacements,
+                replacement_universe=universe)
+        except ValueError as e:
+            return jsonify({"error": "Invalid harvesting parameters", "details": str(e)}), 400
 
         if recommended_sales:
             response_text = (
@@ -182,12 +828,306 @@ def tax_loss_harvesting_route():
         else:
             response_text = "Tax Loss Harvesting Summary: No securities meet the criteria for tax loss harvesting."
 
-        return jsonify({"message": response_text}), 200
+        return json_response({"message": response_text, "recommended_sales": recommended_sales,
+                              "total_losses": total_losses, "tax_savings": tax_savings}), 200
+    except Exception as e:
+        return jsonify({"error": "An internal error occurred", "details": str(e)}), 500
+
+@routes.route('/rebalance', methods=['POST'])
+def rebalance_route():
+    """
+    Find the trades that move the user's portfolio toward target weights at the lowest tax cost.
+
+    Uses the portfolio data (with its tax lots) and tax rates stored in the session.
+
+    Optional JSON data:
+    {
+        "target_weights": {"symbol": float} (defaults to the optimized portfolio),
+        "risk_aversion": float,
+        "max_turnover": float (fraction of the portfolio sold),
+        "gains_budget": float (dollars of net realized gains),
+        "min_trade": float (dollars),
+        "segments": int
+    }
+
+    Returns:
+        JSON response with the trades, the lots they relieve, the tracking error before and after
+        and the estimated tax.
+    """
+    try:
+        stored = session_portfolio()
+        portfolio = stored.positions if stored else None
+        if not portfolio:
+            return jsonify({"error": "No portfolio data provided"}), 400
+        tax_data = (stored.tax_data if stored else None) or {}
+
+        data = request.get_json(silent=True) or {}
+        try:
+            options = rebalance_options(data)
+        except (TypeError, ValueError, AttributeError) as e:
+            return jsonify({"error": "Invalid rebalancing parameters", "details": str(e)}), 400
+
+        account = {"portfolio": portfolio, "tax_bracket": tax_data.get('tax_bracket'),
+                   "long_term_rate": tax_data.get('long_term_rate')}
+        result, = tax_aware_rebalance([account], **options)
+        if "error" in result:
+            return jsonify({"error": "Invalid rebalancing parameters", "details": result["error"]}), 400
+        return json_response(result), 200
+    except Exception as e:
+        return jsonify({"error": "An internal error occurred", "details": str(e)}), 500
+
+
+@routes.route('/rebalance/batch', methods=['POST'])
+def rebalance_batch_route():
+    """
+    Rebalance many accounts in one call against a shared covariance matrix.
+
+    Expected JSON data:
+    {
+        "accounts": [{"id": str, "portfolio": [...], "tax_bracket": float, "long_term_rate": float,
+                      "target_weights": {...}, "max_turnover": float, "gains_budget": float,
+                      "min_trade": float}],
+        "target_weights", "risk_aversion", "max_turnover", "gains_budget", "min_trade", "segments":
+            as for /rebalance, applied to every account that does not set its own
+    }
+
+    Returns:
+        JSON response with one result per account, in order (with an "error" for accounts that
+        could not be rebalanced), and a summary.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        accounts = data.get("accounts")
+        if not isinstance(accounts, list) or not accounts or not all(isinstance(a, dict) for a in accounts):
+            return jsonify({"error": "No accounts provided"}), 400
+        try:
+            options = rebalance_options(data)
+        except (TypeError, ValueError, AttributeError) as e:
+            return jsonify({"error": "Invalid rebalancing parameters", "details": str(e)}), 400
+
+        started = time.time()
+        results = tax_aware_rebalance(accounts, **options)
+        failed = sum(1 for result in results if "error" in result)
+        summary = {"accounts": len(results), "succeeded": len(results) - failed, "failed": failed,
+                   "unsolved": sum(1 for result in results if result.get("solved") is False),
+                   "seconds": time.time() - started}
+        return json_response({"accounts": results, "summary": summary}), 200
+    except Exception as e:
+        return jsonify({"error": "An internal error occurred", "details": str(e)}), 500
+
+
+@routes.route('/batch', methods=['POST'])
+def batch_route():
+    """
+    Run tax loss harvesting and/or portfolio optimization for many portfolios in one call.
+
+    Expected JSON data:
+    {
+        "portfolios": [
+            {"id": "str", "portfolio": [...], "tax_bracket": float, "long_term_rate": float}
+        ],
+        "operations": ["tax-loss-harvesting", "optimize-portfolio"] (optional, defaults to both),
+        "workers": int (optional),
+        "risk_free_rate", "bounds", "groups": as for /optimize-portfolio (optional)
+    }
+
+    Returns:
+        Newline-delimited JSON: one line per portfolio as soon as it finishes (with an "error" for
+        portfolios that failed), followed by a summary line.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        items = data.get("portfolios")
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "No portfolios provided"}), 400
+        if len(items) > MAX_BATCH_PORTFOLIOS:
+            return jsonify({"error": "Invalid batch parameters",
+                            "details": f"A batch may have at most {MAX_BATCH_PORTFOLIOS} portfolios"}), 400
+        try:
+            operations = tuple(data.get("operations") or BATCH_OPERATIONS)
+            unknown = [operation for operation in operations if operation not in BATCH_OPERATIONS]
+            if unknown:
+                raise ValueError(f"Unknown operations {', '.join(map(str, unknown))}, expected {', '.join(BATCH_OPERATIONS)}")
+            options = optimize_options(data)
+            # run_batch caps this at the server's BATCH_WORKERS (or CPU count)
+            workers = int(data.get("workers") or 0) or None
+            if workers is not None and workers < 1:
+                raise ValueError("workers must be a positive integer")
+        except (TypeError, ValueError, KeyError) as e:
+            return jsonify({"error": "Invalid batch parameters", "details": str(e)}), 400
+
+        def generate():
+            started = time.time()
+            succeeded = failed = 0
+            try:
+                for result in run_batch(items, operations, options, workers):
+                    if "error" in result:
+                        failed += 1
+                    else:
+                        succeeded += 1
+                    yield json.dumps(result) + "\n"
+            except Exception as e:
+                yield json.dumps({"error": "An internal error occurred", "details": str(e)}) + "\n"
+            yield json.dumps({"summary": {"items": len(items), "succeeded": succeeded, "failed": failed,
+                                          "seconds": time.time() - started}}) + "\n"
+
+        return Response(generate(), mimetype='application/x-ndjson')
     except Exception as e:
         return jsonify({"error": "An internal error occurred", "details": str(e)}), 500
 
+
+@routes.route('/jobs/optimize-portfolio', methods=['POST'])
+def submit_optimize_job_route():
+    """
+    Queue a portfolio optimization and return its job id immediately.
+
+    Accepts the same JSON data as /optimize-portfolio, plus an optional "priority" (higher runs first).
+
+    Returns:
+        JSON response with the job id and status, with status 202.
+    """
+    try:
+        stored = session_portfolio()
+        if not stored or not stored.positions:
+            return jsonify({"error": "No portfolio data provided"}), 400
+
+        data = request.get_json(silent=True) or {}
+        try:
+            options = optimize_options(data)
+            priority = int(data.get("priority", 0))
+        except (TypeError, ValueError, KeyError) as e:
+            return jsonify({"error": "Invalid optimization parameters", "details": str(e)}), 400
+
+        portfolio = stored.positions
+        return submit_job('optimize-portfolio', lambda progress: run_optimization(portfolio, options), priority, stored)
+    except Exception as e:
+        return jsonify({"error": "An internal error occurred", "details": str(e)}), 500
+
+
+@routes.route('/jobs/monte-carlo', methods=['POST'])
+def submit_monte_carlo_job_route():
+    """
+    Queue a Monte Carlo simulation and return its job id immediately.
+
+    Accepts the same JSON data as /monte-carlo, plus an optional "priority" (higher runs first). In
+    "stream" and "estimate" modes the job reports the number of paths completed while it runs.
+
+    Returns:
+        JSON response with the job id and status, with status 202.
+    """
+    try:
+        stored = session_portfolio()
+        portfolio = stored.positions if stored else []
+
+        data = request.get_json(silent=True) or {}
+        try:
+            context = build_market_context(portfolio, align=data.get("align", "intersect"))
+            options = monte_carlo_options(data, len(context.requested_symbols))
+            priority = int(data.get("priority", 0))
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": "Invalid simulation parameters", "details": str(e)}), 400
+
+        return submit_job('monte-carlo', lambda progress: run_monte_carlo(portfolio, data, options, context, progress),
+                          priority, stored)
+    except Exception as e:
+        return jsonify({"error": "An internal error occurred", "details": str(e)}), 500
+
+
+def submit_job(kind, function, priority, stored):
+    """Queues a job for the session's portfolio revision and builds the 202 response."""
+    metadata = {"portfolio_id": stored.portfolio_id, "portfolio_version": stored.version} if stored else {}
+    try:
+        job = get_job_queue().submit(kind, function, priority=priority, metadata=metadata)
+    except QueueFullError as e:
+        return jsonify({"error": "Too many queued jobs, please retry later", "details": str(e)}), 503
+    return jsonify({"message": f"Your {kind} job has been queued.", **job.to_dict()}), 202
+
+
+@routes.route('/jobs/stats', methods=['GET'])
+def job_stats_route():
+    """
+    Report the job queue depth, number of running jobs and queue wait and run time summaries.
+
+    Returns:
+        JSON response with the job queue statistics.
+    """
+    return jsonify(get_job_queue().stats), 200
+
+
+@routes.route('/jobs/<job_id>', methods=['GET'])
+def job_status_route(job_id):
+    """
+    Report the status and progress of a job.
+
+    Returns:
+        JSON response with the job's state, or 404 if the job is unknown.
+    """
+    state, _ = get_job_queue().get(job_id)
+    if state is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(state), 200
+
+
+@routes.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result_route(job_id):
+    """
+    Return the result of a finished job.
+
+    Returns:
+        JSON response with the job's result (200), its state while it is still queued or running
+        (202), its state if it failed or was cancelled (409), or 404 if the job is unknown.
+    """
+    state, result = get_job_queue().get(job_id)
+    if state is None:
+        return jsonify({"error": "Job not found"}), 404
+    if state["status"] == SUCCEEDED:
+        return jsonify(result), 200
+    if state["status"] in FINISHED_STATES:
+        return jsonify({"error": f"The job {state['status']}", **state}), 409
+    return jsonify(state), 202
+
+
+@routes.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job_route(job_id):
+    """
+    Cancel a job. Queued jobs never start; running jobs stop at their next progress report.
+
+    Returns:
+        JSON response with the job's state: 200 once it has finished (cancelled or otherwise), 202
+        while the cancellation is pending, e.g. for a job run by another worker process, or 404 if
+        the job is unknown.
+    """
+    state = get_job_queue().cancel(job_id)
+    if state is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(state), 200 if state["status"] in FINISHED_STATES else 202
+
+
+@routes.route('/cache-stats', methods=['GET'])
+def cache_stats_route():
+    """
+    Report the hit, miss and eviction counters of the optimization and simulation result cache.
+
+    Returns:
+        JSON response with the cache counters and the number of cached results.
+    """
+    cache = get_result_cache()
+    return jsonify({**cache.stats, "entries": len(cache)}), 200
+
+@routes.route('/metrics', methods=['GET'])
+def metrics_route():
+    """
+    Export stage timings, request durations and cache, upstream API and job counters for Prometheus.
+
+    Returns:
+        Response in the Prometheus text exposition format.
+    """
+    return Response(instrumentation.REGISTRY.render(), content_type=instrumentation.METRICS_CONTENT_TYPE)
+
 @routes.route('/clear-session', methods=['POST'])
 def clear_session():
+    if session.get('portfolio_id'):
+        get_portfolio_store().delete(session['portfolio_id'])
     session.clear()
     return jsonify({"message": "Session cleared"}), 200
 
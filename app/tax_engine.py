@@ -0,0 +1,233 @@
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+FILING_STATUSES = ('single', 'married_joint', 'married_separate', 'head_of_household')
+DEFAULT_TAX_YEAR = 2024
+
+# Federal brackets: lower threshold of each bracket, per filing status, and the bracket rates.
+ORDINARY_RATES = (0.10, 0.12, 0.22, 0.24, 0.32, 0.35, 0.37)
+LONG_TERM_RATES = (0.0, 0.15, 0.20)
+TAX_YEARS = {
+    2023: {
+        "ordinary": {
+            "single": (0, 11000, 44725, 95375, 182100, 231250, 578125),
+            "married_joint": (0, 22000, 89450, 190750, 364200, 462500, 693750),
+            "married_separate": (0, 11000, 44725, 95375, 182100, 231250, 346875),
+            "head_of_household": (0, 15700, 59850, 95350, 182100, 231250, 578100),
+        },
+        "long_term": {
+            "single": (0, 44625, 492300),
+            "married_joint": (0, 89250, 553850),
+            "married_separate": (0, 44625, 276900),
+            "head_of_household": (0, 59750, 523050),
+        },
+        "standard_deduction": {"single": 13850, "married_joint": 27700, "married_separate": 13850,
+                               "head_of_household": 20800},
+    },
+    2024: {
+        "ordinary": {
+            "single": (0, 11600, 47150, 100525, 191950, 243725, 609350),
+            "married_joint": (0, 23200, 94300, 201050, 383900, 487450, 731200),
+            "married_separate": (0, 11600, 47150, 100525, 191950, 243725, 365600),
+            "head_of_household": (0, 16550, 63100, 100500, 191950, 243700, 609350),
+        },
+        "long_term": {
+            "single": (0, 47025, 518900),
+            "married_joint": (0, 94050, 583750),
+            "married_separate": (0, 47025, 291850),
+            "head_of_household": (0, 63000, 551350),
+        },
+        "standard_deduction": {"single": 14600, "married_joint": 29200, "married_separate": 14600,
+                               "head_of_household": 21900},
+    },
+}
+# Net capital losses deductible against ordinary income each year; the rest carries forward.
+CAPITAL_LOSS_LIMIT = {"single": 3000, "married_joint": 3000, "married_separate": 1500, "head_of_household": 3000}
+
+TaxTables = namedtuple('TaxTables', ['ordinary', 'long_term', 'standard_deduction', 'loss_limit'])
+
+
+class BracketTable:
+    """
+    Progressive rate schedule with the tax owed at each bracket threshold precomputed.
+
+    The tax on any amount is then one ``np.searchsorted`` into the thresholds plus one multiply-add,
+    for a scalar or an array of any shape.
+    """
+
+    def __init__(self, thresholds, rates):
+        """
+        Args:
+            thresholds (tuple): Lower threshold of each bracket, starting at 0.
+            rates (tuple): Rate of each bracket.
+        """
+        self.thresholds = np.asarray(thresholds, dtype=np.float64)
+        self.rates = np.asarray(rates, dtype=np.float64)
+        self.cumulative = np.concatenate([[0.0], np.cumsum(np.diff(self.thresholds) * self.rates[:-1])])
+
+    def _bracket(self, amount):
+        return np.maximum(np.searchsorted(self.thresholds, amount, side='right') - 1, 0)
+
+    def evaluate(self, amount):
+        """
+        Returns:
+            tuple: Tax owed on ``amount`` (negative amounts owe nothing) and the marginal rate of the
+            bracket it falls in.
+        """
+        amount = np.maximum(np.asarray(amount, dtype=np.float64), 0.0)
+        bracket = self._bracket(amount)
+        rate = self.rates[bracket]
+        return self.cumulative[bracket] + rate * (amount - self.thresholds[bracket]), rate
+
+    def tax(self, amount):
+        """Tax owed on ``amount`` (negative amounts owe nothing)."""
+        return self.evaluate(amount)[0]
+
+    def rate(self, amount):
+        """Marginal rate of the bracket ``amount`` falls in."""
+        return self.evaluate(amount)[1]
+
+
+@lru_cache(maxsize=None)
+def tax_tables(year=DEFAULT_TAX_YEAR, filing_status='single'):
+    """
+    Returns the bracket tables for a tax year and filing status.
+
+    Raises:
+        ValueError: If the year or filing status is not supported.
+    """
+    if year not in TAX_YEARS:
+        raise ValueError(f"Unsupported tax year {year}, expected one of {', '.join(map(str, TAX_YEARS))}")
+    if filing_status not in FILING_STATUSES:
+        raise ValueError(f"Unknown filing status '{filing_status}', expected one of {', '.join(FILING_STATUSES)}")
+    table = TAX_YEARS[year]
+    return TaxTables(
+        ordinary=BracketTable(table["ordinary"][filing_status], ORDINARY_RATES),
+        long_term=BracketTable(table["long_term"][filing_status], LONG_TERM_RATES),
+        standard_deduction=float(table["standard_deduction"][filing_status]),
+        loss_limit=float(CAPITAL_LOSS_LIMIT[filing_status]),
+    )
+
+
+def compute_tax_liability(income, short_term_gains=0.0, long_term_gains=0.0, harvested_short_term=0.0,
+                          harvested_long_term=0.0, carryforward_short_term=0.0, carryforward_long_term=0.0,
+                          filing_status='single', year=DEFAULT_TAX_YEAR, deduction=None):
+    """
+    Computes federal income tax for any number of scenarios at once.
+
+    Every amount may be a scalar or an array; they are broadcast together. Short-term and long-term
+    results are netted against each other, up to the annual limit of a net capital loss is deducted
+    from ordinary income (short-term losses first) and the rest carries forward with its character.
+    Net long-term gains are taxed at the capital gains rates, stacked on top of ordinary income.
+
+    Args:
+        income (array-like): Ordinary income before deductions.
+        short_term_gains (array-like): Net realized short-term gains (negative for losses).
+        long_term_gains (array-like): Net realized long-term gains (negative for losses).
+        harvested_short_term (array-like): Additional short-term losses harvested (positive amounts).
+        harvested_long_term (array-like): Additional long-term losses harvested (positive amounts).
+        carryforward_short_term (array-like): Short-term losses carried in from prior years.
+        carryforward_long_term (array-like): Long-term losses carried in from prior years.
+        filing_status (str): One of FILING_STATUSES.
+        year (int): Tax year, one of TAX_YEARS.
+        deduction (array-like): Deduction from income. Defaults to the standard deduction.
+
+    Returns:
+        dict: Arrays of the broadcast shape: 'taxable_income', 'ordinary_tax', 'capital_gains_tax',
+        'total_tax', 'marginal_rate' (tax on one more dollar of income), 'loss_deduction',
+        'carryforward_short_term' and 'carryforward_long_term'.
+    """
+    tables = tax_tables(year, filing_status)
+    deduction = tables.standard_deduction if deduction is None else deduction
+    income, short_term, long_term = np.broadcast_arrays(
+        np.asarray(income, dtype=np.float64),
+        np.asarray(short_term_gains, dtype=np.float64) - harvested_short_term - carryforward_short_term,
+        np.asarray(long_term_gains, dtype=np.float64) - harvested_long_term - carryforward_long_term,
+    )
+
+    # Net the two holding periods against each other
+    net = short_term + long_term
+    taxable_short_term = np.where(short_term > 0, np.where(long_term < 0, np.maximum(net, 0), short_term), 0.0)
+    taxable_long_term = np.where(long_term > 0, np.where(short_term < 0, np.maximum(net, 0), long_term), 0.0)
+    short_term_loss = np.maximum(np.maximum(-short_term, 0) - np.maximum(long_term, 0), 0)
+    long_term_loss = np.maximum(np.maximum(-long_term, 0) - np.maximum(short_term, 0), 0)
+    used_short_term = np.minimum(short_term_loss, tables.loss_limit)
+    used_long_term = np.minimum(long_term_loss, tables.loss_limit - used_short_term)
+    loss_deduction = used_short_term + used_long_term
+
+    taxable_income = np.maximum(income + taxable_short_term + taxable_long_term - deduction - loss_deduction, 0)
+    long_term_portion = np.minimum(taxable_long_term, taxable_income)
+    ordinary_portion = taxable_income - long_term_portion
+
+    ordinary_tax, ordinary_rate = tables.ordinary.evaluate(ordinary_portion)
+    stacked_tax, stacked_rate = tables.long_term.evaluate(taxable_income)
+    base_tax, base_rate = tables.long_term.evaluate(ordinary_portion)
+    capital_gains_tax = stacked_tax - base_tax
+    # One more dollar of income is taxed at the ordinary rate and pushes the stacked gains up a
+    # dollar; while the deduction still absorbs part of the gains it only uncovers one more dollar of gains.
+    marginal_rate = np.where(long_term_portion < taxable_long_term, stacked_rate,
+                             ordinary_rate + stacked_rate - base_rate)
+    marginal_rate = np.where(taxable_income > 0, marginal_rate, 0.0)
+
+    return {
+        "taxable_income": taxable_income,
+        "ordinary_tax": ordinary_tax,
+        "capital_gains_tax": capital_gains_tax,
+        "total_tax": ordinary_tax + capital_gains_tax,
+        "marginal_rate": marginal_rate,
+        "loss_deduction": loss_deduction,
+        "carryforward_short_term": short_term_loss - used_short_term,
+        "carryforward_long_term": long_term_loss - used_long_term,
+    }
+
+
+def what_if_grid(incomes, gains, harvests, filing_status='single', year=DEFAULT_TAX_YEAR, gain_term='long_term',
+                 harvest_term='short_term', deduction=None):
+    """
+    Evaluates taxes over every combination of income, realized gains and harvested losses.
+
+    Args:
+        incomes (array-like): Ordinary incomes (first grid axis).
+        gains (array-like): Realized gains (second grid axis).
+        harvests (array-like): Harvested losses, ascending (third grid axis).
+        filing_status (str): One of FILING_STATUSES.
+        year (int): Tax year.
+        gain_term (str): Holding period of the gains, 'short_term' or 'long_term'.
+        harvest_term (str): Holding period of the harvested losses, 'short_term' or 'long_term'.
+        deduction (float): Deduction from income. Defaults to the standard deduction.
+
+    Returns:
+        dict: (incomes x gains x harvests) arrays 'total_tax', 'marginal_rate' and 'tax_savings'
+        (against harvesting nothing), and (incomes x gains x harvests - 1) 'harvest_savings_rate':
+        tax saved per dollar harvested between neighbouring harvest amounts.
+
+    Raises:
+        ValueError: If a holding period is not 'short_term' or 'long_term'.
+    """
+    for term in (gain_term, harvest_term):
+        if term not in ('short_term', 'long_term'):
+            raise ValueError(f"Holding period must be 'short_term' or 'long_term', got '{term}'")
+    incomes = np.asarray(incomes, dtype=np.float64)[:, None, None]
+    gains = np.asarray(gains, dtype=np.float64)[None, :, None]
+    harvests = np.asarray(harvests, dtype=np.float64)
+    result = compute_tax_liability(
+        incomes,
+        filing_status=filing_status,
+        year=year,
+        deduction=deduction,
+        **{f"{gain_term}_gains": gains, f"harvested_{harvest_term}": harvests[None, None, :]},
+    )
+    no_harvest = compute_tax_liability(
+        incomes, filing_status=filing_status, year=year, deduction=deduction, **{f"{gain_term}_gains": gains})
+    total_tax = result["total_tax"]
+    steps = np.diff(harvests)
+    harvest_savings_rate = np.divide(-np.diff(total_tax, axis=2), steps, out=np.zeros(total_tax.shape[:2] + steps.shape),
+                                     where=steps != 0)
+    return {
+        "total_tax": total_tax,
+        "marginal_rate": result["marginal_rate"],
+        "tax_savings": no_harvest["total_tax"] - total_tax,
+        "harvest_savings_rate": harvest_savings_rate,
+    }
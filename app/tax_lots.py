@@ -0,0 +1,246 @@
+import numpy as np
+
+LONG_TERM_DAYS = 365
+WASH_SALE_DAYS = 30
+RELIEF_METHODS = ('fifo', 'hifo', 'specific')
+
+
+def to_days(dates):
+    """Converts 'YYYY-MM-DD' strings (or datetime64 values) to int64 days since the Unix epoch."""
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+
+
+class LotLedger:
+    """
+    Columnar ledger of tax lots, sorted by symbol and then by acquisition date.
+
+    Every lot is one row of parallel NumPy arrays (symbol code, acquisition day, quantity, per-share
+    basis, lot id). Because the rows are sorted by ``(symbol, acquired)``, each symbol owns one
+    contiguous slice, and lots acquired in a date window can be found with a binary search instead of
+    a scan.
+    """
+
+    def __init__(self, symbols, acquired, quantity, basis, lot_ids=None):
+        """
+        Args:
+            symbols (array-like): Symbol of each lot.
+            acquired (array-like): Acquisition day of each lot (int64 days or 'YYYY-MM-DD').
+            quantity (array-like): Number of shares in each lot.
+            basis (array-like): Cost basis per share of each lot.
+            lot_ids (array-like): Identifier of each lot. Defaults to the input position.
+        """
+        symbols = np.asarray(symbols)
+        acquired = np.asarray(acquired)
+        if acquired.dtype.kind in 'UOSM':
+            acquired = to_days(acquired)
+        names, codes = np.unique(symbols, return_inverse=True)
+        lot_ids = np.arange(len(symbols)) if lot_ids is None else np.asarray(lot_ids)
+
+        order = np.lexsort((acquired, codes))
+        self.symbol_names = [str(name) for name in names]
+        self.codes = codes[order].astype(np.int64)
+        self.acquired = acquired.astype(np.int64)[order]
+        self.quantity = np.asarray(quantity, dtype=np.float64)[order]
+        self.basis = np.asarray(basis, dtype=np.float64)[order]
+        self.lot_ids = lot_ids[order]
+        self._symbol_index = {name: code for code, name in enumerate(self.symbol_names)}
+        self._offsets = np.searchsorted(self.codes, np.arange(len(names) + 1))
+        # One sortable key per lot so that (symbol, date) windows are a single searchsorted call.
+        self._span = int(self.acquired.max() - self.acquired.min() + 2 * WASH_SALE_DAYS + 2) if len(order) else 1
+        self._origin = int(self.acquired.min()) - WASH_SALE_DAYS - 1 if len(order) else 0
+        self._keys = self.codes * self._span + (self.acquired - self._origin)
+        self._cumulative_quantity = np.concatenate([[0.0], np.cumsum(self.quantity)])
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def from_portfolio(cls, portfolio):
+        """
+        Builds a ledger from portfolio positions.
+
+        A position either lists its lots as ``{"acquired", "quantity", "basis", "lot_id"}`` entries
+        under 'lots', or is treated as a single lot of 'shares' at 'purchase_price' bought on
+        'purchase_date'. Lots without a date are dated exactly one year back: still short-term, as
+        the flat-bracket calculation assumed, but never mistaken for a recent wash-sale purchase.
+
+        Args:
+            portfolio (list): List of position dictionaries.
+
+        Returns:
+            LotLedger: Ledger of every lot in the portfolio.
+        """
+        undated = str(np.datetime64('today', 'D') - LONG_TERM_DAYS)
+        symbols, acquired, quantity, basis, lot_ids = [], [], [], [], []
+        for position in portfolio:
+            lots = position.get('lots') or [{
+                "acquired": position.get('purchase_date') or undated,
+                "quantity": position.get('shares', 0),
+                "basis": position.get('purchase_price', 0),
+            }]
+            for lot in lots:
+                symbols.append(position['symbol'])
+                acquired.append(lot.get('acquired') or undated)
+                quantity.append(lot['quantity'])
+                basis.append(lot['basis'])
+                lot_ids.append(str(lot.get('lot_id', f"{position['symbol']}-{len(lot_ids)}")))
+        return cls(np.array(symbols, dtype=str), np.array(acquired, dtype='datetime64[D]'),
+                   quantity, basis, np.array(lot_ids, dtype=str))
+
+    def symbol_slice(self, symbol):
+        """Returns the slice of rows holding the lots of ``symbol`` (empty if it has none)."""
+        code = self._symbol_index.get(symbol)
+        if code is None:
+            return slice(0, 0)
+        return slice(int(self._offsets[code]), int(self._offsets[code + 1]))
+
+    def acquired_between(self, symbol_codes, start, end):
+        """
+        Finds the lots of each symbol acquired in the inclusive day window [start, end].
+
+        Args:
+            symbol_codes (np.ndarray): Symbol code per query.
+            start (np.ndarray): First day of each window.
+            end (np.ndarray): Last day of each window.
+
+        Returns:
+            tuple: Row ranges (first, stop) per query and the number of shares acquired in each window.
+        """
+        symbol_codes = np.asarray(symbol_codes, dtype=np.int64)
+        start = np.clip(np.asarray(start, dtype=np.int64) - self._origin, 0, self._span - 1)
+        end = np.clip(np.asarray(end, dtype=np.int64) - self._origin, 0, self._span - 1)
+        first = np.searchsorted(self._keys, symbol_codes * self._span + start, side='left')
+        stop = np.searchsorted(self._keys, symbol_codes * self._span + end, side='right')
+        return first, stop, self._cumulative_quantity[stop] - self._cumulative_quantity[first]
+
+    def relieve(self, symbol, quantity, method='fifo', lot_ids=None):
+        """
+        Chooses which lots a sale of ``quantity`` shares is taken from.
+
+        Args:
+            symbol (str): Symbol being sold.
+            quantity (float): Number of shares sold.
+            method (str): 'fifo' (oldest first), 'hifo' (highest basis first) or 'specific'.
+            lot_ids (list): Lots to sell from, in order, for the 'specific' method.
+
+        Returns:
+            tuple: Row indices of the relieved lots and the shares taken from each.
+
+        Raises:
+            ValueError: If the method is unknown or the lots do not hold enough shares.
+        """
+        if method not in RELIEF_METHODS:
+            raise ValueError(f"Unknown lot relief method '{method}', expected one of {', '.join(RELIEF_METHODS)}")
+        rows = np.arange(self.symbol_slice(symbol).start, self.symbol_slice(symbol).stop)
+        if method == 'hifo':
+            rows = rows[np.argsort(-self.basis[rows], kind='stable')]
+        elif method == 'specific':
+            positions = {lot_id: row for row, lot_id in zip(rows, self.lot_ids[rows].tolist())}
+            rows = np.array([positions[lot_id] for lot_id in lot_ids or () if lot_id in positions], dtype=np.int64)
+
+        available = self.quantity[rows]
+        taken_before = np.concatenate([[0.0], np.cumsum(available)[:-1]])
+        taken = np.clip(quantity - taken_before, 0, available)
+        if taken.sum() < quantity - 1e-9:
+            raise ValueError(f"Not enough shares of {symbol} in the selected lots to sell {quantity}")
+        used = taken > 0
+        return rows[used], taken[used]
+
+    def realize(self, symbol, quantity, price, as_of, method='fifo', lot_ids=None):
+        """
+        Computes the short- and long-term gain of selling shares at ``price`` on ``as_of``.
+
+        Args:
+            symbol (str): Symbol being sold.
+            quantity (float): Number of shares sold.
+            price (float): Sale price per share.
+            as_of (str | int): Sale date.
+            method (str): Lot relief method.
+            lot_ids (list): Lots to sell from for the 'specific' method.
+
+        Returns:
+            dict: Short-term and long-term gains (negative for losses) and the relieved lot ids.
+        """
+        rows, taken = self.relieve(symbol, quantity, method, lot_ids)
+        as_of = int(to_days(as_of)) if not isinstance(as_of, (int, np.integer)) else int(as_of)
+        gains = (price - self.basis[rows]) * taken
+        long_term = as_of - self.acquired[rows] > LONG_TERM_DAYS
+        return {
+            "short_term_gain": float(gains[~long_term].sum()),
+            "long_term_gain": float(gains[long_term].sum()),
+            "lots": self.lot_ids[rows].tolist(),
+            "shares": taken.tolist(),
+        }
+
+    def harvestable_losses(self, prices, as_of):
+        """
+        Computes, per symbol, the losses that selling every lot trading below its basis would realize.
+
+        Lots of the same symbol bought in the 30 days before ``as_of`` and not sold with the losers
+        are replacement purchases: the loss on up to that many shares would be disallowed as a wash
+        sale, so it is reported separately instead of being counted as harvestable.
+
+        Args:
+            prices (dict): Current price per symbol; symbols without a price are skipped.
+            as_of (str | int): Date of the harvesting sale.
+
+        Returns:
+            dict: Arrays indexed like ``symbol_names``: 'short_term_loss', 'long_term_loss',
+            'loss_shares', 'loss_lots', 'wash_sale_shares' and 'disallowed_loss' (losses are positive).
+        """
+        as_of = int(to_days(as_of)) if not isinstance(as_of, (int, np.integer)) else int(as_of)
+        num_symbols = len(self.symbol_names)
+        symbol_prices = np.array([prices.get(name, np.nan) for name in self.symbol_names], dtype=np.float64)
+        price = symbol_prices[self.codes]
+
+        loss_per_share = np.where(np.isnan(price), 0.0, self.basis - price)
+        losing = loss_per_share > 0
+        loss = np.where(losing, loss_per_share * self.quantity, 0.0)
+        long_term = as_of - self.acquired > LONG_TERM_DAYS
+
+        short_term_loss = np.bincount(self.codes, loss * ~long_term, minlength=num_symbols)
+        long_term_loss = np.bincount(self.codes, loss * long_term, minlength=num_symbols)
+        loss_shares = np.bincount(self.codes, self.quantity * losing, minlength=num_symbols)
+        loss_lots = np.bincount(self.codes, losing, minlength=num_symbols)
+
+        # Replacement shares: recent purchases of the symbol that are not themselves being sold.
+        codes = np.arange(num_symbols)
+        _, _, recent_shares = self.acquired_between(codes, np.full(num_symbols, as_of - WASH_SALE_DAYS),
+                                                    np.full(num_symbols, as_of))
+        recent = (self.acquired >= as_of - WASH_SALE_DAYS) & (self.acquired <= as_of)
+        recent_losing_shares = np.bincount(self.codes, self.quantity * (recent & losing), minlength=num_symbols)
+        wash_sale_shares = np.minimum(recent_shares - recent_losing_shares, loss_shares)
+        total_loss = short_term_loss + long_term_loss
+        average_loss = np.divide(total_loss, loss_shares, out=np.zeros(num_symbols), where=loss_shares > 0)
+        disallowed_loss = wash_sale_shares * average_loss
+        # Disallowed losses are taken pro rata out of the short- and long-term buckets.
+        allowed = np.divide(total_loss - disallowed_loss, total_loss, out=np.zeros(num_symbols), where=total_loss > 0)
+
+        return {
+            "short_term_loss": short_term_loss * allowed,
+            "long_term_loss": long_term_loss * allowed,
+            "loss_shares": loss_shares,
+            "loss_lots": loss_lots.astype(np.int64),
+            "wash_sale_shares": wash_sale_shares,
+            "disallowed_loss": disallowed_loss,
+        }
+
+    def wash_sales(self, symbols, sale_dates, window=WASH_SALE_DAYS):
+        """
+        Counts the shares of the same symbol acquired within ``window`` days of each sale.
+
+        Args:
+            symbols (list): Symbol of each sale.
+            sale_dates (array-like): Date of each sale.
+            window (int): Days before and after the sale that count as a replacement purchase.
+
+        Returns:
+            np.ndarray: Shares acquired in the window around each sale (0 where there are none).
+        """
+        sale_dates = to_days(sale_dates)
+        codes = np.array([self._symbol_index.get(symbol, -1) for symbol in symbols], dtype=np.int64)
+        known = codes >= 0
+        shares = np.zeros(len(codes))
+        _, _, shares[known] = self.acquired_between(codes[known], sale_dates[known] - window,
+                                                    sale_dates[known] + window)
+        return shares
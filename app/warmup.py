@@ -0,0 +1,104 @@
+import contextlib
+import gc
+import importlib
+import logging
+import time
+
+import numpy as np
+
+from .formats import optional_module
+
+logger = logging.getLogger(__name__)
+
+# Imported on first use by the application; the warm-up imports them ahead of time.
+HEAVY_MODULES = ('scipy.linalg', 'scipy.optimize', 'requests', 'requests.adapters')
+
+
+def _single_threaded_blas():
+    # OpenMP-based BLAS builds start their thread pool on the first parallel call; on one thread they
+    # never do, so nothing of theirs is running at the fork.
+    threadpoolctl = optional_module('threadpoolctl')
+    if threadpoolctl is None:
+        return contextlib.nullcontext()
+    return threadpoolctl.threadpool_limits(limits=1, user_api='blas')
+
+
+def _prime_linear_algebra():
+    # Loads BLAS/LAPACK and runs a factorization through each.
+    from scipy.linalg import cho_factor
+
+    matrix = np.random.default_rng(0).standard_normal((64, 64))
+    covariance = matrix @ matrix.T + 64 * np.eye(64)
+    np.linalg.cholesky(covariance)
+    cho_factor(covariance)
+
+
+def _prime_kernels():
+    # Runs every numerical kernel once on a tiny problem, so lazily initialized state (SciPy
+    # submodules, NumPy random generators and ufunc loops, cached tax tables) exists before the fork.
+    from .monte_carlo import simulate_growth
+    from .optimizer import efficient_frontier, max_sharpe_weights
+    from .price_matrix import PriceMatrix
+    from .price_store import PriceHistory
+    from .tax_engine import FILING_STATUSES, TAX_YEARS, compute_tax_liability, tax_tables
+    from .tax_lots import LotLedger
+
+    mean_returns = np.array([0.0004, 0.0003, 0.0005])
+    covariance = np.diag([1e-4, 2e-4, 3e-4])
+    max_sharpe_weights(mean_returns * 252, covariance * 252)
+    efficient_frontier(mean_returns * 252, covariance * 252, num_points=3)
+    simulate_growth(mean_returns, covariance, num_simulations=8, time_horizon=5, seed=0)
+    simulate_growth(mean_returns, covariance, num_simulations=8, time_horizon=5, seed=0, dtype=np.float32)
+
+    prices = PriceMatrix.from_histories({"A": PriceHistory(np.array([19724, 19725]), np.array([10.0, 10.5]))})
+    prices.align('ffill').log_returns
+    for year in TAX_YEARS:
+        for status in FILING_STATUSES:
+            tax_tables(year, status)
+    compute_tax_liability(np.array([50000.0, 250000.0]), short_term_gains=1000.0, long_term_gains=-5000.0)
+    ledger = LotLedger(['A', 'A'], np.array(['2023-01-02', '2024-05-01'], dtype='datetime64[D]'),
+                       np.array([10.0, 5.0]), np.array([12.0, 9.0]))
+    ledger.harvestable_losses({'A': 10.0}, np.datetime64('2024-06-03'))
+
+
+def warm_up(freeze=True):
+    """
+    Prepares the process to serve requests without first-request start-up costs.
+
+    Imports the heavy libraries the routes import lazily, initializes BLAS/LAPACK, runs each numerical
+    kernel once on a tiny problem and fills the pure caches. No sockets or database connections are
+    created, so this can run in a pre-forking server's master process (e.g. from the app factory
+    under ``gunicorn --preload``): every worker then inherits the initialized modules and shares
+    their memory copy-on-write.
+
+    BLAS is the one library that may hold threads at the fork. The OpenBLAS pthreads build shipped
+    in the NumPy and SciPy wheels starts its pool when it is loaded, i.e. on importing NumPy, and
+    stops and restarts it around fork, so it is fork-safe. OpenMP-based builds (MKL, or OpenBLAS
+    built with OpenMP) are not once their pool runs; with the optional threadpoolctl package the
+    warm-up keeps BLAS on the calling thread so that no such pool is started. Without it, use the
+    wheels' OpenBLAS or skip the warm-up with such builds.
+
+    Args:
+        freeze (bool): Move every object alive afterwards into the garbage collector's permanent
+            generation, so collections in the workers do not touch (and copy) the shared pages.
+
+    Returns:
+        dict: Seconds spent in each step.
+    """
+    timings = {}
+    start = time.perf_counter()
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+    timings["imports"] = time.perf_counter() - start
+
+    with _single_threaded_blas():
+        for step, prime in (("linear_algebra", _prime_linear_algebra), ("kernels", _prime_kernels)):
+            start = time.perf_counter()
+            prime()
+            timings[step] = time.perf_counter() - start
+
+    if freeze:
+        gc.collect()
+        gc.freeze()
+    logger.info("Warm-up finished", extra={"seconds": {step: round(seconds, 4) for step, seconds in timings.items()}})
+    return timings
@@ -0,0 +1,136 @@
+"""
+Measures how long a freshly started worker takes to answer its first requests.
+
+Each measurement runs in a new interpreter. In 'lazy' mode the worker imports and creates the app
+itself, as a worker of a non-preloading server does. In 'preload' mode the app is created with
+warm-up in a master process that then forks the worker, as under ``gunicorn --preload``; the
+master's start-up is reported separately and is not part of the worker's time to first response.
+
+Usage: python -m benchmarks.cold_start [--runs 5] [--output cold_start.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = ('lazy', 'preload')
+PORTFOLIO = [{"symbol": "SYM0000", "purchase_price": 120, "shares": 10},
+             {"symbol": "SYM0001", "purchase_price": 80, "shares": 25},
+             {"symbol": "SYM0002", "purchase_price": 300, "shares": 4}]
+
+
+def _first_requests(app, data):
+    from unittest.mock import patch
+
+    from app.price_store import parse_daily_series
+
+    timings = {}
+    client = app.test_client()
+    start = time.perf_counter()
+    client.get('/')
+    timings["first_index_seconds"] = time.perf_counter() - start
+
+    with patch('app.calculations.fetch_price_history', side_effect=lambda symbol: parse_daily_series(data[symbol])):
+        client.post('/input-portfolio', json={"portfolio": PORTFOLIO, "income": 100000, "tax_bracket": 0.24})
+        start = time.perf_counter()
+        response = client.post('/optimize-portfolio', json={})
+        timings["first_optimize_seconds"] = time.perf_counter() - start
+    if response.status_code != 200:
+        raise RuntimeError(f"/optimize-portfolio failed: {response.get_data(as_text=True)}")
+    return timings
+
+
+def _child(mode, data_path):
+    # Runs in a fresh interpreter; prints one JSON object with the measurements.
+    with open(data_path) as f:
+        data = json.load(f)
+    import unittest.mock  # noqa: F401 (imported before timing starts)
+
+    start = time.perf_counter()
+    from app import create_app
+    imported = time.perf_counter()
+    app = create_app(warm_up=mode == 'preload')
+    created = time.perf_counter()
+    startup = {"import_seconds": imported - start, "create_app_seconds": created - imported}
+
+    if mode == 'lazy':
+        result = dict(startup, **_first_requests(app, data))
+        result["time_to_first_response_seconds"] = (result["import_seconds"] + result["create_app_seconds"]
+                                                    + result["first_index_seconds"])
+        print(json.dumps(result))
+        return
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        with os.fdopen(write, 'w') as f:
+            json.dump(_first_requests(app, data), f)
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as f:
+        worker = json.load(f)
+    os.waitpid(pid, 0)
+    result = dict(worker, master_import_seconds=startup["import_seconds"],
+                  master_create_app_seconds=startup["create_app_seconds"])
+    result["time_to_first_response_seconds"] = result["first_index_seconds"]
+    print(json.dumps(result))
+
+
+def measure_cold_start(mode, runs=5):
+    """
+    Starts ``runs`` fresh workers in the given mode and returns the median of each measurement.
+
+    Args:
+        mode (str): 'lazy' or 'preload'.
+        runs (int): Number of fresh interpreters.
+
+    Returns:
+        dict: Median seconds per measurement, e.g. 'time_to_first_response_seconds'.
+    """
+    from .synthetic import generate_market_data
+
+    with tempfile.TemporaryDirectory() as directory:
+        data_path = os.path.join(directory, 'prices.json')
+        with open(data_path, 'w') as f:
+            json.dump(generate_market_data(len(PORTFOLIO), 500, seed=0), f)
+        env = dict(os.environ, FLASK_SECRET_KEY='cold-start', LOG_LEVEL='WARNING',
+                   PORTFOLIO_STORE_PATH=os.path.join(directory, 'portfolios.sqlite3'))
+        env.pop('APP_WARM_UP', None)
+        samples = []
+        for _ in range(runs):
+            output = subprocess.run([sys.executable, '-m', 'benchmarks.cold_start', '--child', mode, data_path],
+                                    env=env, check=True, capture_output=True, text=True).stdout
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time to first response of a cold worker.")
+    parser.add_argument('--runs', type=int, default=5, help="Fresh interpreters per mode.")
+    parser.add_argument('--mode', action='append', choices=MODES, help="Mode to measure (repeatable).")
+    parser.add_argument('--output', help="Write the results to this JSON file.")
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'DATA'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        _child(*args.child)
+        return 0
+
+    results = {mode: measure_cold_start(mode, args.runs) for mode in args.mode or MODES}
+    for mode, result in results.items():
+        print(f"{mode}:")
+        for key, seconds in result.items():
+            print(f"  {key:<34} {seconds * 1e3:>9.1f} ms")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"runs": args.runs, "results": results}, f, indent=2, sort_keys=True)
+        print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,391 @@
+import argparse
+import itertools
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from functools import lru_cache
+
+import numpy as np
+
+from app import covariance, result_cache
+from app.calculations import (calculate_taxes, enhanced_tax_loss_harvesting, monte_carlo_simulation_multi,
+                              optimize_portfolio, tax_aware_rebalance)
+from app.market_context import MarketDataContext
+from app.price_matrix import PriceMatrix
+from app.price_store import parse_daily_series
+from app.rebalance import rebalance_weights
+from app.tax_engine import what_if_grid
+
+from .synthetic import generate_market_data, generate_portfolio, generate_rebalance_problem
+
+DEFAULT_THRESHOLD = 0.25
+# Timing differences below this many seconds are treated as noise by the regression check.
+NOISE_FLOOR_SECONDS = 0.002
+
+# Market data shape shared by every benchmark unless a case overrides it.
+DATA_DEFAULTS = {"days": 1260, "correlation": 0.3, "missing_rate": 0.002, "seed": 0}
+
+
+@lru_cache(maxsize=8)
+def market_data(symbols, days, correlation, missing_rate, seed):
+    return generate_market_data(symbols, days, correlation=correlation, missing_rate=missing_rate, seed=seed)
+
+
+@lru_cache(maxsize=8)
+def price_histories(symbols, days, correlation, missing_rate, seed):
+    # What the price store hands out: the series already parsed into PriceHistory columns.
+    data = market_data(symbols, days, correlation, missing_rate, seed)
+    return {symbol: parse_daily_series(series) for symbol, series in data.items()}
+
+
+def _settings(params):
+    settings = dict(DATA_DEFAULTS, **{key: params[key] for key in DATA_DEFAULTS if key in params})
+    return (params["symbols"], settings["days"], settings["correlation"], settings["missing_rate"],
+            settings["seed"])
+
+
+def _data(params):
+    return market_data(*_settings(params))
+
+
+def _histories(params):
+    return price_histories(*_settings(params))
+
+
+def _fetcher(histories):
+    return lambda symbols: {symbol: histories[symbol] for symbol in symbols if symbol in histories}
+
+
+def _context(portfolio, histories):
+    # A fresh context per call, so building the price matrix is part of every timing.
+    return MarketDataContext([security['symbol'] for security in portfolio], _fetcher(histories))
+
+
+def bench_monte_carlo(params):
+    data = _data(params)
+    histories = _histories(params)
+    portfolio = generate_portfolio(data, seed=params.get("seed", 0))
+    dtype = np.dtype(params["dtype"]).type
+    return lambda: monte_carlo_simulation_multi(portfolio, params["simulations"], params["horizon"], seed=1,
+                                                dtype=dtype, context=_context(portfolio, histories))
+
+
+def bench_optimize(params):
+    data = _data(params)
+    histories = _histories(params)
+    portfolio = generate_portfolio(data, seed=params.get("seed", 0))
+    return lambda: optimize_portfolio(portfolio, context=_context(portfolio, histories))
+
+
+def bench_tax_loss_harvesting(params):
+    data = _data(params)
+    histories = _histories(params)
+    portfolio = generate_portfolio(data, num_lots=params["lots"], seed=params.get("seed", 0))
+    return lambda: enhanced_tax_loss_harvesting(portfolio, 0.32, context=_context(portfolio, histories),
+                                                long_term_rate=0.15, as_of='2024-06-03')
+
+
+def bench_rebalance(params):
+    data = _data(params)
+    accounts = [{"id": k, "tax_bracket": 0.32, "long_term_rate": 0.15, "gains_budget": 5000.0 * (k % 3),
+                 "portfolio": generate_portfolio(data, num_lots=params["lots"], seed=k)}
+                for k in range(params["accounts"])]
+    targets = dict.fromkeys(data, 1.0)
+    symbols = list(data)
+    return lambda: tax_aware_rebalance(accounts, target_weights=targets, max_turnover=0.2,
+                                       context=MarketDataContext(symbols, _fetcher(_histories(params))),
+                                       as_of='2024-06-03')
+
+
+def bench_rebalance_weights(params):
+    # The solver alone, on weights and relief segments, for batch sizes beyond what the routes build
+    problem = generate_rebalance_problem(params["accounts"], params["assets"], params["segments"],
+                                         seed=params.get("seed", 0))
+    return lambda: rebalance_weights(*problem[:6], gains_budget=problem[6])
+
+
+def bench_calculate_taxes(params):
+    rng = np.random.default_rng(params.get("seed", 0))
+    requests = [{
+        "income": float(income),
+        "tax_bracket": 0.24,
+        "investment_gains": float(gains),
+        "investment_losses": float(losses),
+        "cost_basis": 0,
+        **({"filing_status": "single", "carryforward_short_term": 1000.0} if params["mode"] == "progressive" else {}),
+    } for income, gains, losses in rng.uniform(0, 400000, (params["calls"], 3)).round(2)]
+    return lambda: [calculate_taxes(request) for request in requests]
+
+
+def bench_tax_what_if(params):
+    size = params["size"]
+    incomes, gains, harvests = np.linspace(0, 1e6, size), np.linspace(-5e4, 5e5, size), np.linspace(0, 1e5, size)
+    return lambda: what_if_grid(incomes, gains, harvests, filing_status='married_joint')
+
+
+def bench_covariance(params):
+    # Fits the history once, then times either a full refit or the incremental update by one new day
+    returns = np.random.default_rng(params.get("seed", 0)).standard_normal((params["days"] + 1, params["symbols"]))
+    returns *= 0.01
+    estimator = covariance.StreamingCovariance(params["symbols"], params["method"]).fit(returns[:-1])
+    if params["update"] == "refit":
+        return lambda: estimator.fit(returns).estimate()
+
+    def one_day():
+        # The service extends a copy of the cached state, so the copy is part of the timing
+        updated = covariance._copy_estimator(estimator)
+        updated.update(returns[-1])
+        return updated.estimate()
+    return one_day
+
+
+def bench_json_parsing(params):
+    data = _data(params)
+    responses = [json.dumps({"Time Series (Daily)": series}) for series in data.values()]
+    return lambda: PriceMatrix.from_series(
+        {symbol: json.loads(text)["Time Series (Daily)"] for symbol, text in zip(data, responses)})
+
+
+# Benchmark name -> (setup function, full parameter grid, quick parameter grid). A setup function
+# builds its inputs outside the timed region and returns the callable that is timed.
+BENCHMARKS = {
+    "monte_carlo_simulation_multi": (
+        bench_monte_carlo,
+        {"symbols": [5, 20], "simulations": [1000, 5000], "horizon": [252], "dtype": ["float64", "float32"]},
+        {"symbols": [5], "simulations": [1000], "horizon": [252], "dtype": ["float64"]},
+    ),
+    "optimize_portfolio": (
+        bench_optimize,
+        {"symbols": [10, 50, 200]},
+        {"symbols": [10]},
+    ),
+    "enhanced_tax_loss_harvesting": (
+        bench_tax_loss_harvesting,
+        {"symbols": [50], "lots": [500, 20000]},
+        {"symbols": [20], "lots": [500]},
+    ),
+    "tax_aware_rebalance": (
+        bench_rebalance,
+        {"symbols": [30], "lots": [100], "accounts": [1, 256]},
+        {"symbols": [10], "lots": [50], "accounts": [16]},
+    ),
+    "rebalance_weights": (
+        bench_rebalance_weights,
+        {"assets": [50], "segments": [4], "accounts": [256, 2000, 10000]},
+        {"assets": [20], "segments": [4], "accounts": [64]},
+    ),
+    "calculate_taxes": (
+        bench_calculate_taxes,
+        {"mode": ["flat", "progressive"], "calls": [1000]},
+        {"mode": ["flat", "progressive"], "calls": [100]},
+    ),
+    "tax_what_if": (
+        bench_tax_what_if,
+        {"size": [20, 100]},
+        {"size": [20]},
+    ),
+    "covariance": (
+        bench_covariance,
+        {"symbols": [50, 500], "days": [1260], "method": ["expanding", "ewma"], "update": ["refit", "one_day"]},
+        {"symbols": [50], "days": [1260], "method": ["ewma"], "update": ["refit", "one_day"]},
+    ),
+    "json_parsing": (
+        bench_json_parsing,
+        {"symbols": [10, 100], "days": [1260, 5000]},
+        {"symbols": [10], "days": [1260]},
+    ),
+}
+
+
+def expand_grid(grid):
+    """
+    Expands a parameter grid into every combination of its values.
+
+    Args:
+        grid (dict): Mapping of parameter name to a list of values.
+
+    Returns:
+        list: One parameter dictionary per combination, in grid order.
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def case_key(name, params):
+    """Returns the stable identifier of a benchmark case, e.g. 'optimize_portfolio[symbols=10]'."""
+    return f"{name}[{','.join(f'{key}={value}' for key, value in sorted(params.items()))}]"
+
+
+def measure(function, repeat=5):
+    """
+    Times a callable and measures its peak traced memory.
+
+    The callable runs once to warm up, ``repeat`` times under ``time.perf_counter`` and once more
+    under tracemalloc (which slows it down, so that run is not timed). NumPy reports its buffers to
+    tracemalloc, so the peak includes array memory.
+
+    Args:
+        function (callable): Callable to measure.
+        repeat (int): Number of timed runs.
+
+    Returns:
+        dict: 'median_seconds', 'min_seconds', 'repeat' and 'peak_bytes'.
+    """
+    function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"median_seconds": statistics.median(times), "min_seconds": min(times), "repeat": repeat,
+            "peak_bytes": peak}
+
+
+def run_benchmarks(names=None, quick=False, repeat=5, data_overrides=None):
+    """
+    Runs benchmark cases over their parameter grids.
+
+    The result and covariance caches are replaced by ones that store nothing for the duration of the
+    run, so every timed call does the full computation.
+
+    Args:
+        names (list): Benchmarks to run. Defaults to all of BENCHMARKS.
+        quick (bool): Use the small parameter grids.
+        repeat (int): Number of timed runs per case.
+        data_overrides (dict): Market data settings ('days', 'correlation', 'missing_rate', 'seed')
+            applied to every case that does not set them in its grid.
+
+    Returns:
+        dict: 'meta' describing the environment and 'results' keyed by case.
+    """
+    names = names or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError(f"Unknown benchmark '{name}', expected one of {', '.join(BENCHMARKS)}")
+
+    previous_cache = result_cache._default_cache
+    previous_covariance = covariance._default_service
+    result_cache._default_cache = result_cache.ResultCache(max_bytes=0)
+    covariance._default_service = covariance.CovarianceService(max_entries=0)
+    results = {}
+    try:
+        for name in names:
+            setup, full_grid, quick_grid = BENCHMARKS[name]
+            for params in expand_grid(quick_grid if quick else full_grid):
+                params = dict(data_overrides or {}, **params)
+                key = case_key(name, params)
+                print(f"Running {key}", file=sys.stderr)
+                results[key] = {"benchmark": name, "params": params, **measure(setup(params), repeat)}
+    finally:
+        result_cache._default_cache = previous_cache
+        covariance._default_service = previous_covariance
+
+    return {
+        "meta": {
+            "created_at": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "quick": quick,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD, memory_threshold=None):
+    """
+    Compares benchmark results with a baseline.
+
+    A case regresses when its median time exceeds the baseline's by more than ``threshold`` (as a
+    fraction) and by more than NOISE_FLOOR_SECONDS, or when its peak memory exceeds the baseline's by
+    more than ``memory_threshold``. Cases missing from either side are ignored.
+
+    Args:
+        current (dict): Output of run_benchmarks.
+        baseline (dict): Earlier output of run_benchmarks.
+        threshold (float): Allowed relative slowdown.
+        memory_threshold (float): Allowed relative growth of peak memory. Defaults to ``threshold``.
+
+    Returns:
+        list: One {'case', 'metric', 'baseline', 'current', 'ratio'} entry per regression.
+    """
+    memory_threshold = threshold if memory_threshold is None else memory_threshold
+    regressions = []
+    for key, result in current["results"].items():
+        reference = baseline["results"].get(key)
+        if reference is None:
+            continue
+        checks = (
+            ("median_seconds", threshold, NOISE_FLOOR_SECONDS),
+            ("peak_bytes", memory_threshold, 0),
+        )
+        for metric, allowed, floor in checks:
+            before, after = reference[metric], result[metric]
+            if after > before * (1 + allowed) and after - before > floor:
+                regressions.append({"case": key, "metric": metric, "baseline": before, "current": after,
+                                    "ratio": after / before if before else float('inf')})
+    return regressions
+
+
+def format_results(report):
+    """Returns a plain-text table of benchmark results."""
+    lines = [f"{'case':<80} {'median (ms)':>12} {'min (ms)':>10} {'peak (MiB)':>11}"]
+    for key, result in report["results"].items():
+        lines.append(f"{key:<80} {result['median_seconds'] * 1e3:>12.2f} {result['min_seconds'] * 1e3:>10.2f} "
+                     f"{result['peak_bytes'] / 2 ** 20:>11.2f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the portfolio calculations.")
+    parser.add_argument('--only', action='append', choices=list(BENCHMARKS), help="Benchmark to run (repeatable).")
+    parser.add_argument('--quick', action='store_true', help="Use the small parameter grids.")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per case.")
+    parser.add_argument('--days', type=int, help="Trading days of synthetic history.")
+    parser.add_argument('--correlation', type=float, help="Pairwise correlation of synthetic returns.")
+    parser.add_argument('--missing-rate', type=float, help="Fraction of days missing per symbol.")
+    parser.add_argument('--seed', type=int, help="Seed of the synthetic data.")
+    parser.add_argument('--output', help="Write the results to this JSON file (e.g. to save a baseline).")
+    parser.add_argument('--baseline', help="Compare with a baseline JSON file and fail on regressions.")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed relative slowdown before a case counts as a regression.")
+    parser.add_argument('--memory-threshold', type=float, help="Allowed relative growth of peak memory.")
+    args = parser.parse_args(argv)
+
+    overrides = {key: value for key, value in (("days", args.days), ("correlation", args.correlation),
+                                               ("missing_rate", args.missing_rate), ("seed", args.seed))
+                 if value is not None}
+    report = run_benchmarks(args.only, quick=args.quick, repeat=args.repeat, data_overrides=overrides)
+    print(format_results(report))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold, args.memory_threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression['case']} {regression['metric']}: {regression['baseline']:.6g} -> "
+                  f"{regression['current']:.6g} ({regression['ratio']:.2f}x)")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
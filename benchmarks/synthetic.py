@@ -0,0 +1,106 @@
+import numpy as np
+
+
+def generate_market_data(num_symbols=10, num_days=1260, correlation=0.3, missing_rate=0.0, seed=0,
+                         start='2015-01-02', annual_drift=0.07, annual_volatility=0.25):
+    """
+    Generates Alpha Vantage style daily price series for synthetic symbols.
+
+    Daily log returns follow a one-factor model: every symbol loads on a common market factor so that
+    any two symbols have the requested return correlation, and the rest of the variance is
+    idiosyncratic. Weekends are skipped, and each symbol then misses a random ``missing_rate``
+    fraction of the trading days (never its latest one).
+
+    Args:
+        num_symbols (int): Number of symbols, named SYM0000, SYM0001, ...
+        num_days (int): Number of trading days per symbol before dropping missing days.
+        correlation (float): Pairwise correlation of daily log returns, between 0 and 1.
+        missing_rate (float): Fraction of days dropped at random from each symbol.
+        seed (int): Seed of the generator; equal arguments give identical data.
+        start (str): First calendar day of the history.
+        annual_drift (float): Expected annual log return.
+        annual_volatility (float): Annual volatility of every symbol.
+
+    Returns:
+        dict: Mapping of symbol to a {"YYYY-MM-DD": {"4. close": "price"}} mapping, newest date first.
+    """
+    rng = np.random.default_rng(seed)
+    dates = np.busday_offset(np.datetime64(start, 'D'), np.arange(num_days), roll='forward')
+    date_strings = np.datetime_as_string(dates)
+
+    daily_volatility = annual_volatility / np.sqrt(252)
+    market = rng.standard_normal((num_days, 1))
+    idiosyncratic = rng.standard_normal((num_days, num_symbols))
+    shocks = np.sqrt(correlation) * market + np.sqrt(1 - correlation) * idiosyncratic
+    log_returns = annual_drift / 252 + daily_volatility * shocks
+    closes = rng.uniform(20, 500, num_symbols) * np.exp(np.cumsum(log_returns, axis=0))
+
+    observed = rng.random((num_days, num_symbols)) >= missing_rate
+    observed[-1] = True
+    data = {}
+    for column in range(num_symbols):
+        rows = np.flatnonzero(observed[:, column])[::-1]
+        data[f"SYM{column:04d}"] = {date_strings[row]: {"4. close": f"{closes[row, column]:.4f}"} for row in rows}
+    return data
+
+
+def generate_portfolio(market_data, num_lots=None, seed=0, as_of='2024-06-03'):
+    """
+    Generates a portfolio over the symbols of synthetic market data.
+
+    Args:
+        market_data (dict): Output of generate_market_data.
+        num_lots (int): Number of tax lots spread over the symbols. Without it, every symbol is one
+            position with a single 'purchase_price'.
+        seed (int): Seed of the generator.
+        as_of (str): Lots are acquired in the five years before this day.
+
+    Returns:
+        list: Portfolio positions.
+    """
+    rng = np.random.default_rng(seed)
+    symbols = list(market_data)
+    latest = {symbol: float(next(iter(series.values()))["4. close"]) for symbol, series in market_data.items()}
+    if num_lots is None:
+        return [{"symbol": symbol, "purchase_price": round(latest[symbol] * rng.uniform(0.6, 1.4), 2),
+                 "shares": int(rng.integers(1, 500))} for symbol in symbols]
+
+    owners = rng.integers(0, len(symbols), num_lots)
+    acquired = np.datetime_as_string(np.datetime64(as_of, 'D') - rng.integers(1, 5 * 365, num_lots))
+    quantity = rng.integers(1, 200, num_lots)
+    basis_factor = rng.uniform(0.6, 1.4, num_lots)
+    positions = {symbol: {"symbol": symbol, "lots": []} for symbol in symbols}
+    for owner, date, shares, factor in zip(owners.tolist(), acquired.tolist(), quantity.tolist(), basis_factor.tolist()):
+        symbol = symbols[owner]
+        positions[symbol]["lots"].append({"acquired": date, "quantity": shares,
+                                          "basis": round(latest[symbol] * factor, 2)})
+    return [position for position in positions.values() if position["lots"]]
+
+
+def generate_rebalance_problem(num_accounts, num_assets=50, num_segments=4, seed=0):
+    """
+    Generates the solver inputs of a batch of tax-aware rebalancing problems, see rebalance_weights.
+
+    The covariance follows a five-factor model and the targets are equal weights. Every account holds
+    random weights split over its relief segments at gains between -50% and +60%, taxed at the
+    long-term or short-term rate, and every third account has a gains budget of 1%.
+
+    Args:
+        num_accounts (int): Number of accounts.
+        num_assets (int): Number of assets.
+        num_segments (int): Relief segments per asset.
+        seed (int): Seed of the generator.
+
+    Returns:
+        tuple: Covariance, target weights, current weights, capacities, costs, gains and gains budgets.
+    """
+    rng = np.random.default_rng(seed)
+    factors = rng.standard_normal((num_assets, 5)) * 0.1
+    covariance = factors @ factors.T + np.diag(rng.uniform(0.01, 0.05, num_assets))
+    target = np.full(num_assets, 1.0 / num_assets)
+    current = rng.dirichlet(np.ones(num_assets), num_accounts)
+    capacities = current[:, :, None] * rng.dirichlet(np.ones(num_segments), (num_accounts, num_assets))
+    gains = np.sort(rng.uniform(-0.5, 0.6, (num_accounts, num_assets, num_segments)), axis=2)
+    costs = np.sort(gains * np.where(rng.random(gains.shape) < 0.5, 0.15, 0.32), axis=2)
+    budget = np.where(np.arange(num_accounts) % 3 == 0, 0.01, np.inf)
+    return covariance, target, current, capacities, costs, gains, budget
@@ -0,0 +1,37 @@
+import numpy as np
+
+from app.price_store import PriceStoreError, parse_daily_series
+
+
+def make_stock_data(closes, start='2024-01-01'):
+    """
+    Builds an Alpha Vantage daily mapping with one close per consecutive calendar day.
+
+    Args:
+        closes (list): Closing prices, oldest first.
+        start (str): Day of the first close.
+
+    Returns:
+        dict: Mapping of 'YYYY-MM-DD' to {'4. close': str}, newest date first.
+    """
+    dates = np.datetime_as_string(np.datetime64(start) + np.arange(len(closes)))
+    return {date: {"4. close": str(close)} for date, close in zip(dates[::-1], closes[::-1])}
+
+
+def serve_stock_data(stock_data):
+    """
+    Builds a stand-in for app.calculations.fetch_price_history from Alpha Vantage daily mappings.
+
+    Args:
+        stock_data (dict | callable): Mapping of symbol to a daily mapping or an error dictionary,
+            or a callable taking a symbol and returning one. Looked up on every call.
+
+    Returns:
+        callable: Takes a symbol and returns its PriceHistory, or raises PriceStoreError.
+    """
+    def fetch_price_history(symbol):
+        series = stock_data(symbol) if callable(stock_data) else stock_data.get(symbol)
+        if not series or "error" in series:
+            raise PriceStoreError("Invalid symbol or data not available")
+        return parse_daily_series(series)
+    return fetch_price_history
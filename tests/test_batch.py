@@ -0,0 +1,67 @@
+import unittest
+from unittest.mock import patch
+
+from app.batch import run_batch
+from helpers import make_stock_data, serve_stock_data
+
+
+STOCK_DATA = {
+    "AAPL": make_stock_data([100, 102, 101, 104, 103, 106, 108]),
+    "MSFT": make_stock_data([50, 49, 51, 52, 50, 53, 52]),
+    "GOOG": make_stock_data([30, 31, 29, 30, 32, 31, 33]),
+    "NOPE": {"error": "Invalid symbol or data not available"},
+}
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch('app.calculations.fetch_price_history', side_effect=serve_stock_data(STOCK_DATA))
+        self.mock_fetch_price_history = patcher.start()
+        self.addCleanup(patcher.stop)
+        symbols = ["AAPL", "MSFT", "GOOG"]
+        self.items = [
+            {"id": f"household-{i}", "tax_bracket": 0.3, "portfolio": [
+                {"symbol": symbols[i % 3], "purchase_price": 120, "shares": 10},
+                {"symbol": symbols[(i + 1) % 3], "purchase_price": 20, "shares": 5},
+            ]}
+            for i in range(9)
+        ]
+        self.items.append({"id": "broken", "portfolio": [{"symbol": "NOPE", "purchase_price": 1, "shares": 1}]})
+        self.items.append({"id": "empty", "portfolio": []})
+
+    def test_union_fetched_once_and_errors_isolated(self):
+        results = list(run_batch(self.items, workers=1))
+        self.assertEqual(self.mock_fetch_price_history.call_count, 4)
+        self.assertEqual([result["index"] for result in results], list(range(11)))
+        self.assertIn("error", results[9])
+        self.assertIn("error", results[10])
+
+        first = results[0]
+        self.assertEqual(first["id"], "household-0")
+        self.assertAlmostEqual(sum(first["optimize-portfolio"]["weights"].values()), 1.0)
+        self.assertEqual([sale["symbol"] for sale in first["tax-loss-harvesting"]["recommended_sales"]], ["AAPL"])
+
+    @patch.dict('os.environ', {'BATCH_WORKERS': '2'})
+    def test_process_pool_matches_in_process(self):
+        serial = list(run_batch(self.items, operations=("optimize-portfolio",), workers=1))
+        parallel = sorted(run_batch(self.items, operations=("optimize-portfolio",), workers=2),
+                          key=lambda result: result["index"])
+        self.assertEqual(len(parallel), len(serial))
+        for expected, actual in zip(serial, parallel):
+            self.assertEqual(expected.keys(), actual.keys())
+            if "error" not in expected:
+                self.assertNotIn("tax-loss-harvesting", actual)
+                for symbol, weight in expected["optimize-portfolio"]["weights"].items():
+                    self.assertAlmostEqual(actual["optimize-portfolio"]["weights"][symbol], weight)
+
+    @patch.dict('os.environ', {'BATCH_WORKERS': '1'})
+    @patch('app.batch.ProcessPoolExecutor')
+    def test_workers_are_capped_by_the_server(self, mock_pool):
+        results = list(run_batch(self.items, operations=("optimize-portfolio",), workers=64))
+        self.assertEqual(len(results), len(self.items))
+        mock_pool.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+import numpy as np
+
+from app.price_matrix import PriceMatrix
+from benchmarks.run import case_key, compare, expand_grid, measure
+from benchmarks.synthetic import generate_market_data, generate_portfolio
+
+
+class TestSyntheticData(unittest.TestCase):
+
+    def test_generator_is_seeded(self):
+        first = generate_market_data(3, 50, seed=7)
+        self.assertEqual(first, generate_market_data(3, 50, seed=7))
+        self.assertNotEqual(first, generate_market_data(3, 50, seed=8))
+        self.assertEqual(list(first), ['SYM0000', 'SYM0001', 'SYM0002'])
+        dates = list(first['SYM0000'])
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+    def test_correlation_and_missing_days(self):
+        data = generate_market_data(4, 4000, correlation=0.6, missing_rate=0.1, seed=1)
+        prices = PriceMatrix.from_series(data)
+        self.assertAlmostEqual(float(prices.mask.mean()), 0.9, delta=0.02)
+        self.assertTrue(prices.mask[-1].all())
+
+        returns = PriceMatrix.from_series(generate_market_data(4, 4000, correlation=0.6, seed=1)).log_returns
+        correlation = np.corrcoef(returns, rowvar=False)[np.triu_indices(4, 1)]
+        np.testing.assert_allclose(correlation, 0.6, atol=0.05)
+
+    def test_portfolio_lots(self):
+        data = generate_market_data(5, 30, seed=2)
+        portfolio = generate_portfolio(data, num_lots=40, seed=2)
+        self.assertEqual(sum(len(position['lots']) for position in portfolio), 40)
+        self.assertTrue({position['symbol'] for position in portfolio} <= set(data))
+        self.assertEqual(len(generate_portfolio(data)), 5)
+
+
+class TestBenchmarkRunner(unittest.TestCase):
+
+    def test_grid_and_keys(self):
+        grid = expand_grid({"symbols": [5, 20], "dtype": ["float64"]})
+        self.assertEqual(grid, [{"symbols": 5, "dtype": "float64"}, {"symbols": 20, "dtype": "float64"}])
+        self.assertEqual(case_key("mc", grid[0]), "mc[dtype=float64,symbols=5]")
+
+    def test_measure(self):
+        result = measure(lambda: np.ones(100000), repeat=2)
+        self.assertEqual(result["repeat"], 2)
+        self.assertGreaterEqual(result["peak_bytes"], 800000)
+        self.assertLessEqual(result["min_seconds"], result["median_seconds"])
+
+    def test_compare_flags_regressions_beyond_threshold(self):
+        def report(seconds, peak):
+            return {"results": {"case": {"median_seconds": seconds, "peak_bytes": peak}}}
+
+        baseline = report(0.1, 1000)
+        self.assertEqual(compare(report(0.12, 1100), baseline, threshold=0.25), [])
+        regressions = compare(report(0.2, 2000), baseline, threshold=0.25)
+        self.assertEqual([r["metric"] for r in regressions], ["median_seconds", "peak_bytes"])
+        self.assertAlmostEqual(regressions[0]["ratio"], 2.0)
+        # Tiny absolute slowdowns are noise
+        self.assertEqual(compare(report(0.0002, 1000), report(0.0001, 1000)), [])
+        self.assertEqual(compare({"results": {"new": {"median_seconds": 1, "peak_bytes": 1}}}, baseline), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from app.bulk_loader import BulkLoadError, group_by_symbol, load_price_files, read_price_file
+from app.price_store import PriceStore
+
+
+def refuse_download(symbol):
+    raise AssertionError(f"{symbol} should have been served from the store")
+
+
+class TestBulkLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = PriceStore(refuse_download, root=os.path.join(self.root, 'store'), ttl=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, text):
+        path = os.path.join(self.root, name)
+        with open(path, 'w') as handle:
+            handle.write(text)
+        return path
+
+    def test_read_splits_on_line_boundaries(self):
+        rows = [f"{'AB'[i % 2]}{i % 7},2024-01-{1 + i // 14:02d},{10 + i}.5\n" for i in range(200)]
+        path = self.write('dump.csv', "Date,Volume,Symbol,Close\n" + ''.join(
+            f"{date},1,{symbol},{close}" for symbol, date, close in (row.split(',') for row in rows)))
+        expected = read_price_file(path, workers=1, chunk_bytes=1 << 20)
+        for workers in (1, 2):
+            symbols, dates, closes = read_price_file(path, workers=workers, chunk_bytes=50)
+            self.assertEqual(len(symbols), 200)
+            np.testing.assert_array_equal(symbols, expected[0])
+            np.testing.assert_array_equal(dates, expected[1])
+            np.testing.assert_array_equal(closes, np.arange(10, 210) + 0.5)
+
+        with self.assertRaises(BulkLoadError):
+            read_price_file(self.write('bad.csv', "ticker,date,price\nAAPL,2024-01-02,1\n"))
+        for name, text in (('empty.csv', ""), ('garbled.csv', "symbol,date,close\nAAPL,yesterday,1\n")):
+            with self.assertRaises(BulkLoadError):
+                read_price_file(self.write(name, text), workers=1)
+        with self.assertRaises(BulkLoadError):
+            read_price_file(os.path.join(self.root, 'missing.csv'))
+        self.assertEqual(len(read_price_file(self.write('header.csv', "symbol,date,close\n"))[0]), 0)
+
+    def test_group_by_symbol(self):
+        histories = group_by_symbol(np.array([b'msft', b'AAPL', b' AAPL', b'MSFT', b'AAPL']),
+                                    np.array([3, 2, 1, 3, 2]), np.array([1.0, 2.0, 3.0, 4.0, np.nan]))
+        self.assertEqual(sorted(histories), ["AAPL", "MSFT"])
+        np.testing.assert_array_equal(histories["AAPL"].dates, [1, 2])
+        np.testing.assert_array_equal(histories["AAPL"].closes, [3.0, 2.0])
+        # The later row of a duplicated day wins
+        np.testing.assert_array_equal(histories["MSFT"].closes, [4.0])
+
+    def test_load_into_store(self):
+        history = self.write('history.csv', 'symbol,date,close\n"AAPL",2024-08-14,198.5\n'
+                                            'AAPL,2024-08-15,200\nMSFT,2024-08-15,400\n../X,2024-08-15,1\n')
+        stats = load_price_files([history], self.store, workers=1)
+        self.assertEqual((stats["rows"], stats["symbols"], stats["skipped"]), (4, 2, 1))
+        aapl = self.store.get("AAPL")
+        self.assertIsInstance(aapl.closes, np.memmap)
+        np.testing.assert_allclose(aapl.closes, [198.5, 200.0])
+
+        # A nightly file extends the stored histories
+        nightly = self.write('nightly.csv', 'symbol,date,close\nAAPL,2024-08-16,201\nMSFT,2024-08-16,401\n')
+        load_price_files([nightly], self.store, workers=2)
+        np.testing.assert_allclose(self.store.get("AAPL").closes, [198.5, 200.0, 201.0])
+        self.assertEqual(len(self.store.get("MSFT").dates), 2)
+
+    def test_load_files_out_of_order(self):
+        nightly = self.write('nightly.csv', 'symbol,date,close\nAAA,2024-06-03,11\n')
+        full = self.write('full.csv', 'symbol,date,close\nAAA,2024-05-30,5.4\nAAA,2024-05-31,5.5\n'
+                                      'AAA,2024-06-03,5.6\n')
+        load_price_files([nightly], self.store, workers=1)
+        load_price_files([full], self.store, workers=1)
+        aaa = self.store.get("AAA")
+        np.testing.assert_array_equal(aaa.dates.astype('datetime64[D]'),
+                                      np.array(['2024-05-30', '2024-05-31', '2024-06-03'], dtype='datetime64[D]'))
+        np.testing.assert_allclose(aaa.closes, [5.4, 5.5, 5.6])
+
+        # The download path still only appends newer days
+        self.store.put("AAA", aaa._replace(closes=aaa.closes * 2))
+        np.testing.assert_allclose(self.store.get("AAA").closes, [5.4, 5.5, 5.6])
+
+
+if __name__ == '__main__':
+    unittest.main()
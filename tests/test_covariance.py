@@ -0,0 +1,89 @@
+import unittest
+
+import numpy as np
+
+from app.covariance import CovarianceService, StreamingCovariance
+
+
+def ledoit_wolf(returns):
+    # Direct implementation of Ledoit & Wolf (2004), scaled like np.cov
+    days, assets = returns.shape
+    centered = returns - returns.mean(axis=0)
+    sample = centered.T @ centered / days
+    target = np.trace(sample) / assets
+    distance = np.sum((sample - target * np.eye(assets)) ** 2)
+    spread = sum(np.sum((np.outer(row, row) - sample) ** 2) for row in centered) / days ** 2
+    intensity = min(spread, distance) / distance
+    return ((1 - intensity) * sample + intensity * target * np.eye(assets)) * days / (days - 1), intensity
+
+
+class TestStreamingCovariance(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        factor = rng.standard_normal((80, 1))
+        self.returns = 0.01 * (factor + rng.standard_normal((80, 6))) + 0.0005
+
+    def test_matches_ledoit_wolf(self):
+        covariance, intensity = StreamingCovariance(6).fit(self.returns).estimate()
+        expected, expected_intensity = ledoit_wolf(self.returns)
+        np.testing.assert_allclose(covariance, expected, rtol=1e-10)
+        self.assertAlmostEqual(intensity, expected_intensity)
+        self.assertTrue(0 < intensity < 1)
+
+        unshrunk, _ = StreamingCovariance(6).fit(self.returns).estimate(shrinkage=False)
+        np.testing.assert_allclose(unshrunk, np.cov(self.returns, rowvar=False), rtol=1e-10)
+
+    def test_updates_match_refit(self):
+        for method in ('expanding', 'ewma', 'rolling'):
+            with self.subTest(method=method):
+                streamed = StreamingCovariance(6, method, window=30, halflife=10).fit(self.returns[:20])
+                for row in self.returns[20:]:
+                    streamed.update(row)
+                refit = StreamingCovariance(6, method, window=30, halflife=10).fit(self.returns)
+                np.testing.assert_allclose(streamed.estimate()[0], refit.estimate()[0], rtol=1e-9)
+
+    def test_rolling_uses_window(self):
+        covariance, _ = StreamingCovariance(6, 'rolling', window=30).fit(self.returns).estimate()
+        np.testing.assert_allclose(covariance, ledoit_wolf(self.returns[-30:])[0], rtol=1e-10)
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            StreamingCovariance(2, 'median')
+        with self.assertRaises(ValueError):
+            StreamingCovariance(2).fit(self.returns[:1, :2]).estimate()
+
+
+class TestCovarianceService(unittest.TestCase):
+
+    def setUp(self):
+        self.returns = np.random.default_rng(1).standard_normal((50, 3)) * 0.01
+        self.dates = np.arange(19000, 19050)
+        self.symbols = ['A', 'B', 'C']
+
+    def test_reuses_and_extends_cached_estimate(self):
+        service = CovarianceService(max_entries=2)
+        first = service.estimate(self.symbols, self.dates[:40], self.returns[:40])
+        self.assertIs(service.estimate(self.symbols, self.dates[:40], self.returns[:40]), first)
+
+        extended = service.estimate(self.symbols, self.dates, self.returns)
+        np.testing.assert_allclose(extended.covariance, ledoit_wolf(self.returns)[0], rtol=1e-10)
+        np.testing.assert_allclose(extended.factor @ extended.factor.T, extended.covariance, rtol=1e-10)
+        self.assertEqual(extended.num_observations, 50)
+
+        # A revised history is rebuilt rather than extended
+        revised = self.returns.copy()
+        revised[39] += 0.001
+        service.estimate(self.symbols, self.dates, revised)
+        self.assertEqual(service.stats, {"hit": 1, "update": 1, "rebuild": 2})
+
+    def test_evicts_least_recently_used(self):
+        service = CovarianceService(max_entries=1)
+        service.estimate(self.symbols, self.dates, self.returns)
+        service.estimate(self.symbols[:2], self.dates, self.returns[:, :2])
+        service.estimate(self.symbols, self.dates, self.returns)
+        self.assertEqual(service.stats["rebuild"], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
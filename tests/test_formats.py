@@ -0,0 +1,72 @@
+import gzip
+import io
+import json
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from flask import Flask
+
+from app import formats
+
+
+class TestFormats(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    def test_npy_chunks_round_trip(self):
+        array = np.arange(24, dtype=np.float32).reshape(2, 3, 4)[:, ::2]  # Not contiguous
+        with patch('app.formats.CHUNK_BYTES', 8):
+            chunks = list(formats.npy_chunks(array))
+        self.assertEqual(len(chunks), 1 + array.nbytes // 8)
+        np.testing.assert_array_equal(np.load(io.BytesIO(b''.join(chunks))), array)
+        self.assertEqual(np.load(io.BytesIO(b''.join(formats.npy_chunks(np.empty((0, 3)))))).shape, (0, 3))
+
+    @unittest.skipUnless(formats.optional_module('pyarrow'), "needs pyarrow")
+    def test_arrow_chunks_are_bounded(self):
+        pa = formats.optional_module('pyarrow')
+        paths = np.arange(2 * 1000 * 50, dtype=np.float64).reshape(2, 1000, 50)
+        with patch('app.formats.CHUNK_BYTES', 40_000):
+            chunks = list(formats.arrow_chunks(formats.arrow_path_batches(['A', 'B'], paths)))
+        self.assertGreater(len(chunks), 10)
+        self.assertLess(max(chunk.nbytes for chunk in chunks), 60_000)
+        table = pa.ipc.open_stream(b''.join(chunks)).read_all()
+        self.assertEqual(table.column('symbol').to_pylist(), ['A'] * 1000 + ['B'] * 1000)
+        values = table.column('values').combine_chunks().flatten().to_numpy()
+        np.testing.assert_array_equal(values.reshape(2, 1000, 50), paths)
+
+    def test_encode_chunks(self):
+        chunks = [b'a' * 1000, memoryview(b'b' * 1000)]
+        self.assertEqual(gzip.decompress(b''.join(formats.encode_chunks(chunks, 'gzip'))), b'a' * 1000 + b'b' * 1000)
+        self.assertEqual(b''.join(formats.encode_chunks(chunks, None)), b'a' * 1000 + b'b' * 1000)
+
+    def test_negotiation(self):
+        cases = [({}, formats.JSON_MIMETYPE), ({"Accept": "*/*"}, formats.JSON_MIMETYPE),
+                 ({"Accept": "text/html"}, formats.JSON_MIMETYPE),
+                 ({"Accept": "application/x-npy"}, formats.NPY_MIMETYPE),
+                 ({"Accept": "application/x-npy;q=0.5, application/json"}, formats.JSON_MIMETYPE)]
+        for headers, expected in cases:
+            with self.app.test_request_context(headers=headers):
+                self.assertEqual(formats.negotiate_format(), expected)
+        with self.app.test_request_context(headers={"Accept": "application/x-npy"}):
+            self.assertEqual(formats.negotiate_format(binary=False), formats.JSON_MIMETYPE)
+
+        with patch.dict(formats._optional_modules, {'zstandard': None}):
+            with self.app.test_request_context(headers={"Accept-Encoding": "zstd, gzip;q=0.5"}):
+                self.assertEqual(formats.negotiate_encoding(), 'gzip')
+            with self.app.test_request_context(headers={"Accept-Encoding": "br"}):
+                self.assertIsNone(formats.negotiate_encoding())
+
+    def test_json_response_is_compressed_when_large(self):
+        with self.app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+            small = formats.json_response({"a": 1})
+            large = formats.json_response({"values": list(range(1000))})
+        self.assertNotIn("Content-Encoding", small.headers)
+        self.assertEqual(large.headers["Content-Encoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(large.get_data())), {"values": list(range(1000))})
+        self.assertIn("Accept-Encoding", large.vary)
+
+
+if __name__ == '__main__':
+    unittest.main()
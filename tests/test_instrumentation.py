@@ -0,0 +1,103 @@
+import json
+import logging
+import unittest
+
+from flask import Flask, jsonify
+
+from app import instrumentation
+from app.instrumentation import JsonFormatter, MetricsRegistry, server_timing, span
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_counter_and_histogram_exposition(self):
+        registry = MetricsRegistry()
+        counter = registry.counter('lookups_total', "Lookups.", ('result',))
+        counter.inc(result='hit')
+        counter.inc(2, result='hit')
+        counter.inc(result='miss')
+        histogram = registry.histogram('latency_seconds', "Latency.", ('stage',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value, stage='fetch')
+        registry.collector(lambda: [("queued", "gauge", "Queued jobs.", [({}, 4)])])
+
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE lookups_total counter', lines)
+        self.assertIn('lookups_total{result="hit"} 3', lines)
+        self.assertIn('lookups_total{result="miss"} 1', lines)
+        self.assertIn('latency_seconds_bucket{stage="fetch",le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{stage="fetch",le="1.0"} 2', lines)
+        self.assertIn('latency_seconds_bucket{stage="fetch",le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_sum{stage="fetch"} 5.55', lines)
+        self.assertIn('latency_seconds_count{stage="fetch"} 3', lines)
+        self.assertIn('queued 4', lines)
+        self.assertIs(registry.counter('lookups_total', "Lookups.", ('result',)), counter)
+        with self.assertRaises(ValueError):
+            registry.histogram('lookups_total', "Lookups.")
+
+    def test_failing_collector_is_skipped(self):
+        registry = MetricsRegistry()
+        registry.counter('requests_total', "Requests.").inc()
+
+        def broken():
+            raise RuntimeError("boom")
+
+        registry.collector(broken)
+        with self.assertLogs('app.instrumentation', level='ERROR'):
+            self.assertIn('requests_total 1', registry.render())
+
+    def test_server_timing(self):
+        self.assertEqual(server_timing({"fetch": 0.0125, "parse": 0.001}, total=0.02),
+                         "fetch;dur=12.50, parse;dur=1.00, total;dur=20.00")
+
+
+class TestRequestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        instrumentation.init_app(self.app)
+        instrumentation.init_app(self.app)  # Idempotent
+
+        @self.app.route('/work')
+        def work():
+            with span('optimize'):
+                pass
+            with span('optimize'):
+                pass
+            return jsonify({"ok": True})
+
+        self.client = self.app.test_client()
+
+    def test_server_timing_header_and_histograms(self):
+        before = instrumentation.STAGE_SECONDS.samples()
+        response = self.client.get('/work')
+        self.assertEqual(response.get_json(), {"ok": True})
+        entries = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+        self.assertEqual(entries, ['optimize', 'serialize', 'total'])
+
+        def count(samples, stage):
+            return sum(value for suffix, labels, value in samples if suffix == '_count' and labels['stage'] == stage)
+
+        after = instrumentation.STAGE_SECONDS.samples()
+        self.assertEqual(count(after, 'optimize') - count(before, 'optimize'), 2)
+        self.assertIn('endpoint="work"', instrumentation.REGISTRY.render())
+
+    def test_spans_outside_requests_only_feed_the_histogram(self):
+        with span('parse'):
+            pass
+        self.assertIsNone(instrumentation._request_timings.get())
+
+
+class TestJsonFormatter(unittest.TestCase):
+
+    def test_extra_fields(self):
+        record = logging.LogRecord('app.routes', logging.INFO, __file__, 1, "Stored %s", ("portfolio",), None)
+        record.portfolio_id = 'abc'
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "Stored portfolio")
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual(entry["portfolio_id"], "abc")
+
+
+if __name__ == '__main__':
+    unittest.main()
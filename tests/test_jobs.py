@@ -0,0 +1,147 @@
+import os
+import tempfile
+import threading
+import time
+import sqlite3
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from app.jobs import CANCELLED, FAILED, SUCCEEDED, JobQueue, JobStore, QueueFullError
+
+
+def wait_for(queue, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        state, result = queue.get(job_id)
+        if state["status"] in (SUCCEEDED, FAILED, CANCELLED):
+            return state, result
+        time.sleep(0.005)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = JobStore(os.path.join(directory.name, 'jobs.sqlite3'))
+
+    def test_priority_order_and_results(self):
+        queue = JobQueue(workers=1, store=self.store)
+        gate = threading.Event()
+        order = []
+        blocker = queue.submit('block', lambda progress: gate.wait(5))
+        low = queue.submit('work', lambda progress: order.append('low') or 'low', priority=0)
+        high = queue.submit('work', lambda progress: order.append('high') or {"value": 'high'}, priority=5)
+        self.assertEqual(queue.stats["queued"], 2)
+        gate.set()
+
+        self.assertEqual(wait_for(queue, low.job_id)[1], 'low')
+        state, result = wait_for(queue, high.job_id)
+        self.assertEqual(result, {"value": 'high'})
+        self.assertEqual(order, ['high', 'low'])
+        wait_for(queue, blocker.job_id)
+
+        stats = queue.stats
+        self.assertEqual((stats["succeeded"], stats["queued"], stats["running"]), (3, 0, 0))
+        self.assertEqual(stats["run_seconds"]["count"], 3)
+        self.assertGreater(stats["wait_seconds"]["p95"], 0)
+
+        # Finished jobs are served from the store, also by another queue sharing it.
+        self.assertEqual(JobQueue(workers=0, store=self.store).get(high.job_id)[1], {"value": 'high'})
+
+    def test_progress_and_cancellation(self):
+        queue = JobQueue(workers=1, store=self.store)
+        started = threading.Event()
+
+        def work(progress):
+            for done in range(1, 1000):
+                progress(done, 1000)
+                started.set()
+                time.sleep(0.001)
+            return 'finished'
+
+        running = queue.submit('work', work)
+        queued = queue.submit('work', work)
+        started.wait(5)
+        self.assertGreater(queue.get(running.job_id)[0]["progress"]["done"], 0)
+        self.assertEqual(queue.get(running.job_id)[0]["progress"]["total"], 1000)
+
+        self.assertEqual(queue.cancel(queued.job_id)["status"], CANCELLED)
+        queue.cancel(running.job_id)
+        self.assertEqual(wait_for(queue, running.job_id)[0]["status"], CANCELLED)
+        self.assertEqual(queue.get(queued.job_id)[0]["status"], CANCELLED)
+        self.assertIsNone(queue.cancel('unknown'))
+
+    def test_other_process_sees_progress_and_cancels(self):
+        # Two queues on one store stand for two worker processes; only `owner` runs jobs
+        owner = JobQueue(workers=1, store=self.store, sync_seconds=0)
+        other = JobQueue(workers=0, store=self.store)
+        gate, started = threading.Event(), threading.Event()
+
+        def work(progress):
+            for done in range(1, 100000):
+                progress(done, 100000)
+                started.set()
+                time.sleep(0.001)
+            return 'finished'
+
+        running = owner.submit('work', work)
+        queued = owner.submit('work', lambda progress: gate.wait(5))
+        started.wait(5)
+        time.sleep(0.05)
+        self.assertGreater(other.get(running.job_id)[0]["progress"]["done"], 0)
+        self.assertEqual(other.get(running.job_id)[0]["progress"]["total"], 100000)
+
+        for job in (queued, running):
+            state = other.cancel(job.job_id)
+            self.assertIn(state["status"], ('queued', 'running'))
+            self.assertTrue(state["cancel_requested"])
+        self.assertEqual(wait_for(other, running.job_id)[0]["status"], CANCELLED)
+        self.assertEqual(wait_for(other, queued.job_id)[0]["status"], CANCELLED)
+        self.assertFalse(gate.is_set())
+        # Finished jobs are left alone
+        self.assertEqual(other.cancel(running.job_id)["status"], CANCELLED)
+
+    def test_failures_and_bounded_queue(self):
+        queue = JobQueue(workers=0, max_queued=1)
+        queue.submit('work', lambda progress: 1)
+        with self.assertRaises(QueueFullError):
+            queue.submit('work', lambda progress: 2)
+
+        queue = JobQueue(workers=1, store=self.store)
+        job = queue.submit('work', lambda progress: 1 / 0)
+        state, result = wait_for(queue, job.job_id)
+        self.assertEqual(state["status"], FAILED)
+        self.assertIn("division by zero", state["error"])
+        self.assertIsNone(result)
+
+    def test_unstorable_results(self):
+        queue = JobQueue(workers=1, store=self.store)
+        job = queue.submit('work', lambda progress: {"values": np.arange(3)})
+        state, result = wait_for(queue, job.job_id)
+        self.assertEqual(state["status"], FAILED)
+        self.assertIn("could not be stored", state["error"])
+        self.assertIsNone(result)
+        self.assertEqual(JobQueue(workers=0, store=self.store).get(job.job_id)[0]["status"], FAILED)
+        self.assertEqual((queue.stats["succeeded"], queue.stats["failed"]), (0, 1))
+
+        # A job whose final state the store rejects stays in memory with it
+        save = self.store.save
+
+        def fail_when_finished(job):
+            if job.status == SUCCEEDED:
+                raise sqlite3.OperationalError("disk I/O error")
+            save(job)
+
+        with patch.object(self.store, 'save', side_effect=fail_when_finished):
+            job = queue.submit('work', lambda progress: 'done')
+            state, result = wait_for(queue, job.job_id)
+        self.assertEqual((state["status"], result), (SUCCEEDED, 'done'))
+        self.assertEqual(self.store.load(job.job_id)[0]["status"], 'running')
+
+
+if __name__ == '__main__':
+    unittest.main()
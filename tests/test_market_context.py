@@ -0,0 +1,73 @@
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from app.calculations import (
+    build_market_context,
+    enhanced_tax_loss_harvesting,
+    fetch_current_prices,
+    optimize_portfolio
+)
+from app.price_store import PriceHistory
+from helpers import make_stock_data, serve_stock_data
+
+
+STOCK_DATA = {
+    "AAPL": make_stock_data([100, 102, 101, 104, 103, 106]),
+    "MSFT": make_stock_data([50, 49, 51, 52, 50], start='2024-01-02'),
+    "NOPE": {"error": "Invalid symbol or data not available"},
+}
+
+
+class TestMarketDataContext(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch('app.calculations.fetch_price_history', side_effect=serve_stock_data(STOCK_DATA))
+        self.mock_fetch_price_history = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.portfolio = [
+            {"symbol": "AAPL", "purchase_price": 110, "shares": 10},
+            {"symbol": "MSFT", "purchase_price": 40, "shares": 5},
+            {"symbol": "AAPL", "purchase_price": 90, "shares": 3},
+            {"symbol": "NOPE", "purchase_price": 10, "shares": 1},
+        ]
+
+    def test_nothing_is_fetched_until_needed(self):
+        build_market_context(self.portfolio)
+        self.mock_fetch_price_history.assert_not_called()
+
+    def test_symbols_are_fetched_once_and_aligned(self):
+        context = build_market_context(self.portfolio)
+        self.assertEqual(context.symbols, ["AAPL", "MSFT"])
+        self.assertEqual(context.closing_prices.shape, (5, 2))
+        np.testing.assert_allclose(context.closing_prices[:, 0], [102, 101, 104, 103, 106])
+        self.assertEqual(context.latest_prices, {"AAPL": 106.0, "MSFT": 50.0})
+        self.assertEqual(context.covariance.shape, (2, 2))
+        self.assertIs(context.covariance, context.covariance)
+        self.assertEqual(self.mock_fetch_price_history.call_count, 3)
+
+    def test_prices_keep_full_precision(self):
+        history = PriceHistory(np.array([19723, 19724]), np.array([100.123456789, 101.987654321]))
+        self.mock_fetch_price_history.side_effect = lambda symbol: history
+        context = build_market_context([{"symbol": "AAPL", "purchase_price": 90, "shares": 1}])
+        np.testing.assert_array_equal(context.closing_prices[:, 0], history.closes)
+
+    def test_current_prices_do_not_mutate_portfolio(self):
+        updated = fetch_current_prices(self.portfolio)
+        self.assertEqual([security["current_price"] for security in updated], [106.0, 50.0, 106.0, None])
+        self.assertNotIn("current_price", self.portfolio[0])
+
+    def test_calculations_share_one_context(self):
+        context = build_market_context(self.portfolio)
+        optimal_weights, _, _, _ = optimize_portfolio(self.portfolio, context=context)
+        self.assertEqual(list(optimal_weights), ["AAPL", "MSFT"])
+
+        recommended_sales, total_losses, _ = enhanced_tax_loss_harvesting(self.portfolio, 0.2, context=context)
+        self.assertEqual([sale["symbol"] for sale in recommended_sales], ["AAPL"])
+        self.assertAlmostEqual(total_losses, 40.0)
+        self.assertEqual(self.mock_fetch_price_history.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
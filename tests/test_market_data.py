@@ -0,0 +1,154 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from app.market_data import AlphaVantageClient, FallbackProvider, OfflineProvider, TokenBucket, resolve_provider
+
+
+class StubAlphaVantage(BaseHTTPRequestHandler):
+    """Mimics the Alpha Vantage daily endpoint, throttling the first ``throttle`` requests."""
+
+    def do_GET(self):
+        server = self.server
+        symbol = parse_qs(urlparse(self.path).query)["symbol"][0]
+        with server.lock:
+            server.requests.append(symbol)
+            throttled = server.throttle > 0
+            server.throttle -= 1
+        time.sleep(server.delay)
+
+        if throttled:
+            body = {"Note": "Thank you for using Alpha Vantage! Our standard API call frequency is 5 calls per minute."}
+        elif symbol == "NOPE":
+            body = {"Error Message": "Invalid API call."}
+        else:
+            body = {
+                "Meta Data": {"2. Symbol": symbol},
+                "Time Series (Daily)": {"2024-08-15": {"4. close": "200.0000"}},
+            }
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestMarketDataClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubAlphaVantage)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.throttle = 0
+        self.server.delay = 0.0
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/query"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_client(self, **kwargs):
+        kwargs.setdefault("requests_per_minute", 6000)
+        return AlphaVantageClient("demo", base_url=self.url, backoff=0.01, **kwargs)
+
+    def test_fetch_many_runs_concurrently(self):
+        self.server.delay = 0.2
+        client = self.make_client(max_workers=8)
+        started = time.monotonic()
+        results = client.fetch_many(["AAPL", "MSFT", "GOOG", "AMZN", "aapl"])
+        elapsed = time.monotonic() - started
+        self.assertEqual(sorted(results), ["AAPL", "AMZN", "GOOG", "MSFT"])
+        self.assertEqual(results["AAPL"]["2024-08-15"]["4. close"], "200.0000")
+        self.assertLess(elapsed, 0.6)
+
+    def test_duplicate_in_flight_requests_are_coalesced(self):
+        self.server.delay = 0.2
+        client = self.make_client()
+        threads = [threading.Thread(target=client.fetch_daily, args=("AAPL",)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.server.requests, ["AAPL"])
+        self.assertEqual(client.stats["coalesced"], 4)
+
+    def test_throttled_requests_back_off_and_retry(self):
+        self.server.throttle = 2
+        client = self.make_client()
+        result = client.fetch_daily("AAPL")
+        self.assertIn("2024-08-15", result)
+        self.assertEqual(client.stats["throttled"], 2)
+        self.assertEqual(client.bucket.stalls, 2)
+
+    def test_retries_are_bounded(self):
+        self.server.throttle = 10
+        client = self.make_client(max_retries=1)
+        self.assertIn("rate limit", client.fetch_daily("AAPL")["error"])
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_invalid_symbol(self):
+        client = self.make_client()
+        self.assertEqual(client.fetch_daily("NOPE"), {"error": "Invalid symbol or data not available"})
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_bucket_limits_rate(self):
+        now = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        bucket = TokenBucket(60, capacity=2, clock=lambda: now[0], sleep=sleep)
+        for _ in range(5):
+            bucket.acquire()
+        # Two requests from the initial burst, then one per second.
+        self.assertAlmostEqual(now[0], 3.0)
+
+        bucket.stall(10)
+        bucket.acquire()
+        self.assertGreaterEqual(now[0], 13.0)
+
+
+
+class FakeProvider:
+
+    max_workers = 32
+
+    def __init__(self, symbols=("VEND",)):
+        self.symbols = symbols
+
+    def fetch_daily(self, symbol):
+        if symbol in self.symbols:
+            return {"2024-08-15": {"4. close": "10.0"}}
+        return {"error": "Not in the vendor feed"}
+
+
+class TestProviders(unittest.TestCase):
+
+    def test_resolve_provider(self):
+        self.assertIsInstance(resolve_provider('offline'), OfflineProvider)
+        provider = resolve_provider(f'{__name__}:FakeProvider, offline')
+        self.assertIsInstance(provider, FallbackProvider)
+        self.assertEqual(provider.max_workers, 32)
+        self.assertIn("2024-08-15", provider.fetch_daily("VEND"))
+        self.assertEqual(provider.fetch_daily("AAPL"), {"error": "No price data loaded for AAPL"})
+
+        for spec in ('bloomberg', 'app.nowhere:Provider', ' , '):
+            with self.assertRaises(ValueError):
+                resolve_provider(spec)
+
+
+if __name__ == '__main__':
+    unittest.main()
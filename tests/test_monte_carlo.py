@@ -0,0 +1,91 @@
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from app import monte_carlo
+from app.monte_carlo import estimate_portfolio_statistics, factor_covariance, simulate_growth
+
+
+class TestMonteCarloEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.mean_returns = np.array([0.0005, 0.0002])
+        self.covariance_matrix = np.array([[4e-4, 1e-4], [1e-4, 2e-4]])
+
+    def test_shape_and_dtype(self):
+        simulations = simulate_growth(self.mean_returns, self.covariance_matrix, 300, 20, seed=1,
+                                      dtype=np.float32)
+        self.assertEqual(simulations.shape, (2, 300, 20))
+        self.assertEqual(simulations.dtype, np.float32)
+
+    def test_seed_is_reproducible(self):
+        first = simulate_growth(self.mean_returns, self.covariance_matrix, 100, 10, seed=7)
+        second = simulate_growth(self.mean_returns, self.covariance_matrix, 100, 10, seed=7)
+        np.testing.assert_array_equal(first, second)
+
+    def test_moments_match_inputs(self):
+        simulations = simulate_growth(self.mean_returns, self.covariance_matrix, 4000, 50, seed=3)
+        log_returns = np.log(simulations).reshape(2, -1)
+        np.testing.assert_allclose(log_returns.mean(axis=1), self.mean_returns, atol=2e-4)
+        np.testing.assert_allclose(np.cov(log_returns), self.covariance_matrix, rtol=0.05)
+
+    def test_semi_definite_covariance(self):
+        factor = factor_covariance(np.ones((2, 2)) * 1e-4)
+        np.testing.assert_allclose(factor @ factor.T, np.ones((2, 2)) * 1e-4, atol=1e-12)
+
+    def test_worker_count_does_not_change_results(self):
+        with patch.object(monte_carlo, 'PARALLEL_THRESHOLD', 0):
+            serial = simulate_growth(self.mean_returns, self.covariance_matrix, 600, 15, seed=11)
+            parallel = simulate_growth(self.mean_returns, self.covariance_matrix, 600, 15, seed=11,
+                                       workers=2)
+        np.testing.assert_array_equal(serial, parallel)
+
+    def test_antithetic_paths_mirror_each_other(self):
+        simulations = simulate_growth(self.mean_returns, self.covariance_matrix, 256, 5, seed=2,
+                                      sampling='antithetic')
+        shocks = np.log(simulations) - self.mean_returns[:, None, None]
+        np.testing.assert_allclose(shocks[:, :128], -shocks[:, 128:], atol=1e-12)
+
+    def test_sobol_blocks_form_one_sequence(self):
+        with patch.object(monte_carlo, 'BLOCK_SIZE', 64), patch.object(monte_carlo, 'PARALLEL_THRESHOLD', 0):
+            blocks = simulate_growth(self.mean_returns, self.covariance_matrix, 256, 5, seed=4, sampling='sobol',
+                                     workers=2)
+        whole = simulate_growth(self.mean_returns, self.covariance_matrix, 256, 5, seed=4, sampling='sobol')
+        np.testing.assert_allclose(blocks, whole)
+        with self.assertRaises(ValueError):
+            simulate_growth(self.mean_returns, self.covariance_matrix, 8, 20000, sampling='sobol')
+
+    def test_adaptive_estimate_reaches_target(self):
+        weights = np.array([0.5, 0.5])
+        pseudo = estimate_portfolio_statistics(self.mean_returns, self.covariance_matrix, weights, time_horizon=20,
+                                               seed=5, target_standard_error=0.0005, batch_size=256,
+                                               statistics=('expected_return',))
+        self.assertTrue(pseudo["converged"])
+        self.assertLessEqual(pseudo["statistics"]["expected_return"]["standard_error"], 0.0005)
+        self.assertEqual(pseudo["num_simulations"], 256 * pseudo["batches"])
+
+        antithetic = estimate_portfolio_statistics(self.mean_returns, self.covariance_matrix, weights,
+                                                   time_horizon=20, seed=5, target_standard_error=0.0005,
+                                                   batch_size=256, statistics=('expected_return',),
+                                                   sampling='antithetic')
+        self.assertLess(antithetic["num_simulations"], pseudo["num_simulations"])
+
+        exact = weights @ np.exp(20 * (self.mean_returns + np.diag(self.covariance_matrix) / 2)) - 1
+        controlled = estimate_portfolio_statistics(self.mean_returns, self.covariance_matrix, weights,
+                                                   num_simulations=1024, time_horizon=20, seed=5,
+                                                   control_variates=True)
+        self.assertAlmostEqual(controlled["statistics"]["expected_return"]["estimate"], exact, places=10)
+        self.assertIsNone(controlled["converged"])
+        self.assertEqual(controlled["batches"], monte_carlo.MIN_BATCHES)
+
+    def test_estimate_stops_at_budget(self):
+        result = estimate_portfolio_statistics(self.mean_returns, self.covariance_matrix, np.array([0.5, 0.5]),
+                                               time_horizon=20, seed=5, target_standard_error=1e-6,
+                                               max_simulations=1000, batch_size=256)
+        self.assertFalse(result["converged"])
+        self.assertEqual(result["num_simulations"], 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
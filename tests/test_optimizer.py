@@ -0,0 +1,127 @@
+import unittest
+
+import numpy as np
+from scipy.optimize import minimize
+
+from app.optimizer import efficient_frontier, max_sharpe_weights, min_variance_weights, solve_qp
+
+
+def make_moments(num_assets, seed=0):
+    rng = np.random.default_rng(seed)
+    factors = rng.normal(0, 0.01, (750, 3))
+    loadings = rng.normal(1, 0.3, (3, num_assets))
+    returns = factors @ loadings / 3 + rng.normal(0.0004, 0.01, (750, num_assets))
+    return returns.mean(axis=0) * 252, np.cov(returns, rowvar=False) * 252
+
+
+def sharpe_ratio(weights, expected_returns, covariance_matrix, risk_free_rate=0.01):
+    return (weights @ expected_returns - risk_free_rate) / np.sqrt(weights @ covariance_matrix @ weights)
+
+
+class TestOptimizer(unittest.TestCase):
+
+    def setUp(self):
+        self.expected_returns, self.covariance_matrix = make_moments(25)
+
+    def test_max_sharpe_matches_slsqp(self):
+        weights = max_sharpe_weights(self.expected_returns, self.covariance_matrix)
+        reference = minimize(
+            lambda w: -sharpe_ratio(w, self.expected_returns, self.covariance_matrix), np.full(25, 1 / 25),
+            method='SLSQP', bounds=[(0, 1)] * 25, constraints={'type': 'eq', 'fun': lambda w: w.sum() - 1},
+            options={'ftol': 1e-14, 'maxiter': 1000}).x
+        self.assertAlmostEqual(weights.sum(), 1.0)
+        self.assertGreaterEqual(weights.min(), 0.0)
+        self.assertAlmostEqual(sharpe_ratio(weights, self.expected_returns, self.covariance_matrix),
+                               sharpe_ratio(reference, self.expected_returns, self.covariance_matrix), places=8)
+
+    def test_deterministic_and_warm_start_independent(self):
+        first = max_sharpe_weights(self.expected_returns, self.covariance_matrix)
+        second = max_sharpe_weights(self.expected_returns, self.covariance_matrix, initial_weights=first)
+        np.testing.assert_allclose(first, second, atol=1e-10)
+
+    def test_bounds_and_groups(self):
+        bounds = [(0.0, 0.1)] * 25
+        bounds[3] = (0.05, 0.1)
+        groups = [(range(0, 10), 0.5, None), (range(10, 25), None, 0.5)]
+        weights = max_sharpe_weights(self.expected_returns, self.covariance_matrix, bounds=bounds, groups=groups)
+        self.assertLessEqual(weights.max(), 0.1 + 1e-9)
+        self.assertGreaterEqual(weights[3], 0.05 - 1e-9)
+        self.assertGreaterEqual(weights[:10].sum(), 0.5 - 1e-9)
+        self.assertAlmostEqual(weights.sum(), 1.0)
+
+    def test_infeasible_constraints(self):
+        mu, covariance_matrix = self.expected_returns[:3], self.covariance_matrix[:3, :3]
+        for solve in (lambda **limits: max_sharpe_weights(mu, covariance_matrix, **limits),
+                      lambda **limits: min_variance_weights(covariance_matrix, **limits)):
+            with self.assertRaises(ValueError):
+                solve(bounds=[(0, 0.1)] * 3)
+            with self.assertRaises(ValueError):
+                solve(bounds=[(0.5, 1)] * 3)
+            with self.assertRaises(ValueError):
+                solve(groups=[([0, 1], None, 0.4), ([2], None, 0.4)])
+
+    def test_min_variance_without_binding_bounds(self):
+        covariance_matrix = np.diag([0.04, 0.09, 0.16])
+        inverse = 1 / np.diag(covariance_matrix)
+        np.testing.assert_allclose(min_variance_weights(covariance_matrix), inverse / inverse.sum(), atol=1e-10)
+
+    def test_no_asset_beats_risk_free_rate(self):
+        weights = max_sharpe_weights(self.expected_returns, self.covariance_matrix, risk_free_rate=10.0)
+        np.testing.assert_allclose(weights, min_variance_weights(self.covariance_matrix), atol=1e-10)
+
+    def test_efficient_frontier(self):
+        targets, weights, risks, solved = efficient_frontier(self.expected_returns, self.covariance_matrix,
+                                                             num_points=10)
+        self.assertTrue(solved.all())
+        np.testing.assert_allclose(weights @ self.expected_returns, targets, atol=1e-9)
+        np.testing.assert_allclose(weights.sum(axis=1), 1.0)
+        self.assertTrue(np.all(np.diff(risks) > -1e-12))
+
+        # The tangency portfolio lies on the frontier.
+        tangency = max_sharpe_weights(self.expected_returns, self.covariance_matrix)
+        _, _, risk, _ = efficient_frontier(self.expected_returns, self.covariance_matrix,
+                                           target_returns=[tangency @ self.expected_returns])
+        self.assertAlmostEqual(risk[0], np.sqrt(tangency @ self.covariance_matrix @ tangency), places=8)
+
+    def test_unattainable_targets(self):
+        _, weights, _, solved = efficient_frontier(self.expected_returns, self.covariance_matrix,
+                                                   target_returns=[self.expected_returns.max() + 1])
+        self.assertFalse(solved[0])
+        self.assertTrue(np.isnan(weights).all())
+
+    def test_per_problem_rows_and_bounds(self):
+        # min 1/2 |x - c|^2 with sum(x) = 1, a budget row that differs per problem and per-problem bounds
+        c = np.array([0.6, 0.3, 0.1])
+        rows = np.array([[[1.0, 0.0], [0.0, 1.0], [0.0, 0.0]]])
+        upper = np.array([[1.0, 0.2], [1.0, 1.0], [1.0, 1.0]])
+        x, solved = solve_qp(np.eye(3), -np.column_stack([c, c]), np.ones((1, 3)), [[1.0, 1.0], [-np.inf, -np.inf]],
+                             [[1.0, 1.0], [0.5, 0.2]], np.zeros(3), upper, A_batch=rows)
+        self.assertTrue(solved.all())
+        np.testing.assert_allclose(x[:, 0], [0.5, 0.35, 0.15], atol=1e-9)
+        np.testing.assert_allclose(x[:, 1], [0.2, 0.2, 0.6], atol=1e-9)
+
+    def test_low_rank_factors(self):
+        # Same problems with P given as diagonal plus low-rank, the way rebalance_weights passes it
+        rng = np.random.default_rng(0)
+        U = rng.standard_normal((2, 6))
+        W = np.array([[2.0, 0.5], [0.5, 1.0]])
+        d = np.full(6, 0.1)
+        P = np.diag(d) + U.T @ W @ U
+        q = rng.standard_normal((6, 3))
+        rows = rng.uniform(0, 1, (1, 6, 3))
+        args = (P, q, np.ones((1, 6)), [[1.0] * 3, [-np.inf] * 3], [[1.0] * 3, [0.5] * 3], np.zeros(6), np.ones(6))
+        dense, dense_solved = solve_qp(*args, A_batch=rows)
+        factored, factored_solved = solve_qp(*args, A_batch=rows, P_factors=(d, U, W))
+        self.assertTrue(dense_solved.all() and factored_solved.all())
+        np.testing.assert_allclose(factored, dense, atol=1e-8)
+
+    def test_degenerate_vertex(self):
+        # x = 0 is optimal with more active constraints than variables
+        x, solved = solve_qp(np.eye(2) * 1e-9, [1.0, 1.0], np.array([[1.0, 1.0], [1.0, -1.0]]), [0.0, 0.0],
+                             [np.inf, 0.0], np.zeros(2), np.ones(2))
+        self.assertTrue(solved)
+        np.testing.assert_allclose(x, 0.0, atol=1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()
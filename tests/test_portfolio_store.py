@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from app.portfolio_store import PortfolioEncodingError, PortfolioStore, decode_positions, encode_positions
+
+
+class TestPortfolioEncoding(unittest.TestCase):
+
+    def test_round_trip(self):
+        positions = [
+            {"symbol": "AAPL", "purchase_price": 150.25, "shares": 10},
+            {"symbol": "MSFT", "purchase_price": 300, "shares": 2.5, "purchase_date": "2023-04-03", "note": "ira"},
+            {"symbol": "AAPL", "lots": [
+                {"acquired": "2021-01-04", "quantity": 5, "basis": 120.5, "lot_id": "a1"},
+                {"acquired": "2022-02-01", "quantity": 7, "basis": 160, "lot_id": "a2"}
+            ]},
+        ]
+        self.assertEqual(decode_positions(encode_positions(positions)), positions)
+        self.assertEqual(decode_positions(encode_positions([])), [])
+
+    def test_encoding_is_compact(self):
+        positions = [{"symbol": f"S{i % 500}", "purchase_price": 100 + i / 7, "shares": i % 90 + 1}
+                     for i in range(20000)]
+        blob = encode_positions(positions)
+        self.assertLess(len(blob), 20000 * 24)
+        self.assertEqual(decode_positions(blob), positions)
+
+    def test_rejects_foreign_blobs(self):
+        with self.assertRaises(PortfolioEncodingError):
+            decode_positions(b'not a portfolio')
+
+
+class TestPortfolioStore(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'portfolios.sqlite3')
+        self.store = PortfolioStore(self.path, cache_entries=2, keep_revisions=2)
+
+    def test_versions(self):
+        first = self.store.save([{"symbol": "AAPL", "shares": 1}], {"tax_bracket": 0.3})
+        second = self.store.save([{"symbol": "AAPL", "shares": 2}], {"tax_bracket": 0.3},
+                                 portfolio_id=first.portfolio_id)
+        self.assertEqual((first.version, second.version), (1, 2))
+        self.assertNotEqual(first.fingerprint, second.fingerprint)
+
+        latest = self.store.load(first.portfolio_id)
+        self.assertEqual(latest.version, 2)
+        self.assertEqual(latest.positions, [{"symbol": "AAPL", "shares": 2}])
+        self.assertEqual(self.store.load(first.portfolio_id, version=1).positions, [{"symbol": "AAPL", "shares": 1}])
+
+        # Older revisions are pruned and deleted portfolios disappear.
+        self.store.save([], portfolio_id=first.portfolio_id)
+        self.assertIsNone(self.store.load(first.portfolio_id, version=1))
+        self.store.delete(first.portfolio_id)
+        self.assertIsNone(self.store.load(first.portfolio_id))
+        self.assertIsNone(self.store.load(None))
+
+    def test_concurrent_saves(self):
+        # Every thread has its own connection; each save must get its own version
+        portfolio_id = self.store.save([]).portfolio_id
+        store = PortfolioStore(self.path, keep_revisions=100)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            saved = list(pool.map(lambda shares: store.save([{"symbol": "AAPL", "shares": shares}],
+                                                            portfolio_id=portfolio_id), range(40)))
+        self.assertEqual(sorted(stored.version for stored in saved), list(range(2, 42)))
+
+    def test_persists_across_instances(self):
+        stored = self.store.save([{"symbol": "MSFT", "purchase_price": 10, "shares": 3}], {"income": 1})
+        reopened = PortfolioStore(self.path).load(stored.portfolio_id)
+        self.assertEqual(reopened.positions, stored.positions)
+        self.assertEqual(reopened.tax_data, {"income": 1})
+        self.assertEqual(reopened.fingerprint, stored.fingerprint)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+
+import numpy as np
+
+from app.price_matrix import PriceMatrix
+from app.price_store import PriceHistory
+
+
+def day(date):
+    return np.datetime64(date, 'D').astype(np.int64)
+
+
+class TestPriceMatrix(unittest.TestCase):
+
+    def setUp(self):
+        # NEW lists on the 3rd and OLD has a gap on the 4th.
+        self.matrix = PriceMatrix.from_series({
+            "OLD": {
+                "2024-01-05": {"4. close": "14.0"},
+                "2024-01-03": {"4. close": "12.0"},
+                "2024-01-02": {"4. close": "11.0"},
+                "2024-01-01": {"4. close": "10.0"},
+            },
+            "NEW": {
+                "2024-01-03": {"4. close": "20.0"},
+                "2024-01-05": {"4. close": "22.0"},
+                "2024-01-04": {"4. close": "21.0"},
+            },
+            "BAD": {"error": "Invalid symbol or data not available"},
+        })
+
+    def test_parse_builds_sorted_union_with_mask(self):
+        self.assertEqual(self.matrix.symbols, ["OLD", "NEW"])
+        self.assertEqual(self.matrix.shape, (5, 2))
+        self.assertEqual(self.matrix.dates[0], day('2024-01-01'))
+        self.assertTrue(np.all(np.diff(self.matrix.dates) > 0))
+        np.testing.assert_array_equal(self.matrix.mask[:, 1], [False, False, True, True, True])
+        self.assertTrue(self.matrix.values.flags['C_CONTIGUOUS'])
+        self.assertEqual(self.matrix.latest_prices, {"OLD": 14.0, "NEW": 22.0})
+
+    def test_intersect(self):
+        aligned = self.matrix.align('intersect')
+        np.testing.assert_array_equal(aligned.dates, [day('2024-01-03'), day('2024-01-05')])
+        np.testing.assert_allclose(aligned.values, [[12, 20], [14, 22]])
+
+    def test_forward_fill(self):
+        aligned = self.matrix.align('ffill')
+        np.testing.assert_allclose(aligned.column("OLD"), [12, 12, 14])
+        np.testing.assert_allclose(aligned.column("NEW"), [20, 21, 22])
+
+    def test_drop_short_histories(self):
+        aligned = self.matrix.align('drop', min_coverage=0.7)
+        self.assertEqual(aligned.symbols, ["OLD"])
+        np.testing.assert_allclose(aligned.column("OLD"), [10, 11, 12, 14])
+        self.assertFalse(np.isnan(aligned.log_returns).any())
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            self.matrix.align('nearest')
+
+    def test_from_histories_matches_from_series(self):
+        histories = {
+            symbol: PriceHistory(self.matrix.dates[self.matrix.mask[:, i]],
+                                 self.matrix.values[self.matrix.mask[:, i], i])
+            for i, symbol in enumerate(self.matrix.symbols)
+        }
+        rebuilt = PriceMatrix.from_histories(histories)
+        np.testing.assert_array_equal(rebuilt.dates, self.matrix.dates)
+        np.testing.assert_array_equal(rebuilt.values, self.matrix.values)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from app.price_store import PriceStore, PriceStoreError, format_daily_series, parse_daily_series
+
+
+class FakeDownloader:
+
+    def __init__(self, series):
+        self.series = series
+        self.calls = 0
+
+    def __call__(self, symbol):
+        self.calls += 1
+        return dict(self.series)
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPriceStore(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.clock = FakeClock()
+        self.downloader = FakeDownloader({
+            "2024-08-15": {"4. close": "200.00"},
+            "2024-08-14": {"4. close": "198.50"},
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def make_store(self, **kwargs):
+        return PriceStore(self.downloader, root=self.root, ttl=60, clock=self.clock, **kwargs)
+
+    def test_parse_sorts_chronologically(self):
+        history = parse_daily_series(self.downloader.series)
+        self.assertTrue(np.all(np.diff(history.dates) > 0))
+        np.testing.assert_allclose(history.closes, [198.5, 200.0])
+        self.assertEqual(list(format_daily_series(history)), ["2024-08-15", "2024-08-14"])
+
+    def test_rejects_symbols_that_are_not_file_names(self):
+        store = self.make_store()
+        for symbol in ("../etc/passwd", ".hidden", "A/B", "", "X" * 33, None):
+            with self.assertRaises(PriceStoreError):
+                store.get(symbol)
+            with self.assertRaises(PriceStoreError):
+                store.put(symbol, parse_daily_series(self.downloader.series))
+        self.assertEqual(self.downloader.calls, 0)
+        for symbol in ("brk.b", "^GSPC", "EURUSD=X", "BF-B"):
+            store.get(symbol)
+
+    def test_warm_reads_make_no_downloads(self):
+        store = self.make_store()
+        store.get('AAPL')
+        store.get('aapl')
+        self.assertEqual(self.downloader.calls, 1)
+
+        # A fresh store instance reads the persisted, memory-mapped files.
+        reopened = self.make_store()
+        history = reopened.get('AAPL')
+        self.assertIsInstance(history.closes, np.memmap)
+        self.assertEqual(self.downloader.calls, 1)
+
+    def test_stale_symbol_appends_only_new_days(self):
+        store = self.make_store()
+        store.get('AAPL')
+        self.clock.now += 61
+        self.downloader.series = {
+            "2024-08-16": {"4. close": "201.00"},
+            "2024-08-15": {"4. close": "999.00"},
+        }
+        history = store.get('AAPL')
+        self.assertEqual(self.downloader.calls, 2)
+        np.testing.assert_allclose(history.closes, [198.5, 200.0, 201.0])
+
+    def test_per_symbol_ttl(self):
+        store = self.make_store()
+        store.set_ttl('AAPL', 3600)
+        store.get('AAPL')
+        self.clock.now += 61
+        store.get('AAPL')
+        self.assertEqual(self.downloader.calls, 1)
+
+    def test_hot_tier_evicts_least_recently_used(self):
+        store = self.make_store(hot_entries=2)
+        for symbol in ('AAPL', 'MSFT', 'AAPL', 'GOOG'):
+            store.get(symbol)
+        self.assertEqual(list(store._hot), ['AAPL', 'GOOG'])
+
+    def test_download_error_without_history_raises(self):
+        self.downloader.series = {"error": "Invalid symbol or data not available"}
+        store = self.make_store()
+        with self.assertRaises(PriceStoreError):
+            store.get('NOPE')
+
+    def test_download_error_serves_stale_history(self):
+        store = self.make_store()
+        store.get('AAPL')
+        self.clock.now += 61
+        self.downloader.series = {"error": "Failed to fetch data from Alpha Vantage"}
+        np.testing.assert_allclose(store.get('AAPL').closes, [198.5, 200.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
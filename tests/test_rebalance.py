@@ -0,0 +1,136 @@
+import unittest
+
+import numpy as np
+
+from app.calculations import tax_aware_rebalance
+from app.market_context import MarketDataContext
+from app.price_matrix import PriceMatrix
+from app.rebalance import rebalance_weights, relief_segments
+
+
+class TestReliefSegments(unittest.TestCase):
+
+    def test_lots_are_relieved_cheapest_first(self):
+        capacities, costs, gains, order = relief_segments(
+            [0, 0, 0, 1], [0.2, 0.3, 0.1, 0.4], [0.06, -0.03, 0.02, 0.0], [0.2, -0.1, 0.1, 0.0], 2, 3)
+        np.testing.assert_allclose(capacities, [[0.3, 0.1, 0.2], [0.4, 0.0, 0.0]])
+        np.testing.assert_allclose(costs, [[-0.03, 0.02, 0.06], [0.0, 0.0, 0.0]])
+        np.testing.assert_allclose(gains[0], [-0.1, 0.1, 0.2])
+        self.assertEqual(order.tolist(), [1, 2, 0, 3])
+
+    def test_merged_segments_stay_convex(self):
+        rng = np.random.default_rng(0)
+        cost_rates = rng.normal(0, 0.1, 10)
+        capacities, costs, _, _ = relief_segments(np.zeros(10, dtype=int), np.full(10, 0.1), cost_rates,
+                                                  cost_rates / 0.2, 1, 3)
+        self.assertAlmostEqual(capacities.sum(), 1.0)
+        self.assertTrue(np.all(np.diff(costs[0]) >= 0))
+        self.assertAlmostEqual((capacities * costs).sum(), 0.1 * cost_rates.sum())
+
+
+class TestRebalanceWeights(unittest.TestCase):
+
+    def setUp(self):
+        self.covariance = np.array([[0.04, 0.01, 0.0], [0.01, 0.09, 0.02], [0.0, 0.02, 0.0625]])
+        self.current = np.array([[0.6, 0.3, 0.1]])
+        self.target = np.array([0.3, 0.3, 0.4])
+        # The overweight asset holds a loss lot and a gain lot
+        self.segments = [s[None] for s in relief_segments([0, 0, 1, 2], [0.3, 0.3, 0.3, 0.1], [0.1, -0.05, 0, 0],
+                                                          [0.4, -0.2, 0, 0], 3, 2)[:3]]
+
+    def test_sells_losses_before_gains(self):
+        result = rebalance_weights(self.covariance, self.target, self.current, *self.segments)
+        self.assertTrue(result["solved"][0])
+        np.testing.assert_allclose(result["weights"][0], self.target, atol=1e-9)
+        np.testing.assert_allclose(result["segment_sells"][0, 0], [0.3, 0.0], atol=1e-9)
+        self.assertAlmostEqual(result["tax"][0], -0.015)
+        self.assertAlmostEqual(result["tracking_error_after"][0], 0.0)
+
+    def test_turnover_budget_and_minimum_trade(self):
+        limited = rebalance_weights(self.covariance, self.target, self.current, *self.segments, max_turnover=0.1)
+        self.assertAlmostEqual(limited["sells"].sum(), 0.1)
+
+        # Only gains are left to sell: a budget of 0.02 allows 0.05 of the 0.4 gain-per-unit lot
+        gains_only = [np.array(s) for s in self.segments]
+        gains_only[1][0, 0, 0], gains_only[2][0, 0, 0] = 0.05, 0.2
+        budgeted = rebalance_weights(self.covariance, self.target, self.current, *gains_only, risk_aversion=1000,
+                                     gains_budget=np.array([0.02]))
+        self.assertAlmostEqual(budgeted["realized_gain"][0], 0.02)
+        self.assertTrue(budgeted["solved"][0])
+
+        blocked = rebalance_weights(self.covariance, self.target, self.current, *self.segments, min_trade=0.35)
+        np.testing.assert_allclose(blocked["weights"], self.current)
+
+    def test_batch_matches_single_accounts(self):
+        rng = np.random.default_rng(1)
+        current = rng.dirichlet(np.ones(3), 5)
+        capacities = current[:, :, None] * rng.dirichlet(np.ones(2), (5, 3))
+        gains = np.sort(rng.normal(0.1, 0.3, (5, 3, 2)), axis=2)
+        budgets = np.array([0.0, 0.01, np.inf, 0.005, 0.02])
+        batch = rebalance_weights(self.covariance, self.target, current, capacities, gains * 0.3, gains,
+                                  max_turnover=0.2, gains_budget=budgets)
+        self.assertTrue(batch["solved"].all())
+        for k in range(5):
+            single = rebalance_weights(self.covariance, self.target, current[k:k + 1], capacities[k:k + 1],
+                                       gains[k:k + 1] * 0.3, gains[k:k + 1], max_turnover=0.2,
+                                       gains_budget=budgets[k])
+            np.testing.assert_allclose(batch["weights"][k], single["weights"][0], atol=1e-8)
+            self.assertLessEqual(batch["realized_gain"][k], budgets[k] + 1e-9)
+
+
+class TestTaxAwareRebalance(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        returns = rng.standard_normal((120, 3)) * 0.01
+        values = 100 * np.exp(np.vstack([np.zeros(3), np.cumsum(returns, axis=0)]))
+        self.prices = PriceMatrix(np.arange(19000, 19121), ["AAA", "BBB", "CCC"], values)
+        self.latest = self.prices.latest_prices
+        self.as_of = "2024-06-03"
+
+    def test_relieves_lots_and_reports_tax(self):
+        aaa = self.latest["AAA"]
+        account = {"id": "x", "tax_bracket": 0.4, "long_term_rate": 0.15, "portfolio": [
+            {"symbol": "AAA", "lots": [
+                {"acquired": "2024-01-02", "quantity": 60, "basis": aaa * 0.5, "lot_id": "short-gain"},
+                {"acquired": "2020-01-02", "quantity": 60, "basis": aaa * 0.5, "lot_id": "long-gain"},
+                {"acquired": "2023-01-02", "quantity": 30, "basis": aaa * 1.2, "lot_id": "loss"},
+            ]},
+            {"symbol": "BBB", "shares": 10, "purchase_price": self.latest["BBB"], "purchase_date": "2023-01-02"},
+        ]}
+        context = MarketDataContext.from_prices(["AAA", "BBB", "CCC"], self.prices)
+        result, failed = tax_aware_rebalance([account, {"id": "y", "portfolio": []}],
+                                             target_weights={"AAA": 1, "BBB": 1, "CCC": 1}, context=context,
+                                             as_of=self.as_of)
+        self.assertEqual(failed, {"id": "y", "error": "No portfolio data provided"})
+        self.assertTrue(result["solved"])
+        sale, = [trade for trade in result["trades"] if trade["action"] == "sell"]
+        # The loss goes first, then long-term gains at the lower rate; the short-term lot is kept
+        self.assertEqual([lot["lot_id"] for lot in sale["lots"]], ["loss", "long-gain"])
+        self.assertEqual(sale["lots"][0]["shares"], 30)
+        self.assertEqual(result["realized_short_term_gain"], 0.0)
+        self.assertAlmostEqual(result["estimated_tax"], result["realized_long_term_gain"] * 0.15)
+        self.assertLess(result["tracking_error_after"], result["tracking_error_before"])
+        self.assertAlmostEqual(sum(result["weights"].values()), 1.0)
+        buys = {trade["symbol"] for trade in result["trades"] if trade["action"] == "buy"}
+        self.assertEqual(buys, {"BBB", "CCC"})
+
+    def test_recent_purchases_disallow_losses(self):
+        account = {"portfolio": [
+            {"symbol": "AAA", "lots": [
+                {"acquired": "2023-01-02", "quantity": 100, "basis": self.latest["AAA"] * 1.5},
+                {"acquired": "2024-05-20", "quantity": 1, "basis": self.latest["AAA"]},
+            ]},
+            {"symbol": "BBB", "shares": 1, "purchase_price": self.latest["BBB"], "purchase_date": "2023-01-02"},
+        ]}
+        context = MarketDataContext.from_prices(["AAA", "BBB"], self.prices)
+        result, = tax_aware_rebalance([account], target_weights={"AAA": 0.5, "BBB": 0.5}, context=context,
+                                      as_of=self.as_of)
+        sale, = [trade for trade in result["trades"] if trade["action"] == "sell"]
+        self.assertGreater(sale["disallowed_loss"], 0)
+        self.assertEqual(result["realized_long_term_gain"], 0.0)
+        self.assertEqual(result["estimated_tax"], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
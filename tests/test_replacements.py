@@ -0,0 +1,113 @@
+import unittest
+
+import numpy as np
+
+from app.price_matrix import PriceMatrix
+from app.replacements import ReplacementFinder, SimilarityIndex
+
+
+def make_prices(num_days=120, seed=0):
+    rng = np.random.default_rng(seed)
+    market = rng.standard_normal(num_days) * 0.01
+    returns = {
+        "AAA": market + rng.standard_normal(num_days) * 0.002,
+        "AAB": market + rng.standard_normal(num_days) * 0.002,  # share class of AAA
+        "CLOSE": market + rng.standard_normal(num_days) * 0.004,
+        "LOOSE": market + rng.standard_normal(num_days) * 0.01,
+        "OTHER": rng.standard_normal(num_days) * 0.01,
+        "RECENT": market + rng.standard_normal(num_days) * 0.003,
+    }
+    dates = np.arange(19000, 19000 + num_days + 1)
+    values = np.column_stack([100 * np.exp(np.concatenate([[0.0], np.cumsum(r)])) for r in returns.values()])
+    return PriceMatrix(dates, list(returns), values)
+
+
+class TestSimilarityIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.prices = make_prices()
+        self.index = SimilarityIndex.from_prices(self.prices, lookback=100, identical_groups=[["AAA", "AAB"]])
+
+    def test_ranks_by_tracking_error(self):
+        substitutes = self.index.nearest("AAA", k=3, exclude=["RECENT"])
+        self.assertEqual([s["symbol"] for s in substitutes], ["CLOSE", "LOOSE", "OTHER"])
+        self.assertEqual(len(self.index.returns[0]), 100)
+
+        returns = self.index.returns
+        difference = returns[0] - returns[self.index.symbols.index("CLOSE")]
+        self.assertAlmostEqual(substitutes[0]["tracking_error"], difference.std() * np.sqrt(252))
+        self.assertAlmostEqual(substitutes[0]["correlation"], np.corrcoef(returns[0], returns[2])[0, 1])
+        self.assertGreater(substitutes[0]["beta"], 0)
+
+    def test_excludes_identical_securities(self):
+        symbols = [s["symbol"] for s in self.index.nearest("AAB", k=10)]
+        self.assertNotIn("AAA", symbols)
+        self.assertNotIn("AAB", symbols)
+
+        index = SimilarityIndex.from_prices(self.prices, lookback=100, max_correlation=0.9)
+        self.assertNotIn("AAB", [s["symbol"] for s in index.nearest("AAA", k=10)])
+
+    def test_target_outside_index(self):
+        index = SimilarityIndex.from_prices(self.prices.select(["CLOSE", "LOOSE", "OTHER"]), lookback=100)
+        column = self.prices.column("AAA").copy()
+        column[-50] = np.nan  # A gap is forward filled
+        substitutes = index.nearest("AAA", k=2, prices=(self.prices.dates, column))
+        self.assertEqual([s["symbol"] for s in substitutes], ["CLOSE", "LOOSE"])
+
+        # A short history is compared over the overlapping days only
+        short = self.prices.column("AAA").copy()
+        short[:-40] = np.nan
+        substitutes = index.nearest("AAA", k=1, prices=(self.prices.dates, short))
+        self.assertEqual(substitutes[0]["symbol"], "CLOSE")
+        self.assertEqual(index.nearest("AAA", prices=(self.prices.dates[-5:], short[-5:])), [])
+
+
+class TestReplacementFinder(unittest.TestCase):
+
+    def test_index_is_built_once_per_universe_and_ttl(self):
+        prices = make_prices()
+        loads = []
+        now = [0.0]
+
+        def load_prices(symbols):
+            loads.append(symbols)
+            return prices.select(symbols)
+
+        finder = ReplacementFinder(load_prices, universe=["CLOSE", "OTHER"], ttl=60, clock=lambda: now[0])
+        self.assertEqual(finder.index().symbols, ["CLOSE", "OTHER"])
+        finder.index()
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(len(finder.index(["LOOSE"])), 1)
+        now[0] = 61
+        finder.index()
+        self.assertEqual(len(loads), 3)
+        self.assertEqual(len(ReplacementFinder(load_prices).index()), 0)
+
+    def test_request_universes(self):
+        prices = make_prices()
+        loads = []
+
+        def load_prices(symbols):
+            loads.append(symbols)
+            return prices.select(symbols)
+
+        finder = ReplacementFinder(load_prices, universe=["AAA", "CLOSE", "LOOSE", "OTHER"], max_indexes=1,
+                                   max_request_universe=2)
+        default = finder.index()
+        # Parts of the configured universe are cut from its index without loading prices
+        subset = finder.index(["OTHER", "CLOSE"])
+        self.assertEqual(subset.symbols, ["CLOSE", "OTHER"])
+        np.testing.assert_array_equal(subset.returns[0], default.returns[default.symbols.index("CLOSE")])
+        self.assertEqual(len(loads), 1)
+
+        # Other universes are built on their own and cannot evict the default index
+        self.assertEqual(finder.index(["RECENT"]).symbols, ["RECENT"])
+        self.assertEqual(finder.index(["RECENT", "AAB"]).symbols, ["AAB", "RECENT"])
+        self.assertIs(finder.index(), default)
+        self.assertEqual(len(loads), 3)
+        with self.assertRaises(ValueError):
+            finder.index(["AAB", "RECENT", "AAA"])
+
+
+if __name__ == '__main__':
+    unittest.main()
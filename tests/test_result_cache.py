@@ -0,0 +1,118 @@
+import os
+import pickle
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from app.calculations import build_market_context, monte_carlo_simulation_multi, optimize_portfolio
+from app.result_cache import ResultCache, fingerprint
+from helpers import make_stock_data, serve_stock_data
+
+
+class TestResultCache(unittest.TestCase):
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint("a", np.arange(3.0), {"x": 1, "y": [1, 2]}),
+                         fingerprint("a", np.arange(3.0), {"y": [1, 2], "x": 1}))
+        self.assertNotEqual(fingerprint(np.arange(3.0)), fingerprint(np.arange(3.0, dtype=np.float32)))
+        self.assertNotEqual(fingerprint(np.arange(3.0)), fingerprint(np.arange(3.0).reshape(1, 3)))
+        self.assertNotEqual(fingerprint(1), fingerprint("1"))
+        self.assertNotEqual(fingerprint(None), fingerprint("None"))
+
+    def test_size_aware_eviction(self):
+        cache = ResultCache(max_bytes=3000)
+        for i in range(4):
+            cache.put(str(i), np.zeros(100))  # ~950 bytes pickled
+        self.assertEqual(cache.get("0"), (False, None))
+        found, value = cache.get("3")
+        self.assertTrue(found)
+        np.testing.assert_array_equal(value, np.zeros(100))
+        self.assertLessEqual(cache.stats["bytes"], 3000)
+        self.assertGreater(cache.stats["evictions"], 0)
+        self.assertEqual((cache.stats["hits"], cache.stats["misses"]), (1, 1))
+
+        cache.put("big", np.zeros(1000))
+        self.assertEqual(cache.get("big"), (False, None))
+
+    def test_large_results_are_not_cached(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory=directory, max_entry_bytes=1000)
+            paths = {"paths": np.zeros((2, 100))}
+            with patch('app.result_cache.pickle.dumps', wraps=pickle.dumps) as dumps:
+                self.assertIs(cache.get_or_compute("big", lambda: paths), paths)
+                cache.put("big", paths)
+            dumps.assert_not_called()
+            self.assertEqual(cache.get("big"), (False, None))
+            self.assertEqual(os.listdir(directory), [])
+            self.assertEqual(cache.stats["uncacheable"], 2)
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as directory:
+            ResultCache(directory=directory).put("key", {"value": 1})
+            cache = ResultCache(directory=directory)
+            self.assertEqual(cache.get("key"), (True, {"value": 1}))
+            self.assertEqual(cache.stats["disk_hits"], 1)
+
+            small = ResultCache(directory=directory, disk_max_bytes=170)
+            small.put("other", "x" * 150)
+            self.assertEqual(sorted(os.listdir(directory)), ["other.pkl"])
+
+    def test_concurrent_misses_compute_once(self):
+        cache = ResultCache()
+        calls = []
+        release = threading.Event()
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return 42
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while cache.stats["coalesced"] < 3:
+            threading.Event().wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [42] * 4)
+        self.assertEqual(len(calls), 1)
+
+
+class TestCachedCalculations(unittest.TestCase):
+
+    def setUp(self):
+        self.stock_data = {
+            "AAPL": make_stock_data([100, 102, 101, 104, 103, 106]),
+            "MSFT": make_stock_data([50, 49, 51, 52, 50, 53]),
+        }
+        patcher = patch('app.calculations.fetch_price_history', side_effect=serve_stock_data(self.stock_data))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.portfolio = [{"symbol": "AAPL", "purchase_price": 110, "shares": 10},
+                          {"symbol": "MSFT", "purchase_price": 40, "shares": 5}]
+
+    def test_unseeded_simulations_are_reproducible(self):
+        first = monte_carlo_simulation_multi(self.portfolio, num_simulations=50, time_horizon=5)
+        second = monte_carlo_simulation_multi(self.portfolio, num_simulations=50, time_horizon=5)
+        np.testing.assert_array_equal(first, second)
+
+    @patch('app.calculations.max_sharpe_weights', return_value=np.array([0.25, 0.75]))
+    def test_new_trading_day_invalidates(self, mock_max_sharpe_weights):
+        optimize_portfolio(self.portfolio, context=build_market_context(self.portfolio), risk_free_rate=0.0123)
+        optimize_portfolio(self.portfolio, context=build_market_context(self.portfolio), risk_free_rate=0.0123)
+        self.assertEqual(mock_max_sharpe_weights.call_count, 1)
+
+        self.stock_data["AAPL"] = make_stock_data([100, 102, 101, 104, 103, 106, 107])
+        self.stock_data["MSFT"] = make_stock_data([50, 49, 51, 52, 50, 53, 52])
+        optimize_portfolio(self.portfolio, context=build_market_context(self.portfolio), risk_free_rate=0.0123)
+        self.assertEqual(mock_max_sharpe_weights.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from app.calculations import monte_carlo_risk_stream
+from app.risk_stats import PortfolioRiskAccumulator, QuantileSketch, WelfordAccumulator
+from helpers import make_stock_data, serve_stock_data
+
+
+def random_stock_data(seed, days=60):
+    rng = np.random.default_rng(seed)
+    prices = 100 * np.exp(np.cumsum(rng.normal(0.0005, 0.01, days)))
+    return make_stock_data(prices.round(4).tolist())
+
+
+class TestRiskStats(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def test_welford_matches_numpy_across_chunks(self):
+        samples = self.rng.normal(1.0, 0.2, (1000, 3))
+        accumulator = WelfordAccumulator((3,))
+        other = WelfordAccumulator((3,))
+        for chunk in np.array_split(samples[:600], 7):
+            accumulator.update(chunk)
+        other.update(samples[600:])
+        accumulator.merge(other)
+        np.testing.assert_allclose(accumulator.mean, samples.mean(axis=0))
+        np.testing.assert_allclose(accumulator.variance, samples.var(axis=0, ddof=1))
+
+    def test_sketch_quantiles_within_relative_accuracy(self):
+        samples = self.rng.lognormal(0, 0.3, (20000, 2))
+        sketch = QuantileSketch((2,), relative_accuracy=0.01)
+        for chunk in np.array_split(samples, 4):
+            sketch.update(chunk)
+        for q in (0.05, 0.5, 0.95):
+            expected = np.quantile(samples, q, axis=0, method='inverted_cdf')
+            np.testing.assert_allclose(sketch.quantile(q), expected, rtol=0.011)
+
+    def test_sketch_merge_equals_single_pass(self):
+        samples = self.rng.lognormal(0, 0.3, 5000)
+        whole = QuantileSketch()
+        whole.update(samples)
+        left, right = QuantileSketch(), QuantileSketch()
+        left.update(samples[:1234])
+        right.update(samples[1234:])
+        left.merge(right)
+        np.testing.assert_array_equal(left.counts, whole.counts)
+
+    def test_value_at_risk_and_drawdown(self):
+        values = np.cumprod(self.rng.lognormal(0, 0.01, (20000, 30)), axis=1)
+        accumulator = PortfolioRiskAccumulator(30)
+        for chunk in np.array_split(values, 5):
+            accumulator.update(chunk)
+
+        terminal = values[:, -1]
+        cutoff = np.quantile(terminal, 0.05)
+        var, cvar = accumulator.value_at_risk(0.95)
+        self.assertAlmostEqual(var, 1 - cutoff, delta=0.01)
+        self.assertAlmostEqual(cvar, 1 - terminal[terminal <= cutoff].mean(), delta=0.01)
+
+        peaks = np.maximum(np.maximum.accumulate(values, axis=1), 1.0)
+        drawdowns = (1 - values / peaks).max(axis=1)
+        mean_drawdown, _ = accumulator.max_drawdown()
+        self.assertAlmostEqual(mean_drawdown, drawdowns.mean())
+
+    @patch('app.calculations.fetch_price_history')
+    def test_stream_reports_fan_chart_and_tail_risk(self, mock_fetch_price_history):
+        mock_fetch_price_history.side_effect = serve_stock_data(lambda symbol: random_stock_data(len(symbol)))
+        portfolio = [
+            {"symbol": "AAPL", "purchase_price": 300, "shares": 10},
+            {"symbol": "MSFT", "purchase_price": 500, "shares": 5},
+            {"symbol": "GE", "purchase_price": 100, "shares": 5},
+        ]
+        result = monte_carlo_risk_stream(portfolio, num_simulations=500, time_horizon=20, chunk_size=128, seed=1)
+        self.assertEqual(len(result["percentiles"]["50"]), 20)
+        self.assertAlmostEqual(sum(result["weights"]), 1.0)
+        self.assertTrue(np.all(np.diff([result["percentiles"][p][-1] for p in ("5", "50", "95")]) > 0))
+        self.assertGreater(result["conditional_value_at_risk"], result["value_at_risk"])
+
+
+if __name__ == '__main__':
+    unittest.main()
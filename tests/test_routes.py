@@ -1,7 +1,13 @@
+import gzip
+import io
+import json
+import time
 import unittest
-from unittest.mock import patch
+from unittest.mock import ANY, patch
 from flask import Flask
+from app.price_store import parse_daily_series
 from app.routes import routes
+from helpers import serve_stock_data
 import numpy as np
 
 class TestRoutes(unittest.TestCase):
@@ -14,13 +20,13 @@ class TestRoutes(unittest.TestCase):
         with self.app.app_context():
             self.app.register_blueprint(routes)
 
-    @patch('app.calculations.fetch_stock_data')
-    def test_calculate_taxes(self, mock_fetch_stock_data):
-        mock_fetch_stock_data.return_value = {
+    @patch('app.calculations.fetch_price_history')
+    def test_calculate_taxes(self, mock_fetch_price_history):
+        mock_fetch_price_history.return_value = parse_daily_series({
             "2024-08-15": {
                 "4. close": "200.00"
             }
-        }
+        })
 
         self.client.post('/input-portfolio', json={
             "portfolio": [
@@ -36,6 +42,39 @@ class TestRoutes(unittest.TestCase):
 
         response = self.client.post('/calculate-taxes')
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["tax_owed"], 30000.0)
+
+    def test_tax_what_if(self):
+        response = self.client.post('/tax-what-if', json={
+            "filing_status": "married_joint",
+            "incomes": {"start": 50000, "stop": 500000, "num": 10},
+            "gains": [0, 50000],
+            "harvests": {"start": 0, "stop": 20000, "num": 5}
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(np.shape(response.json["total_tax"]), (10, 2, 5))
+        self.assertEqual(np.shape(response.json["harvest_savings_rate"]), (10, 2, 4))
+
+        response = self.client.post('/tax-what-if', json={"filing_status": "widowed"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_tax_what_if_npy(self):
+        grid = {"incomes": {"start": 0, "stop": 500000, "num": 60}, "gains": {"start": 0, "stop": 1e5, "num": 60},
+                "harvests": {"start": 0, "stop": 20000, "num": 60}}
+        # Too many cells for JSON, but fine as arrays
+        response = self.client.post('/tax-what-if', json=grid)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/tax-what-if', json=grid, headers={"Accept": "application/x-npy"})
+        self.assertEqual(response.status_code, 200)
+        names = response.headers["X-Arrays"].split(",")
+        self.assertEqual(names[:4], ["incomes", "gains", "harvests", "total_tax"])
+        body = io.BytesIO(response.get_data())
+        arrays = {name: np.load(body) for name in names}
+        self.assertEqual(arrays["total_tax"].shape, (60, 60, 60))
+        self.assertEqual(arrays["harvest_savings_rate"].shape, (60, 60, 59))
+
+        small = self.client.post('/tax-what-if', json=dict(grid, harvests=[0, 20000])).json
+        np.testing.assert_allclose(small["total_tax"], arrays["total_tax"][:, :, [0, -1]])
 
     @patch('app.routes.optimize_portfolio')
     def test_optimize_portfolio(self, mock_optimize_portfolio):
@@ -63,9 +102,40 @@ class TestRoutes(unittest.TestCase):
         # Test the optimize-portfolio route
         response = self.client.post('/optimize-portfolio')
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["weights"], {'AAPL': 0.5, 'MSFT': 0.5})
+        self.assertEqual(response.json["sharpe_ratio"], 1.2)
+
+        mock_optimize_portfolio.side_effect = ValueError("The weight bounds cannot be satisfied by weights summing to 1")
+        response = self.client.post('/optimize-portfolio', json={"bounds": {"AAPL": [0, 0.1], "MSFT": [0, 0.1]}})
+        self.assertEqual(response.status_code, 400)
+
+    @patch('app.routes.calculate_efficient_frontier')
+    def test_efficient_frontier(self, mock_calculate_efficient_frontier):
+        mock_calculate_efficient_frontier.return_value = [
+            {"target_return": 0.05, "risk": 0.1, "weights": {"AAPL": 1.0}, "feasible": True}
+        ]
+
+        self.client.post('/input-portfolio', json={
+            "portfolio": [{"symbol": "AAPL", "purchase_price": 300, "shares": 10}]
+        })
+
+        response = self.client.post('/efficient-frontier', json={
+            "num_points": 5, "bounds": {"AAPL": [0, 0.5]}, "groups": [{"symbols": ["AAPL"], "max": 0.8}]
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json["frontier"]), 1)
+
+        response = self.client.post('/efficient-frontier', json={"bounds": {"AAPL": [0.6, 0.5]}})
+        self.assertEqual(response.status_code, 400)
 
+    @patch('app.calculations.fetch_price_history')
     @patch('app.routes.monte_carlo_simulation_multi')
-    def test_monte_carlo(self, mock_monte_carlo_simulation_multi):
+    def test_monte_carlo(self, mock_monte_carlo_simulation_multi, mock_fetch_price_history):
+        mock_fetch_price_history.return_value = parse_daily_series({
+            "2024-08-15": {"4. close": "200.00"},
+            "2024-08-14": {"4. close": "196.00"},
+            "2024-08-13": {"4. close": "199.00"}
+        })
         # Mock the response of monte_carlo_simulation_multi
         mock_monte_carlo_simulation_multi.return_value = np.array(
             [[[1.1, 1.2], [1.1, 1.2]], [[1.05, 1.06], [1.05, 1.06]]])
@@ -86,14 +156,207 @@ class TestRoutes(unittest.TestCase):
         # Test the monte-carlo route
         response = self.client.post('/monte-carlo')
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["symbols"], ["AAPL", "MSFT"])
+        np.testing.assert_allclose(response.json["expected_returns"], [1.15, 1.055])
+
+    @patch('app.calculations.fetch_price_history')
+    @patch('app.routes.monte_carlo_simulation_multi')
+    def test_monte_carlo_formats(self, mock_monte_carlo_simulation_multi, mock_fetch_price_history):
+        mock_fetch_price_history.return_value = parse_daily_series({
+            "2024-08-15": {"4. close": "200.00"},
+            "2024-08-14": {"4. close": "196.00"},
+            "2024-08-13": {"4. close": "199.00"},
+            "2024-08-12": {"4. close": "197.50"}
+        })
+        paths = np.random.default_rng(0).uniform(0.9, 1.1, (2, 50, 4)).astype(np.float32)
+        mock_monte_carlo_simulation_multi.return_value = paths
+        self.client.post('/input-portfolio', json={
+            "portfolio": [
+                {"symbol": "AAPL", "purchase_price": 300, "shares": 10},
+                {"symbol": "MSFT", "purchase_price": 500, "shares": 5}
+            ]
+        })
+
+        response = self.client.post('/monte-carlo', headers={"Accept": "application/x-npy"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-npy")
+        self.assertEqual(response.headers["X-Symbols"], "AAPL,MSFT")
+        np.testing.assert_array_equal(np.load(io.BytesIO(response.get_data())), paths)
+
+        response = self.client.post('/monte-carlo', headers={"Accept": "application/x-npy",
+                                                             "Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        np.testing.assert_array_equal(np.load(io.BytesIO(gzip.decompress(response.get_data()))), paths)
+
+        response = self.client.post('/monte-carlo', headers={"Accept": "application/x-npy"}, json={
+            "mode": "stream", "num_simulations": 100, "time_horizon": 5, "seed": 1, "percentiles": [10, 90]
+        })
+        self.assertEqual(response.headers["X-Percentiles"], "10,90")
+        bands = np.load(io.BytesIO(response.get_data()))
+        self.assertEqual(bands.shape, (2, 5))
+        self.assertTrue(np.all(bands[0] <= bands[1]))
+
+        # Statistics have no array form, so they stay JSON
+        response = self.client.post('/monte-carlo', headers={"Accept": "application/x-npy"}, json={
+            "mode": "estimate", "time_horizon": 5, "seed": 1, "max_simulations": 256
+        })
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertIn("statistics", response.json)
+
+    @patch('app.calculations.fetch_price_history')
+    @patch('app.routes.monte_carlo_simulation_multi')
+    def test_monte_carlo_options(self, mock_monte_carlo_simulation_multi, mock_fetch_price_history):
+        mock_monte_carlo_simulation_multi.return_value = np.ones((1, 4, 3), dtype=np.float32)
+        mock_fetch_price_history.return_value = parse_daily_series({
+            "2024-08-15": {"4. close": "200.00"},
+            "2024-08-14": {"4. close": "196.00"}
+        })
+
+        self.client.post('/input-portfolio', json={
+            "portfolio": [{"symbol": "AAPL", "purchase_price": 300, "shares": 10}]
+        })
+
+        response = self.client.post('/monte-carlo', json={
+            "num_simulations": 4, "time_horizon": 3, "dtype": "float32", "workers": 2, "seed": 5
+        })
+        self.assertEqual(response.status_code, 200)
+        mock_monte_carlo_simulation_multi.assert_called_once_with(
+            [{"symbol": "AAPL", "purchase_price": 300, "shares": 10}],
+            context=ANY, num_simulations=4, time_horizon=3, dtype=np.float32, workers=2, seed=5, sampling='pseudo')
+
+        response = self.client.post('/monte-carlo', json={"dtype": "float16"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/monte-carlo', json={"sampling": "halton"})
+        self.assertEqual(response.status_code, 400)
+        # Beyond the limits, or 500,000 paths x 252 days held at once
+        for body in ({"num_simulations": 10_000_000}, {"time_horizon": 100_000},
+                     {"mode": "estimate", "max_simulations": 10_000_000}, {"num_simulations": 500_000}):
+            response = self.client.post('/monte-carlo', json=body)
+            self.assertEqual(response.status_code, 400, body)
+        self.assertEqual(mock_monte_carlo_simulation_multi.call_count, 1)
+
+    @patch('app.calculations.fetch_price_history')
+    def test_monte_carlo_stream(self, mock_fetch_price_history):
+        mock_fetch_price_history.return_value = parse_daily_series({
+            "2024-08-15": {"4. close": "200.00"},
+            "2024-08-14": {"4. close": "196.00"},
+            "2024-08-13": {"4. close": "199.00"},
+            "2024-08-12": {"4. close": "197.50"}
+        })
+
+        self.client.post('/input-portfolio', json={
+            "portfolio": [{"symbol": "AAPL", "purchase_price": 300, "shares": 10}]
+        })
+
+        response = self.client.post('/monte-carlo', json={
+            "mode": "stream", "num_simulations": 300, "time_horizon": 5, "chunk_size": 64, "seed": 1,
+            "percentiles": [10, 50, 90]
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.json["percentiles"]), ["10", "50", "90"])
+        self.assertEqual(len(response.json["percentiles"]["50"]), 5)
+
+    @patch('app.calculations.fetch_price_history')
+    def test_monte_carlo_estimate(self, mock_fetch_price_history):
+        mock_fetch_price_history.return_value = parse_daily_series({
+            "2024-08-15": {"4. close": "200.00"},
+            "2024-08-14": {"4. close": "196.00"},
+            "2024-08-13": {"4. close": "199.00"},
+            "2024-08-12": {"4. close": "197.50"}
+        })
+
+        self.client.post('/input-portfolio', json={
+            "portfolio": [{"symbol": "AAPL", "purchase_price": 300, "shares": 10}]
+        })
+
+        response = self.client.post('/monte-carlo', json={
+            "mode": "estimate", "time_horizon": 5, "seed": 1, "sampling": "antithetic",
+            "target_standard_error": 0.01, "batch_size": 64, "max_simulations": 2048,
+            "statistics": ["expected_return", "value_at_risk"]
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json["converged"])
+        self.assertEqual(response.json["num_simulations"], 64 * response.json["batches"])
+        self.assertEqual(sorted(response.json["statistics"]), ["expected_return", "value_at_risk"])
+        self.assertLessEqual(response.json["statistics"]["value_at_risk"]["standard_error"], 0.01)
 
-    @patch('app.calculations.fetch_stock_data')
-    def test_tax_loss_harvesting(self, mock_fetch_stock_data):
-        mock_fetch_stock_data.return_value = {
+        response = self.client.post('/monte-carlo', json={"mode": "estimate", "statistics": ["sharpe"]})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/monte-carlo', json={
+            "mode": "estimate", "sampling": "sobol", "time_horizon": 30000
+        })
+        self.assertEqual(response.status_code, 400)
+
+    @patch('app.calculations.fetch_price_history')
+    def test_monte_carlo_job(self, mock_fetch_price_history):
+        mock_fetch_price_history.return_value = parse_daily_series({
+            "2024-08-15": {"4. close": "200.00"},
+            "2024-08-14": {"4. close": "196.00"},
+            "2024-08-13": {"4. close": "199.00"}
+        })
+
+        self.client.post('/input-portfolio', json={
+            "portfolio": [{"symbol": "AAPL", "purchase_price": 300, "shares": 10}]
+        })
+
+        response = self.client.post('/jobs/monte-carlo', json={
+            "mode": "stream", "num_simulations": 200, "time_horizon": 5, "chunk_size": 50, "priority": 3
+        })
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json["job_id"]
+
+        for _ in range(500):
+            response = self.client.get(f'/jobs/{job_id}/result')
+            if response.status_code != 202:
+                break
+            time.sleep(0.01)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["num_simulations"], 200)
+
+        status = self.client.get(f'/jobs/{job_id}').json
+        self.assertEqual(status["progress"], {"done": 200, "total": 200})
+        self.assertEqual(self.client.get('/jobs/missing').status_code, 404)
+        self.assertIn("wait_seconds", self.client.get('/jobs/stats').json)
+        response = self.client.delete(f'/jobs/{job_id}')
+        self.assertEqual((response.status_code, response.json["status"]), (200, "succeeded"))
+        self.assertEqual(self.client.delete('/jobs/missing').status_code, 404)
+
+    @patch('app.calculations.fetch_price_history')
+    def test_batch(self, mock_fetch_price_history):
+        mock_fetch_price_history.return_value = parse_daily_series({
+            "2024-08-15": {"4. close": "200.00"},
+            "2024-08-14": {"4. close": "196.00"},
+            "2024-08-13": {"4. close": "199.00"}
+        })
+
+        response = self.client.post('/batch', json={
+            "portfolios": [
+                {"id": "a", "tax_bracket": 0.3, "portfolio": [{"symbol": "AAPL", "purchase_price": 300, "shares": 10}]},
+                {"id": "b", "portfolio": []}
+            ],
+            "operations": ["tax-loss-harvesting"],
+            "workers": 1
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(lines[0]["tax-loss-harvesting"]["total_losses"], 1000.0)
+        self.assertIn("error", lines[1])
+        self.assertEqual(lines[2]["summary"]["succeeded"], 1)
+
+        response = self.client.post('/batch', json={"portfolios": [{}], "operations": ["rebalance"]})
+        self.assertEqual(response.status_code, 400)
+        with patch('app.routes.MAX_BATCH_PORTFOLIOS', 1):
+            response = self.client.post('/batch', json={"portfolios": [{}, {}]})
+        self.assertEqual(response.status_code, 400)
+
+    @patch('app.calculations.fetch_price_history')
+    def test_tax_loss_harvesting(self, mock_fetch_price_history):
+        mock_fetch_price_history.return_value = parse_daily_series({
             "2024-08-15": {
                 "4. close": "200.00"
             }
-        }
+        })
 
         self.client.post('/input-portfolio', json={
             "portfolio": [
@@ -110,6 +373,123 @@ class TestRoutes(unittest.TestCase):
         response = self.client.post('/tax-loss-harvesting')
         self.assertEqual(response.status_code, 200)
 
+    @patch('app.replacements._default_finder', None)
+    @patch('app.calculations.fetch_price_history')
+    def test_tax_loss_harvesting_replacements(self, mock_fetch_price_history):
+        rng = np.random.default_rng(0)
+        market = rng.standard_normal(60) * 0.01
+        noise = {"AAPL": 0.002, "MSFT": 0.004, "QQQ": 0.003, "XLE": 0.02}
+        dates = np.datetime_as_string(np.arange(np.datetime64('2024-05-01'), np.datetime64('2024-07-01')))
+        series = {}
+        for symbol, scale in noise.items():
+            closes = 100 * np.exp(np.cumsum(market + rng.standard_normal(60) * scale))
+            series[symbol] = {date: {"4. close": f"{close:.4f}"} for date, close in zip(dates[::-1], closes[::-1])}
+        mock_fetch_price_history.side_effect = serve_stock_data(series)
+
+        self.client.post('/input-portfolio', json={
+            "portfolio": [
+                {"symbol": "AAPL", "purchase_price": 1000, "shares": 10, "purchase_date": "2023-01-03"},
+                {"symbol": "MSFT", "purchase_price": 80, "shares": 5,
+                 "purchase_date": str(np.datetime64('today', 'D') - 10)}
+            ],
+            "tax_bracket": 0.3
+        })
+
+        response = self.client.post('/tax-loss-harvesting', json={
+            "replacements": 2, "replacement_universe": ["AAPL", "MSFT", "QQQ", "XLE"]
+        })
+        self.assertEqual(response.status_code, 200)
+        sale, = response.json["recommended_sales"]
+        self.assertEqual(sale["symbol"], "AAPL")
+        # MSFT was bought in the wash-sale window, AAPL is the security being sold
+        self.assertEqual([s["symbol"] for s in sale["replacements"]], ["QQQ", "XLE"])
+        self.assertLess(sale["replacements"][0]["tracking_error"], sale["replacements"][1]["tracking_error"])
+
+        response = self.client.post('/tax-loss-harvesting', json={"replacements": -1})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/tax-loss-harvesting', json={"replacement_universe": ["../../etc/passwd"]})
+        self.assertEqual(response.status_code, 400)
+
+    @patch('app.calculations.fetch_price_history')
+    def test_rebalance(self, mock_fetch_price_history):
+        rng = np.random.default_rng(1)
+        dates = np.datetime_as_string(np.arange(np.datetime64('2024-05-01'), np.datetime64('2024-07-01')))
+        series = {}
+        for symbol in ("AAPL", "MSFT"):
+            closes = 100 * np.exp(np.cumsum(rng.standard_normal(61) * 0.01))
+            series[symbol] = {date: {"4. close": f"{close:.4f}"} for date, close in zip(dates[::-1], closes[::-1])}
+        mock_fetch_price_history.side_effect = serve_stock_data(series)
+
+        self.client.post('/input-portfolio', json={
+            "portfolio": [
+                {"symbol": "AAPL", "lots": [
+                    {"acquired": "2020-01-02", "quantity": 40, "basis": 50, "lot_id": "gain"},
+                    {"acquired": "2023-01-02", "quantity": 40, "basis": 500, "lot_id": "loss"}
+                ]},
+                {"symbol": "MSFT", "purchase_price": 100, "shares": 5, "purchase_date": "2023-01-02"}
+            ],
+            "tax_bracket": 0.3,
+            "long_term_rate": 0.15
+        })
+
+        response = self.client.post('/rebalance', json={"target_weights": {"AAPL": 0.5, "MSFT": 0.5},
+                                                        "max_turnover": 0.5})
+        self.assertEqual(response.status_code, 200)
+        sale = response.json["trades"][0]
+        self.assertEqual((sale["symbol"], sale["action"]), ("AAPL", "sell"))
+        self.assertEqual(sale["lots"][0]["lot_id"], "loss")
+        self.assertLess(response.json["tracking_error_after"], response.json["tracking_error_before"])
+
+        response = self.client.post('/rebalance', json={"risk_aversion": 0})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post('/rebalance/batch', json={
+            "accounts": [
+                {"id": "a", "portfolio": [{"symbol": "AAPL", "purchase_price": 150, "shares": 10}]},
+                {"id": "b", "portfolio": []}
+            ],
+            "target_weights": {"AAPL": 0.5, "MSFT": 0.5},
+            "min_trade": 1
+        })
+        self.assertEqual(response.status_code, 200)
+        first, second = response.json["accounts"]
+        self.assertEqual({trade["symbol"] for trade in first["trades"]}, {"AAPL", "MSFT"})
+        self.assertIn("error", second)
+        self.assertEqual(response.json["summary"]["failed"], 1)
+        self.assertEqual(self.client.post('/rebalance/batch', json={"accounts": []}).status_code, 400)
+
+    @patch('app.calculations.fetch_price_history')
+    def test_tax_loss_harvesting_lots(self, mock_fetch_price_history):
+        mock_fetch_price_history.return_value = parse_daily_series({
+            "2024-08-15": {
+                "4. close": "200.00"
+            }
+        })
+
+        self.client.post('/input-portfolio', json={
+            "portfolio": [
+                {"symbol": "AAPL", "lots": [
+                    {"acquired": "2020-01-02", "quantity": 10, "basis": 300, "lot_id": "old"},
+                    {"acquired": "2020-06-01", "quantity": 5, "basis": 150, "lot_id": "gain"}
+                ]}
+            ],
+            "tax_bracket": 0.3,
+            "long_term_rate": 0.15
+        })
+
+        response = self.client.post('/tax-loss-harvesting')
+        self.assertEqual(response.status_code, 200)
+        sale, = response.json["recommended_sales"]
+        self.assertEqual(sale["shares"], 10)
+        self.assertAlmostEqual(sale["long_term_loss"], 1000.0)
+        self.assertIn("$150.00", response.json["message"])
+        self.assertIn("harvest;dur=", response.headers["Server-Timing"])
+
+        metrics = self.client.get('/metrics')
+        self.assertEqual(metrics.status_code, 200)
+        self.assertTrue(metrics.content_type.startswith('text/plain'))
+        self.assertIn('tax_alpha_stage_seconds_count{stage="harvest"}', metrics.get_data(as_text=True))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+
+import numpy as np
+
+from app.calculations import calculate_taxes
+from app.tax_engine import BracketTable, compute_tax_liability, tax_tables, what_if_grid
+
+
+def reference_tax(amount, thresholds, rates):
+    upper = list(thresholds[1:]) + [float('inf')]
+    return sum(rate * max(0.0, min(amount, high) - low) for low, high, rate in zip(thresholds, upper, rates))
+
+
+class TestTaxEngine(unittest.TestCase):
+
+    def test_bracket_table_matches_reference(self):
+        tables = tax_tables(2024, 'married_joint')
+        amounts = np.array([0, 1, 23200, 50000, 400000, 1_000_000], dtype=float)
+        expected = [reference_tax(a, tables.ordinary.thresholds, tables.ordinary.rates) for a in amounts]
+        np.testing.assert_allclose(tables.ordinary.tax(amounts), expected)
+        self.assertEqual(BracketTable((0, 100), (0.1, 0.2)).tax(-5), 0.0)
+
+    def test_long_term_gains_stack_on_ordinary_income(self):
+        result = compute_tax_liability(100000, long_term_gains=20000)
+        self.assertAlmostEqual(float(result["taxable_income"]), 105400)
+        self.assertAlmostEqual(float(result["ordinary_tax"]), 13841)
+        self.assertAlmostEqual(float(result["capital_gains_tax"]), 3000)
+        self.assertAlmostEqual(float(result["marginal_rate"]), 0.22)
+
+    def test_loss_cap_and_carryforward(self):
+        result = compute_tax_liability(100000, short_term_gains=-10000, long_term_gains=2000)
+        self.assertAlmostEqual(float(result["loss_deduction"]), 3000)
+        self.assertAlmostEqual(float(result["carryforward_short_term"]), 5000)
+        self.assertAlmostEqual(float(result["carryforward_long_term"]), 0)
+
+        result = compute_tax_liability(50000, short_term_gains=-1000, long_term_gains=-4000,
+                                       filing_status='married_separate')
+        self.assertAlmostEqual(float(result["loss_deduction"]), 1500)
+        self.assertAlmostEqual(float(result["carryforward_short_term"]), 0)
+        self.assertAlmostEqual(float(result["carryforward_long_term"]), 3500)
+
+        # Carried-in losses offset this year's gains first.
+        result = compute_tax_liability(100000, long_term_gains=5000, carryforward_long_term=5000)
+        self.assertAlmostEqual(float(result["capital_gains_tax"]), 0)
+
+    def test_marginal_rate_matches_finite_difference(self):
+        rng = np.random.default_rng(0)
+        income = rng.uniform(0, 800000, 20000)
+        short_term = rng.uniform(-50000, 100000, 20000)
+        long_term = rng.uniform(-50000, 300000, 20000)
+        base = compute_tax_liability(income, short_term, long_term, filing_status='head_of_household')
+        bumped = compute_tax_liability(income + 0.01, short_term, long_term, filing_status='head_of_household')
+        np.testing.assert_allclose((bumped["total_tax"] - base["total_tax"]) / 0.01, base["marginal_rate"], atol=1e-6)
+
+    def test_what_if_grid(self):
+        incomes = np.array([50000.0, 250000.0])
+        gains = np.array([0.0, 20000.0, 100000.0])
+        harvests = np.linspace(0, 30000, 4)
+        grid = what_if_grid(incomes, gains, harvests)
+        self.assertEqual(grid["total_tax"].shape, (2, 3, 4))
+        self.assertEqual(grid["harvest_savings_rate"].shape, (2, 3, 3))
+        for i, income in enumerate(incomes):
+            for j, gain in enumerate(gains):
+                for k, harvest in enumerate(harvests):
+                    expected = compute_tax_liability(income, long_term_gains=gain, harvested_short_term=harvest)
+                    self.assertAlmostEqual(grid["total_tax"][i, j, k], float(expected["total_tax"]))
+        np.testing.assert_allclose(grid["tax_savings"][..., 0], 0)
+
+    def test_invalid_inputs(self):
+        with self.assertRaises(ValueError):
+            tax_tables(1999, 'single')
+        with self.assertRaises(ValueError):
+            tax_tables(2024, 'widowed')
+        with self.assertRaises(ValueError):
+            what_if_grid([1], [1], [1], gain_term='medium_term')
+
+    def test_calculate_taxes_modes(self):
+        legacy = calculate_taxes({"income": 100000, "tax_bracket": 0.3, "investment_gains": 20000,
+                                  "investment_losses": 5000, "cost_basis": 15000})
+        self.assertEqual(legacy["tax_owed"], 30000)
+
+        progressive = calculate_taxes({"income": 100000, "filing_status": "single", "investment_gains": 25000,
+                                       "investment_losses": 5000})
+        self.assertAlmostEqual(progressive["tax_owed"], 16841)
+        self.assertIn("marginal rate of 22%", progressive["explanation"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+
+import numpy as np
+
+from app.tax_lots import LotLedger, to_days
+
+
+class TestLotLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.ledger = LotLedger(
+            symbols=['AAPL', 'MSFT', 'AAPL', 'AAPL', 'MSFT'],
+            acquired=['2022-01-10', '2023-06-01', '2023-03-01', '2024-05-20', '2024-05-25'],
+            quantity=[10, 5, 20, 4, 5],
+            basis=[150.0, 300.0, 170.0, 160.0, 250.0],
+            lot_ids=['a1', 'm1', 'a2', 'a3', 'm2'],
+        )
+
+    def test_lots_sorted_by_symbol_and_date(self):
+        self.assertEqual(self.ledger.symbol_names, ['AAPL', 'MSFT'])
+        rows = self.ledger.symbol_slice('AAPL')
+        self.assertEqual(self.ledger.lot_ids[rows].tolist(), ['a1', 'a2', 'a3'])
+        self.assertEqual(self.ledger.symbol_slice('GOOG'), slice(0, 0))
+
+    def test_relief_methods(self):
+        rows, taken = self.ledger.relieve('AAPL', 15, 'fifo')
+        self.assertEqual(self.ledger.lot_ids[rows].tolist(), ['a1', 'a2'])
+        self.assertEqual(taken.tolist(), [10, 5])
+
+        rows, taken = self.ledger.relieve('AAPL', 22, 'hifo')
+        self.assertEqual(self.ledger.lot_ids[rows].tolist(), ['a2', 'a3'])
+        self.assertEqual(taken.tolist(), [20, 2])
+
+        rows, taken = self.ledger.relieve('AAPL', 12, 'specific', lot_ids=['a3', 'a1'])
+        self.assertEqual(self.ledger.lot_ids[rows].tolist(), ['a3', 'a1'])
+        self.assertEqual(taken.tolist(), [4, 8])
+
+        with self.assertRaises(ValueError):
+            self.ledger.relieve('AAPL', 100)
+        with self.assertRaises(ValueError):
+            self.ledger.relieve('AAPL', 1, 'lifo')
+
+    def test_realize_splits_holding_period(self):
+        result = self.ledger.realize('AAPL', 15, 160.0, '2024-06-01', 'fifo')
+        self.assertAlmostEqual(result['long_term_gain'], 10 * 10 + 5 * -10)
+        self.assertAlmostEqual(result['short_term_gain'], 0.0)
+
+    def test_harvestable_losses_with_wash_sale(self):
+        losses = self.ledger.harvestable_losses({'AAPL': 155.0, 'MSFT': 260.0}, '2024-06-01')
+        # AAPL: a2 is a long-term loss of 15/share; a3 (bought 12 days ago) is a short-term loss of 5/share.
+        self.assertAlmostEqual(losses['long_term_loss'][0], 300.0)
+        self.assertAlmostEqual(losses['short_term_loss'][0], 20.0)
+        self.assertEqual(losses['wash_sale_shares'][0], 0)
+        # MSFT: m1 loses 40/share, but m2 was bought at a gain 7 days ago and is kept, washing the sale.
+        self.assertEqual(losses['wash_sale_shares'][1], 5)
+        self.assertAlmostEqual(losses['disallowed_loss'][1], 200.0)
+        self.assertAlmostEqual(losses['long_term_loss'][1] + losses['short_term_loss'][1], 0.0)
+
+    def test_wash_sale_window(self):
+        shares = self.ledger.wash_sales(['AAPL', 'AAPL', 'MSFT', 'GOOG'],
+                                        ['2024-06-15', '2024-07-15', '2023-05-05', '2024-06-01'])
+        self.assertEqual(shares.tolist(), [4, 0, 5, 0])
+
+    def test_million_lots(self):
+        rng = np.random.default_rng(0)
+        size = 1_000_000
+        symbols = np.array([f"S{i}" for i in range(2000)])[rng.integers(0, 2000, size)]
+        ledger = LotLedger(symbols, rng.integers(to_days('2015-01-01'), to_days('2024-06-01'), size),
+                           rng.uniform(1, 100, size), rng.uniform(10, 200, size))
+        prices = {symbol: 100.0 for symbol in ledger.symbol_names}
+        losses = ledger.harvestable_losses(prices, '2024-06-01')
+        expected = np.clip(ledger.basis - 100.0, 0, None) @ ledger.quantity
+        total = losses['short_term_loss'].sum() + losses['long_term_loss'].sum() + losses['disallowed_loss'].sum()
+        self.assertAlmostEqual(total / expected, 1.0, places=9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+import unittest
+from unittest.mock import patch
+
+from app import create_app
+from app.warmup import warm_up
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_routes_do_not_import_scipy_or_requests(self):
+        code = "import sys, app.routes; print(sorted({'scipy', 'requests'} & set(sys.modules)))"
+        output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True, capture_output=True,
+                                text=True).stdout
+        self.assertEqual(output.strip(), "[]")
+
+    def test_warm_up(self):
+        timings = warm_up(freeze=False)
+        self.assertEqual(set(timings), {"imports", "linear_algebra", "kernels"})
+        self.assertIn('scipy.optimize', sys.modules)
+
+    def test_debug_and_warm_up_from_environment(self):
+        with patch.dict(os.environ, {"FLASK_DEBUG": "0", "APP_WARM_UP": "0"}):
+            self.assertFalse(create_app().debug)
+        with patch.dict(os.environ, {"FLASK_DEBUG": "1", "APP_WARM_UP": "1"}), \
+                patch('app.warmup.warm_up') as mock_warm_up:
+            self.assertTrue(create_app().debug)
+            mock_warm_up.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()